@@ -16,7 +16,14 @@ load_dotenv()
 
 from ii_agent.core.event import RealtimeEvent, EventType
 from ii_agent.utils.constants import DEFAULT_MODEL
-from utils import parse_common_args, create_workspace_manager_for_connection
+from utils import (
+    parse_common_args,
+    create_workspace_manager_for_connection,
+    configure_llm_limits,
+    create_context_manager,
+    create_llm_client,
+    wrap_llm_cache,
+)
 from rich.console import Console
 from rich.panel import Panel
 
@@ -24,11 +31,6 @@ from ii_agent.tools import get_system_tools
 from ii_agent.prompts.system_prompt import SYSTEM_PROMPT
 from ii_agent.agents.anthropic_fc import AnthropicFC
 from ii_agent.utils import WorkspaceManager
-from ii_agent.llm import get_client
-from ii_agent.llm.context_manager.llm_summarizing import LLMSummarizingContextManager
-from ii_agent.llm.context_manager.amortized_forgetting import (
-    AmortizedForgettingContextManager,
-)
 from ii_agent.llm.token_counter import TokenCounter
 from ii_agent.db.manager import DatabaseManager
 
@@ -41,8 +43,15 @@ async def async_main():
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="CLI for interacting with the Agent")
     parser = parse_common_args(parser)
+    parser.add_argument(
+        "--trace-path",
+        type=str,
+        default=None,
+        help="Write a Chrome trace of the session to this file on exit",
+    )
 
     args = parser.parse_args()
+    configure_llm_limits(args)
 
     if os.path.exists(args.logs_path):
         os.remove(args.logs_path)
@@ -98,17 +107,15 @@ async def async_main():
         "model_name": args.model_name,
     }
     if args.llm_client == "anthropic-direct":
-        client_kwargs["use_caching"] = False # Or a configurable value if needed later
+        client_kwargs["use_caching"] = True
         client_kwargs["project_id"] = args.project_id
         client_kwargs["region"] = args.region
     elif args.llm_client == "openai-direct":
         client_kwargs["azure_model"] = args.azure_model
         client_kwargs["cot_model"] = args.cot_model
-    
-    client = get_client(
-        args.llm_client,
-        **client_kwargs
-    )
+
+    client = create_llm_client(args.llm_client, args, **client_kwargs)
+    client = wrap_llm_cache(client, args)
 
     # Initialize workspace manager with the session-specific workspace
     workspace_manager = WorkspaceManager(
@@ -116,24 +123,12 @@ async def async_main():
     )
 
     # Initialize token counter
-    token_counter = TokenCounter()
+    token_counter = TokenCounter.for_model(args.model_name, args.tokenizer, client)
 
     # Create context manager based on argument
-    if args.context_manager == "llm-summarizing":
-        context_manager = LLMSummarizingContextManager(
-            client=client,
-            token_counter=token_counter,
-            logger=logger_for_agent_logs,
-            token_budget=120_000,
-        )
-    elif args.context_manager == "amortized-forgetting":
-        context_manager = AmortizedForgettingContextManager(
-            token_counter=token_counter,
-            logger=logger_for_agent_logs,
-            token_budget=120_000,
-        )
-    else:
-        raise ValueError(f"Unknown context manager type: {args.context_manager}")
+    context_manager = create_context_manager(
+        args.context_manager, client, token_counter, logger_for_agent_logs
+    )
 
     queue = asyncio.Queue()
     tools = get_system_tools(
@@ -188,11 +183,7 @@ async def async_main():
 
             logger_for_agent_logs.info("\nAgent is thinking...")
             try:
-                # Run synchronous method in executor
-                result = await loop.run_in_executor(
-                    None,  # Uses default ThreadPoolExecutor
-                    lambda: agent.run_agent(user_input, resume=True),
-                )
+                result = await agent.arun_agent(user_input, resume=True)
                 logger_for_agent_logs.info(f"Agent: {result}")
             except (KeyboardInterrupt, asyncio.CancelledError):
                 agent.cancel()
@@ -209,6 +200,10 @@ async def async_main():
     finally:
         # Cleanup tasks
         message_task.cancel()
+        await db_manager.flush_events()
+        if args.trace_path:
+            agent.tracer.write(args.trace_path)
+            console.print(f"Trace written to {args.trace_path}")
 
     console.print("[bold]Goodbye![/bold]")
 
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the context management strategies over long trajectories.
+
+Plays synthetic trajectories, and trajectories rebuilt from recorded
+cassettes, through a message history with each context manager, truncating
+before every model call as the agent does. Summaries come from a fake LLM
+client, so no model is called. Facts are planted in tool outputs and needed
+again many turns later; a fact is retained if it is still in the context, as
+such or in a summary, when the turn that depends on it is generated.
+
+For each strategy it reports the tokens per call before and after truncation,
+how often the history was truncated, the CPU time of truncation, the number
+of summary calls and the share of facts retained. The CPU time is that of
+the thread truncating, so summaries made ahead in the background do not count.
+
+    python context_benchmark.py --steps 300
+    python context_benchmark.py --cassette recordings/session.jsonl.gz --strategies llm-summarizing
+"""
+
+import argparse
+import base64
+import gzip
+import io
+import json
+import logging
+import math
+import random
+import re
+import statistics
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Tuple
+
+from PIL import Image
+
+from ii_agent.llm.base import (
+    AssistantContentBlock,
+    GeneralContentBlock,
+    LLMClient,
+    LLMMessages,
+    TextPrompt,
+    TextResult,
+    ToolCall,
+    ToolFormattedResult,
+    ToolParam,
+)
+from ii_agent.llm.cassette import block_from_json
+from ii_agent.llm.message_history import MessageHistory
+from ii_agent.llm.token_counter import TokenCounter
+from ii_agent.llm.tokenizers import TOKENIZER_BACKENDS
+from ii_agent.utils.constants import DEFAULT_MODEL
+from utils import CONTEXT_MANAGERS, create_context_manager
+
+FACT_PATTERN = re.compile(r"Note: the value of setting_\d+ is v\d+-[0-9a-f]{6}\.")
+
+WORDS = (
+    "the request returned status ok with payload error retry cache build test "
+    "module function value config server client token file path line column "
+    "warning info debug result output input table row index query page link"
+).split()
+
+
+@dataclass
+class Fact:
+    text: str
+    value: str
+    # Step whose tool output states the fact
+    planted: int
+    # Step whose model call depends on the fact
+    needed: int
+
+
+@dataclass
+class Step:
+    # What the model generates, and the tool results or prompt that follow
+    assistant: list[AssistantContentBlock]
+    user: list[GeneralContentBlock]
+
+
+@dataclass
+class Trajectory:
+    name: str
+    prompt: str
+    steps: list[Step]
+    facts: list[Fact]
+
+
+class Filler:
+    """Tool output text, cut from a pool of random words."""
+
+    def __init__(self, rng: random.Random, pool_chars: int = 200_000):
+        lines = []
+        size = 0
+        while size < pool_chars:
+            line = " ".join(rng.choices(WORDS, k=rng.randint(4, 16)))
+            lines.append(line)
+            size += len(line) + 1
+        self.pool = "\n".join(lines)
+
+    def text(self, rng: random.Random, chars: int) -> str:
+        start = rng.randrange(len(self.pool))
+        text = (self.pool[start:] + self.pool)[:chars]
+        while len(text) < chars:
+            text += self.pool[: chars - len(text)]
+        return text
+
+
+def make_screenshot(width: int = 1280, height: int = 800) -> dict[str, Any]:
+    """A PNG screenshot in the form browser tools return it."""
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (240, 240, 240)).save(buffer, "PNG")
+    return {
+        "type": "base64",
+        "media_type": "image/png",
+        "data": base64.b64encode(buffer.getvalue()).decode(),
+    }
+
+
+def plan_facts(rng: random.Random, steps: int, count: int) -> list[Fact]:
+    """Facts planted over the first part of a trajectory, each needed much later."""
+    facts = []
+    if steps < 2:
+        return facts
+    for k in range(count):
+        planted = 1 + k * max(1, int(steps * 0.6) - 1) // max(count, 1)
+        gap = rng.randint(max(1, steps // 10), max(1, steps // 3))
+        needed = min(steps - 1, planted + gap)
+        if needed <= planted:
+            continue
+        value = f"v{k}-{rng.randrange(16**6):06x}"
+        facts.append(
+            Fact(f"Note: the value of setting_{k} is {value}.", value, planted, needed)
+        )
+    return facts
+
+
+def tool_output(
+    rng: random.Random, filler: Filler, chars: int, facts: list[Fact]
+) -> str:
+    """Filler text of about the given length, with the facts at random lines."""
+    lines = filler.text(rng, chars).split("\n")
+    for fact in facts:
+        lines.insert(rng.randrange(len(lines) + 1), fact.text)
+    return "\n".join(lines)
+
+
+def output_chars(rng: random.Random, low: int, high: int) -> int:
+    """An output length, uniform on a log scale, as most outputs are short."""
+    return int(math.exp(rng.uniform(math.log(low), math.log(high))))
+
+
+def tool_results(
+    rng: random.Random,
+    filler: Filler,
+    args: argparse.Namespace,
+    assistant: list[AssistantContentBlock],
+    facts: list[Fact],
+    screenshot: dict[str, Any],
+) -> list[GeneralContentBlock]:
+    """Results for the tool calls of an assistant turn, stating the given facts."""
+    calls = [block for block in assistant if isinstance(block, ToolCall)]
+    if not calls:
+        return [TextPrompt(text="Please continue.")]
+    results = []
+    for i, call in enumerate(calls):
+        text = tool_output(
+            rng,
+            filler,
+            output_chars(rng, args.min_output_chars, args.max_output_chars),
+            facts if i == 0 else [],
+        )
+        if call.tool_name.startswith("browser"):
+            output: Any = [
+                {"type": "image", "source": screenshot},
+                {"type": "text", "text": text},
+            ]
+        else:
+            output = text
+        results.append(
+            ToolFormattedResult(
+                tool_call_id=call.tool_call_id,
+                tool_name=call.tool_name,
+                tool_output=output,
+            )
+        )
+    return results
+
+
+def synthetic_trajectory(args: argparse.Namespace, seed: int) -> Trajectory:
+    """A long agent run of shell commands, web pages, file views and screenshots."""
+    rng = random.Random(seed)
+    filler = Filler(rng)
+    screenshot = make_screenshot()
+    facts = plan_facts(rng, args.steps, args.facts)
+    steps = []
+    for i in range(args.steps):
+        planted = [fact for fact in facts if fact.planted == i]
+        needed = [fact for fact in facts if fact.needed == i]
+        if needed:
+            # The call depends on facts seen many turns ago
+            tool_name = "bash"
+            tool_input = {
+                "command": "deploy "
+                + " ".join(f"--{fact.text.split()[4]}={fact.value}" for fact in needed)
+            }
+        elif args.screenshot_every and i % args.screenshot_every == 0:
+            tool_name, tool_input = "browser_view", {}
+        else:
+            tool_name, tool_input = rng.choice(
+                [
+                    ("bash", {"command": f"grep -rn pattern_{i} src"}),
+                    ("visit_webpage", {"url": f"https://example.com/page/{i}"}),
+                    (
+                        "str_replace_editor",
+                        {"command": "view", "path": f"src/module_{i}.py"},
+                    ),
+                ]
+            )
+        assistant: list[AssistantContentBlock] = [
+            TextResult(text=f"Step {i}: " + filler.text(rng, rng.randint(50, 400))),
+            ToolCall(
+                tool_call_id=f"call_{i}", tool_name=tool_name, tool_input=tool_input
+            ),
+        ]
+        steps.append(
+            Step(
+                assistant,
+                tool_results(rng, filler, args, assistant, planted, screenshot),
+            )
+        )
+    return Trajectory(
+        name=f"synthetic (seed {seed})",
+        prompt="Audit the services and deploy them with the settings you find.",
+        steps=steps,
+        facts=facts,
+    )
+
+
+def recorded_trajectory(args: argparse.Namespace, path: str, seed: int) -> Trajectory:
+    """The recorded model responses of a cassette, with synthetic tool results."""
+    assistant_turns = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                assistant_turns.append(
+                    [block_from_json(block) for block in entry["response"]]
+                )
+    rng = random.Random(seed)
+    filler = Filler(rng)
+    screenshot = make_screenshot()
+    facts = plan_facts(rng, len(assistant_turns), args.facts)
+    steps = [
+        Step(
+            assistant,
+            tool_results(
+                rng,
+                filler,
+                args,
+                assistant,
+                [fact for fact in facts if fact.planted == i],
+                screenshot,
+            ),
+        )
+        for i, assistant in enumerate(assistant_turns)
+    ]
+    return Trajectory(name=path, prompt="Recorded session.", steps=steps, facts=facts)
+
+
+class FakeSummaryClient(LLMClient):
+    """Answers summary requests with the facts in the prompt, each kept at the given recall."""
+
+    def __init__(self, recall: float = 1.0, seed: int = 0):
+        self.model_name = "fake"
+        self.recall = recall
+        self.calls = 0
+        self._rng = random.Random(seed)
+        # Summaries may be generated in the background
+        self._lock = threading.Lock()
+
+    def generate(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        prompt = "\n".join(
+            block.text
+            for message in messages
+            for block in message
+            if isinstance(block, TextPrompt)
+        )
+        with self._lock:
+            self.calls += 1
+            kept = [
+                fact
+                for fact in dict.fromkeys(FACT_PATTERN.findall(prompt))
+                if self._rng.random() < self.recall
+            ]
+        summary = (
+            "USER_CONTEXT: Audit and deploy the services\nCURRENT_STATE:\n"
+            + "\n".join(kept)
+        )
+        return [TextResult(text=summary)], {"input_tokens": len(prompt) // 3}
+
+
+def context_text(message_lists: list[list[GeneralContentBlock]]) -> str:
+    """All the text the model sees of a history."""
+    parts = []
+    for message_list in message_lists:
+        for block in message_list:
+            if isinstance(block, (TextPrompt, TextResult)):
+                parts.append(block.text)
+            elif isinstance(block, ToolCall):
+                parts.append(json.dumps(block.tool_input))
+            elif isinstance(block, ToolFormattedResult):
+                if isinstance(block.tool_output, str):
+                    parts.append(block.tool_output)
+                else:
+                    parts.extend(item.get("text", "") for item in block.tool_output)
+    return "\n".join(parts)
+
+
+@dataclass
+class Results:
+    tokens_before: list[int] = field(default_factory=list)
+    tokens_after: list[int] = field(default_factory=list)
+    cpu_seconds: list[float] = field(default_factory=list)
+    truncations: int = 0
+    summary_calls: int = 0
+    facts_needed: int = 0
+    facts_retained: int = 0
+
+
+def run_strategy(
+    trajectory: Trajectory,
+    strategy: str,
+    args: argparse.Namespace,
+    logger: logging.Logger,
+) -> Results:
+    """Play a trajectory through a history managed by the given strategy."""
+    client = FakeSummaryClient(args.summary_recall, args.seed)
+    token_counter = TokenCounter.for_model(args.model_name, args.tokenizer)
+    history = MessageHistory(
+        create_context_manager(
+            strategy, client, token_counter, logger, args.token_budget
+        )
+    )
+    results = Results()
+    history.add_user_prompt(trajectory.prompt)
+    for i, step in enumerate(trajectory.steps):
+        before = history.get_messages_for_llm()
+        results.tokens_before.append(history.count_tokens())
+        # CPU time of this thread only, as summaries made ahead run in others
+        started = time.thread_time()
+        history.truncate()
+        results.cpu_seconds.append(time.thread_time() - started)
+        after = history.get_messages_for_llm()
+        results.tokens_after.append(history.count_tokens())
+        if len(after) != len(before) or any(a is not b for a, b in zip(after, before)):
+            results.truncations += 1
+
+        needed = [fact for fact in trajectory.facts if fact.needed == i]
+        if needed:
+            text = context_text(after)
+            results.facts_needed += len(needed)
+            results.facts_retained += sum(fact.value in text for fact in needed)
+
+        history.add_assistant_turn(step.assistant)
+        history.add_user_turn(step.user)
+    results.summary_calls = client.calls
+    return results
+
+
+def report(trajectory: Trajectory, results: dict[str, Results]) -> None:
+    print(
+        f"\n{trajectory.name}: {len(trajectory.steps)} model calls, {len(trajectory.facts)} facts"
+    )
+    header = (
+        f"{'strategy':<38} {'tokens before':>13} {'tokens after':>12} {'peak':>8} "
+        f"{'truncated':>9} {'cpu ms mean':>11} {'cpu ms p95':>10} {'summaries':>9} {'facts':>7}"
+    )
+    print(header)
+    print("-" * len(header))
+    for strategy, result in results.items():
+        cpu_ms = [seconds * 1000 for seconds in result.cpu_seconds]
+        p95 = statistics.quantiles(cpu_ms, n=20)[18] if len(cpu_ms) > 1 else cpu_ms[0]
+        retained = (
+            f"{result.facts_retained / result.facts_needed:.0%}"
+            if result.facts_needed
+            else "n/a"
+        )
+        print(
+            f"{strategy:<38} {statistics.mean(result.tokens_before):>13.0f} "
+            f"{statistics.mean(result.tokens_after):>12.0f} {max(result.tokens_after):>8} "
+            f"{result.truncations / len(result.tokens_after):>9.1%} "
+            f"{statistics.mean(cpu_ms):>11.2f} {p95:>10.2f} "
+            f"{result.summary_calls:>9} {retained:>7}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the context managers")
+    parser.add_argument(
+        "--strategies",
+        nargs="+",
+        choices=CONTEXT_MANAGERS,
+        default=list(CONTEXT_MANAGERS),
+        help="Context managers to compare",
+    )
+    parser.add_argument(
+        "--steps", type=int, default=300, help="Model calls in a synthetic trajectory"
+    )
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=1,
+        help="Number of synthetic trajectories, each with its own seed",
+    )
+    parser.add_argument(
+        "--cassette",
+        action="append",
+        default=[],
+        help="Cassette whose recorded responses make up a trajectory; may be repeated",
+    )
+    parser.add_argument(
+        "--facts", type=int, default=20, help="Facts planted in each trajectory"
+    )
+    parser.add_argument(
+        "--min-output-chars", type=int, default=200, help="Shortest tool output"
+    )
+    parser.add_argument(
+        "--max-output-chars", type=int, default=40_000, help="Longest tool output"
+    )
+    parser.add_argument(
+        "--screenshot-every",
+        type=int,
+        default=5,
+        help="Steps between browser screenshots in synthetic trajectories, 0 for none",
+    )
+    parser.add_argument(
+        "--summary-recall",
+        type=float,
+        default=1.0,
+        help="Share of the facts in its input that the fake summarizer keeps",
+    )
+    parser.add_argument(
+        "--token-budget", type=int, default=120_000, help="Token budget"
+    )
+    parser.add_argument(
+        "--model-name",
+        type=str,
+        default=DEFAULT_MODEL,
+        help="Model whose tokens are counted",
+    )
+    parser.add_argument(
+        "--tokenizer",
+        type=str,
+        default="bpe",
+        # The api backend would need a real model client
+        choices=[backend for backend in TOKENIZER_BACKENDS if backend != "api"],
+        help="Backend used to count tokens",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the first trajectory"
+    )
+    args = parser.parse_args()
+
+    # Truncations are reported by the benchmark, not logged
+    logger = logging.getLogger("context_benchmark")
+    logger.setLevel(logging.ERROR)
+
+    trajectories = [
+        synthetic_trajectory(args, args.seed + i) for i in range(args.synthetic)
+    ]
+    trajectories += [
+        recorded_trajectory(args, path, args.seed) for path in args.cassette
+    ]
+    for trajectory in trajectories:
+        report(
+            trajectory,
+            {
+                strategy: run_strategy(trajectory, strategy, args, logger)
+                for strategy in args.strategies
+            },
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,7 @@ import dynamic from "next/dynamic";
 import { Orbitron } from "next/font/google";
 import Cookies from "js-cookie";
 import { v4 as uuidv4 } from "uuid";
+import { uploadFileResumable } from "@/utils/upload";
 import { useRouter, useSearchParams } from "next/navigation";
 import SidebarButton from "@/components/sidebar-button";
 import { useSession } from "next-auth/react";
@@ -49,9 +50,15 @@ import {
 import ChatMessage from "./chat-message";
 import ImageBrowser from "./image-browser";
 
+const RECONNECT_DELAY_MS = 1000;
+
 export default function Home() {
   const xtermRef = useRef<XTerm | null>(null);
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  // Last event sequence number received, to resume after a reconnect
+  const lastSeqRef = useRef(0);
+  const sessionIdRef = useRef<string | null>(null);
+  const closedByUserRef = useRef(false);
   const searchParams = useSearchParams();
   const router = useRouter();
   const { data: session } = useSession();
@@ -103,6 +110,10 @@ export default function Home() {
     setSessionId(id);
   }, [searchParams]);
 
+  useEffect(() => {
+    sessionIdRef.current = sessionId;
+  }, [sessionId]);
+
   // Fetch session events when session ID is available
   useEffect(() => {
     const fetchSessionEvents = async () => {
@@ -117,8 +128,9 @@ export default function Home() {
           throw new Error("No authentication token found");
         }
 
+        // Replay needs screenshots and file contents, stream them line by line
         const response = await fetch(
-          `${process.env.NEXT_PUBLIC_API_URL}/api/sessions/${id}/events`,
+          `${process.env.NEXT_PUBLIC_API_URL}/api/sessions/${id}/events?format=ndjson&limit=0&include_heavy=true`,
           {
             headers: {
               "Authorization": `Bearer ${sessionToken}`,
@@ -127,13 +139,30 @@ export default function Home() {
           }
         );
 
-        if (!response.ok) {
+        if (!response.ok || !response.body) {
           throw new Error(
             `Error fetching session events: ${response.statusText}`
           );
         }
 
-        const data = await response.json();
+        const events: IEvent[] = [];
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        while (true) {
+          const { done, value } = await reader.read();
+          buffer += decoder.decode(value, { stream: !done });
+          const lines = buffer.split("\n");
+          buffer = done ? "" : lines.pop() || "";
+          for (const line of lines) {
+            if (line.trim()) {
+              events.push(JSON.parse(line));
+            }
+          }
+          if (done) break;
+        }
+
+        const data = { events };
         const workspace = data.events?.[0]?.workspace_dir;
         setWorkspaceInfo(workspace);
 
@@ -373,8 +402,10 @@ export default function Home() {
 
   const resetChat = () => {
     if (socket) {
+      closedByUserRef.current = true;
       socket.close();
     }
+    lastSeqRef.current = 0;
     setSessionId(null);
     router.push("/ultron");
     setMessages([]);
@@ -498,33 +529,18 @@ export default function Home() {
                 throw new Error("No authentication token found");
               }
 
-              // Upload the file with authentication
-              const response = await fetch(
-                `${process.env.NEXT_PUBLIC_API_URL}/api/upload`,
-                {
-                  method: "POST",
-                  headers: {
-                    "Authorization": `Bearer ${sessionToken}`,
-                    "Content-Type": "application/json",
-                  },
-                  body: JSON.stringify({
-                    session_id: connectionId,
-                    file: {
-                      path: file.name,
-                      content,
-                    },
-                  }),
-                }
-              );
-
-              const result = await response.json();
-
-              if (response.ok) {
+              // Upload the raw file in resumable chunks
+              try {
+                const uploaded = await uploadFileResumable(
+                  file,
+                  connectionId as string,
+                  sessionToken
+                );
                 // Update uploaded files state
-                setUploadedFiles((prev) => [...prev, result.file.path]);
+                setUploadedFiles((prev) => [...prev, uploaded.path]);
                 resolve({ name: file.name, success: true });
-              } else {
-                console.error(`Error uploading ${file.name}:`, result.error);
+              } catch (error) {
+                console.error(`Error uploading ${file.name}:`, error);
                 resolve({ name: file.name, success: false });
               }
             };
@@ -622,20 +638,52 @@ export default function Home() {
       case AgentEvent.PROCESSING:
         setIsLoading(true);
         break;
+      case AgentEvent.SESSION_RESUMED:
+        setIsLoading(!!data.content.running);
+        if (data.content.missed_events) {
+          catchUpFromHistory(data.content.session_id as string);
+        }
+        break;
+      case AgentEvent.QUEUE_POSITION:
+        toast.info(`Waiting for a free agent, position ${data.content.position} in queue`, {
+          id: "queue-position",
+        });
+        break;
+      case AgentEvent.THROTTLED:
+        toast.info(`Model rate limit reached, continuing in ${Math.ceil(data.content.wait_seconds as number)}s`, {
+          id: "throttled",
+        });
+        break;
       case AgentEvent.WORKSPACE_INFO:
         setWorkspaceInfo(data.content.path as string);
         break;
-      case AgentEvent.AGENT_THINKING:
-        setMessages((prev) => [
-          ...prev,
-          {
-            id: data.id,
-            role: "assistant",
-            content: data.content.text as string,
-            timestamp: Date.now(),
-          },
-        ]);
+      case AgentEvent.AGENT_THINKING: {
+        const streamId = data.content.stream_id as string | undefined;
+        if (data.content.delta && data.content.kind !== "text") {
+          break;
+        }
+        setMessages((prev) => {
+          const lastMessage = prev[prev.length - 1];
+          if (streamId && lastMessage?.streamId === streamId) {
+            // Deltas extend the streamed message, the final event replaces it
+            const content = data.content.delta
+              ? (lastMessage.content || "") + (data.content.text as string)
+              : (data.content.text as string);
+            return [...prev.slice(0, -1), { ...lastMessage, content }];
+          }
+          return [
+            ...prev,
+            {
+              id: data.id,
+              role: "assistant",
+              content: data.content.text as string,
+              timestamp: Date.now(),
+              streamId,
+            },
+          ];
+        });
         break;
+      }
 
       case AgentEvent.TOOL_CALL:
         if (data.content.tool_name === TOOL.SEQUENTIAL_THINKING) {
@@ -858,6 +906,38 @@ export default function Home() {
     setIsStopped(true);
   };
 
+  // Apply saved events that were sent while disconnected and are no longer
+  // buffered by the server
+  const catchUpFromHistory = async (id: string) => {
+    try {
+      let cursor: string | null = "";
+      while (cursor !== null) {
+        const params = new URLSearchParams({ limit: "1000" });
+        if (cursor) params.set("after", cursor);
+        const response = await fetch(
+          `${process.env.NEXT_PUBLIC_API_URL}/api/sessions/${id}/events?${params}`,
+          { headers: { Authorization: `Bearer ${session?.accessToken}` } }
+        );
+        if (!response.ok) {
+          throw new Error(response.statusText);
+        }
+        const data: { events: IEvent[]; next_cursor: string | null } =
+          await response.json();
+        for (const event of data.events) {
+          const seq = event.event_payload.seq;
+          if (typeof seq === "number" && seq > lastSeqRef.current) {
+            lastSeqRef.current = seq;
+            handleEvent({ ...event.event_payload, id: event.id });
+          }
+        }
+        cursor = data.next_cursor;
+      }
+    } catch (error) {
+      console.error("Failed to catch up on session events:", error);
+      toast.error("Some agent progress could not be loaded");
+    }
+  };
+
   useEffect(() => {
     // Connect to WebSocket when the component mounts
     const connectWebSocket = () => {
@@ -874,6 +954,19 @@ export default function Home() {
       ws.onopen = () => {
         console.log("WebSocket connection established");
         setWsConnectionState("connected");
+        // Pick up the running session where the dropped connection left off
+        if (sessionIdRef.current) {
+          ws.send(
+            JSON.stringify({
+              type: "resume",
+              content: {
+                session_id: sessionIdRef.current,
+                last_seq: lastSeqRef.current,
+              },
+            })
+          );
+          return;
+        }
         // Request workspace info immediately after connection
         ws.send(
           JSON.stringify({
@@ -886,6 +979,11 @@ export default function Home() {
       ws.onmessage = (event) => {
         try {
           const data = JSON.parse(event.data);
+          if (typeof data.seq === "number") {
+            // Skip events already received before a reconnect
+            if (data.seq <= lastSeqRef.current) return;
+            lastSeqRef.current = data.seq;
+          }
           handleEvent({ ...data, id: Date.now().toString() });
         } catch (error) {
           console.error("Error parsing WebSocket data:", error);
@@ -902,6 +1000,11 @@ export default function Home() {
         console.log("WebSocket connection closed");
         setWsConnectionState("disconnected");
         setSocket(null);
+        if (closedByUserRef.current) {
+          closedByUserRef.current = false;
+        } else if (sessionIdRef.current) {
+          setTimeout(connectWebSocket, RECONNECT_DELAY_MS);
+        }
       };
 
       setSocket(ws);
@@ -915,6 +1018,7 @@ export default function Home() {
     // Clean up the WebSocket connection when the component unmounts
     return () => {
       if (socket) {
+        closedByUserRef.current = true;
         socket.close();
       }
     };
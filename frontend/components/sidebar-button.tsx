@@ -26,6 +26,7 @@ const SidebarButton = ({ className, workspaceInfo }: SidebarButtonProps) => {
   const [isOpen, setIsOpen] = useState(false);
   const [sessions, setSessions] = useState<ISession[]>([]);
   const [isLoading, setIsLoading] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [error, setError] = useState<string | null>(null);
   const [activeSessionId, setActiveSessionId] = useState<string | null>(null);
 
@@ -44,7 +45,7 @@ const SidebarButton = ({ className, workspaceInfo }: SidebarButtonProps) => {
     setIsOpen(!isOpen);
   };
 
-  const fetchSessions = useCallback(async () => {
+  const fetchSessions = useCallback(async (cursor?: string) => {
     // Check if user is authenticated
     if (status !== "authenticated" || !session) {
       setError("User not authenticated");
@@ -61,8 +62,9 @@ const SidebarButton = ({ className, workspaceInfo }: SidebarButtonProps) => {
         throw new Error("No authentication token found");
       }
 
+      const params = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
       const response = await fetch(
-        `${process.env.NEXT_PUBLIC_API_URL}/api/sessions`,
+        `${process.env.NEXT_PUBLIC_API_URL}/api/sessions${params}`,
         {
           headers: {
             "Authorization": `Bearer ${sessionToken}`,
@@ -76,7 +78,9 @@ const SidebarButton = ({ className, workspaceInfo }: SidebarButtonProps) => {
       }
 
       const data = await response.json();
-      setSessions(data.sessions || []);
+      const page: ISession[] = data.sessions || [];
+      setSessions((prev) => (cursor ? [...prev, ...page] : page));
+      setNextCursor(data.next_cursor || null);
     } catch (err) {
       console.error("Failed to fetch sessions:", err);
       setError("Failed to load sessions. Please try again.");
@@ -196,6 +200,15 @@ const SidebarButton = ({ className, workspaceInfo }: SidebarButtonProps) => {
                     ))}
                   </div>
                 )}
+                {nextCursor && !isLoading && !error && (
+                  <Button
+                    variant="ghost"
+                    onClick={() => fetchSessions(nextCursor)}
+                    className="w-full mt-2 text-gray-400 hover:text-white hover:bg-[#2a2b30]"
+                  >
+                    Load more
+                  </Button>
+                )}
               </div>
             </motion.div>
           </>
@@ -34,6 +34,9 @@ export enum AgentEvent {
   BROWSER_USE = "browser_use",
   FILE_EDIT = "file_edit",
   PROMPT_GENERATED = "prompt_generated",
+  QUEUE_POSITION = "queue_position",
+  SESSION_RESUMED = "session_resumed",
+  THROTTLED = "throttled",
 }
 
 export enum TOOL {
@@ -111,6 +114,7 @@ export interface Message {
   action?: ActionStep;
   files?: string[]; // File names
   fileContents?: { [filename: string]: string }; // Base64 content of files
+  streamId?: string; // Model turn the content was streamed from
 }
 
 export interface ISession {
@@ -119,6 +123,7 @@ export interface ISession {
   created_at: string;
   device_id: string;
   first_message: string;
+  last_activity_at?: string;
 }
 
 export interface IEvent {
@@ -127,9 +132,12 @@ export interface IEvent {
   event_payload: {
     type: AgentEvent;
     content: Record<string, unknown>;
+    seq?: number;
   };
   timestamp: string;
   workspace_dir: string;
+  cursor?: string;
+  heavy_fields_omitted?: boolean;
 }
 
 export interface ToolSettings {
@@ -0,0 +1,73 @@
+import { v4 as uuidv4 } from "uuid";
+
+const CHUNK_SIZE = 8 * 1024 * 1024;
+const MAX_RETRIES = 3;
+
+interface UploadResult {
+  path: string;
+  saved_path: string;
+}
+
+const getReceivedOffset = async (
+  baseUrl: string,
+  uploadId: string,
+  headers: HeadersInit
+): Promise<number> => {
+  const response = await fetch(`${baseUrl}/${uploadId}`, { headers });
+  if (!response.ok) {
+    throw new Error(`Error checking upload: ${response.statusText}`);
+  }
+  const result = await response.json();
+  return result.offset as number;
+};
+
+// Upload a file as raw chunks, resuming from the server's offset after a failure
+export const uploadFileResumable = async (
+  file: File,
+  sessionId: string,
+  sessionToken: string
+): Promise<UploadResult> => {
+  const baseUrl = `${process.env.NEXT_PUBLIC_API_URL}/api/upload/${sessionId}`;
+  const headers = { Authorization: `Bearer ${sessionToken}` };
+  const uploadId = uuidv4();
+  let offset = 0;
+  let retries = 0;
+
+  while (true) {
+    const end = Math.min(offset + CHUNK_SIZE, file.size);
+    const params = new URLSearchParams({
+      path: file.name,
+      upload_id: uploadId,
+      total: `${file.size}`,
+      offset: `${offset}`,
+    });
+
+    try {
+      const response = await fetch(`${baseUrl}?${params}`, {
+        method: "PUT",
+        headers: { ...headers, "Content-Type": "application/octet-stream" },
+        body: file.slice(offset, end),
+      });
+      const result = await response.json();
+
+      if (response.status === 409 && typeof result.offset === "number") {
+        offset = result.offset;
+        continue;
+      }
+      if (!response.ok) {
+        throw new Error(result.error || result.detail || response.statusText);
+      }
+      if (result.complete) {
+        return result.file as UploadResult;
+      }
+      offset = result.offset;
+      retries = 0;
+    } catch (error) {
+      retries += 1;
+      if (retries > MAX_RETRIES) {
+        throw error;
+      }
+      offset = await getReceivedOffset(baseUrl, uploadId, headers);
+    }
+  }
+};
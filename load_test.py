@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Load generator for the WebSocket server.
+
+Opens concurrent sessions against a server started with `--replay`, so no
+model is called, drives each through init_agent and a number of queries, and
+reports query latency, event throughput and server memory.
+
+    python ws_server.py --replay --replay-latency lognormal:1.5,0.5
+    python load_test.py --sessions 50 --queries 3
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import statistics
+import threading
+import time
+import urllib.request
+from dataclasses import dataclass, field
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+import websockets
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Served to the visit_webpage tool in place of a real site
+STAND_IN_PAGE = b"""<html><head><title>Replay stand-in</title></head>
+<body><h1>Replay stand-in</h1><p>A local page for load testing.</p>
+<ul><li><a href="/a">First link</a></li><li><a href="/b">Second link</a></li></ul>
+</body></html>"""
+
+
+class StandInHandler(SimpleHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(STAND_IN_PAGE)))
+        self.end_headers()
+        self.wfile.write(STAND_IN_PAGE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stand_in_server() -> str:
+    """Serve the stand-in page on a free local port and return its URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/page"
+
+
+def mint_token(secret: str, user: int) -> str:
+    """Create a NextAuth style JWT for a load test user."""
+    now = int(time.time())
+    claims = {
+        "sub": f"loadtest-{user}",
+        "name": f"Load test {user}",
+        "email": f"loadtest-{user}@example.com",
+        "iat": now,
+        "exp": now + 24 * 3600,
+    }
+    return jwt.encode(claims, secret, algorithm="HS256")
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Return the q-th percentile, interpolating between the closest ranks."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+@dataclass
+class Results:
+    query_latencies: list[float] = field(default_factory=list)
+    first_event_latencies: list[float] = field(default_factory=list)
+    events: int = 0
+    errors: list[str] = field(default_factory=list)
+    memory_samples: list[float] = field(default_factory=list)
+
+
+async def run_session(
+    index: int, args: argparse.Namespace, token: str, web_url: str, results: Results
+) -> None:
+    """Drive one session through init_agent and the configured queries."""
+    url = f"{args.url}/ws?token={token}"
+    await asyncio.sleep(index * args.ramp_up / max(args.sessions, 1))
+    try:
+        async with websockets.connect(url, max_size=None) as ws:
+
+            async def receive() -> dict:
+                event = json.loads(await asyncio.wait_for(ws.recv(), args.timeout))
+                results.events += 1
+                if event["type"] == "error":
+                    raise RuntimeError(event["content"].get("message"))
+                return event
+
+            while (await receive())["type"] != "connection_established":
+                pass
+
+            await ws.send(
+                json.dumps(
+                    {
+                        "type": "init_agent",
+                        "content": {
+                            "model_name": "replay",
+                            "tool_args": {},
+                            "replay_variables": {"web_url": web_url},
+                        },
+                    }
+                )
+            )
+            while (await receive())["type"] != "agent_initialized":
+                pass
+
+            for query in range(args.queries):
+                started = time.perf_counter()
+                await ws.send(
+                    json.dumps(
+                        {
+                            "type": "query",
+                            "content": {
+                                "text": f"Load test query {query} of session {index}"
+                            },
+                        }
+                    )
+                )
+                first_event = None
+                while True:
+                    event = await receive()
+                    if first_event is None and event["type"] != "processing":
+                        first_event = time.perf_counter() - started
+                    if event["type"] == "agent_response":
+                        break
+                results.query_latencies.append(time.perf_counter() - started)
+                if first_event is not None:
+                    results.first_event_latencies.append(first_event)
+    except Exception as e:
+        results.errors.append(f"session {index}: {type(e).__name__}: {e}")
+
+
+def scrape_memory(metrics_url: str) -> float | None:
+    """Read the server's resident memory from its metrics endpoint."""
+    try:
+        with urllib.request.urlopen(metrics_url, timeout=5) as response:
+            for line in response.read().decode().splitlines():
+                if line.startswith("process_resident_memory_bytes "):
+                    return float(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+async def sample_memory(
+    metrics_url: str, results: Results, stop: asyncio.Event
+) -> None:
+    """Sample server memory every second until stopped."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        memory = await loop.run_in_executor(
+            None, functools.partial(scrape_memory, metrics_url)
+        )
+        if memory is not None:
+            results.memory_samples.append(memory)
+        try:
+            await asyncio.wait_for(stop.wait(), 1)
+        except asyncio.TimeoutError:
+            pass
+
+
+def report(args: argparse.Namespace, results: Results, elapsed: float) -> None:
+    print(f"\nSessions: {args.sessions}, queries per session: {args.queries}")
+    print(
+        f"Completed queries: {len(results.query_latencies)}, failed sessions: {len(results.errors)}"
+    )
+    for error in results.errors[:10]:
+        print(f"  {error}")
+    for name, values in (
+        ("Query latency", results.query_latencies),
+        ("First event latency", results.first_event_latencies),
+    ):
+        print(
+            f"{name} (s): p50 {percentile(values, 50):.3f}  "
+            f"p95 {percentile(values, 95):.3f}  p99 {percentile(values, 99):.3f}  "
+            f"max {max(values, default=float('nan')):.3f}"
+        )
+    print(
+        f"Events: {results.events} in {elapsed:.1f}s ({results.events / elapsed:.1f}/s)"
+    )
+    if results.memory_samples:
+        mib = [sample / 2**20 for sample in results.memory_samples]
+        print(
+            f"Server memory (MiB): start {mib[0]:.1f}  peak {max(mib):.1f}  "
+            f"end {mib[-1]:.1f}  mean {statistics.mean(mib):.1f}"
+        )
+    else:
+        print("Server memory: not available from /metrics")
+
+
+async def async_main(args: argparse.Namespace) -> None:
+    secret = os.getenv("NEXTAUTH_SECRET")
+    if not secret:
+        raise SystemExit("NEXTAUTH_SECRET must be set to the server's secret")
+
+    web_url = start_stand_in_server()
+    tokens = [mint_token(secret, i % args.users) for i in range(args.sessions)]
+    results = Results()
+
+    metrics_url = args.url.replace("ws://", "http://").replace("wss://", "https://")
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(
+        sample_memory(f"{metrics_url}/metrics", results, stop)
+    )
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(
+            run_session(i, args, tokens[i], web_url, results)
+            for i in range(args.sessions)
+        )
+    )
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await sampler
+    report(args, results, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the WebSocket server")
+    parser.add_argument(
+        "--url",
+        type=str,
+        default="ws://localhost:8000",
+        help="Base websocket URL of the server",
+    )
+    parser.add_argument(
+        "--sessions", type=int, default=10, help="Number of concurrent sessions"
+    )
+    parser.add_argument(
+        "--queries", type=int, default=3, help="Queries sent by each session"
+    )
+    parser.add_argument(
+        "--users",
+        type=int,
+        default=None,
+        help="Number of distinct users the sessions belong to, one per session by default",
+    )
+    parser.add_argument(
+        "--ramp-up",
+        type=float,
+        default=5.0,
+        help="Seconds over which sessions are opened",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=300.0,
+        help="Seconds to wait for the next event before failing a session",
+    )
+    args = parser.parse_args()
+    if args.users is None:
+        args.users = args.sessions
+
+    asyncio.run(async_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -51,13 +51,18 @@ from ii_agent.tools.visit_webpage_tool import VisitWebpageTool
 from ii_agent.tools.visualizer import DisplayImageTool
 from ii_agent.tools.web_search_tool import WebSearchTool
 from ii_agent.utils import WorkspaceManager
-from ii_agent.llm import get_client
 from ii_agent.llm.context_manager.llm_summarizing import LLMSummarizingContextManager
 from ii_agent.llm.token_counter import TokenCounter
 from ii_agent.utils.constants import DEFAULT_MODEL, UPLOAD_FOLDER_NAME
-from utils import parse_common_args
+from utils import (
+    configure_llm_limits,
+    create_llm_client,
+    parse_common_args,
+    wrap_llm_cache,
+)
 from ii_agent.db.manager import DatabaseManager
 from ii_agent.core.event import RealtimeEvent, EventType
+from ii_agent.core.scheduler import AgentScheduler, RunPriority
 from ii_agent.tools.youtube_transcript_tool import YoutubeTranscriptTool
 
 # Global lock for thread-safe file appending
@@ -334,14 +339,10 @@ Run verification steps if that's needed, you must make sure you find the correct
         )
 
         # Run agent with question-specific workspace
-        loop = asyncio.get_running_loop()
-        final_result = await loop.run_in_executor(
-            None,  # Uses default ThreadPoolExecutor
-            lambda: agent.run_agent(
-                augmented_question,
-                resume=True,
-                files=[example["file_name"]] if example["file_name"] else [],
-            ),
+        final_result = await agent.arun_agent(
+            augmented_question,
+            resume=True,
+            files=[example["file_name"]] if example["file_name"] else [],
         )
 
         output = str(final_result)
@@ -368,6 +369,7 @@ Run verification steps if that's needed, you must make sure you find the correct
             await message_queue.join()
         except asyncio.CancelledError:
             pass
+        await db_manager.flush_events()
 
     end_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
@@ -396,6 +398,7 @@ Run verification steps if that's needed, you must make sure you find the correct
 def main():
     """Main entry point for GAIA evaluation."""
     args = parse_args()
+    configure_llm_limits(args)
     print(f"Starting GAIA evaluation with arguments: {args}")
 
     # Setup logging
@@ -409,17 +412,19 @@ def main():
         logger.addHandler(logging.StreamHandler())
 
     # Initialize LLM client
-    client = get_client(
+    client = create_llm_client(
         "anthropic-direct",
+        args,
         model_name=DEFAULT_MODEL,
-        use_caching=False,
+        use_caching=True,
         project_id=args.project_id,
         region=args.region,
         thinking_tokens=0,
     )
+    client = wrap_llm_cache(client, args)
 
     # Initialize token counter and context manager
-    token_counter = TokenCounter()
+    token_counter = TokenCounter.for_model(DEFAULT_MODEL, args.tokenizer, client)
     context_manager = LLMSummarizingContextManager(
         client=client,
         token_counter=token_counter,
@@ -461,11 +466,15 @@ def main():
     tasks_to_run = get_examples_to_answer(answers_file, eval_ds)
 
     async def process_tasks():
-        # Create semaphore to limit concurrent tasks
-        sem = asyncio.Semaphore(args.concurrency)
+        # Limit concurrent tasks, as batch runs they would give way to
+        # interactive runs sharing the scheduler
+        scheduler = AgentScheduler(
+            max_concurrent_runs=args.concurrency,
+            max_runs_per_user=args.concurrency,
+        )
 
-        async def process_with_semaphore(example):
-            async with sem:
+        async def process_with_slot(example):
+            async with scheduler.slot("gaia", RunPriority.BATCH):
                 return await answer_single_question(
                     example,
                     answers_file,
@@ -475,8 +484,8 @@ def main():
                     args.use_container_workspace,
                 )
 
-        # Create tasks with semaphore
-        tasks = [process_with_semaphore(example) for example in tasks_to_run]
+        # Create tasks, each waiting for a run slot
+        tasks = [process_with_slot(example) for example in tasks_to_run]
 
         # Process tasks with progress bar
         for f in tqdm(
@@ -1,19 +1,29 @@
 import asyncio
 import logging
-from typing import Any, Optional
+from typing import Any, Coroutine, Optional, TypeVar
 import uuid
 
 from typing import List
 from fastapi import WebSocket
 from ii_agent.agents.base import BaseAgent
 from ii_agent.core.event import EventType, RealtimeEvent
-from ii_agent.llm.base import LLMClient, TextResult, ToolCallParameters
+from ii_agent.core.event_buffer import EventBuffer
+from ii_agent.core.scheduler import checkpoint
+from ii_agent.core.tracing import Tracer, current_tracer, span, use_tracer
+from ii_agent.llm.base import (
+    LLMClient,
+    StreamDelta,
+    TextResult,
+    ToolCallParameters,
+)
 from ii_agent.llm.context_manager.base import ContextManager
 from ii_agent.llm.message_history import MessageHistory
+from ii_agent.llm.prompt_cache import PromptCacheStats
+from ii_agent.llm.rate_limit import use_throttle_listener
 from ii_agent.tools.base import ToolImplOutput, LLMTool
 from ii_agent.tools.utils import encode_image
 from ii_agent.db.manager import DatabaseManager
-from ii_agent.tools import AgentToolManager
+from ii_agent.tools import AgentToolManager, ToolOutputStore
 from ii_agent.utils.constants import COMPLETE_MESSAGE
 from ii_agent.utils.workspace_manager import WorkspaceManager
 
@@ -26,6 +36,52 @@ AGENT_INTERRUPT_FAKE_MODEL_RSP = (
     "Agent interrupted by user. You can resume by providing a new instruction."
 )
 
+# Events only relevant while they are current, sent but not saved
+TRANSIENT_EVENT_TYPES = {EventType.QUEUE_POSITION, EventType.THROTTLED}
+
+T = TypeVar("T")
+
+
+def run_without_loop(coroutine: Coroutine[Any, Any, T]) -> T:
+    """Run a coroutine from synchronous code, on an event loop of its own.
+
+    Raises:
+        RuntimeError: If called from a running event loop, where the agent
+            must be awaited with `arun_agent` instead
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    coroutine.close()
+    raise RuntimeError(
+        "The agent cannot run synchronously inside a running event loop, "
+        "await arun_agent instead"
+    )
+
+
+def is_stream_delta(event: RealtimeEvent) -> bool:
+    """Whether an event carries a partial model response."""
+    return event.type == EventType.AGENT_THINKING and bool(event.content.get("delta"))
+
+
+def coalesce_stream_deltas(events: list[RealtimeEvent]) -> list[RealtimeEvent]:
+    """Merge consecutive deltas of the same content block into one event."""
+    merged: list[RealtimeEvent] = []
+    for event in events:
+        if merged:
+            last = merged[-1].content
+            content = event.content
+            if (
+                last["stream_id"] == content["stream_id"]
+                and last["index"] == content["index"]
+                and last["kind"] == content["kind"]
+            ):
+                last["text"] += content["text"]
+                continue
+        merged.append(RealtimeEvent(type=event.type, content=dict(event.content)))
+    return merged
+
 
 class AnthropicFC(BaseAgent):
     name = "general_agent"
@@ -61,6 +117,8 @@ try breaking down the task into smaller steps. After call this tool to update or
         websocket: Optional[WebSocket] = None,
         session_id: Optional[uuid.UUID] = None,
         interactive_mode: bool = True,
+        stream_model_output: bool = False,
+        stream_frame_interval: float = 0.05,
     ):
         """Initialize the agent.
 
@@ -75,6 +133,10 @@ try breaking down the task into smaller steps. After call this tool to update or
             max_turns: Maximum number of turns
             websocket: Optional WebSocket for real-time communication
             session_id: UUID of the session this agent belongs to
+            stream_model_output: Whether to forward model output to the message
+                queue as it is generated
+            stream_frame_interval: Seconds over which streamed deltas are
+                coalesced before being sent to the websocket
         """
         super().__init__()
         self.workspace_manager = workspace_manager
@@ -84,6 +146,7 @@ try breaking down the task into smaller steps. After call this tool to update or
             tools=tools,
             logger_for_agent_logs=logger_for_agent_logs,
             interactive_mode=interactive_mode,
+            output_store=ToolOutputStore(workspace_manager),
         )
 
         self.logger_for_agent_logs = logger_for_agent_logs
@@ -99,35 +162,57 @@ try breaking down the task into smaller steps. After call this tool to update or
 
         self.message_queue = message_queue
         self.websocket = websocket
+        self.stream_model_output = stream_model_output
+        self.stream_frame_interval = stream_frame_interval
+
+        # Timeline of the session, exported as a Chrome trace
+        self.tracer = Tracer(name=f"session {session_id}")
+
+        # Input tokens of the session's LLM requests, by prompt cache use
+        self.cache_stats = PromptCacheStats()
+
+        # Recent events sent to the client, replayed when it reconnects
+        self.event_buffer = EventBuffer()
+        self._sent_seq = 0
+        self._send_lock = asyncio.Lock()
 
     async def _process_messages(self):
+        current_tracer.set(self.tracer)
         try:
             while True:
                 try:
                     message: RealtimeEvent = await self.message_queue.get()
 
+                    if is_stream_delta(message):
+                        frame, message = await self._collect_stream_frame(message)
+                        # Deltas are only for live display, the complete
+                        # response is saved once the turn is over
+                        for event in coalesce_stream_deltas(frame):
+                            self.event_buffer.append(event)
+                            await self._send_to_websocket(event)
+                        if message is None:
+                            continue
+
+                    # Number the events sent to the client, before saving them
+                    # so the saved events carry the number too
+                    is_sent = message.type != EventType.USER_MESSAGE
+                    if is_sent and message.type not in TRANSIENT_EVENT_TYPES:
+                        self.event_buffer.append(message)
+
                     # Save all events to database if we have a session
-                    if self.session_id is not None:
-                        self.db_manager.save_event(self.session_id, message)
+                    if message.type in TRANSIENT_EVENT_TYPES:
+                        pass
+                    elif self.session_id is not None:
+                        with span("db.enqueue_event", "db", type=message.type.value):
+                            self.db_manager.enqueue_event(self.session_id, message)
                     else:
                         self.logger_for_agent_logs.info(
                             f"No session ID, skipping event: {message}"
                         )
 
-                    # Only send to websocket if this is not an event from the client and websocket exists
-                    if (
-                        message.type != EventType.USER_MESSAGE
-                        and self.websocket is not None
-                    ):
-                        try:
-                            await self.websocket.send_json(message.model_dump())
-                        except Exception as e:
-                            # If websocket send fails, just log it and continue processing
-                            self.logger_for_agent_logs.warning(
-                                f"Failed to send message to websocket: {str(e)}"
-                            )
-                            # Set websocket to None to prevent further attempts
-                            self.websocket = None
+                    # Only send to websocket if this is not an event from the client
+                    if is_sent:
+                        await self._send_to_websocket(message)
 
                     self.message_queue.task_done()
                 except asyncio.CancelledError:
@@ -141,6 +226,66 @@ try breaking down the task into smaller steps. After call this tool to update or
         except Exception as e:
             self.logger_for_agent_logs.error(f"Error in message processor: {str(e)}")
 
+    async def _collect_stream_frame(
+        self, first: RealtimeEvent
+    ) -> tuple[list[RealtimeEvent], Optional[RealtimeEvent]]:
+        """Gather the deltas that arrive within one frame interval.
+
+        Returns the deltas and the first non-delta event taken off the queue,
+        if any, which the caller must still process.
+        """
+        await asyncio.sleep(self.stream_frame_interval)
+        frame = [first]
+        self.message_queue.task_done()
+        while True:
+            try:
+                message = self.message_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return frame, None
+            if not is_stream_delta(message):
+                return frame, message
+            frame.append(message)
+            self.message_queue.task_done()
+
+    async def _send_to_websocket(self, message: RealtimeEvent):
+        with span("websocket.send", "websocket", type=message.type.value):
+            async with self._send_lock:
+                if self.websocket is None:
+                    return
+                # Already sent to this websocket by a replay
+                if message.seq is not None and message.seq <= self._sent_seq:
+                    return
+                try:
+                    await self.websocket.send_json(message.model_dump())
+                    if message.seq is not None:
+                        self._sent_seq = message.seq
+                except Exception as e:
+                    # If websocket send fails, just log it and continue processing
+                    self.logger_for_agent_logs.warning(
+                        f"Failed to send message to websocket: {str(e)}"
+                    )
+                    # Set websocket to None to prevent further attempts
+                    self.websocket = None
+
+    async def attach_websocket(self, websocket: WebSocket, last_seq: int) -> bool:
+        """Send events to a new websocket, starting after the client's last seen event.
+
+        Args:
+            websocket: The websocket of the reconnected client
+            last_seq: The sequence number of the last event the client received
+
+        Returns:
+            Whether every missed event was replayed. If not, the client has to
+            fetch the saved events to catch up.
+        """
+        async with self._send_lock:
+            missed = self.event_buffer.since(last_seq)
+            for event in missed or []:
+                await websocket.send_json(event.model_dump())
+            self.websocket = websocket
+            self._sent_seq = self.event_buffer.last_seq
+        return missed is not None
+
     def _validate_tool_parameters(self):
         """Validate tool parameters and check for duplicates."""
         tool_params = [tool.get_tool_param() for tool in self.tool_manager.get_tools()]
@@ -159,6 +304,13 @@ try breaking down the task into smaller steps. After call this tool to update or
         self,
         tool_input: dict[str, Any],
         message_history: Optional[MessageHistory] = None,
+    ) -> ToolImplOutput:
+        return run_without_loop(self.arun_impl(tool_input, message_history))
+
+    async def arun_impl(
+        self,
+        tool_input: dict[str, Any],
+        message_history: Optional[MessageHistory] = None,
     ) -> ToolImplOutput:
         instruction = tool_input["instruction"]
         files = tool_input["files"]
@@ -200,112 +352,191 @@ try breaking down the task into smaller steps. After call this tool to update or
 
         remaining_turns = self.max_turns
         while remaining_turns > 0:
-            self.history.truncate()
-            remaining_turns -= 1
-
-            delimiter = "-" * 45 + " NEW TURN " + "-" * 45
-            self.logger_for_agent_logs.info(f"\n{delimiter}\n")
+            turn = self.max_turns - remaining_turns + 1
+            with span("agent.turn", "agent", turn=turn):
+                # A batch run gives up its slot here when an interactive run needs it
+                await checkpoint()
+                # Truncation may call the LLM to summarize, keep it off the loop
+                await asyncio.to_thread(self.history.truncate)
+                remaining_turns -= 1
+
+                delimiter = "-" * 45 + " NEW TURN " + "-" * 45
+                self.logger_for_agent_logs.info(f"\n{delimiter}\n")
+
+                # Get tool parameters for available tools
+                all_tool_params = self._validate_tool_parameters()
+
+                if self.interrupted:
+                    # Handle interruption during model generation or other operations
+                    self.add_fake_assistant_turn(AGENT_INTERRUPT_FAKE_MODEL_RSP)
+                    return ToolImplOutput(
+                        tool_output=AGENT_INTERRUPT_MESSAGE,
+                        tool_result_message=AGENT_INTERRUPT_MESSAGE,
+                    )
 
-            # Get tool parameters for available tools
-            all_tool_params = self._validate_tool_parameters()
+                # Counting can ask the provider, so it happens off the loop
+                token_count = await asyncio.to_thread(self.history.count_tokens)
+                self.logger_for_agent_logs.info(
+                    f"(Current token count: {token_count})\n"
+                )
 
-            if self.interrupted:
-                # Handle interruption during model generation or other operations
-                self.add_fake_assistant_turn(AGENT_INTERRUPT_FAKE_MODEL_RSP)
-                return ToolImplOutput(
-                    tool_output=AGENT_INTERRUPT_MESSAGE,
-                    tool_result_message=AGENT_INTERRUPT_MESSAGE,
+                if self.stream_model_output:
+                    model_response, metadata = await self._stream_model_response(
+                        all_tool_params
+                    )
+                else:
+                    model_response, metadata = await self.client.agenerate(
+                        messages=self.history.get_messages_for_llm(),
+                        max_tokens=self.max_output_tokens,
+                        tools=all_tool_params,
+                        system_prompt=self.system_prompt,
+                    )
+                self.cache_stats.record(metadata)
+                # The history still holds exactly the messages of the request
+                await asyncio.to_thread(
+                    self.history.observe_usage,
+                    metadata,
+                    self.system_prompt,
+                    all_tool_params,
+                )
+                self.logger_for_agent_logs.info(
+                    f"(Prompt cache read ratio: {self.cache_stats.read_ratio:.2f})\n"
                 )
 
-            self.logger_for_agent_logs.info(
-                f"(Current token count: {self.history.count_tokens()})\n"
-            )
+                if len(model_response) == 0:
+                    model_response = [TextResult(text=COMPLETE_MESSAGE)]
 
-            model_response, _ = self.client.generate(
-                messages=self.history.get_messages_for_llm(),
-                max_tokens=self.max_output_tokens,
-                tools=all_tool_params,
-                system_prompt=self.system_prompt,
-            )
+                # Add the raw response to the canonical history
+                self.history.add_assistant_turn(model_response)
+
+                # Handle tool calls
+                pending_tool_calls = self.history.get_pending_tool_calls()
 
-            if len(model_response) == 0:
-                model_response = [TextResult(text=COMPLETE_MESSAGE)]
+                if len(pending_tool_calls) == 0:
+                    # No tools were called, so assume the task is complete
+                    self.logger_for_agent_logs.info("[no tools were called]")
+                    self.message_queue.put_nowait(
+                        RealtimeEvent(
+                            type=EventType.AGENT_RESPONSE,
+                            content={"text": "Task completed"},
+                        )
+                    )
+                    return ToolImplOutput(
+                        tool_output=self.history.get_last_assistant_text_response(),
+                        tool_result_message="Task completed",
+                    )
 
-            # Add the raw response to the canonical history
-            self.history.add_assistant_turn(model_response)
+                for tool_call in pending_tool_calls:
+                    self.message_queue.put_nowait(
+                        RealtimeEvent(
+                            type=EventType.TOOL_CALL,
+                            content={
+                                "tool_call_id": tool_call.tool_call_id,
+                                "tool_name": tool_call.tool_name,
+                                "tool_input": tool_call.tool_input,
+                            },
+                        )
+                    )
 
-            # Handle tool calls
-            pending_tool_calls = self.history.get_pending_tool_calls()
+                text_results = [
+                    item for item in model_response if isinstance(item, TextResult)
+                ]
+                if len(text_results) > 0:
+                    text_result = text_results[0]
+                    self.logger_for_agent_logs.info(
+                        f"Top-level agent planning next step: {text_result.text}\n",
+                    )
 
-            if len(pending_tool_calls) == 0:
-                # No tools were called, so assume the task is complete
-                self.logger_for_agent_logs.info("[no tools were called]")
-                self.message_queue.put_nowait(
-                    RealtimeEvent(
-                        type=EventType.AGENT_RESPONSE,
-                        content={"text": "Task completed"},
+                # Handle tool calls by the agent
+                if self.interrupted:
+                    # Handle interruption during tool execution
+                    self.add_tool_call_results(
+                        pending_tool_calls,
+                        [TOOL_RESULT_INTERRUPT_MESSAGE] * len(pending_tool_calls),
                     )
+                    self.add_fake_assistant_turn(TOOL_CALL_INTERRUPT_FAKE_MODEL_RSP)
+                    return ToolImplOutput(
+                        tool_output=TOOL_RESULT_INTERRUPT_MESSAGE,
+                        tool_result_message=TOOL_RESULT_INTERRUPT_MESSAGE,
+                    )
+                tool_results = await self.tool_manager.arun_tools(
+                    pending_tool_calls, self.history
                 )
-                return ToolImplOutput(
-                    tool_output=self.history.get_last_assistant_text_response(),
-                    tool_result_message="Task completed",
-                )
 
-            if len(pending_tool_calls) > 1:
-                raise ValueError("Only one tool call per turn is supported")
+                self.add_tool_call_results(pending_tool_calls, tool_results)
+                if self.tool_manager.should_stop():
+                    # Add a fake model response, so the next turn is the user's
+                    # turn in case they want to resume
+                    self.add_fake_assistant_turn(self.tool_manager.get_final_answer())
+                    return ToolImplOutput(
+                        tool_output=self.tool_manager.get_final_answer(),
+                        tool_result_message="Task completed",
+                    )
+
+        agent_answer = "Agent did not complete after max turns"
+        self.message_queue.put_nowait(
+            RealtimeEvent(type=EventType.AGENT_RESPONSE, content={"text": agent_answer})
+        )
+        return ToolImplOutput(
+            tool_output=agent_answer, tool_result_message=agent_answer
+        )
+
+    def _throttle_reporter(self, loop: asyncio.AbstractEventLoop):
+        """Tell the client while LLM requests wait on a rate limit.
+
+        Requests may wait in worker threads, like summarization during
+        truncation, so the event is queued from the loop's thread.
+        """
+
+        def report(wait_seconds: float, reason: str):
+            event = RealtimeEvent(
+                type=EventType.THROTTLED,
+                content={"wait_seconds": round(wait_seconds, 1), "reason": reason},
+            )
+            loop.call_soon_threadsafe(self.message_queue.put_nowait, event)
 
-            assert len(pending_tool_calls) == 1
+        return report
 
-            tool_call = pending_tool_calls[0]
+    async def _stream_model_response(self, all_tool_params):
+        """Get the model response while forwarding its deltas to the message queue."""
+        stream_id = str(uuid.uuid4())
 
+        def on_delta(delta: StreamDelta):
             self.message_queue.put_nowait(
                 RealtimeEvent(
-                    type=EventType.TOOL_CALL,
+                    type=EventType.AGENT_THINKING,
                     content={
-                        "tool_call_id": tool_call.tool_call_id,
-                        "tool_name": tool_call.tool_name,
-                        "tool_input": tool_call.tool_input,
+                        "text": delta.text,
+                        "delta": True,
+                        "stream_id": stream_id,
+                        "index": delta.index,
+                        "kind": delta.kind,
+                        "tool_call_id": delta.tool_call_id,
+                        "tool_name": delta.tool_name,
                     },
                 )
             )
 
-            text_results = [
-                item for item in model_response if isinstance(item, TextResult)
-            ]
-            if len(text_results) > 0:
-                text_result = text_results[0]
-                self.logger_for_agent_logs.info(
-                    f"Top-level agent planning next step: {text_result.text}\n",
-                )
-
-            # Handle tool call by the agent
-            if self.interrupted:
-                # Handle interruption during tool execution
-                self.add_tool_call_result(tool_call, TOOL_RESULT_INTERRUPT_MESSAGE)
-                self.add_fake_assistant_turn(TOOL_CALL_INTERRUPT_FAKE_MODEL_RSP)
-                return ToolImplOutput(
-                    tool_output=TOOL_RESULT_INTERRUPT_MESSAGE,
-                    tool_result_message=TOOL_RESULT_INTERRUPT_MESSAGE,
-                )
-            tool_result = self.tool_manager.run_tool(tool_call, self.history)
-
-            self.add_tool_call_result(tool_call, tool_result)
-            if self.tool_manager.should_stop():
-                # Add a fake model response, so the next turn is the user's
-                # turn in case they want to resume
-                self.add_fake_assistant_turn(self.tool_manager.get_final_answer())
-                return ToolImplOutput(
-                    tool_output=self.tool_manager.get_final_answer(),
-                    tool_result_message="Task completed",
-                )
-
-        agent_answer = "Agent did not complete after max turns"
-        self.message_queue.put_nowait(
-            RealtimeEvent(type=EventType.AGENT_RESPONSE, content={"text": agent_answer})
+        model_response, metadata = await self.client.astream(
+            messages=self.history.get_messages_for_llm(),
+            max_tokens=self.max_output_tokens,
+            tools=all_tool_params,
+            system_prompt=self.system_prompt,
+            on_delta=on_delta,
         )
-        return ToolImplOutput(
-            tool_output=agent_answer, tool_result_message=agent_answer
+
+        # Send the complete text so it is persisted and replaces the deltas
+        text = "".join(
+            item.text for item in model_response if isinstance(item, TextResult)
         )
+        if text:
+            self.message_queue.put_nowait(
+                RealtimeEvent(
+                    type=EventType.AGENT_THINKING,
+                    content={"text": text, "stream_id": stream_id},
+                )
+            )
+        return model_response, metadata
 
     def get_tool_start_message(self, tool_input: dict[str, Any]) -> str:
         return f"Agent started with instruction: {tool_input['instruction']}"
@@ -328,6 +559,44 @@ try breaking down the task into smaller steps. After call this tool to update or
         Returns:
             A tuple of (result, message).
         """
+        return run_without_loop(
+            self.arun_agent(instruction, files, resume, orientation_instruction)
+        )
+
+    async def arun_agent(
+        self,
+        instruction: str,
+        files: list[str] | None = None,
+        resume: bool = False,
+        orientation_instruction: str | None = None,
+    ) -> str:
+        """Start a new agent run on the running event loop.
+
+        Args:
+            instruction: The instruction to the agent.
+            resume: Whether to resume the agent from the previous state,
+                continuing the dialog.
+            orientation_instruction: Optional orientation instruction
+
+        Returns:
+            A tuple of (result, message).
+        """
+        tool_input = self._prepare_run(
+            instruction, files, resume, orientation_instruction
+        )
+        with (
+            use_tracer(self.tracer),
+            use_throttle_listener(self._throttle_reporter(asyncio.get_running_loop())),
+        ):
+            return await self.arun(tool_input, self.history)
+
+    def _prepare_run(
+        self,
+        instruction: str,
+        files: list[str] | None,
+        resume: bool,
+        orientation_instruction: str | None,
+    ) -> dict[str, Any]:
         self.tool_manager.reset()
         if not resume:
             self.history.clear()
@@ -339,7 +608,7 @@ try breaking down the task into smaller steps. After call this tool to update or
         }
         if orientation_instruction:
             tool_input["orientation_instruction"] = orientation_instruction
-        return self.run(tool_input, self.history)
+        return tool_input
 
     def clear(self):
         """Clear the dialog and reset interruption state.
@@ -355,18 +624,25 @@ try breaking down the task into smaller steps. After call this tool to update or
 
     def add_tool_call_result(self, tool_call: ToolCallParameters, tool_result: str):
         """Add a tool call result to the history and send it to the message queue."""
-        self.history.add_tool_call_result(tool_call, tool_result)
+        self.add_tool_call_results([tool_call], [tool_result])
 
-        self.message_queue.put_nowait(
-            RealtimeEvent(
-                type=EventType.TOOL_RESULT,
-                content={
-                    "tool_call_id": tool_call.tool_call_id,
-                    "tool_name": tool_call.tool_name,
-                    "result": tool_result,
-                },
+    def add_tool_call_results(
+        self, tool_calls: list[ToolCallParameters], tool_results: list[str]
+    ):
+        """Add the results of one turn's tool calls to the history and send them to the message queue."""
+        self.history.add_tool_call_results(tool_calls, tool_results)
+
+        for tool_call, tool_result in zip(tool_calls, tool_results):
+            self.message_queue.put_nowait(
+                RealtimeEvent(
+                    type=EventType.TOOL_RESULT,
+                    content={
+                        "tool_call_id": tool_call.tool_call_id,
+                        "tool_name": tool_call.tool_name,
+                        "result": tool_result,
+                    },
+                )
             )
-        )
 
     def add_fake_assistant_turn(self, text: str):
         """Add a fake assistant turn to the history and send it to the message queue."""
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Any
+from typing import Any, Optional
 import enum
 
 
@@ -22,8 +22,13 @@ class EventType(str, enum.Enum):
     FILE_EDIT = "file_edit"
     USER_MESSAGE = "user_message"
     PROMPT_GENERATED = "prompt_generated"
+    QUEUE_POSITION = "queue_position"
+    SESSION_RESUMED = "session_resumed"
+    THROTTLED = "throttled"
 
 
 class RealtimeEvent(BaseModel):
     type: EventType
     content: dict[str, Any]
+    # Position in the session's event stream, set when the event is sent
+    seq: Optional[int] = None
@@ -0,0 +1,53 @@
+import itertools
+from collections import deque
+from typing import Optional
+
+from ii_agent.core.event import RealtimeEvent
+
+
+class EventBuffer:
+    """Numbers the events sent to a session's client and keeps the latest ones.
+
+    A client that reconnects passes the last sequence number it saw and gets
+    the events it missed replayed, as long as they are still buffered.
+    """
+
+    def __init__(self, max_events: int = 1000):
+        """Initialize the buffer.
+
+        Args:
+            max_events: Number of most recent events kept for replay
+        """
+        self._events: deque[RealtimeEvent] = deque(maxlen=max_events)
+        self._next_seq = 1
+
+    @property
+    def last_seq(self) -> int:
+        """The sequence number of the latest event, 0 before the first one."""
+        return self._next_seq - 1
+
+    def append(self, event: RealtimeEvent) -> RealtimeEvent:
+        """Give the event the next sequence number and keep it for replay."""
+        event.seq = self._next_seq
+        self._next_seq += 1
+        self._events.append(event)
+        return event
+
+    def since(self, seq: int) -> Optional[list[RealtimeEvent]]:
+        """Get the events after the given sequence number.
+
+        Args:
+            seq: The last sequence number the client saw
+
+        Returns:
+            The missed events in order, or None if some of them are no longer
+            buffered or the client saw events this buffer never produced
+        """
+        if seq > self.last_seq:
+            return None
+        if seq == self.last_seq:
+            return []
+        first_seq = self._events[0].seq
+        if seq + 1 < first_seq:
+            return None
+        return list(itertools.islice(self._events, seq + 1 - first_seq, None))
@@ -0,0 +1,333 @@
+"""Process wide metrics in the Prometheus text exposition format.
+
+Metrics are plain in-memory counters guarded by a lock, cheap enough to
+update on every LLM call and tool run. Gauges whose value already lives
+elsewhere, like queue sizes, are computed by a callback when scraped.
+"""
+
+import bisect
+import math
+import os
+import sys
+import threading
+from typing import Callable, Iterable, Optional
+
+LabelValues = tuple[str, ...]
+
+# Seconds, spanning quick tool calls up to long model responses
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """A named metric with a fixed set of label names."""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(
+                f"Metric {self.name} expects labels {self.label_names}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for name, label_values, value in self.samples():
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return lines
+
+    def samples(self) -> list[tuple[str, LabelValues, float]]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only be increased")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> list[tuple[str, LabelValues, float]]:
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """A value that goes up and down, set directly or read from a callback.
+
+    The callback returns a mapping from label values to the current value,
+    or a single number for a gauge without labels.
+    """
+
+    type_name = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        callback: Optional[Callable[[], dict[LabelValues, float] | float]] = None,
+    ):
+        super().__init__(name, documentation, labels)
+        self._values: dict[LabelValues, float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def get(self, **labels: str) -> float:
+        return dict(self._current()).get(self._key(labels), 0)
+
+    def _current(self) -> list[tuple[LabelValues, float]]:
+        if self.callback is not None:
+            values = self.callback()
+            if not isinstance(values, dict):
+                return [((), values)]
+            return [
+                (tuple(str(v) for v in key), value) for key, value in values.items()
+            ]
+        with self._lock:
+            return list(self._values.items())
+
+    def samples(self) -> list[tuple[str, LabelValues, float]]:
+        return [(self.name, key, value) for key, value in self._current()]
+
+
+class Histogram(Metric):
+    """Counts observations into cumulative buckets, along with their sum."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: count per bucket (last one is +Inf), sum
+        self._values: dict[LabelValues, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = self._values[key]
+            counts[index] += 1
+            total[0] += value
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], [0.0]))
+            return sum(counts)
+
+    def samples(self) -> list[tuple[str, LabelValues, float]]:
+        samples = []
+        with self._lock:
+            values = [
+                (key, list(counts), total[0])
+                for key, (counts, total) in self._values.items()
+            ]
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append(
+                    (f"{self.name}_bucket", key + (_format_value(bound),), cumulative)
+                )
+            samples.append((f"{self.name}_sum", key, total))
+            samples.append((f"{self.name}_count", key, cumulative))
+        return samples
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for name, label_values, value in self.samples():
+            label_names = self.label_names
+            if name.endswith("_bucket"):
+                label_names = label_names + ("le",)
+            labels = _format_labels(label_names, label_values)
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """The set of metrics exposed together on one endpoint."""
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+LLM_REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "ii_agent_llm_request_duration_seconds",
+        "Time taken by LLM requests, including retries.",
+        labels=("provider", "model", "method"),
+    )
+)
+LLM_REQUESTS = REGISTRY.register(
+    Counter(
+        "ii_agent_llm_requests_total",
+        "LLM requests by outcome.",
+        labels=("provider", "model", "outcome"),
+    )
+)
+LLM_TOKENS = REGISTRY.register(
+    Counter(
+        "ii_agent_llm_tokens_total",
+        "Tokens reported by the LLM provider, by kind: input, output, "
+        "cache_read or cache_creation.",
+        labels=("provider", "model", "kind"),
+    )
+)
+LLM_CACHE_LOOKUPS = REGISTRY.register(
+    Counter(
+        "ii_agent_llm_cache_lookups_total",
+        "Lookups of LLM responses in a cassette, by outcome: hit or miss.",
+        labels=("outcome",),
+    )
+)
+LLM_THROTTLE_SECONDS = REGISTRY.register(
+    Counter(
+        "ii_agent_llm_throttle_seconds_total",
+        "Time LLM requests waited before being sent, by reason: rate_limit "
+        "for the request and token budgets, retry for backoff after an error.",
+        labels=("provider", "reason"),
+    )
+)
+LLM_HEDGED_REQUESTS = REGISTRY.register(
+    Counter(
+        "ii_agent_llm_hedged_requests_total",
+        "LLM requests of hedged clients, by trigger: none, hedge when the "
+        "primary was slow, failover when it was overloaded; and by the client "
+        "whose response was used.",
+        labels=("trigger", "winner"),
+    )
+)
+TOOL_RUN_SECONDS = REGISTRY.register(
+    Histogram(
+        "ii_agent_tool_run_duration_seconds",
+        "Time taken by tool runs.",
+        labels=("tool",),
+    )
+)
+TOOL_RUNS = REGISTRY.register(
+    Counter(
+        "ii_agent_tool_runs_total",
+        "Tool runs by outcome, error when the tool raised.",
+        labels=("tool", "outcome"),
+    )
+)
+
+
+def resident_memory_bytes() -> float:
+    """Return the resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # No procfs, fall back to the peak size
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Reported in bytes on macOS and in kilobytes elsewhere
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+PROCESS_MEMORY = REGISTRY.register(
+    Gauge(
+        "process_resident_memory_bytes",
+        "Resident memory size in bytes.",
+        callback=resident_memory_bytes,
+    )
+)
+
+# Metadata keys of the LLM clients, by token kind
+TOKEN_METADATA_KEYS = {
+    "input": "input_tokens",
+    "output": "output_tokens",
+    "cache_read": "cache_read_input_tokens",
+    "cache_creation": "cache_creation_input_tokens",
+}
+
+
+def record_llm_tokens(provider: str, model: str, metadata: dict) -> None:
+    """Count the tokens from the metadata an LLM client returned."""
+    for kind, key in TOKEN_METADATA_KEYS.items():
+        tokens = metadata.get(key)
+        # Providers report -1 or None for counts they do not have
+        if isinstance(tokens, (int, float)) and tokens > 0:
+            LLM_TOKENS.inc(tokens, provider=provider, model=model, kind=kind)
@@ -0,0 +1,240 @@
+import asyncio
+import contextvars
+import enum
+import itertools
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RunPriority(str, enum.Enum):
+    INTERACTIVE = "interactive"
+    BATCH = "batch"
+
+
+# Share of run slots each priority gets relative to the others
+DEFAULT_WEIGHTS = {RunPriority.INTERACTIVE: 4.0, RunPriority.BATCH: 1.0}
+
+
+@dataclass(eq=False)
+class RunSlot:
+    """Admission to run one agent, held for the duration of the run."""
+
+    scheduler: "AgentScheduler"
+    user_id: str
+    priority: RunPriority
+    tag: float
+    on_position: Optional[Callable[[int], None]] = None
+    preempt_requested: bool = field(default=False, init=False)
+    # Whether the run holds the slot, which it does not while preempted
+    held: bool = field(default=False, init=False)
+
+    async def checkpoint(self) -> None:
+        """Give up the slot if an interactive run asked for it, then wait to get it back.
+
+        Agents call this between turns, where pausing leaves no work half done.
+        """
+        if self.preempt_requested:
+            await self.scheduler._yield_slot(self)
+
+
+@dataclass(eq=False)
+class _Waiter:
+    slot: RunSlot
+    seq: int
+    future: asyncio.Future
+    preempted: bool = False
+    last_position: int = 0
+
+
+current_run_slot: contextvars.ContextVar[Optional[RunSlot]] = contextvars.ContextVar(
+    "current_run_slot", default=None
+)
+
+
+async def checkpoint() -> None:
+    """Let the scheduler preempt the current run, if it is running under one."""
+    slot = current_run_slot.get()
+    if slot is not None:
+        await slot.checkpoint()
+
+
+class AgentScheduler:
+    """Admission control for agent runs.
+
+    At most `max_concurrent_runs` runs hold a slot at once, and at most
+    `max_runs_per_user` of them belong to the same user. Waiting runs are
+    served in weighted fair queue order: each run gets a virtual start tag
+    that advances by 1 / weight of its priority per run of the same user, so
+    a user with many queued runs cannot push other users back and
+    interactive runs get a larger share than batch runs.
+
+    When an interactive run is kept waiting by a full scheduler, running
+    batch runs are asked to give up their slot at their next checkpoint.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_runs: int = 16,
+        max_runs_per_user: int = 2,
+        weights: Optional[dict[RunPriority, float]] = None,
+    ):
+        """Initialize the scheduler.
+
+        Args:
+            max_concurrent_runs: Maximum number of runs holding a slot
+            max_runs_per_user: Maximum number of slots held by one user
+            weights: Relative share of slots per priority
+        """
+        self.max_concurrent_runs = max_concurrent_runs
+        self.max_runs_per_user = max_runs_per_user
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+
+        self._waiters: list[_Waiter] = []
+        self._running: list[RunSlot] = []
+        self._user_running: dict[str, int] = {}
+        self._user_tags: dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+
+    @property
+    def running_count(self) -> int:
+        return len(self._running)
+
+    @property
+    def waiting_count(self) -> int:
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        user_id: str,
+        priority: RunPriority = RunPriority.INTERACTIVE,
+        on_position: Optional[Callable[[int], None]] = None,
+    ) -> AsyncIterator[RunSlot]:
+        """Wait for a run slot and hold it for the duration of the block.
+
+        Args:
+            user_id: The user the run belongs to
+            priority: The priority class of the run
+            on_position: Called with the 1-based queue position while waiting
+
+        Returns:
+            The slot, which is also available through `current_run_slot`
+        """
+        tag = max(self._virtual_time, self._user_tags.get(user_id, 0.0))
+        tag += 1.0 / self.weights[priority]
+        self._user_tags[user_id] = tag
+
+        slot = RunSlot(self, user_id, priority, tag, on_position)
+        await self._wait(slot)
+        token = current_run_slot.set(slot)
+        try:
+            yield slot
+        finally:
+            current_run_slot.reset(token)
+            self._release(slot)
+
+    async def _wait(self, slot: RunSlot, preempted: bool = False) -> None:
+        waiter = _Waiter(
+            slot=slot,
+            seq=next(self._seq),
+            future=asyncio.get_running_loop().create_future(),
+            preempted=preempted,
+        )
+        self._waiters.append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._dispatch()
+            else:
+                # The slot was granted as the wait got cancelled
+                self._release(slot)
+            raise
+
+    async def _yield_slot(self, slot: RunSlot) -> None:
+        logger.info(f"Preempting batch run of user {slot.user_id}")
+        self._release(slot)
+        slot.preempt_requested = False
+        await self._wait(slot, preempted=True)
+
+    def _release(self, slot: RunSlot) -> None:
+        # A run cancelled while preempted has already given up its slot
+        if not slot.held:
+            return
+        slot.held = False
+        if slot in self._running:
+            self._running.remove(slot)
+        self._user_running[slot.user_id] -= 1
+        if self._user_running[slot.user_id] == 0:
+            del self._user_running[slot.user_id]
+        self._dispatch()
+
+    def _eligible(self, waiter: _Waiter) -> bool:
+        return self._user_running.get(waiter.slot.user_id, 0) < self.max_runs_per_user
+
+    def _dispatch(self) -> None:
+        self._waiters.sort(key=lambda w: (w.slot.tag, w.seq))
+        while len(self._running) < self.max_concurrent_runs:
+            eligible = [w for w in self._waiters if self._eligible(w)]
+            # Preempted runs wait until no interactive run is held back
+            if any(w.slot.priority == RunPriority.INTERACTIVE for w in eligible):
+                eligible = [w for w in eligible if not w.preempted]
+            if not eligible:
+                break
+            waiter = eligible[0]
+            slot = waiter.slot
+            self._waiters.remove(waiter)
+            self._running.append(slot)
+            slot.held = True
+            self._user_running[slot.user_id] = (
+                self._user_running.get(slot.user_id, 0) + 1
+            )
+            self._virtual_time = max(self._virtual_time, slot.tag)
+            waiter.future.set_result(None)
+
+        self._forget_idle_users()
+        self._request_preemption()
+        self._notify_positions()
+
+    def _forget_idle_users(self) -> None:
+        # A tag the virtual time has reached no longer affects the next one,
+        # so users without runs are dropped rather than kept forever
+        active = set(self._user_running)
+        active.update(w.slot.user_id for w in self._waiters)
+        for user_id, tag in list(self._user_tags.items()):
+            if tag <= self._virtual_time and user_id not in active:
+                del self._user_tags[user_id]
+
+    def _request_preemption(self) -> None:
+        blocked = sum(
+            1
+            for w in self._waiters
+            if w.slot.priority == RunPriority.INTERACTIVE and self._eligible(w)
+        )
+        batch_slots = [s for s in self._running if s.priority == RunPriority.BATCH]
+        blocked -= sum(1 for s in batch_slots if s.preempt_requested)
+        # Preempt the most recently started batch runs first
+        for slot in reversed(batch_slots):
+            if blocked <= 0:
+                break
+            if not slot.preempt_requested:
+                slot.preempt_requested = True
+                blocked -= 1
+
+    def _notify_positions(self) -> None:
+        for position, waiter in enumerate(self._waiters, start=1):
+            on_position = waiter.slot.on_position
+            if on_position is None or waiter.last_position == position:
+                continue
+            waiter.last_position = position
+            try:
+                on_position(position)
+            except Exception as e:
+                logger.warning(f"Failed to report queue position: {str(e)}")
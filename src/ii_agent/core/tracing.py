@@ -0,0 +1,140 @@
+"""Span timing for agent sessions, exported in the Chrome trace event format.
+
+Code marks the work it does with `span(...)`. Spans are recorded on the
+tracer of the session the current context runs for, and are skipped when
+there is none. The export loads in chrome://tracing and ui.perfetto.dev.
+"""
+
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+
+def _now_us() -> float:
+    return time.perf_counter_ns() / 1000
+
+
+class Tracer:
+    """Collects the spans of one session.
+
+    Spans started in different asyncio tasks or worker threads go to
+    separate tracks, so concurrent work does not appear nested.
+    """
+
+    def __init__(self, name: str = "agent", max_spans: int = 20_000):
+        """Initialize the tracer.
+
+        Args:
+            name: Process name shown in the trace viewer
+            max_spans: Number of most recent spans kept
+        """
+        self.name = name
+        self._spans: deque[dict[str, Any]] = deque(maxlen=max_spans)
+        self._tracks: dict[tuple[str, int], tuple[int, str]] = {}
+        self._lock = threading.Lock()
+        # Timestamps are relative to this, so traces start near zero
+        self._origin_us = _now_us()
+
+    def _track(self) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            key, label = ("task", id(task)), task.get_name()
+        else:
+            thread = threading.current_thread()
+            key, label = ("thread", thread.ident or 0), thread.name
+        with self._lock:
+            if key not in self._tracks:
+                self._tracks[key] = (len(self._tracks) + 1, label)
+            return self._tracks[key][0]
+
+    @contextmanager
+    def span(self, name: str, category: str, **args: Any) -> Iterator[dict[str, Any]]:
+        """Record the time spent in the block.
+
+        Yields the span arguments, which the block may add to.
+        """
+        track = self._track()
+        start = _now_us()
+        try:
+            yield args
+        finally:
+            event = {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": round(start - self._origin_us, 3),
+                "dur": round(_now_us() - start, 3),
+                "pid": os.getpid(),
+                "tid": track,
+            }
+            if args:
+                event["args"] = args
+            with self._lock:
+                self._spans.append(event)
+
+    def export(self) -> dict[str, Any]:
+        """Return the spans as a Chrome trace JSON object."""
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self._spans)
+            tracks = list(self._tracks.values())
+        metadata = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": self.name},
+            }
+        ]
+        metadata += [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": track,
+                "args": {"name": label},
+            }
+            for track, label in tracks
+        ]
+        return {"traceEvents": metadata + spans, "displayTimeUnit": "ms"}
+
+    def write(self, path: Path | str) -> None:
+        """Write the Chrome trace JSON to a file."""
+        with open(path, "w") as f:
+            json.dump(self.export(), f, default=str)
+
+
+current_tracer: contextvars.ContextVar[Optional[Tracer]] = contextvars.ContextVar(
+    "current_tracer", default=None
+)
+
+
+@contextmanager
+def span(name: str, category: str, **args: Any) -> Iterator[dict[str, Any]]:
+    """Record a span on the current tracer, if any."""
+    tracer = current_tracer.get()
+    if tracer is None:
+        yield args
+        return
+    with tracer.span(name, category, **args) as span_args:
+        yield span_args
+
+
+@contextmanager
+def use_tracer(tracer: Optional[Tracer]) -> Iterator[None]:
+    """Record spans of the block, and of tasks and threads it starts, on `tracer`."""
+    token = current_tracer.set(tracer)
+    try:
+        yield
+    finally:
+        current_tracer.reset(token)
@@ -0,0 +1,101 @@
+"""One-off backfill of the denormalized session fields.
+
+Sessions created before `first_message` and `last_activity_at` were kept on
+the session document have them empty. Run once after deploying:
+
+    python -m ii_agent.db.backfill
+"""
+
+import argparse
+import logging
+
+from pymongo import UpdateOne
+
+from ii_agent.core.event import EventType
+from ii_agent.db.models import Event, Session, init_db
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_session_summaries(batch_size: int = 500) -> int:
+    """Fill `first_message` and `last_activity_at` on every session from its events.
+
+    Args:
+        batch_size: Number of session updates sent per bulk write
+
+    Returns:
+        The number of sessions updated
+    """
+    pipeline = [
+        {
+            "$group": {
+                "_id": "$session_id",
+                "last_activity_at": {"$max": "$timestamp"},
+                # $min ignores nulls and compares documents field by field,
+                # so this picks the earliest user message
+                "first_user_message": {
+                    "$min": {
+                        "$cond": [
+                            {"$eq": ["$event_type", EventType.USER_MESSAGE.value]},
+                            {
+                                "timestamp": "$timestamp",
+                                "text": "$event_payload.content.text",
+                            },
+                            None,
+                        ]
+                    }
+                },
+            }
+        },
+        {
+            "$project": {
+                "last_activity_at": 1,
+                "first_message": {"$ifNull": ["$first_user_message.text", ""]},
+            }
+        },
+    ]
+
+    sessions = Session._get_collection()
+    updated = 0
+    updates = []
+    for summary in Event._get_collection().aggregate(pipeline, allowDiskUse=True):
+        updates.append(
+            UpdateOne(
+                {"_id": summary["_id"]},
+                {
+                    "$set": {
+                        "first_message": summary["first_message"],
+                        "last_activity_at": summary["last_activity_at"],
+                    }
+                },
+            )
+        )
+        if len(updates) >= batch_size:
+            updated += sessions.bulk_write(updates, ordered=False).modified_count
+            updates = []
+    if updates:
+        updated += sessions.bulk_write(updates, ordered=False).modified_count
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--mongodb-url",
+        type=str,
+        default=None,
+        help="MongoDB connection URL, defaults to MONGODB_URL",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    init_db(args.mongodb_url)
+    # Creates the indexes declared in the model meta
+    Session.ensure_indexes()
+    Event.ensure_indexes()
+    updated = backfill_session_summaries()
+    logger.info(f"Updated {updated} sessions")
+
+
+if __name__ == "__main__":
+    main()
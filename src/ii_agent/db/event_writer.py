@@ -0,0 +1,321 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from ii_agent.core.event import EventType, RealtimeEvent
+from ii_agent.db.models import Event, Session
+
+logger = logging.getLogger(__name__)
+
+
+DUPLICATE_KEY_ERROR = 11000
+
+# Thread doing the spill file I/O, one so that appends and renames keep their order
+_file_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="event-spill")
+
+
+async def _in_file_thread(function: Callable, *args):
+    """Run a function on the spill file thread, off the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(
+        _file_executor, function, *args
+    )
+
+
+def insert_events(documents: list[dict]) -> None:
+    """Insert event documents into MongoDB in one round trip.
+
+    Documents that already exist, left over from a partially written batch
+    that is being retried, are skipped.
+    """
+    try:
+        Event._get_collection().insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != DUPLICATE_KEY_ERROR for error in errors):
+            raise
+    update_session_activity(documents)
+
+
+def update_session_activity(documents: list[dict]) -> None:
+    """Keep the denormalized session fields in step with written events.
+
+    Sets `last_activity_at` to the newest event timestamp and fills in
+    `first_message` from the first user message of a session that has none.
+    """
+    last_activity = {}
+    first_messages = {}
+    for document in documents:
+        session_id = document["session_id"]
+        timestamp = document["timestamp"]
+        if session_id not in last_activity or timestamp > last_activity[session_id]:
+            last_activity[session_id] = timestamp
+        if (
+            document["event_type"] == EventType.USER_MESSAGE.value
+            and session_id not in first_messages
+        ):
+            content = document["event_payload"].get("content", {})
+            first_messages[session_id] = content.get("text", "")
+
+    updates = [
+        UpdateOne({"_id": session_id}, {"$max": {"last_activity_at": timestamp}})
+        for session_id, timestamp in last_activity.items()
+    ]
+    updates += [
+        UpdateOne(
+            {"_id": session_id, "first_message": {"$in": ["", None]}},
+            {"$set": {"first_message": text}},
+        )
+        for session_id, text in first_messages.items()
+        if text
+    ]
+    if updates:
+        Session._get_collection().bulk_write(updates, ordered=False)
+
+
+class EventWriter:
+    """Buffers events in memory and writes them to MongoDB in batches.
+
+    Events are timestamped when they are enqueued, so they keep their order
+    within a session even when a batch is retried or restored from the spill
+    file. Batches that still fail after retrying are appended to a JSON lines
+    spill file and written again after the next successful flush.
+    """
+
+    def __init__(
+        self,
+        insert_many: Callable[[list[dict]], None] = insert_events,
+        max_batch_size: int = 100,
+        flush_interval: float = 0.2,
+        max_pending: int = 10_000,
+        max_retries: int = 3,
+        retry_delay: float = 0.5,
+        spill_path: Optional[Path] = None,
+    ):
+        """Initialize the writer.
+
+        Args:
+            insert_many: Function writing a list of event documents
+            max_batch_size: Number of buffered events that triggers a flush
+            flush_interval: Seconds to wait for a batch to fill up
+            max_pending: Events kept in memory before spilling to disk
+            max_retries: Attempts per batch before spilling it to disk
+            retry_delay: Base delay between attempts, doubled each time
+            spill_path: File for events that could not be written
+        """
+        if spill_path is None:
+            spill_path = Path(os.getenv("EVENT_SPILL_PATH", "event_spill.jsonl"))
+        self.insert_many = insert_many
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.spill_path = spill_path
+
+        self._pending: deque[dict] = deque()
+        self._available = True
+        self._last_timestamp = datetime.min
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def enqueue(self, session_id: uuid.UUID, event: RealtimeEvent) -> str:
+        """Buffer an event for writing without blocking.
+
+        Must be called from a running event loop.
+
+        Args:
+            session_id: The UUID of the session this event belongs to
+            event: The event to save
+
+        Returns:
+            The id the event will be stored under
+        """
+        document = {
+            "_id": str(uuid.uuid4()),
+            "session_id": str(session_id),
+            "timestamp": self._next_timestamp(),
+            "event_type": event.type.value,
+            "event_payload": event.model_dump(),
+        }
+        if len(self._pending) >= self.max_pending:
+            logger.warning("Event buffer is full, spilling event to disk")
+            _file_executor.submit(self._spill_or_log, [document])
+        else:
+            self._pending.append(document)
+
+        self._ensure_running()
+        if len(self._pending) >= self.max_batch_size:
+            self._wakeup.set()
+        return document["_id"]
+
+    async def flush(self) -> None:
+        """Write every buffered event before returning."""
+        self._ensure_running()
+        async with self._lock:
+            while self._pending:
+                await self._write_batch()
+            if self._available:
+                await self._restore_spilled()
+
+    async def close(self) -> None:
+        """Flush buffered events and stop the background task."""
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _next_timestamp(self) -> datetime:
+        # Events of a burst can share a clock reading, keep them strictly
+        # ordered at the millisecond precision MongoDB stores dates with
+        timestamp = datetime.utcnow()
+        timestamp = timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000)
+        if timestamp <= self._last_timestamp:
+            timestamp = self._last_timestamp + timedelta(milliseconds=1)
+        self._last_timestamp = timestamp
+        return timestamp
+
+    def _ensure_running(self) -> None:
+        loop = asyncio.get_running_loop()
+        if (
+            self._task is not None
+            and not self._task.done()
+            and self._task.get_loop() is loop
+        ):
+            return
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        # The writer serves every session, so it must not inherit context
+        # such as the tracer of the session that happened to start it
+        self._task = contextvars.Context().run(loop.create_task, self._run())
+
+    async def _run(self) -> None:
+        try:
+            async with self._lock:
+                await self._restore_spilled()
+        except Exception as e:
+            logger.error(f"Error restoring spilled events: {str(e)}")
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self._pending:
+                continue
+            try:
+                async with self._lock:
+                    while self._pending:
+                        await self._write_batch()
+                    if self._available:
+                        await self._restore_spilled()
+            except Exception as e:
+                logger.error(f"Error writing events: {str(e)}")
+
+    async def _write_batch(self) -> None:
+        batch = [
+            self._pending.popleft()
+            for _ in range(min(self.max_batch_size, len(self._pending)))
+        ]
+        if not await self._insert_with_retry(batch):
+            await _in_file_thread(self._spill, batch)
+
+    async def _insert_with_retry(self, batch: list[dict]) -> bool:
+        for retry in range(self.max_retries):
+            try:
+                await asyncio.to_thread(self.insert_many, batch)
+                self._available = True
+                return True
+            except Exception as e:
+                logger.warning(
+                    f"Failed to write {len(batch)} events "
+                    f"({retry + 1}/{self.max_retries}): {str(e)}"
+                )
+                if retry < self.max_retries - 1:
+                    await asyncio.sleep(self.retry_delay * 2**retry)
+        self._available = False
+        return False
+
+    def _spill(self, documents: list[dict]) -> None:
+        self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.spill_path, "a") as f:
+            for document in documents:
+                record = dict(document, timestamp=document["timestamp"].isoformat())
+                f.write(json.dumps(record, default=str) + "\n")
+
+    def _spill_or_log(self, documents: list[dict]) -> None:
+        # Spills of a full buffer are not awaited, so errors end here
+        try:
+            self._spill(documents)
+        except OSError as e:
+            logger.error(f"Failed to spill {len(documents)} events: {str(e)}")
+
+    def _take_spilled(self, restoring_path: Path) -> Optional[list[dict]]:
+        """Move the spill file aside and read the events in it, if there is one.
+
+        Lines that cannot be read, like one cut short by a crash, are skipped.
+        """
+        # A restoring file left behind by a crash is picked up first
+        if not restoring_path.exists():
+            if not self.spill_path.exists():
+                return None
+            self.spill_path.rename(restoring_path)
+        documents = []
+        with open(restoring_path) as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    document = json.loads(line)
+                    document["timestamp"] = datetime.fromisoformat(
+                        document["timestamp"]
+                    )
+                except (ValueError, TypeError, KeyError) as e:
+                    logger.warning(
+                        f"Skipping unreadable event on line {line_number} of "
+                        f"{restoring_path}: {str(e)}"
+                    )
+                    continue
+                documents.append(document)
+        return documents
+
+    async def _restore_spilled(self) -> None:
+        """Write back events spilled while the database was unavailable."""
+        restoring_path = self.spill_path.with_suffix(".restoring")
+        documents = await _in_file_thread(self._take_spilled, restoring_path)
+        if documents is None:
+            return
+
+        for start in range(0, len(documents), self.max_batch_size):
+            batch = documents[start : start + self.max_batch_size]
+            if not await self._insert_with_retry(batch):
+                await _in_file_thread(self._spill, documents[start:])
+                break
+        await _in_file_thread(restoring_path.unlink)
+
+
+_event_writer: Optional[EventWriter] = None
+
+
+def get_event_writer() -> EventWriter:
+    """Return the process wide event writer, shared by all sessions."""
+    global _event_writer
+    if _event_writer is None:
+        _event_writer = EventWriter()
+    return _event_writer
@@ -1,12 +1,24 @@
 from contextlib import contextmanager
+from datetime import datetime
 from typing import Optional, Generator
 import uuid
 from pathlib import Path
-from mongoengine import DoesNotExist
+from mongoengine import DoesNotExist, Q
+from pymongo import ASCENDING, DESCENDING
+from pymongo.cursor import Cursor
 from ii_agent.db.models import Session, Event, init_db
+from ii_agent.db.event_writer import get_event_writer, update_session_activity
 from ii_agent.core.event import EventType, RealtimeEvent
 import os
 
+# Event payload fields that can hold megabytes: screenshot data in tool
+# results and whole file contents in file edits and file creation calls.
+HEAVY_EVENT_FIELDS = [
+    "event_payload.content.result.source.data",
+    "event_payload.content.content",
+    "event_payload.content.tool_input.file_text",
+]
+
 
 class DatabaseManager:
     """Manager class for database operations."""
@@ -77,8 +89,29 @@ class DatabaseManager:
             event_payload=event.model_dump(),
         )
         db_event.save()
+        update_session_activity([db_event.to_mongo().to_dict()])
         return uuid.UUID(db_event.id)
 
+    def enqueue_event(self, session_id: uuid.UUID, event: RealtimeEvent) -> uuid.UUID:
+        """Queue an event to be saved by the batched event writer.
+
+        Unlike `save_event` this does not wait on the database, so it is safe
+        to call from the event loop. Use `flush_events` before reading or
+        deleting events that may still be buffered.
+
+        Args:
+            session_id: The UUID of the session this event belongs to
+            event: The event to save
+
+        Returns:
+            The UUID the event will be stored under
+        """
+        return uuid.UUID(get_event_writer().enqueue(session_id, event))
+
+    async def flush_events(self) -> None:
+        """Wait until every queued event has been written."""
+        await get_event_writer().flush()
+
     def get_session_events(self, session_id: uuid.UUID) -> list[Event]:
         """Get all events for a session.
 
@@ -90,6 +123,47 @@ class DatabaseManager:
         """
         return list(Event.objects(session_id=str(session_id)).order_by('timestamp'))
 
+    def find_session_events(
+        self,
+        session_id: uuid.UUID,
+        after: Optional[str] = None,
+        limit: Optional[int] = None,
+        include_heavy: bool = False,
+    ) -> Cursor:
+        """Get a cursor over a session's events, oldest first.
+
+        Args:
+            session_id: The UUID of the session
+            after: An event cursor, only events after it are returned
+            limit: The maximum number of events to return
+            include_heavy: Whether to include the fields in HEAVY_EVENT_FIELDS
+
+        Returns:
+            A pymongo cursor of raw event documents
+
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        query = {"session_id": str(session_id)}
+        if after:
+            timestamp, event_id = decode_cursor(after)
+            query["$or"] = [
+                {"timestamp": {"$gt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$gt": event_id}},
+            ]
+        projection = None
+        if not include_heavy:
+            projection = {field: 0 for field in HEAVY_EVENT_FIELDS}
+
+        cursor = (
+            Event._get_collection()
+            .find(query, projection)
+            .sort([("timestamp", ASCENDING), ("_id", ASCENDING)])
+        )
+        if limit:
+            cursor = cursor.limit(limit)
+        return cursor
+
     def get_session_by_workspace(self, workspace_dir: str) -> Optional[Session]:
         """Get a session by its workspace directory.
 
@@ -118,6 +192,20 @@ class DatabaseManager:
         except DoesNotExist:
             return None
 
+    def get_session_for_device(
+        self, session_id: uuid.UUID, device_id: str
+    ) -> Optional[Session]:
+        """Get a session by its UUID if it belongs to the given device.
+
+        Args:
+            session_id: The UUID of the session
+            device_id: The device identifier
+
+        Returns:
+            The session if found, None otherwise
+        """
+        return Session.objects(id=str(session_id), device_id=device_id).first()
+
     def get_session_by_device_id(self, device_id: str) -> Optional[Session]:
         """Get a session by its device ID.
 
@@ -132,6 +220,47 @@ class DatabaseManager:
         except DoesNotExist:
             return None
 
+    def list_sessions(
+        self, device_id: str, limit: int = 50, cursor: Optional[str] = None
+    ) -> tuple[list[Session], Optional[str]]:
+        """Get one page of a device's sessions, newest first.
+
+        Args:
+            device_id: The device identifier
+            limit: The maximum number of sessions to return
+            cursor: The `next_cursor` of the previous page, if any
+
+        Returns:
+            A tuple of (sessions, next_cursor), next_cursor is None on the last page
+
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        query = Q(device_id=device_id)
+        if cursor:
+            created_at, session_id = decode_session_cursor(cursor)
+            query &= Q(created_at__lt=created_at) | Q(
+                created_at=created_at, id__lt=session_id
+            )
+
+        sessions = list(
+            Session.objects(query)
+            .order_by("-created_at", "-id")
+            .only(
+                "id",
+                "workspace_dir",
+                "created_at",
+                "device_id",
+                "first_message",
+                "last_activity_at",
+            )
+            .limit(limit + 1)
+        )
+        if len(sessions) <= limit:
+            return sessions, None
+        sessions = sessions[:limit]
+        return sessions, encode_session_cursor(sessions[-1])
+
     def delete_session_events(self, session_id: uuid.UUID) -> None:
         """Delete all events for a session.
 
@@ -139,6 +268,7 @@ class DatabaseManager:
             session_id: The UUID of the session to delete events for
         """
         Event.objects(session_id=str(session_id)).delete()
+        self._refresh_session_activity(session_id)
 
     def delete_events_from_last_to_user_message(self, session_id: uuid.UUID) -> None:
         """Delete events from the most recent event backwards to the last user message (inclusive).
@@ -161,3 +291,62 @@ class DatabaseManager:
         else:
             # If no user message found, delete all events
             Event.objects(session_id=str(session_id)).delete()
+
+        self._refresh_session_activity(session_id)
+
+    def _refresh_session_activity(self, session_id: uuid.UUID) -> None:
+        """Recompute the denormalized session fields from the events left.
+
+        Deleted events may have been the newest one or the first user
+        message, which the session listing shows.
+        """
+        events = Event._get_collection()
+        last_event = events.find_one(
+            {"session_id": str(session_id)},
+            {"timestamp": 1},
+            sort=[("timestamp", DESCENDING)],
+        )
+        first_user_event = events.find_one(
+            {"session_id": str(session_id), "event_type": EventType.USER_MESSAGE.value},
+            {"event_payload.content.text": 1},
+            sort=[("timestamp", ASCENDING)],
+        )
+        first_message = ""
+        if first_user_event:
+            content = first_user_event.get("event_payload", {}).get("content", {})
+            first_message = content.get("text", "")
+        Session._get_collection().update_one(
+            {"_id": str(session_id)},
+            {
+                "$set": {
+                    "first_message": first_message,
+                    "last_activity_at": last_event["timestamp"] if last_event else None,
+                }
+            },
+        )
+
+
+def encode_cursor(timestamp: datetime, document_id: str) -> str:
+    """Encode a position in a listing ordered by (timestamp, id)."""
+    return f"{timestamp.isoformat()}|{document_id}"
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    """Decode a cursor made by `encode_cursor`."""
+    timestamp, _, document_id = cursor.partition("|")
+    if not document_id:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    try:
+        return datetime.fromisoformat(timestamp), document_id
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def encode_session_cursor(session: Session) -> str:
+    """Encode the position after a session in the session listing."""
+    return encode_cursor(session.created_at, session.id)
+
+
+def decode_session_cursor(cursor: str) -> tuple[datetime, str]:
+    """Decode a cursor made by `encode_session_cursor`."""
+    return decode_cursor(cursor)
@@ -7,14 +7,23 @@ import os
 
 class Session(Document):
     """Database model for agent sessions."""
-    
-    meta = {'collection': 'sessions'}
-    
+
+    meta = {
+        "collection": "sessions",
+        "indexes": [
+            # Session listing: one user's sessions, newest first, paged by cursor
+            {"fields": ["device_id", "-created_at", "-id"]},
+        ],
+    }
+
     # Store UUID as string in MongoDB
     id = StringField(primary_key=True, default=lambda: str(uuid.uuid4()))
     workspace_dir = StringField(unique=True, required=True)
     created_at = DateTimeField(default=datetime.utcnow)
     device_id = StringField()  # Optional device identifier
+    # Denormalized from the session's events when they are written
+    first_message = StringField(default="")
+    last_activity_at = DateTimeField()
 
     def __init__(
         self, id: uuid.UUID = None, workspace_dir: str = None, device_id: Optional[str] = None, **kwargs
@@ -37,8 +46,14 @@ class Session(Document):
 
 class Event(Document):
     """Database model for agent events."""
-    
-    meta = {'collection': 'events'}
+
+    meta = {
+        "collection": "events",
+        "indexes": [
+            {"fields": ["session_id", "timestamp"]},
+            {"fields": ["session_id", "event_type", "timestamp"]},
+        ],
+    }
 
     # Store UUID as string in MongoDB
     id = StringField(primary_key=True, default=lambda: str(uuid.uuid4()))
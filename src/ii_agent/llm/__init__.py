@@ -2,6 +2,10 @@ from ii_agent.llm.base import LLMClient
 from ii_agent.llm.openai import OpenAIDirectClient
 from ii_agent.llm.anthropic import AnthropicDirectClient
 from ii_agent.llm.gemini import GeminiDirectClient
+from ii_agent.llm.replay import ReplayClient
+from ii_agent.llm.cassette import CachingLLMClient, CacheMode
+from ii_agent.llm.hedged import HedgedLLMClient
+
 
 def get_client(client_name: str, **kwargs) -> LLMClient:
     """Get a client for a given client name."""
@@ -11,6 +15,8 @@ def get_client(client_name: str, **kwargs) -> LLMClient:
         return OpenAIDirectClient(**kwargs)
     elif client_name == "gemini-direct":
         return GeminiDirectClient(**kwargs)
+    elif client_name == "replay":
+        return ReplayClient(**kwargs)
     else:
         raise ValueError(f"Unknown client name: {client_name}")
 
@@ -20,5 +26,9 @@ __all__ = [
     "OpenAIDirectClient",
     "AnthropicDirectClient",
     "GeminiDirectClient",
+    "ReplayClient",
+    "CachingLLMClient",
+    "CacheMode",
+    "HedgedLLMClient",
     "get_client",
 ]
@@ -1,8 +1,6 @@
 import os
 
-import random
-import time
-from typing import Any, Tuple, cast
+from typing import Any, Callable, Tuple, cast
 import anthropic
 from anthropic import (
     NOT_GIVEN as Anthropic_NOT_GIVEN,
@@ -41,7 +39,9 @@ from anthropic.types.message_create_params import (
 
 from ii_agent.llm.base import (
     LLMClient,
+    observe_llm_request,
     AssistantContentBlock,
+    StreamDelta,
     ToolParam,
     TextPrompt,
     ToolCall,
@@ -51,13 +51,40 @@ from ii_agent.llm.base import (
     UserContentBlock,
     recursively_remove_invoke_tag,
     ImageBlock,
+    convert_cached,
 )
+from ii_agent.llm.http_pool import HTTP_CLIENTS
+from ii_agent.llm.rate_limit import RATE_LIMITERS, estimate_request_tokens
+from ii_agent.llm.prompt_cache import MAX_CACHE_BREAKPOINTS, plan_message_breakpoints
 from ii_agent.utils.constants import DEFAULT_MODEL
 
 
+def _with_cache_control(block: Any) -> Any:
+    """Return a copy of a content block that ends a cache breakpoint."""
+    if isinstance(block, dict):
+        return {**block, "cache_control": {"type": "ephemeral"}}
+    block = block.model_copy()
+    block.cache_control = {"type": "ephemeral"}
+    return block
+
+
+def _is_retryable(error: Exception) -> bool:
+    return isinstance(
+        error,
+        (
+            AnthropicAPIConnectionError,
+            AnthropicInternalServerError,
+            AnthropicRateLimitError,
+            AnthropicOverloadedError,
+        ),
+    )
+
+
 class AnthropicDirectClient(LLMClient):
     """Use Anthropic models via first party API."""
 
+    provider = "anthropic"
+
     def __init__(
         self,
         model_name=DEFAULT_MODEL,
@@ -71,27 +98,108 @@ class AnthropicDirectClient(LLMClient):
         """Initialize the Anthropic first party client."""
         # Disable retries since we are handling retries ourselves.
         if (project_id is not None) and (region is not None):
+            # Requests through Vertex count against the project's quota
+            credential = (project_id, region)
+            http_client, async_http_client = HTTP_CLIENTS.get(
+                self.provider,
+                ("vertex", project_id, region),
+                anthropic.DefaultHttpxClient,
+                anthropic.DefaultAsyncHttpxClient,
+            )
             self.client = anthropic.AnthropicVertex(
                 project_id=project_id,
                 region=region,
                 timeout=60 * 5,
                 max_retries=1,
+                http_client=http_client,
+            )
+            self.async_client = anthropic.AsyncAnthropicVertex(
+                project_id=project_id,
+                region=region,
+                timeout=60 * 5,
+                max_retries=1,
+                http_client=async_http_client,
             )
         else:
             api_key = os.getenv("ANTHROPIC_API_KEY")
+            credential = api_key
+            http_client, async_http_client = HTTP_CLIENTS.get(
+                self.provider,
+                ("api",),
+                anthropic.DefaultHttpxClient,
+                anthropic.DefaultAsyncHttpxClient,
+            )
             self.client = anthropic.Anthropic(
-                api_key=api_key, max_retries=1, timeout=60 * 5
+                api_key=api_key, max_retries=1, timeout=60 * 5, http_client=http_client
+            )
+            self.async_client = anthropic.AsyncAnthropic(
+                api_key=api_key,
+                max_retries=1,
+                timeout=60 * 5,
+                http_client=async_http_client,
             )
             model_name = model_name.replace(
                 "@", "-"
             )  # Quick fix for Anthropic Vertex API
         self.model_name = model_name
+        self.rate_limiter = RATE_LIMITERS.get(self.provider, model_name, credential)
         self.max_retries = max_retries
         self.use_caching = use_caching
         self.prompt_caching_headers = {"anthropic-beta": "prompt-caching-2024-07-31"}
         self.thinking_tokens = thinking_tokens
 
-    def generate(
+    def _convert_block(self, message: Any) -> Any:
+        """Convert one internal content block into an Anthropic content block."""
+        # Check string type to avoid import issues particularly with reloads.
+        if str(type(message)) == str(TextPrompt):
+            message = cast(TextPrompt, message)
+            message_content = AnthropicTextBlock(
+                type="text",
+                text=message.text,
+            )
+        elif str(type(message)) == str(ImageBlock):
+            message = cast(ImageBlock, message)
+            message_content = AnthropicImageBlockParam(
+                type="image",
+                source=message.source,
+            )
+        elif str(type(message)) == str(TextResult):
+            message = cast(TextResult, message)
+            message_content = AnthropicTextBlock(
+                type="text",
+                text=message.text,
+            )
+        elif str(type(message)) == str(ToolCall):
+            message = cast(ToolCall, message)
+            message_content = AnthropicToolUseBlock(
+                type="tool_use",
+                id=message.tool_call_id,
+                name=message.tool_name,
+                input=message.tool_input,
+            )
+        elif str(type(message)) == str(ToolFormattedResult):
+            message = cast(ToolFormattedResult, message)
+            message_content = AnthropicToolResultBlockParam(
+                type="tool_result",
+                tool_use_id=message.tool_call_id,
+                content=message.tool_output,
+            )
+        elif str(type(message)) == str(AnthropicRedactedThinkingBlock):
+            message = cast(AnthropicRedactedThinkingBlock, message)
+            message_content = message
+        elif str(type(message)) == str(AnthropicThinkingBlock):
+            message = cast(AnthropicThinkingBlock, message)
+            message_content = message
+        else:
+            print(
+                f"Unknown message type: {type(message)}, expected one of {str(TextPrompt)}, {str(TextResult)}, {str(ToolCall)}, {str(ToolFormattedResult)}"
+            )
+            raise ValueError(
+                f"Unknown message type: {type(message)}, expected one of {str(TextPrompt)}, {str(TextResult)}, {str(ToolCall)}, {str(ToolFormattedResult)}"
+            )
+        return message_content
+
+    def _build_request(
         self,
         messages: LLMMessages,
         max_tokens: int,
@@ -100,84 +208,41 @@ class AnthropicDirectClient(LLMClient):
         tools: list[ToolParam] = [],
         tool_choice: dict[str, str] | None = None,
         thinking_tokens: int | None = None,
-    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
-        """Generate responses.
-
-        Args:
-            messages: A list of messages.
-            max_tokens: The maximum number of tokens to generate.
-            system_prompt: A system prompt.
-            temperature: The temperature.
-            tools: A list of tools.
-            tool_choice: A tool choice.
-
-        Returns:
-            A generated response.
-        """
+    ) -> dict[str, Any]:
+        """Turn internal messages and generation options into `messages.create` kwargs."""
 
         # Turn GeneralContentBlock into Anthropic message format
+        cached_messages = set()
+        if self.use_caching:
+            # One breakpoint goes to the tools and system prompt
+            cached_messages = set(
+                plan_message_breakpoints(messages, MAX_CACHE_BREAKPOINTS - 1)
+            )
         anthropic_messages = []
         for idx, message_list in enumerate(messages):
             role = (
                 "user" if isinstance(message_list[0], UserContentBlock) else "assistant"
             )
-            message_content_list = []
-            for message in message_list:
-                # Check string type to avoid import issues particularly with reloads.
-                if str(type(message)) == str(TextPrompt):
-                    message = cast(TextPrompt, message)
-                    message_content = AnthropicTextBlock(
-                        type="text",
-                        text=message.text,
-                    )
-                elif str(type(message)) == str(ImageBlock):
-                    message = cast(ImageBlock, message)
-                    message_content = AnthropicImageBlockParam(
-                        type="image",
-                        source=message.source,
-                    )
-                elif str(type(message)) == str(TextResult):
-                    message = cast(TextResult, message)
-                    message_content = AnthropicTextBlock(
-                        type="text",
-                        text=message.text,
-                    )
-                elif str(type(message)) == str(ToolCall):
-                    message = cast(ToolCall, message)
-                    message_content = AnthropicToolUseBlock(
-                        type="tool_use",
-                        id=message.tool_call_id,
-                        name=message.tool_name,
-                        input=message.tool_input,
-                    )
-                elif str(type(message)) == str(ToolFormattedResult):
-                    message = cast(ToolFormattedResult, message)
-                    message_content = AnthropicToolResultBlockParam(
-                        type="tool_result",
-                        tool_use_id=message.tool_call_id,
-                        content=message.tool_output,
-                    )
-                elif str(type(message)) == str(AnthropicRedactedThinkingBlock):
-                    message = cast(AnthropicRedactedThinkingBlock, message)
-                    message_content = message
-                elif str(type(message)) == str(AnthropicThinkingBlock):
-                    message = cast(AnthropicThinkingBlock, message)
-                    message_content = message
-                else:
-                    print(
-                        f"Unknown message type: {type(message)}, expected one of {str(TextPrompt)}, {str(TextResult)}, {str(ToolCall)}, {str(ToolFormattedResult)}"
+            message_content_list = [
+                convert_cached(message, self.provider, self._convert_block)
+                for message in message_list
+            ]
+
+            if idx in cached_messages:
+                # Thinking blocks cannot carry a breakpoint
+                markable = [
+                    position
+                    for position, block in enumerate(message_content_list)
+                    if not isinstance(
+                        block, (AnthropicThinkingBlock, AnthropicRedactedThinkingBlock)
                     )
-                    raise ValueError(
-                        f"Unknown message type: {type(message)}, expected one of {str(TextPrompt)}, {str(TextResult)}, {str(ToolCall)}, {str(ToolFormattedResult)}"
+                ]
+                if markable:
+                    # Converted blocks are shared with later requests, mark a copy
+                    position = markable[-1]
+                    message_content_list[position] = _with_cache_control(
+                        message_content_list[position]
                     )
-                message_content_list.append(message_content)
-
-            # Anthropic supports up to 4 cache breakpoints, so we put them on the last 4 messages.
-            if self.use_caching and idx >= len(messages) - 4:
-                if isinstance(message_content_list[-1], dict):
-                    message_content_list[-1]["cache_control"] = {"type": "ephemeral"}
-                else:
-                    message_content_list[-1].cache_control = {"type": "ephemeral"}
 
             anthropic_messages.append(
                 {
@@ -217,8 +282,6 @@ class AnthropicDirectClient(LLMClient):
                 for tool in tools
             ]
 
-        response = None
-
         if thinking_tokens is None:
             thinking_tokens = self.thinking_tokens
         if thinking_tokens and thinking_tokens > 0:
@@ -232,39 +295,37 @@ class AnthropicDirectClient(LLMClient):
         else:
             extra_body = None
 
-        for retry in range(self.max_retries):
-            try:
-                response = self.client.messages.create(  # type: ignore
-                    max_tokens=max_tokens,
-                    messages=anthropic_messages,
-                    model=self.model_name,
-                    temperature=temperature,
-                    system=system_prompt or Anthropic_NOT_GIVEN,
-                    tool_choice=tool_choice_param,  # type: ignore
-                    tools=tool_params,
-                    extra_headers=extra_headers,
-                    extra_body=extra_body,
-                )
-                break
-            except (
-                AnthropicAPIConnectionError,
-                AnthropicInternalServerError,
-                AnthropicRateLimitError,
-                AnthropicOverloadedError,
-            ) as e:
-                if retry == self.max_retries - 1:
-                    print(f"Failed Anthropic request after {retry + 1} retries")
-                    raise e
-                else:
-                    print(f"Retrying LLM request: {retry + 1}/{self.max_retries}")
-                    # Sleep 12-18 seconds with jitter to avoid thundering herd.
-                    time.sleep(15 * random.uniform(0.8, 1.2))
-            except Exception as e:
-                raise e
+        # The tools and system prompt are the same for every turn, cache them together
+        system_param = system_prompt or Anthropic_NOT_GIVEN
+        if self.use_caching and system_prompt:
+            system_param = [
+                {
+                    "type": "text",
+                    "text": system_prompt,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ]
+        elif self.use_caching and tool_params is not Anthropic_NOT_GIVEN:
+            tool_params[-1]["cache_control"] = {"type": "ephemeral"}
+
+        return dict(
+            max_tokens=max_tokens,
+            messages=anthropic_messages,
+            model=self.model_name,
+            temperature=temperature,
+            system=system_param,
+            tool_choice=tool_choice_param,
+            tools=tool_params,
+            extra_headers=extra_headers,
+            extra_body=extra_body,
+        )
 
+    def _convert_response(
+        self, response: Any
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Convert an Anthropic response back into internal content blocks."""
         # Convert messages back to internal format
         internal_messages = []
-        assert response is not None
         for message in response.content:
             if "</invoke>" in str(message):
                 warning_msg = "\n".join(
@@ -305,3 +366,184 @@ class AnthropicDirectClient(LLMClient):
         }
 
         return internal_messages, message_metadata
+
+    def count_tokens(self, text: str) -> int | None:
+        """Count the tokens of a text with Anthropic's count tokens endpoint."""
+        result = self.client.messages.count_tokens(
+            model=self.model_name, messages=[{"role": "user", "content": text}]
+        )
+        return result.input_tokens
+
+    @observe_llm_request
+    def generate(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Generate responses.
+
+        Args:
+            messages: A list of messages.
+            max_tokens: The maximum number of tokens to generate.
+            system_prompt: A system prompt.
+            temperature: The temperature.
+            tools: A list of tools.
+            tool_choice: A tool choice.
+
+        Returns:
+            A generated response.
+        """
+        request = self._build_request(
+            messages,
+            max_tokens,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            tools=tools,
+            tool_choice=tool_choice,
+            thinking_tokens=thinking_tokens,
+        )
+
+        tokens = estimate_request_tokens(messages)
+
+        def create():
+            raw_response = self.client.messages.with_raw_response.create(**request)  # type: ignore
+            self.rate_limiter.update_from_headers(raw_response.headers)
+            return raw_response.parse()
+
+        response = self.rate_limiter.call(
+            create,
+            tokens=tokens,
+            retryable=_is_retryable,
+            max_retries=self.max_retries,
+        )
+        blocks, metadata = self._convert_response(response)
+        self.rate_limiter.settle(tokens, metadata)
+        return blocks, metadata
+
+    @observe_llm_request
+    async def agenerate(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Generate responses using the async Anthropic client.
+
+        Same contract as `generate`, but waits on the network and on retry
+        backoff without holding a thread.
+        """
+        request = self._build_request(
+            messages,
+            max_tokens,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            tools=tools,
+            tool_choice=tool_choice,
+            thinking_tokens=thinking_tokens,
+        )
+
+        tokens = estimate_request_tokens(messages)
+
+        async def create():
+            raw_response = await self.async_client.messages.with_raw_response.create(
+                **request
+            )  # type: ignore
+            self.rate_limiter.update_from_headers(raw_response.headers)
+            return raw_response.parse()
+
+        response = await self.rate_limiter.acall(
+            create,
+            tokens=tokens,
+            retryable=_is_retryable,
+            max_retries=self.max_retries,
+        )
+        blocks, metadata = self._convert_response(response)
+        self.rate_limiter.settle(tokens, metadata)
+        return blocks, metadata
+
+    @observe_llm_request
+    async def astream(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+        on_delta: Callable[[StreamDelta], None] | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Generate responses over the streaming Messages API.
+
+        Text and tool input JSON are passed to `on_delta` as they arrive.
+        A failed request is only retried if nothing has been streamed yet,
+        since the caller cannot take back deltas it already received.
+        """
+        request = self._build_request(
+            messages,
+            max_tokens,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            tools=tools,
+            tool_choice=tool_choice,
+            thinking_tokens=thinking_tokens,
+        )
+
+        tokens = estimate_request_tokens(messages)
+        streamed = False
+
+        async def stream_response():
+            nonlocal streamed
+            async with self.async_client.messages.stream(**request) as stream:  # type: ignore
+                # Only some SDK versions keep the HTTP response on the stream
+                http_response = getattr(stream, "response", None)
+                self.rate_limiter.update_from_headers(
+                    getattr(http_response, "headers", None)
+                )
+                tool_uses = {}
+                async for event in stream:
+                    if event.type == "content_block_start":
+                        if event.content_block.type == "tool_use":
+                            tool_uses[event.index] = event.content_block
+                    elif event.type == "content_block_delta":
+                        if event.delta.type == "text_delta":
+                            delta = StreamDelta(
+                                index=event.index,
+                                kind="text",
+                                text=event.delta.text,
+                            )
+                        elif event.delta.type == "input_json_delta":
+                            tool_use = tool_uses[event.index]
+                            delta = StreamDelta(
+                                index=event.index,
+                                kind="tool_input",
+                                text=event.delta.partial_json,
+                                tool_call_id=tool_use.id,
+                                tool_name=tool_use.name,
+                            )
+                        else:
+                            continue
+                        streamed = True
+                        if on_delta is not None:
+                            on_delta(delta)
+                return await stream.get_final_message()
+
+        response = await self.rate_limiter.acall(
+            stream_response,
+            tokens=tokens,
+            retryable=_is_retryable,
+            max_retries=self.max_retries,
+            can_retry=lambda: not streamed,
+        )
+        blocks, metadata = self._convert_response(response)
+        self.rate_limiter.settle(tokens, metadata)
+        return blocks, metadata
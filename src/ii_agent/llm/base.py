@@ -1,7 +1,11 @@
 from abc import ABC, abstractmethod
+import asyncio
+import functools
+import inspect
 import json
-from dataclasses import dataclass
-from typing import Any, Tuple
+import time
+from dataclasses import dataclass, is_dataclass
+from typing import Any, Callable, Tuple
 from dataclasses_json import DataClassJsonMixin
 from anthropic.types import (
     ThinkingBlock as AnthropicThinkingBlock,
@@ -9,6 +13,8 @@ from anthropic.types import (
 )
 from typing import Literal
 
+from ii_agent.core.metrics import LLM_REQUEST_SECONDS, LLM_REQUESTS, record_llm_tokens
+from ii_agent.core.tracing import span
 
 import logging
 
@@ -114,6 +120,21 @@ class TextResult(DataClassJsonMixin):
     text: str
 
 
+@dataclass
+class StreamDelta:
+    """Incremental piece of an assistant response that is still being generated.
+
+    `index` is the position of the content block the delta belongs to, so
+    consumers can stitch deltas of the same block back together.
+    """
+
+    index: int
+    kind: Literal["text", "tool_input"]
+    text: str
+    tool_call_id: str | None = None
+    tool_name: str | None = None
+
+
 AssistantContentBlock = (
     TextResult | ToolCall | AnthropicRedactedThinkingBlock | AnthropicThinkingBlock
 )
@@ -125,6 +146,9 @@ LLMMessages = list[list[GeneralContentBlock]]
 class LLMClient(ABC):
     """A client for LLM APIs for the use in agents."""
 
+    # Label for the metrics of this client's requests
+    provider: str = "unknown"
+
     @abstractmethod
     def generate(
         self,
@@ -151,6 +175,190 @@ class LLMClient(ABC):
         """
         raise NotImplementedError
 
+    async def agenerate(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Generate responses without blocking the event loop.
+
+        Clients backed by an SDK with native asyncio support should override
+        this. The default runs `generate` in a worker thread.
+
+        Args:
+            messages: A list of messages.
+            max_tokens: The maximum number of tokens to generate.
+            system_prompt: A system prompt.
+            temperature: The temperature.
+            tools: A list of tools.
+            tool_choice: A tool choice.
+
+        Returns:
+            A generated response.
+        """
+        return await asyncio.to_thread(
+            self.generate,
+            messages=messages,
+            max_tokens=max_tokens,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            tools=tools,
+            tool_choice=tool_choice,
+            thinking_tokens=thinking_tokens,
+        )
+
+    async def astream(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+        on_delta: Callable[[StreamDelta], None] | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Generate responses, reporting text and tool input as it arrives.
+
+        `on_delta` is called on the event loop for every delta, in order.
+        The return value is the same as `agenerate`. Clients without a
+        streaming API fall back to `agenerate` and report each block as a
+        single delta once the full response is available.
+
+        Args:
+            messages: A list of messages.
+            max_tokens: The maximum number of tokens to generate.
+            system_prompt: A system prompt.
+            temperature: The temperature.
+            tools: A list of tools.
+            tool_choice: A tool choice.
+            on_delta: Callback for incremental output.
+
+        Returns:
+            A generated response.
+        """
+        blocks, metadata = await self.agenerate(
+            messages=messages,
+            max_tokens=max_tokens,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            tools=tools,
+            tool_choice=tool_choice,
+            thinking_tokens=thinking_tokens,
+        )
+        if on_delta is not None:
+            for index, block in enumerate(blocks):
+                for delta in block_to_deltas(index, block):
+                    on_delta(delta)
+        return blocks, metadata
+
+    def count_tokens(self, text: str) -> int | None:
+        """Count the tokens of a text with the provider's tokenizer.
+
+        Returns None for providers without a count tokens endpoint.
+        """
+        return None
+
+
+def observe_llm_request(method):
+    """Record latency, outcome and token metrics for an LLM client method.
+
+    The call is also traced as a span. Works on both sync and async methods
+    returning `(blocks, metadata)`.
+    """
+
+    def observe(client: LLMClient, started: float, outcome: str, metadata=None):
+        provider = client.provider
+        model = getattr(client, "model_name", "unknown")
+        LLM_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            provider=provider,
+            model=model,
+            method=method.__name__,
+        )
+        LLM_REQUESTS.inc(provider=provider, model=model, outcome=outcome)
+        if metadata:
+            record_llm_tokens(provider, model, metadata)
+
+    if inspect.iscoroutinefunction(method):
+
+        @functools.wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            started = time.perf_counter()
+            with span(
+                f"llm.{method.__name__}",
+                "llm",
+                model=getattr(self, "model_name", "unknown"),
+            ):
+                try:
+                    blocks, metadata = await method(self, *args, **kwargs)
+                except asyncio.CancelledError:
+                    observe(self, started, "cancelled")
+                    raise
+                except Exception:
+                    observe(self, started, "error")
+                    raise
+            observe(self, started, "ok", metadata)
+            return blocks, metadata
+
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        with span(
+            f"llm.{method.__name__}",
+            "llm",
+            model=getattr(self, "model_name", "unknown"),
+        ):
+            try:
+                blocks, metadata = method(self, *args, **kwargs)
+            except Exception:
+                observe(self, started, "error")
+                raise
+        observe(self, started, "ok", metadata)
+        return blocks, metadata
+
+    return wrapper
+
+
+def convert_cached(block: Any, provider: str, convert: Callable[[Any], Any]) -> Any:
+    """Convert a history block into a provider object, reusing earlier conversions.
+
+    The conversion is kept on the block itself. Blocks are not changed once
+    they are in the history, truncation replaces them with new ones, so the
+    conversion stays valid as long as the block exists. Callers must copy
+    the result before changing it.
+    """
+    if not is_dataclass(block):
+        return convert(block)
+    converted = block.__dict__.setdefault("_converted", {})
+    if provider not in converted:
+        converted[provider] = convert(block)
+    return converted[provider]
+
+
+def block_to_deltas(index: int, block: Any) -> list[StreamDelta]:
+    """Express a complete content block as stream deltas."""
+    if isinstance(block, TextResult):
+        return [StreamDelta(index=index, kind="text", text=block.text)]
+    if isinstance(block, ToolCall):
+        return [
+            StreamDelta(
+                index=index,
+                kind="tool_input",
+                text=json.dumps(block.tool_input),
+                tool_call_id=block.tool_call_id,
+                tool_name=block.tool_name,
+            )
+        ]
+    return []
+
 
 def recursively_remove_invoke_tag(obj):
     """Recursively remove the </invoke> tag from a dictionary or list."""
@@ -0,0 +1,284 @@
+"""Caching wrapper that records LLM responses to a local cassette file.
+
+Requests are keyed by a hash of their canonical JSON form, so replaying a
+recorded trajectory gives the same responses without any network access.
+The cassette is a gzip compressed JSON lines file with one request/response
+pair per line, appended to as responses are recorded.
+"""
+
+import asyncio
+import enum
+import gzip
+import hashlib
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Callable, Tuple
+
+from anthropic.types import (
+    ThinkingBlock as AnthropicThinkingBlock,
+    RedactedThinkingBlock as AnthropicRedactedThinkingBlock,
+)
+
+from ii_agent.core.metrics import LLM_CACHE_LOOKUPS
+from ii_agent.llm.base import (
+    LLMClient,
+    AssistantContentBlock,
+    ImageBlock,
+    LLMMessages,
+    StreamDelta,
+    TextPrompt,
+    TextResult,
+    ToolCall,
+    ToolFormattedResult,
+    ToolParam,
+    block_to_deltas,
+)
+
+logger = logging.getLogger(__name__)
+
+# Guards appends, which may come from several clients sharing a cassette
+_append_lock = threading.Lock()
+
+
+class CacheMode(str, enum.Enum):
+    # Always call the model and store the response, replacing older ones
+    RECORD = "record"
+    # Only serve stored responses, fail on requests that were not recorded
+    REPLAY = "replay"
+    # Serve stored responses and record the ones that are missing
+    READ_THROUGH = "read-through"
+
+
+class CassetteMissError(Exception):
+    """A request was not found in a cassette opened for replay only."""
+
+
+_DATACLASS_BLOCKS = {
+    cls.__name__: cls
+    for cls in (TextPrompt, TextResult, ToolCall, ToolFormattedResult, ImageBlock)
+}
+_PYDANTIC_BLOCKS = {
+    "AnthropicThinkingBlock": AnthropicThinkingBlock,
+    "AnthropicRedactedThinkingBlock": AnthropicRedactedThinkingBlock,
+}
+
+
+def block_to_json(block: Any) -> dict[str, Any]:
+    """Serialize a content block along with its type."""
+    for name, cls in _PYDANTIC_BLOCKS.items():
+        if isinstance(block, cls):
+            return {"block_type": name, **block.model_dump()}
+    return {"block_type": type(block).__name__, **block.to_dict()}
+
+
+def block_from_json(data: dict[str, Any]) -> Any:
+    """Recreate a content block serialized by `block_to_json`."""
+    data = dict(data)
+    name = data.pop("block_type")
+    if name in _PYDANTIC_BLOCKS:
+        return _PYDANTIC_BLOCKS[name].model_validate(data)
+    return _DATACLASS_BLOCKS[name].from_dict(data)
+
+
+def request_key(model_name: str, **request: Any) -> str:
+    """Hash the canonical JSON form of a request."""
+    canonical = {
+        "model_name": model_name,
+        "messages": [
+            [block_to_json(block) for block in message]
+            for message in request["messages"]
+        ],
+        "system_prompt": request["system_prompt"],
+        "tools": [tool.to_dict() for tool in request["tools"]],
+        "max_tokens": request["max_tokens"],
+        "temperature": request["temperature"],
+        "tool_choice": request["tool_choice"],
+        "thinking_tokens": request["thinking_tokens"],
+    }
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def _serializable_metadata(metadata: dict[str, Any]) -> dict[str, Any]:
+    # Raw SDK responses and the like are dropped
+    kept = {}
+    for key, value in metadata.items():
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+        kept[key] = value
+    return kept
+
+
+class CachingLLMClient(LLMClient):
+    """Wrap an LLM client, serving responses from and recording them to a cassette."""
+
+    def __init__(
+        self,
+        client: LLMClient,
+        cassette_path: Path | str,
+        mode: CacheMode | str = CacheMode.READ_THROUGH,
+    ):
+        """Initialize the caching client.
+
+        Args:
+            client: The client that answers requests not served from the cassette
+            cassette_path: Path of the cassette file, created if missing
+            mode: Whether to record, replay or read through
+        """
+        self.client = client
+        self.cassette_path = Path(cassette_path)
+        self.mode = CacheMode(mode)
+        self.provider = client.provider
+        self.model_name = getattr(client, "model_name", "unknown")
+        self._entries: dict[str, dict[str, Any]] = {}
+        if self.cassette_path.exists():
+            self._load()
+
+    def count_tokens(self, text: str) -> int | None:
+        return self.client.count_tokens(text)
+
+    def __getattr__(self, name: str) -> Any:
+        # Settings of the wrapped client, like thinking_tokens, stay readable
+        if name == "client":
+            raise AttributeError(name)
+        return getattr(self.client, name)
+
+    def _load(self) -> None:
+        with gzip.open(self.cassette_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    # Later recordings of the same request win
+                    self._entries[entry["key"]] = entry
+        logger.info(f"Loaded {len(self._entries)} responses from {self.cassette_path}")
+
+    def _lookup(
+        self, key: str
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]] | None:
+        if self.mode == CacheMode.RECORD:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            LLM_CACHE_LOOKUPS.inc(outcome="miss")
+            if self.mode == CacheMode.REPLAY:
+                raise CassetteMissError(
+                    f"Request {key[:12]} is not recorded in {self.cassette_path}"
+                )
+            return None
+        LLM_CACHE_LOOKUPS.inc(outcome="hit")
+        blocks = [block_from_json(block) for block in entry["response"]]
+        return blocks, dict(entry["metadata"], raw_response=None)
+
+    def _store(
+        self,
+        key: str,
+        blocks: list[AssistantContentBlock],
+        metadata: dict[str, Any],
+    ) -> None:
+        entry = {
+            "key": key,
+            "model_name": self.model_name,
+            "response": [block_to_json(block) for block in blocks],
+            "metadata": _serializable_metadata(metadata),
+        }
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with _append_lock:
+            self._entries[key] = entry
+            self.cassette_path.parent.mkdir(parents=True, exist_ok=True)
+            # Each append adds a gzip member, which readers see as one stream
+            with gzip.open(self.cassette_path, "at", encoding="utf-8") as f:
+                f.write(line)
+
+    def generate(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Serve the response from the cassette, or generate and record it."""
+        request = dict(
+            messages=messages,
+            max_tokens=max_tokens,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            tools=tools,
+            tool_choice=tool_choice,
+            thinking_tokens=thinking_tokens,
+        )
+        key = request_key(self.model_name, **request)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+        blocks, metadata = self.client.generate(**request)
+        self._store(key, blocks, metadata)
+        return blocks, metadata
+
+    async def agenerate(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Serve the response from the cassette, or generate and record it."""
+        request = dict(
+            messages=messages,
+            max_tokens=max_tokens,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            tools=tools,
+            tool_choice=tool_choice,
+            thinking_tokens=thinking_tokens,
+        )
+        key = request_key(self.model_name, **request)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+        blocks, metadata = await self.client.agenerate(**request)
+        await asyncio.to_thread(self._store, key, blocks, metadata)
+        return blocks, metadata
+
+    async def astream(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+        on_delta: Callable[[StreamDelta], None] | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Serve the response from the cassette as one delta per block, or stream and record it."""
+        request = dict(
+            messages=messages,
+            max_tokens=max_tokens,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            tools=tools,
+            tool_choice=tool_choice,
+            thinking_tokens=thinking_tokens,
+        )
+        key = request_key(self.model_name, **request)
+        cached = self._lookup(key)
+        if cached is not None:
+            blocks, metadata = cached
+            if on_delta is not None:
+                for index, block in enumerate(blocks):
+                    for delta in block_to_deltas(index, block):
+                        on_delta(delta)
+            return blocks, metadata
+        blocks, metadata = await self.client.astream(**request, on_delta=on_delta)
+        await asyncio.to_thread(self._store, key, blocks, metadata)
+        return blocks, metadata
@@ -3,10 +3,14 @@ from ii_agent.llm.context_manager.pipeline import PipelineContextManager
 from ii_agent.llm.context_manager.amortized_forgetting import (
     AmortizedForgettingContextManager,
 )
+from ii_agent.llm.context_manager.observation_masking import (
+    ObservationMaskingContextManager,
+)
 
 
 __all__ = [
     "LLMSummarizingContextManager",
     "PipelineContextManager",
     "AmortizedForgettingContextManager",
+    "ObservationMaskingContextManager",
 ]
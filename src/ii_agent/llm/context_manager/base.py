@@ -1,6 +1,7 @@
 import json
 import logging
 from abc import ABC, abstractmethod
+from collections import Counter
 from typing import final
 from ii_agent.llm.base import (
     GeneralContentBlock,
@@ -9,7 +10,9 @@ from ii_agent.llm.base import (
     ToolCall,
     ToolFormattedResult,
     ImageBlock,
+    convert_cached,
 )
+from ii_agent.core.tracing import span
 from ii_agent.llm.token_counter import TokenCounter
 from ii_agent.llm.base import (
     AnthropicRedactedThinkingBlock,
@@ -20,6 +23,9 @@ from ii_agent.llm.base import (
 class ContextManager(ABC):
     """Abstract base class for context management strategies."""
 
+    # History and token count passed to `apply_truncation_if_needed`
+    _known_count: tuple[list[list[GeneralContentBlock]], int] | None = None
+
     def __init__(
         self,
         token_counter: TokenCounter,
@@ -35,69 +41,135 @@ class ContextManager(ABC):
         """Return the token budget."""
         return self._token_budget
 
-    def count_tokens(self, message_lists: list[list[GeneralContentBlock]]) -> int:
-        """Counts tokens, ignoring thinking blocks except in the very last message."""
-        total_tokens = 0
+    @property
+    def ahead_budget(self) -> int | None:
+        """Token count past which the next truncation is prepared ahead, if any.
+
+        A context manager that prepares, like one summarizing in the
+        background, returns it so that a pipeline can keep the history under
+        it with the context managers before it as long as they can.
+        """
+        return None
+
+    def _count_block(self, message: GeneralContentBlock) -> int:
+        """Count the tokens of one block, thinking blocks included."""
+        if isinstance(message, (TextPrompt, TextResult)):
+            return self.token_counter.count_tokens(message.text)
+        elif isinstance(message, ToolFormattedResult):
+            # Count truncated output if already truncated
+            return self.token_counter.count_tokens(message.tool_output)
+        elif isinstance(message, ToolCall):
+            # Basic counting of input JSON
+            try:
+                input_str = json.dumps(message.tool_input)
+                return self.token_counter.count_tokens(input_str)
+            except TypeError:
+                self.logger.warning(
+                    f"Could not serialize tool input for token counting: {message.tool_input}"
+                )
+                return 100  # Add arbitrary penalty
+        elif isinstance(message, ImageBlock):
+            return self.token_counter.count_image(message.source)
+        elif isinstance(message, AnthropicRedactedThinkingBlock):
+            return 0  # Always 0 tokens
+        elif isinstance(message, AnthropicThinkingBlock):
+            return self.token_counter.count_tokens(message.thinking)
+        else:
+            self.logger.warning(
+                f"Unhandled message type for token counting: {type(message)}"
+            )
+            return 0
+
+    @staticmethod
+    def content_type(message: GeneralContentBlock) -> str:
+        """The content type a block's tokens are calibrated as."""
+        if isinstance(message, ToolCall):
+            return "tool_call"
+        elif isinstance(message, ToolFormattedResult):
+            return "tool_result"
+        elif isinstance(message, ImageBlock):
+            return "image"
+        elif isinstance(
+            message, (AnthropicThinkingBlock, AnthropicRedactedThinkingBlock)
+        ):
+            return "thinking"
+        return "text"
+
+    def count_turn_tokens(
+        self, message_list: list[GeneralContentBlock]
+    ) -> Counter[str]:
+        """Count the estimated tokens of a turn, by content type.
+
+        Counts are kept on the blocks, which do not change once in the history,
+        so counting a history again only counts the blocks added since.
+        """
+        tokens: Counter[str] = Counter()
+        for message in message_list:
+            tokens[self.content_type(message)] += convert_cached(
+                message, self.token_counter.cache_key, self._count_block
+            )
+        return tokens
+
+    def count_tokens_by_type(
+        self, message_lists: list[list[GeneralContentBlock]]
+    ) -> Counter[str]:
+        """Count the estimated tokens of the message lists, by content type.
+
+        Thinking blocks are ignored except in the very last message.
+        """
+        total_tokens: Counter[str] = Counter()
         num_turns = len(message_lists)
         for i, message_list in enumerate(message_lists):
-            is_last_turn = i == num_turns - 1
-            for message in message_list:
-                if isinstance(message, (TextPrompt, TextResult)):
-                    total_tokens += self.token_counter.count_tokens(message.text)
-                elif isinstance(message, ToolFormattedResult):
-                    # Count truncated output if already truncated
-                    total_tokens += self.token_counter.count_tokens(message.tool_output)
-                elif isinstance(message, ToolCall):
-                    # Basic counting of input JSON
-                    try:
-                        input_str = json.dumps(message.tool_input)
-                        total_tokens += self.token_counter.count_tokens(input_str)
-                    except TypeError:
-                        self.logger.warning(
-                            f"Could not serialize tool input for token counting: {message.tool_input}"
-                        )
-                        total_tokens += 100  # Add arbitrary penalty
-                elif isinstance(message, ImageBlock):
-                    # Images are expensive - assign a reasonable token count
-                    # Typical image tokens range from 85-1700+ depending on size and detail
-                    # Using a conservative estimate of 1000 tokens per image
-                    total_tokens += 1000
-                elif isinstance(message, AnthropicRedactedThinkingBlock):
-                    pass  # Always 0 tokens
-                elif isinstance(message, AnthropicThinkingBlock):
-                    # Only count thinking if it's in the very last message list
-                    if is_last_turn:
-                        total_tokens += self.token_counter.count_tokens(
-                            message.thinking
-                        )
-                else:
-                    self.logger.warning(
-                        f"Unhandled message type for token counting: {type(message)}"
-                    )
+            tokens = self.count_turn_tokens(message_list)
+            if i < num_turns - 1:
+                tokens.pop("thinking", None)
+            total_tokens.update(tokens)
         return total_tokens
 
+    def count_tokens(self, message_lists: list[list[GeneralContentBlock]]) -> int:
+        """Counts tokens, ignoring thinking blocks except in the very last message."""
+        known = self._known_count
+        if known is not None and message_lists is known[0]:
+            return known[1]
+        return self.token_counter.calibrate(self.count_tokens_by_type(message_lists))
+
     def should_truncate(self, message_lists: list[list[GeneralContentBlock]]) -> bool:
         """Check if truncation is needed based on the number of message lists."""
         return self.count_tokens(message_lists) > self._token_budget
 
     @final
     def apply_truncation_if_needed(
-        self, message_lists: list[list[GeneralContentBlock]]
+        self,
+        message_lists: list[list[GeneralContentBlock]],
+        token_count: int | None = None,
     ) -> list[list[GeneralContentBlock]]:
-        if not self.should_truncate(message_lists):
-            return message_lists
-
-        current_tokens = self.count_tokens(message_lists)
-        self.logger.warning(
-            f"Token count {current_tokens}."
-        )
-        truncated_message_lists = self.apply_truncation(message_lists)
-        new_token_count = self.count_tokens(truncated_message_lists)
-        tokens_saved = current_tokens - new_token_count
-        self.logger.info(
-            f"Truncation saved ~{tokens_saved} tokens. New count: {new_token_count}"
-        )
-        return truncated_message_lists
+        """Truncate the message lists if they are over budget.
+
+        Args:
+            message_lists: The history to truncate
+            token_count: The token count of `message_lists`, if the caller
+                already keeps one, which saves counting it again
+        """
+        with span("context.truncate", "context", manager=type(self).__name__) as args:
+            if token_count is not None:
+                self._known_count = (message_lists, token_count)
+            try:
+                if not self.should_truncate(message_lists):
+                    args["truncated"] = False
+                    return message_lists
+
+                current_tokens = self.count_tokens(message_lists)
+                self.logger.warning(f"Token count {current_tokens}.")
+                truncated_message_lists = self.apply_truncation(message_lists)
+            finally:
+                self._known_count = None
+            new_token_count = self.count_tokens(truncated_message_lists)
+            tokens_saved = current_tokens - new_token_count
+            self.logger.info(
+                f"Truncation saved ~{tokens_saved} tokens. New count: {new_token_count}"
+            )
+            args["truncated"] = True
+            return truncated_message_lists
 
     @abstractmethod
     def apply_truncation(
@@ -1,9 +1,60 @@
+import contextvars
+import hashlib
 import logging
-from ii_agent.llm.base import GeneralContentBlock, TextPrompt, TextResult
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from ii_agent.llm.base import (
+    GeneralContentBlock,
+    TextPrompt,
+    TextResult,
+    convert_cached,
+)
 from ii_agent.llm.context_manager.base import ContextManager
 from ii_agent.llm.token_counter import TokenCounter
 from ii_agent.llm.base import LLMClient
 
+# Start of the message that replaces condensed events
+SUMMARY_PREFIX = "Conversation Summary:"
+
+# Threads summarizing ahead of the turns that need the summaries
+_executor = ThreadPoolExecutor(thread_name_prefix="summarize-ahead")
+
+
+def _turn_digest(turn: list[GeneralContentBlock]) -> str:
+    """A hash of the content of a turn, the same for equal turns."""
+    digest = hashlib.sha256()
+    for block in turn:
+        # Kept on the block, which does not change once in the history
+        digest.update(
+            convert_cached(
+                block,
+                "digest",
+                lambda block: hashlib.sha256(repr(block).encode()).digest(),
+            )
+        )
+    return digest.hexdigest()
+
+
+@dataclass
+class _Speculation:
+    """A summary being generated in the background for a prefix of the history."""
+
+    # Content hashes of the turns up to the end of the summarized events
+    prefix: list[str]
+    future: Future
+
+    def matches(self, message_lists: list[list[GeneralContentBlock]]) -> bool:
+        """Whether the history still starts with the summarized turns.
+
+        Turns are compared by content, as a context manager before this one
+        in a pipeline may copy them.
+        """
+        return len(message_lists) >= len(self.prefix) and all(
+            _turn_digest(turn) == digest
+            for turn, digest in zip(message_lists, self.prefix)
+        )
+
 
 class LLMSummarizingContextManager(ContextManager):
     """A context manager that summarizes forgotten events using LLM.
@@ -22,7 +73,23 @@ class LLMSummarizingContextManager(ContextManager):
         max_size: int = 100,
         keep_first: int = 1,
         max_event_length: int = 10_000,
+        summarize_ahead_at: float | None = 0.8,
     ):
+        """Initialize the context manager.
+
+        Args:
+            client: The LLM client that writes the summaries
+            token_counter: Token counter instance
+            logger: Logger instance
+            token_budget: Token budget for context
+            max_size: Maximum size of history before forgetting
+            keep_first: Number of initial events to always keep
+            max_event_length: Characters of an event kept in the summary prompt
+            summarize_ahead_at: Share of the token budget and of `max_size`
+                past which the summary is generated in the background, to be
+                swapped in at the next turn. None to only summarize when over
+                the budget, blocking the turn
+        """
         if keep_first >= max_size // 2:
             raise ValueError(
                 f"keep_first ({keep_first}) must be less than half of max_size ({max_size})"
@@ -37,6 +104,16 @@ class LLMSummarizingContextManager(ContextManager):
         self.max_size = max_size
         self.keep_first = keep_first
         self.max_event_length = max_event_length
+        self.summarize_ahead_at = summarize_ahead_at
+        self._speculation: _Speculation | None = None
+        self._speculation_lock = threading.Lock()
+
+    @property
+    def ahead_budget(self) -> int | None:
+        """Token count past which the summary is generated in the background."""
+        if self.summarize_ahead_at is None:
+            return None
+        return int(self._token_budget * self.summarize_ahead_at)
 
     def _truncate_content(self, content: str) -> str:
         """Truncate the content to fit within the specified maximum event length."""
@@ -56,46 +133,143 @@ class LLMSummarizingContextManager(ContextManager):
                 parts.append(f"{type(message).__name__}: {str(message)}")
         return "\n".join(parts)
 
+    def _over_limit(
+        self, message_lists: list[list[GeneralContentBlock]], share: float
+    ) -> bool:
+        """Whether the history is past a share of the size or token budget."""
+        return (
+            len(message_lists) > self.max_size * share
+            or self.count_tokens(message_lists) > self._token_budget * share
+        )
+
     def should_truncate(self, message_lists: list[list[GeneralContentBlock]]) -> bool:
-        """Check if condensation is needed based on the number of message lists."""
-        return len(message_lists) > self.max_size or super().should_truncate(
-            message_lists
+        """Check if condensation is needed based on the number of message lists.
+
+        Past the summarize ahead threshold this starts the summary in the
+        background, and once it is ready, condensation is needed to swap it in.
+        """
+        if self._over_limit(message_lists, 1.0):
+            return True
+        if self.summarize_ahead_at is None:
+            return False
+        if self._take_speculation(message_lists, wait=False, peek=True) is not None:
+            return True
+        if self._over_limit(message_lists, self.summarize_ahead_at):
+            self._summarize_ahead(message_lists)
+        return False
+
+    def _summarize_ahead(self, message_lists: list[list[GeneralContentBlock]]) -> None:
+        """Start summarizing the events a truncation would forget now, in the background."""
+        with self._speculation_lock:
+            if self._speculation is not None and self._speculation.matches(
+                message_lists
+            ):
+                return
+            previous_summary, summary_start_idx, forgotten_end_idx = self._plan(
+                message_lists
+            )
+            forgotten_events = message_lists[summary_start_idx:forgotten_end_idx]
+            if not forgotten_events:
+                return
+            # Keep the session's tracer in the background thread
+            context = contextvars.copy_context()
+            future = _executor.submit(
+                context.run, self._summarize, previous_summary, forgotten_events
+            )
+            self._speculation = _Speculation(
+                prefix=[
+                    _turn_digest(turn) for turn in message_lists[:forgotten_end_idx]
+                ],
+                future=future,
+            )
+        self.logger.info(
+            f"Summarizing {len(forgotten_events)} events ahead of the token budget"
         )
 
-    def apply_truncation(
+    def _take_speculation(
+        self,
+        message_lists: list[list[GeneralContentBlock]],
+        wait: bool,
+        peek: bool = False,
+    ) -> tuple[str, int] | None:
+        """Return the background summary if it was made for this history.
+
+        Args:
+            message_lists: The history the summary would be swapped into
+            wait: Wait for a summary still being generated
+            peek: Keep the summary for a later call
+
+        Returns:
+            The summary and the end of the events it replaces, or None if
+            there is none, it failed, or the history changed since
+        """
+        with self._speculation_lock:
+            speculation = self._speculation
+            if speculation is None:
+                return None
+            if not speculation.matches(message_lists):
+                self.logger.info("History changed, discarding the summary made ahead")
+                self._speculation = None
+                return None
+            if not wait and not speculation.future.done():
+                return None
+            if not peek:
+                self._speculation = None
+        try:
+            summary = speculation.future.result()
+        except Exception as e:
+            self.logger.error(f"Failed to generate summary ahead: {e}")
+            with self._speculation_lock:
+                if self._speculation is speculation:
+                    self._speculation = None
+            return None
+        return summary, len(speculation.prefix)
+
+    def _plan(
         self, message_lists: list[list[GeneralContentBlock]]
-    ) -> list[list[GeneralContentBlock]]:
-        """Apply truncation with LLM summarization when needed."""
+    ) -> tuple[str, int, int]:
+        """Decide which events to forget.
 
-        head = message_lists[: self.keep_first]
+        Returns:
+            The previous summary, or an empty string, and the start and end
+            of the forgotten events
+        """
         target_size = min(self.max_size, len(message_lists)) // 2
-        events_from_tail = target_size - len(head) - 1
+        events_from_tail = target_size - self.keep_first - 1
 
         # Check if we already have a summary in the expected position
-        summary_content = "No events summarized"
+        previous_summary = ""
         summary_start_idx = self.keep_first
 
         if (
             len(message_lists) > self.keep_first
             and message_lists[self.keep_first]
             and isinstance(message_lists[self.keep_first][0], TextPrompt)
-            and message_lists[self.keep_first][0].text.startswith(
-                "Conversation Summary:"
-            )
+            and message_lists[self.keep_first][0].text.startswith(SUMMARY_PREFIX)
         ):  # TODO: this is a hack to get the summary from the previous summary
-            summary_content = message_lists[self.keep_first][0].text
+            previous_summary = message_lists[self.keep_first][0].text.replace(
+                f"{SUMMARY_PREFIX} ", ""
+            )
             summary_start_idx = self.keep_first + 1
 
-        # Identify events to be forgotten (those not in head or tail)
-        forgotten_events = (
-            message_lists[summary_start_idx:-events_from_tail]
+        # Events not in head or tail are forgotten
+        forgotten_end_idx = (
+            len(message_lists) - events_from_tail
             if events_from_tail > 0
-            else message_lists[summary_start_idx:]
+            else len(message_lists)
+        )
+        return (
+            previous_summary,
+            summary_start_idx,
+            max(summary_start_idx, forgotten_end_idx),
         )
 
-        if not forgotten_events:
-            return message_lists
-
+    def _summarize(
+        self,
+        previous_summary: str,
+        forgotten_events: list[list[GeneralContentBlock]],
+    ) -> str:
+        """Summarize the forgotten events into the previous summary with the LLM."""
         # Construct prompt for summarization
         prompt = """You are maintaining a context-aware state summary for an interactive agent. You will be given a list of events corresponding to actions taken by the agent, and the most recent previous summary if one exists. Track:
 
@@ -140,12 +314,6 @@ CURRENT_STATE: Last flip: Heads, Haiku count: 15/20
 
 """
 
-        # Add the previous summary if it exists
-        previous_summary = (
-            summary_content.replace("Conversation Summary: ", "")
-            if summary_content != "No events summarized"
-            else ""
-        )
         prompt += f"<PREVIOUS SUMMARY>\n{self._truncate_content(previous_summary)}\n</PREVIOUS SUMMARY>\n\n"
 
         # Add all events that are being forgotten
@@ -156,44 +324,68 @@ CURRENT_STATE: Last flip: Heads, Haiku count: 15/20
             prompt += f"<EVENT id={i}>\n{event_content}\n</EVENT>\n"
 
         prompt += "\nNow summarize the events using the rules above."
-        # Generate summary using LLM
-        try:
-            summary_messages = [[TextPrompt(text=prompt)]]
-            model_response, _ = self.client.generate(
-                messages=summary_messages,
-                max_tokens=4000,
-                thinking_tokens=0,
+        summary_messages = [[TextPrompt(text=prompt)]]
+        model_response, _ = self.client.generate(
+            messages=summary_messages,
+            max_tokens=4000,
+            thinking_tokens=0,
+        )
+        summary = ""
+        for message in model_response:
+            if isinstance(message, TextResult):
+                summary += message.text
+        return summary
+
+    def _condense(
+        self,
+        message_lists: list[list[GeneralContentBlock]],
+        summary: str,
+        forgotten_end_idx: int,
+    ) -> list[list[GeneralContentBlock]]:
+        """Replace the events before `forgotten_end_idx` after the head with the summary."""
+        head = message_lists[: self.keep_first]
+        tail = message_lists[forgotten_end_idx:]
+        condensed_messages = [
+            *head,
+            [TextPrompt(text=f"{SUMMARY_PREFIX} {summary}")],
+            *tail,
+        ]
+        self.logger.info(
+            f"Condensed {len(message_lists)} message lists to {len(condensed_messages)} "
+            f"(kept {len(head)} head + 1 summary + {len(tail)} tail)"
+        )
+        return condensed_messages
+
+    def apply_truncation(
+        self, message_lists: list[list[GeneralContentBlock]]
+    ) -> list[list[GeneralContentBlock]]:
+        """Apply truncation with LLM summarization when needed."""
+        speculated = self._take_speculation(message_lists, wait=True)
+        if speculated is not None:
+            summary, forgotten_end_idx = speculated
+            condensed_messages = self._condense(
+                message_lists, summary, forgotten_end_idx
             )
-            summary = ""
-            for message in model_response:
-                if isinstance(message, TextResult):
-                    summary += message.text
+            if not self._over_limit(condensed_messages, 1.0):
+                return condensed_messages
+            # The history grew past the budget while summarizing, summarize
+            # again starting from the new summary
+            message_lists = condensed_messages
 
+        previous_summary, summary_start_idx, forgotten_end_idx = self._plan(
+            message_lists
+        )
+        forgotten_events = message_lists[summary_start_idx:forgotten_end_idx]
+        if not forgotten_events:
+            return message_lists
+
+        try:
+            summary = self._summarize(previous_summary, forgotten_events)
             self.logger.info(
                 f"Generated summary for {len(forgotten_events)} forgotten events"
             )
-
         except Exception as e:
             self.logger.error(f"Failed to generate summary: {e}")
             summary = f"Failed to summarize {len(forgotten_events)} events due to error: {str(e)}"
 
-        # Create new condensed message list
-        condensed_messages = []
-
-        # Add head messages
-        condensed_messages.extend(head)
-
-        # Add summary as a new message
-        summary_message = [TextPrompt(text=f"Conversation Summary: {summary}")]
-        condensed_messages.append(summary_message)
-
-        # Add tail messages
-        if events_from_tail > 0:
-            condensed_messages.extend(message_lists[-events_from_tail:])
-
-        self.logger.info(
-            f"Condensed {len(message_lists)} message lists to {len(condensed_messages)} "
-            f"(kept {len(head)} head + 1 summary + {events_from_tail} tail)"
-        )
-
-        return condensed_messages
+        return self._condense(message_lists, summary, forgotten_end_idx)
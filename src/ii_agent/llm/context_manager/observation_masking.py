@@ -0,0 +1,146 @@
+import logging
+from typing import Any
+
+from ii_agent.llm.base import (
+    GeneralContentBlock,
+    ImageBlock,
+    TextPrompt,
+    ToolFormattedResult,
+)
+from ii_agent.llm.context_manager.base import ContextManager
+from ii_agent.llm.token_counter import TokenCounter
+
+# Start of the text that replaces a masked observation
+MASK_PREFIX = "[Observation masked"
+
+
+class ObservationMaskingContextManager(ContextManager):
+    """A context manager that masks old tool outputs and images, without an LLM.
+
+    Every turn is kept, with all tool calls and assistant text, so the agent
+    still knows what it did. Only what it observed is condensed: starting
+    with the oldest turn, tool outputs are replaced by a short extract and
+    images by a placeholder, until the history fits the token budget. Before
+    an `LLMSummarizingContextManager` in a `PipelineContextManager`, this
+    makes the summarizer's model call unnecessary as long as masking suffices.
+    """
+
+    def __init__(
+        self,
+        token_counter: TokenCounter,
+        logger: logging.Logger,
+        token_budget: int = 120_000,
+        keep_recent: int = 4,
+        extract_chars: int = 300,
+    ):
+        """Initialize the context manager.
+
+        Args:
+            token_counter: Token counter instance
+            logger: Logger instance
+            token_budget: Token budget for context
+            keep_recent: Number of most recent turns whose observations are
+                never masked
+            extract_chars: Characters of the start of a tool output kept in
+                its placeholder
+        """
+        if keep_recent < 0:
+            raise ValueError(f"keep_recent ({keep_recent}) cannot be negative")
+        super().__init__(token_counter, logger, token_budget)
+        self.keep_recent = keep_recent
+        self.extract_chars = extract_chars
+
+    def _extract(self, text: str) -> str:
+        """The start of a text, cut at a line break where possible."""
+        if len(text) <= self.extract_chars:
+            return text
+        extract = text[: self.extract_chars]
+        line_end = extract.rfind("\n")
+        if line_end > self.extract_chars // 2:
+            extract = extract[:line_end]
+        return extract + "\n..."
+
+    def _mask_output(self, result: ToolFormattedResult) -> ToolFormattedResult | None:
+        """Mask a tool output, or return None if there is nothing to mask."""
+        if isinstance(result.tool_output, str):
+            output = result.tool_output
+            if output.startswith(MASK_PREFIX):
+                return None
+            masked: Any = (
+                f"{MASK_PREFIX}: {len(output)} characters of {result.tool_name} "
+                f"output were removed to save context. They started with:]\n"
+                f"{self._extract(output)}"
+            )
+            # Short outputs would only grow by the header
+            if len(masked) >= len(output):
+                return None
+        else:
+            if not any(item.get("type") == "image" for item in result.tool_output):
+                return None
+            # Screenshots go, the text that came with them stays
+            masked = [
+                item
+                if item.get("type") != "image"
+                else {
+                    "type": "text",
+                    "text": f"{MASK_PREFIX}: image removed to save context]",
+                }
+                for item in result.tool_output
+            ]
+        return ToolFormattedResult(
+            tool_call_id=result.tool_call_id,
+            tool_name=result.tool_name,
+            tool_output=masked,
+        )
+
+    def _mask(self, message: GeneralContentBlock) -> GeneralContentBlock | None:
+        """Mask a block, or return None if it is not an observation to mask."""
+        if isinstance(message, ToolFormattedResult):
+            return self._mask_output(message)
+        if isinstance(message, ImageBlock):
+            media_type = message.source.get("media_type", "image")
+            return TextPrompt(
+                text=f"{MASK_PREFIX}: {media_type} removed to save context]"
+            )
+        return None
+
+    def apply_truncation(
+        self, message_lists: list[list[GeneralContentBlock]]
+    ) -> list[list[GeneralContentBlock]]:
+        """Mask observations, oldest first, until the history fits the budget."""
+        # Raw counts by type, so the effect of each masked turn can be applied
+        tokens_by_type = self.count_tokens_by_type(message_lists)
+        total_tokens = self.token_counter.calibrate(tokens_by_type)
+        result = list(message_lists)
+        masked_count = 0
+        maskable_turns = max(0, len(message_lists) - self.keep_recent)
+
+        for i in range(maskable_turns):
+            if total_tokens <= self._token_budget:
+                break
+            turn = message_lists[i]
+            masked_turn = []
+            for message in turn:
+                masked = self._mask(message)
+                if masked is None:
+                    masked_turn.append(message)
+                    continue
+                masked_turn.append(masked)
+                masked_count += 1
+            if masked_turn != turn:
+                result[i] = masked_turn
+                # Thinking blocks are never masked, so they cancel out
+                tokens_by_type.update(self.count_turn_tokens(masked_turn))
+                tokens_by_type.subtract(self.count_turn_tokens(turn))
+                total_tokens = self.token_counter.calibrate(tokens_by_type)
+
+        self.logger.info(
+            f"Observation masking: masked {masked_count} observations, "
+            f"about {total_tokens} tokens left"
+        )
+        if total_tokens > self._token_budget:
+            self.logger.warning(
+                f"Still over the token budget after masking all observations older "
+                f"than the last {self.keep_recent} turns"
+            )
+        return result
@@ -1,4 +1,6 @@
 import logging
+from contextlib import contextmanager
+from typing import Iterator
 from ii_agent.llm.base import GeneralContentBlock
 from ii_agent.llm.context_manager.base import ContextManager
 from ii_agent.llm.token_counter import TokenCounter
@@ -35,6 +37,48 @@ class PipelineContextManager(ContextManager):
                 "At least one context manager must be provided to the pipeline"
             )
 
+    @contextmanager
+    def _member(self, index: int) -> Iterator[ContextManager]:
+        """A context manager of the pipeline, set up to run in it.
+
+        Its budget is lowered to the lowest at which a later context manager
+        prepares ahead, so that, like masking before summarizing, it keeps the
+        history under that as long as it can, and the later one only prepares
+        a truncation it will actually need.
+        """
+        context_manager = self.context_managers[index]
+        budget = context_manager._token_budget
+        ahead_budgets = [
+            later.ahead_budget
+            for later in self.context_managers[index + 1 :]
+            if later.ahead_budget is not None
+        ]
+        context_manager._token_budget = min([budget, *ahead_budgets])
+        # The known count is only valid for the same token counter
+        if context_manager.token_counter is self.token_counter:
+            context_manager._known_count = self._known_count
+        try:
+            yield context_manager
+        finally:
+            context_manager._token_budget = budget
+            context_manager._known_count = None
+
+    def should_truncate(self, message_lists: list[list[GeneralContentBlock]]) -> bool:
+        """Check if the pipeline or any of its context managers needs truncation.
+
+        Under the budget, the history reaches each context manager unchanged
+        until one of them needs truncation, so one that prepares ahead of the
+        budget, like summarizing in the background, only sees the history when
+        the context managers before it would leave it as it is.
+        """
+        if super().should_truncate(message_lists):
+            return True
+        for i in range(len(self.context_managers)):
+            with self._member(i) as context_manager:
+                if context_manager.should_truncate(message_lists):
+                    return True
+        return False
+
     def apply_truncation(
         self, message_lists: list[list[GeneralContentBlock]]
     ) -> list[list[GeneralContentBlock]]:
@@ -48,7 +92,8 @@ class PipelineContextManager(ContextManager):
 
             # Apply the context manager's truncation logic
             prev_count = len(result)
-            result = context_manager.apply_truncation_if_needed(result)
+            with self._member(i):
+                result = context_manager.apply_truncation_if_needed(result)
             new_count = len(result)
 
             if new_count != prev_count:
@@ -56,9 +101,13 @@ class PipelineContextManager(ContextManager):
                     f"Context manager {type(context_manager).__name__} reduced message count from {prev_count} to {new_count}"
                 )
 
-            # If we've reduced to an acceptable size, we can stop early
+            # If we've reduced to an acceptable size, we can stop early, unless
+            # the next context manager needs truncation, like swapping in a
+            # summary made ahead. It prepares ahead on the history left here.
             current_tokens = self.count_tokens(result)
-            if current_tokens <= self._token_budget:
+            if current_tokens <= self._token_budget and not self._next_needs_truncation(
+                i, result
+            ):
                 self.logger.debug(
                     f"Token budget satisfied after context manager {i + 1}, stopping pipeline early"
                 )
@@ -73,3 +122,13 @@ class PipelineContextManager(ContextManager):
         )
 
         return result
+
+    def _next_needs_truncation(
+        self, index: int, message_lists: list[list[GeneralContentBlock]]
+    ) -> bool:
+        """Whether a context manager after the one at `index` needs truncation."""
+        for i in range(index + 1, len(self.context_managers)):
+            with self._member(i) as context_manager:
+                if context_manager.should_truncate(message_lists):
+                    return True
+        return False
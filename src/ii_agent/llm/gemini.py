@@ -1,21 +1,31 @@
+import functools
 import os
 import time
 import random
 
-from typing import Any, Tuple
+from typing import Any, Callable, Tuple
+
+import httpx
 from google import genai
 from google.genai import types, errors
 from ii_agent.llm.base import (
     LLMClient,
+    observe_llm_request,
     AssistantContentBlock,
+    StreamDelta,
     ToolParam,
     TextPrompt,
     ToolCall,
     TextResult,
     LLMMessages,
     ToolFormattedResult,
+    convert_cached,
     ImageBlock,
+    block_to_deltas,
 )
+from ii_agent.llm.http_pool import HTTP_CLIENTS
+from ii_agent.llm.rate_limit import RATE_LIMITERS, estimate_request_tokens
+
 
 def generate_tool_call_id() -> str:
     """Generate a unique ID for a tool call.
@@ -28,25 +38,102 @@ def generate_tool_call_id() -> str:
     return f"call_{timestamp}_{random_num}"
 
 
+def _is_retryable(error: Exception) -> bool:
+    # 503: The service may be temporarily overloaded or down.
+    # 429: The request was throttled.
+    return isinstance(error, errors.APIError) and error.code in [503, 429]
+
+
 class GeminiDirectClient(LLMClient):
     """Use Gemini models via first party API."""
 
+    provider = "gemini"
+
     def __init__(self, model_name: str, max_retries: int = 2, project_id: None | str = None, region: None | str = None):
         self.model_name = model_name
 
+        http_options = self._shared_http_options((project_id, region))
         if project_id and region:
-            self.client = genai.Client(vertexai=True, project=project_id, location=region)
+            credential = (project_id, region)
+            self.client = genai.Client(
+                vertexai=True,
+                project=project_id,
+                location=region,
+                http_options=http_options,
+            )
             print(f"====== Using Gemini through Vertex AI API with project_id: {project_id} and region: {region} ======")
         else:
             api_key = os.getenv("GEMINI_API_KEY")
             if not api_key:
                 raise ValueError("GEMINI_API_KEY is not set")
-            self.client = genai.Client(api_key=api_key)
+            credential = api_key
+            self.client = genai.Client(api_key=api_key, http_options=http_options)
             print(f"====== Using Gemini directly ======")
-            
+
+        self.rate_limiter = RATE_LIMITERS.get(self.provider, model_name, credential)
         self.max_retries = max_retries
 
-    def generate(
+    def _shared_http_options(self, endpoint: tuple) -> types.HttpOptions | None:
+        """Point the SDK at the process wide connection pools of the endpoint."""
+        if "httpx_client" not in types.HttpOptions.model_fields:
+            # Older google-genai versions always create their own pools
+            return None
+        # Like the SDK's own clients, leave timeouts to the request options
+        http_client, async_http_client = HTTP_CLIENTS.get(
+            self.provider,
+            endpoint if all(endpoint) else ("api",),
+            functools.partial(httpx.Client, timeout=None),
+            functools.partial(httpx.AsyncClient, timeout=None),
+        )
+        return types.HttpOptions(
+            httpx_client=http_client, httpx_async_client=async_http_client
+        )
+
+    def count_tokens(self, text: str) -> int | None:
+        """Count the tokens of a text with Gemini's count tokens endpoint."""
+        return self.client.models.count_tokens(
+            model=self.model_name, contents=text
+        ).total_tokens
+
+    def _convert_block(self, message: Any) -> types.Part | list[types.Part]:
+        """Convert a history block into a Gemini part, or several for image tool outputs."""
+        if isinstance(message, TextPrompt):
+            message_content = types.Part(text=message.text)
+        elif isinstance(message, ImageBlock):
+            message_content = types.Part.from_bytes(
+                data=message.source["data"],
+                mime_type=message.source["media_type"],
+            )
+        elif isinstance(message, TextResult):
+            message_content = types.Part(text=message.text)
+        elif isinstance(message, ToolCall):
+            message_content = types.Part.from_function_call(
+                name=message.tool_name,
+                args=message.tool_input,
+            )
+        elif isinstance(message, ToolFormattedResult):
+            if isinstance(message.tool_output, str):
+                message_content = types.Part.from_function_response(
+                    name=message.tool_name, response={"result": message.tool_output}
+                )
+            # Handle tool return images. See: https://discuss.ai.google.dev/t/returning-images-from-function-calls/3166/6
+            elif isinstance(message.tool_output, list):
+                message_content = []
+                for item in message.tool_output:
+                    if item["type"] == "text":
+                        message_content.append(types.Part(text=item["text"]))
+                    elif item["type"] == "image":
+                        message_content.append(
+                            types.Part.from_bytes(
+                                data=item["source"]["data"],
+                                mime_type=item["source"]["media_type"],
+                            )
+                        )
+        else:
+            raise ValueError(f"Unknown message type: {type(message)}")
+        return message_content
+
+    def _build_request(
         self,
         messages: LLMMessages,
         max_tokens: int,
@@ -54,47 +141,17 @@ class GeminiDirectClient(LLMClient):
         temperature: float = 0.0,
         tools: list[ToolParam] = [],
         tool_choice: dict[str, str] | None = None,
-    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
-        
+        thinking_tokens: int | None = None,
+    ) -> dict[str, Any]:
+        """Turn internal messages and generation options into `generate_content` kwargs."""
         gemini_messages = []
         for idx, message_list in enumerate(messages):
             role = "user" if idx % 2 == 0 else "model"
             message_content_list = []
             for message in message_list:
-                if isinstance(message, TextPrompt):
-                    message_content = types.Part(text=message.text)
-                elif isinstance(message, ImageBlock):
-                    message_content = types.Part.from_bytes(
-                            data=message.source["data"],
-                            mime_type=message.source["media_type"],
-                        )
-                elif isinstance(message, TextResult):
-                    message_content = types.Part(text=message.text)
-                elif isinstance(message, ToolCall):
-                    message_content = types.Part.from_function_call(
-                        name=message.tool_name,
-                        args=message.tool_input,
-                    )
-                elif isinstance(message, ToolFormattedResult):
-                    if isinstance(message.tool_output, str):
-                        message_content = types.Part.from_function_response(
-                            name=message.tool_name,
-                            response={"result": message.tool_output}
-                        )
-                    # Handle tool return images. See: https://discuss.ai.google.dev/t/returning-images-from-function-calls/3166/6
-                    elif isinstance(message.tool_output, list):
-                        message_content = []
-                        for item in message.tool_output:
-                            if item['type'] == 'text':
-                                message_content.append(types.Part(text=item['text']))
-                            elif item['type'] == 'image':
-                                message_content.append(types.Part.from_bytes(
-                                    data=item['source']['data'],
-                                    mime_type=item['source']['media_type']
-                                ))
-                else:
-                    raise ValueError(f"Unknown message type: {type(message)}")
-                
+                message_content = convert_cached(
+                    message, self.provider, self._convert_block
+                )
                 if isinstance(message_content, list):
                     message_content_list.extend(message_content)
                 else:
@@ -122,35 +179,22 @@ class GeminiDirectClient(LLMClient):
         else:
             raise ValueError(f"Unknown tool_choice type for Gemini: {tool_choice['type']}")
 
-        for retry in range(self.max_retries):
-            try:
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    config=types.GenerateContentConfig(
-                        tools=tool_params,
-                        system_instruction=system_prompt,
-                        temperature=temperature,
-                        max_output_tokens=max_tokens,
-                        tool_config={'function_calling_config': {'mode': mode}}
-                        ),
-                    contents=gemini_messages,
-                )
-                break
-            except errors.APIError as e:
-                # 503: The service may be temporarily overloaded or down.
-                # 429: The request was throttled.
-                if e.code in [503, 429]:
-                    if retry == self.max_retries - 1:
-                        print(f"Failed Gemini request after {retry + 1} retries")
-                        raise e
-                    else:
-                        print(f"Error: {e}")
-                        print(f"Retrying Gemini request: {retry + 1}/{self.max_retries}")
-                        # Sleep 12-18 seconds with jitter to avoid thundering herd.
-                        time.sleep(15 * random.uniform(0.8, 1.2))
-                else:
-                    raise e
+        return dict(
+            model=self.model_name,
+            config=types.GenerateContentConfig(
+                tools=tool_params,
+                system_instruction=system_prompt,
+                temperature=temperature,
+                max_output_tokens=max_tokens,
+                tool_config={"function_calling_config": {"mode": mode}},
+            ),
+            contents=gemini_messages,
+        )
 
+    def _convert_response(
+        self, response: Any
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Convert a Gemini response back into internal content blocks."""
         internal_messages = []
         if response.text:
             internal_messages.append(TextResult(text=response.text))
@@ -169,5 +213,170 @@ class GeminiDirectClient(LLMClient):
             "input_tokens": response.usage_metadata.prompt_token_count,
             "output_tokens": response.usage_metadata.candidates_token_count,
         }
-        
-        return internal_messages, message_metadata
\ No newline at end of file
+
+        return internal_messages, message_metadata
+
+    @observe_llm_request
+    def generate(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Generate responses.
+
+        Args:
+            messages: A list of messages.
+            max_tokens: The maximum number of tokens to generate.
+            system_prompt: A system prompt.
+            temperature: The temperature.
+            tools: A list of tools.
+            tool_choice: A tool choice.
+            thinking_tokens: Unused, accepted for interface compatibility.
+
+        Returns:
+            A generated response.
+        """
+        request = self._build_request(
+            messages,
+            max_tokens,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            tools=tools,
+            tool_choice=tool_choice,
+        )
+
+        tokens = estimate_request_tokens(messages)
+        response = self.rate_limiter.call(
+            lambda: self.client.models.generate_content(**request),
+            tokens=tokens,
+            retryable=_is_retryable,
+            max_retries=self.max_retries,
+        )
+        blocks, metadata = self._convert_response(response)
+        self.rate_limiter.settle(tokens, metadata)
+        return blocks, metadata
+
+    @observe_llm_request
+    async def agenerate(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Generate responses using the async Gemini client.
+
+        Same contract as `generate`, but waits on the network and on retry
+        backoff without holding a thread.
+        """
+        request = self._build_request(
+            messages,
+            max_tokens,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            tools=tools,
+            tool_choice=tool_choice,
+        )
+
+        tokens = estimate_request_tokens(messages)
+        response = await self.rate_limiter.acall(
+            lambda: self.client.aio.models.generate_content(**request),
+            tokens=tokens,
+            retryable=_is_retryable,
+            max_retries=self.max_retries,
+        )
+        blocks, metadata = self._convert_response(response)
+        self.rate_limiter.settle(tokens, metadata)
+        return blocks, metadata
+
+    @observe_llm_request
+    async def astream(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+        on_delta: Callable[[StreamDelta], None] | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Generate responses with a streamed Gemini request.
+
+        Text is passed to `on_delta` chunk by chunk. Gemini sends function
+        calls whole, so each one is reported as a single delta. A failed
+        request is only retried if nothing has been streamed yet.
+        """
+        request = self._build_request(
+            messages,
+            max_tokens,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            tools=tools,
+            tool_choice=tool_choice,
+        )
+
+        tokens = estimate_request_tokens(messages)
+        streamed = False
+
+        async def stream_response():
+            nonlocal streamed
+            text_parts = []
+            tool_calls = []
+            usage_metadata = None
+            async for chunk in await self.client.aio.models.generate_content_stream(
+                **request
+            ):
+                if chunk.usage_metadata:
+                    usage_metadata = chunk.usage_metadata
+                deltas = []
+                if chunk.text:
+                    text_parts.append(chunk.text)
+                    deltas.append(StreamDelta(index=0, kind="text", text=chunk.text))
+                for fn_call in chunk.function_calls or []:
+                    tool_call = ToolCall(
+                        tool_call_id=fn_call.id
+                        if fn_call.id
+                        else generate_tool_call_id(),
+                        tool_name=fn_call.name,
+                        tool_input=fn_call.args,
+                    )
+                    tool_calls.append(tool_call)
+                    deltas.extend(block_to_deltas(len(tool_calls), tool_call))
+                for delta in deltas:
+                    streamed = True
+                    if on_delta is not None:
+                        on_delta(delta)
+            return text_parts, tool_calls, usage_metadata
+
+        text_parts, tool_calls, usage_metadata = await self.rate_limiter.acall(
+            stream_response,
+            tokens=tokens,
+            retryable=_is_retryable,
+            max_retries=self.max_retries,
+            can_retry=lambda: not streamed,
+        )
+
+        internal_messages = []
+        if text_parts:
+            internal_messages.append(TextResult(text="".join(text_parts)))
+        internal_messages.extend(tool_calls)
+
+        message_metadata = {
+            "raw_response": None,
+            "input_tokens": usage_metadata.prompt_token_count if usage_metadata else 0,
+            "output_tokens": usage_metadata.candidates_token_count
+            if usage_metadata
+            else 0,
+        }
+        self.rate_limiter.settle(tokens, message_metadata)
+
+        return internal_messages, message_metadata
@@ -0,0 +1,353 @@
+"""Hedged LLM requests, sent to a second endpoint when the first is slow.
+
+During provider incidents a few requests take minutes, and a session waits
+for them until the client times out. A `HedgedLLMClient` sends each request
+to its primary client, and if no answer has come after the usual latency of
+the primary (a percentile of its recent latencies), sends a duplicate to the
+secondary client, typically the same model in another Vertex region or on
+the provider's direct API. The first success is used and the other request
+cancelled. When the primary fails with an overload error, the request fails
+over to the secondary right away.
+
+Streamed requests are hedged on the time to the first delta, and only the
+deltas of the request that delivered first are passed on.
+"""
+
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from ii_agent.core.metrics import LLM_HEDGED_REQUESTS
+from ii_agent.llm.base import (
+    AssistantContentBlock,
+    LLMClient,
+    LLMMessages,
+    StreamDelta,
+    ToolParam,
+)
+
+logger = logging.getLogger(__name__)
+
+# HTTP status codes of overloaded or unavailable providers
+OVERLOAD_STATUS_CODES = {429, 503, 529}
+
+# Threads for the sync methods, whose losing requests cannot be cancelled
+_executor = ThreadPoolExecutor(thread_name_prefix="llm-hedge")
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """Whether an error says the provider is overloaded rather than the request is wrong."""
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return status in OVERLOAD_STATUS_CODES or type(error).__name__ in (
+        "OverloadedError",
+        "APIConnectionError",
+        "APITimeoutError",
+    )
+
+
+def hedge_client_kwargs(
+    client_name: str, client_kwargs: dict[str, Any], hedge_region: str
+) -> dict[str, Any]:
+    """Derive the `get_client` arguments of the secondary client.
+
+    Args:
+        client_name: The `get_client` name of the primary client
+        client_kwargs: The `get_client` arguments of the primary client
+        hedge_region: A Vertex region, or "direct" for the provider's own API
+
+    Raises:
+        ValueError: If the client cannot be hedged to the region
+    """
+    if client_name == "openai-direct":
+        if hedge_region != "direct" or not client_kwargs.get("azure_model"):
+            raise ValueError(
+                "Only Azure OpenAI requests can be hedged, to the direct API"
+            )
+        return dict(client_kwargs, azure_model=False)
+    if client_name in ("anthropic-direct", "gemini-direct"):
+        on_vertex = client_kwargs.get("project_id") and client_kwargs.get("region")
+        if hedge_region == "direct":
+            if not on_vertex:
+                raise ValueError("Requests to the direct API cannot be hedged to it")
+            return dict(client_kwargs, project_id=None, region=None)
+        if not client_kwargs.get("project_id"):
+            raise ValueError(
+                f"Hedging to Vertex region {hedge_region} needs a project id"
+            )
+        return dict(client_kwargs, region=hedge_region)
+    raise ValueError(f"Requests of client {client_name} cannot be hedged")
+
+
+class HedgedLLMClient(LLMClient):
+    """Send requests to a primary client, hedged or failed over to a secondary one."""
+
+    def __init__(
+        self,
+        primary: LLMClient,
+        secondary: LLMClient,
+        hedge_percentile: float = 95.0,
+        initial_hedge_delay: float = 30.0,
+        min_hedge_delay: float = 1.0,
+        min_samples: int = 20,
+        window: int = 200,
+    ):
+        """Initialize the hedged client.
+
+        Args:
+            primary: The client that gets every request
+            secondary: The client that gets hedged and failed over requests
+            hedge_percentile: Percentile of the primary's recent latencies
+                after which a duplicate request is sent
+            initial_hedge_delay: Seconds to wait before hedging while there
+                are fewer than `min_samples` latencies
+            min_hedge_delay: Shortest wait before hedging, so a run of fast
+                responses does not turn every request into two
+            min_samples: Latencies needed before the percentile is used
+            window: Number of recent latencies kept, per method
+        """
+        self.primary = primary
+        self.secondary = secondary
+        self.provider = primary.provider
+        self.model_name = getattr(primary, "model_name", "unknown")
+        self.hedge_percentile = hedge_percentile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+        # Response latencies, and times to the first delta of streams
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.stream_latencies: deque[float] = deque(maxlen=window)
+
+    def count_tokens(self, text: str) -> int | None:
+        return self.primary.count_tokens(text)
+
+    def __getattr__(self, name: str) -> Any:
+        # Settings of the primary client, like thinking_tokens, stay readable
+        if name == "primary":
+            raise AttributeError(name)
+        return getattr(self.primary, name)
+
+    def hedge_delay(self, latencies: deque[float]) -> float:
+        """Seconds to wait for the primary before sending a duplicate request."""
+        if len(latencies) < self.min_samples:
+            return self.initial_hedge_delay
+        ordered = sorted(latencies)
+        rank = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))
+        return max(self.min_hedge_delay, ordered[rank])
+
+    async def _arace(
+        self,
+        start: Callable[[LLMClient, str], Awaitable[Any]],
+        latencies: deque[float],
+        progress: Optional[asyncio.Event] = None,
+    ) -> Any:
+        """Run a request on the primary, hedging to the secondary if needed.
+
+        Args:
+            start: Makes the request on a client, named primary or secondary
+            latencies: Where the primary's latency is recorded
+            progress: Set when the request made enough progress not to be
+                hedged, the first delta of a stream; completion otherwise
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        primary = asyncio.ensure_future(start(self.primary, "primary"))
+        attempts = {primary: "primary"}
+        progress_waiter = asyncio.ensure_future(progress.wait()) if progress else None
+        try:
+            await asyncio.wait(
+                [task for task in (primary, progress_waiter) if task is not None],
+                timeout=self.hedge_delay(latencies),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if primary.done() and not primary.cancelled():
+                error = primary.exception()
+                if error is None:
+                    if progress is None:
+                        latencies.append(loop.time() - started)
+                    LLM_HEDGED_REQUESTS.inc(trigger="none", winner="primary")
+                    return primary.result()
+                if not is_overload_error(error):
+                    raise error
+                trigger = "failover"
+            elif progress is not None and progress.is_set():
+                trigger = "none"
+            else:
+                trigger = "hedge"
+
+            if trigger != "none":
+                logger.info(
+                    f"{'Failing over' if trigger == 'failover' else 'Hedging'} "
+                    f"{self.model_name} request to the secondary client"
+                )
+                attempts[asyncio.ensure_future(start(self.secondary, "secondary"))] = (
+                    "secondary"
+                )
+
+            errors: dict[str, BaseException] = {}
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    # Streams cancel the attempt that delivered second
+                    if task.cancelled():
+                        continue
+                    error = task.exception()
+                    if error is None:
+                        if attempts[task] == "primary" and progress is None:
+                            latencies.append(loop.time() - started)
+                        LLM_HEDGED_REQUESTS.inc(trigger=trigger, winner=attempts[task])
+                        return task.result()
+                    errors[attempts[task]] = error
+            LLM_HEDGED_REQUESTS.inc(trigger=trigger, winner="none")
+            raise errors.get("primary") or errors["secondary"]
+        finally:
+            for task in [*attempts, progress_waiter]:
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def generate(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Generate a response, hedged across the two clients.
+
+        The losing request runs to completion in its thread, as a blocking
+        call cannot be cancelled, but its response is discarded.
+        """
+        request = dict(
+            messages=messages,
+            max_tokens=max_tokens,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            tools=tools,
+            tool_choice=tool_choice,
+            thinking_tokens=thinking_tokens,
+        )
+
+        def submit(client: LLMClient) -> Future:
+            # Keep the tracer and throttle listener of the caller
+            context = contextvars.copy_context()
+            return _executor.submit(context.run, client.generate, **request)
+
+        started = time.monotonic()
+        primary = submit(self.primary)
+        attempts = {primary: "primary"}
+        done, _ = wait([primary], timeout=self.hedge_delay(self.latencies))
+        if done:
+            error = primary.exception()
+            if error is None:
+                self.latencies.append(time.monotonic() - started)
+                LLM_HEDGED_REQUESTS.inc(trigger="none", winner="primary")
+                return primary.result()
+            if not is_overload_error(error):
+                raise error
+            trigger = "failover"
+        else:
+            trigger = "hedge"
+        logger.info(
+            f"{'Failing over' if trigger == 'failover' else 'Hedging'} "
+            f"{self.model_name} request to the secondary client"
+        )
+        attempts[submit(self.secondary)] = "secondary"
+
+        errors: dict[str, BaseException] = {}
+        pending = set(attempts)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    if attempts[future] == "primary":
+                        self.latencies.append(time.monotonic() - started)
+                    LLM_HEDGED_REQUESTS.inc(trigger=trigger, winner=attempts[future])
+                    return future.result()
+                errors[attempts[future]] = error
+        LLM_HEDGED_REQUESTS.inc(trigger=trigger, winner="none")
+        raise errors.get("primary") or errors["secondary"]
+
+    async def agenerate(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Generate a response, hedged across the two clients."""
+        return await self._arace(
+            lambda client, _: client.agenerate(
+                messages,
+                max_tokens,
+                system_prompt=system_prompt,
+                temperature=temperature,
+                tools=tools,
+                tool_choice=tool_choice,
+                thinking_tokens=thinking_tokens,
+            ),
+            self.latencies,
+        )
+
+    async def astream(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+        on_delta: Callable[[StreamDelta], None] | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Stream a response, hedged across the two clients on the time to the first delta.
+
+        The request that delivers a delta first is the one streamed to
+        `on_delta`, the other one is cancelled at that point.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        first_delta = asyncio.Event()
+        streaming: dict[str, Any] = {"winner": None, "tasks": {}}
+
+        def forward(name: str) -> Callable[[StreamDelta], None]:
+            def on_attempt_delta(delta: StreamDelta) -> None:
+                if streaming["winner"] is None:
+                    streaming["winner"] = name
+                    first_delta.set()
+                    if name == "primary":
+                        self.stream_latencies.append(loop.time() - started)
+                    for other, task in streaming["tasks"].items():
+                        if other != name:
+                            task.cancel()
+                if streaming["winner"] == name and on_delta is not None:
+                    on_delta(delta)
+
+            return on_attempt_delta
+
+        async def start(client: LLMClient, name: str):
+            streaming["tasks"][name] = asyncio.current_task()
+            return await client.astream(
+                messages,
+                max_tokens,
+                system_prompt=system_prompt,
+                temperature=temperature,
+                tools=tools,
+                tool_choice=tool_choice,
+                thinking_tokens=thinking_tokens,
+                on_delta=forward(name),
+            )
+
+        return await self._arace(start, self.stream_latencies, progress=first_delta)
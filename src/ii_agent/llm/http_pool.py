@@ -0,0 +1,172 @@
+"""HTTP connection pools shared by the LLM clients of a process.
+
+Every LLM client used to create its own SDK client, and with it a new
+connection pool, so each session and prompt enhancement paid for new TCP and
+TLS handshakes. The HTTP clients are now created once per provider endpoint
+and handed to the SDK clients, which keeps connections alive across sessions.
+HTTP/2 is used when the optional `h2` package is installed.
+
+Async HTTP clients hold connections bound to the event loop that opened them,
+which is fine for the servers and scripts here as each runs a single loop.
+"""
+
+import importlib.util
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable
+
+import httpx
+
+from ii_agent.core.metrics import REGISTRY, Gauge
+
+logger = logging.getLogger(__name__)
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+@dataclass(frozen=True)
+class PoolLimits:
+    """Connection limits of the pools of one provider."""
+
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    # Seconds an idle connection is kept open
+    keepalive_expiry: float = 60.0
+    http2: bool = True
+
+    def to_httpx(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+
+def parse_pool_limits(spec: str) -> tuple[str, PoolLimits]:
+    """Parse a `PROVIDER=MAX_CONNECTIONS[,MAX_KEEPALIVE]` command line value."""
+    provider, sep, values = spec.partition("=")
+    try:
+        numbers = [int(value) for value in values.split(",")]
+    except ValueError:
+        numbers = []
+    if not sep or not provider or len(numbers) not in (1, 2):
+        raise ValueError(
+            f"Invalid pool limits {spec!r}, expected PROVIDER=MAX_CONNECTIONS[,MAX_KEEPALIVE]"
+        )
+    max_connections = numbers[0]
+    max_keepalive = (
+        numbers[1]
+        if len(numbers) == 2
+        else min(max_connections, PoolLimits.max_keepalive_connections)
+    )
+    return provider, PoolLimits(
+        max_connections=max_connections, max_keepalive_connections=max_keepalive
+    )
+
+
+class HttpClientRegistry:
+    """Sync and async HTTP clients, created once per provider endpoint."""
+
+    def __init__(self):
+        self._clients: dict[tuple[Hashable, ...], tuple[Any, Any]] = {}
+        self._limits: dict[str, PoolLimits] = {}
+        self._lock = threading.Lock()
+
+    def set_limits(self, provider: str, limits: PoolLimits) -> None:
+        """Set the limits of the pools a provider creates from now on."""
+        with self._lock:
+            self._limits[provider] = limits
+
+    def limits(self, provider: str) -> PoolLimits:
+        return self._limits.get(provider, PoolLimits())
+
+    def get(
+        self,
+        provider: str,
+        endpoint: tuple[Hashable, ...],
+        sync_factory: Callable[..., Any],
+        async_factory: Callable[..., Any],
+    ) -> tuple[Any, Any]:
+        """Return the HTTP clients of an endpoint, creating them on first use.
+
+        Args:
+            provider: The provider, which decides the pool limits
+            endpoint: What tells apart the hosts the provider is reached at,
+                like the region and project or the base URL
+            sync_factory: Creates the sync client from `limits` and `http2`,
+                usually the SDK's `DefaultHttpxClient`
+            async_factory: Creates the async client the same way
+
+        Returns:
+            The sync and the async HTTP client
+        """
+        key = (provider, *endpoint)
+        with self._lock:
+            clients = self._clients.get(key)
+            if clients is None:
+                limits = self._limits.get(provider, PoolLimits())
+                options = dict(
+                    limits=limits.to_httpx(), http2=limits.http2 and HTTP2_AVAILABLE
+                )
+                clients = (sync_factory(**options), async_factory(**options))
+                self._clients[key] = clients
+                logger.info(
+                    f"Created HTTP connection pools for {provider} {endpoint}, "
+                    f"http2={options['http2']}"
+                )
+            return clients
+
+    def stats(self) -> list[dict[str, Any]]:
+        """Describe the connections of every pool."""
+        with self._lock:
+            items = list(self._clients.items())
+        stats = []
+        for (provider, *endpoint), clients in items:
+            for kind, client in zip(("sync", "async"), clients):
+                # httpx keeps the connection pool in its default transport
+                pool = getattr(getattr(client, "_transport", None), "_pool", None)
+                connections = list(getattr(pool, "connections", []))
+                idle = sum(1 for connection in connections if connection.is_idle())
+                stats.append(
+                    {
+                        "provider": provider,
+                        "endpoint": endpoint,
+                        "kind": kind,
+                        "connections": len(connections),
+                        "idle": idle,
+                        "active": len(connections) - idle,
+                        "closed": client.is_closed,
+                    }
+                )
+        return stats
+
+    def connection_counts(self) -> dict[tuple[str, str], int]:
+        """Count connections by provider and state, active or idle."""
+        counts: dict[tuple[str, str], int] = {}
+        for pool in self.stats():
+            for state in ("active", "idle"):
+                key = (pool["provider"], state)
+                counts[key] = counts.get(key, 0) + pool[state]
+        return counts
+
+    async def aclose(self) -> None:
+        """Close all clients, for shutdown."""
+        with self._lock:
+            items = list(self._clients.values())
+            self._clients.clear()
+        for sync_client, async_client in items:
+            sync_client.close()
+            await async_client.aclose()
+
+
+HTTP_CLIENTS = HttpClientRegistry()
+
+LLM_POOL_CONNECTIONS = REGISTRY.register(
+    Gauge(
+        "ii_agent_llm_pool_connections",
+        "Open connections of the shared LLM provider pools, by state: active or idle.",
+        labels=("provider", "state"),
+        callback=HTTP_CLIENTS.connection_counts,
+    )
+)
@@ -1,4 +1,5 @@
 import json
+from collections import Counter
 from typing import Optional, cast, Any
 from ii_agent.llm.base import (
     AssistantContentBlock,
@@ -9,7 +10,9 @@ from ii_agent.llm.base import (
     ToolCall,
     ToolCallParameters,
     ToolFormattedResult,
+    ToolParam,
     ImageBlock,
+    convert_cached,
 )
 from ii_agent.llm.context_manager.base import ContextManager
 
@@ -23,6 +26,13 @@ class MessageHistory:
         self._last_user_prompt_index: int | None = (
             None  # Track the last user prompt index
         )
+        # Estimated token counts of the leading turns by content type, and
+        # their running total without thinking blocks
+        self._turn_tokens: list[Counter[str]] = []
+        self._counted_tokens: Counter[str] = Counter()
+        # Set when a turn follows tool calls it has no results for, as after a
+        # run stopped by a tool error, so that truncate removes those calls
+        self._has_unmatched_tool_calls = False
 
     @classmethod
     def _ensure_tool_call_integrity(
@@ -120,21 +130,12 @@ class MessageHistory:
         for msg in messages:
             if not isinstance(msg, (TextPrompt, ToolFormattedResult, ImageBlock)):
                 raise TypeError(f"Invalid message type for user turn: {type(msg)}")
+        self._check_tool_results(messages)
         self._message_lists.append(messages)
 
     def add_assistant_turn(self, messages: list[AssistantContentBlock]):
         """Adds an assistant turn (text response and/or tool calls)."""
-        messages_with_one_tool_call = []
-        has_tool_call = False
-        for message in messages:
-            if isinstance(message, ToolCall) and not has_tool_call:
-                has_tool_call = True
-                messages_with_one_tool_call.append(message)
-            elif isinstance(message, ToolCall) and has_tool_call:
-                print("WARNING: Multiple tool calls in one turn are not supported, selecting the first tool call")
-            else:
-                messages_with_one_tool_call.append(message)
-        self._message_lists.append(cast(list[GeneralContentBlock], messages_with_one_tool_call))
+        self._message_lists.append(cast(list[GeneralContentBlock], list(messages)))
 
     def get_messages_for_llm(self) -> LLMMessages:  # TODO: change name to get_messages
         """Returns messages formatted for the LLM client."""
@@ -163,17 +164,32 @@ class MessageHistory:
     def add_tool_call_results(
         self, parameters: list[ToolCallParameters], results: list[str]
     ):
-        """Add the result of a tool call to the dialog."""
-        self._message_lists.append(
-            [
-                ToolFormattedResult(
-                    tool_call_id=params.tool_call_id,
-                    tool_name=params.tool_name,
-                    tool_output=result,
-                )
-                for params, result in zip(parameters, results)
-            ]
-        )
+        """Add the results of the tool calls of one turn to the dialog, in call order."""
+        turn: list[GeneralContentBlock] = [
+            ToolFormattedResult(
+                tool_call_id=params.tool_call_id,
+                tool_name=params.tool_name,
+                tool_output=result,
+            )
+            for params, result in zip(parameters, results)
+        ]
+        self._check_tool_results(turn)
+        self._message_lists.append(turn)
+
+    def _check_tool_results(self, turn: list[GeneralContentBlock]) -> None:
+        """Note if a turn about to be added lacks results for the calls before it."""
+        if not self._message_lists:
+            return
+        result_ids = {
+            block.tool_call_id
+            for block in turn
+            if isinstance(block, ToolFormattedResult)
+        }
+        if any(
+            isinstance(block, ToolCall) and block.tool_call_id not in result_ids
+            for block in self._message_lists[-1]
+        ):
+            self._has_unmatched_tool_calls = True
 
     def get_last_assistant_text_response(self) -> Optional[str]:  # TODO:: remove get
         """Returns the text part of the last assistant response, if any."""
@@ -190,6 +206,8 @@ class MessageHistory:
         """Removes all messages."""
         self._message_lists = []
         self._last_user_prompt_index = None
+        self._has_unmatched_tool_calls = False
+        self._forget_token_counts()
 
     def clear_from_last_to_user_message(self):
         """Clears messages from the last turn backwards to the last user prompt (inclusive).
@@ -200,6 +218,7 @@ class MessageHistory:
 
         # Keep messages up to and excluding the last user prompt
         self._message_lists = self._message_lists[: self._last_user_prompt_index]
+        self._forget_token_counts(keep=self._last_user_prompt_index)
         # Reset the last user prompt index since we've cleared after it
         self._last_user_prompt_index = None
 
@@ -244,15 +263,90 @@ class MessageHistory:
     def set_message_list(self, message_list: list[list[GeneralContentBlock]]):
         """Sets the message list and ensures tool call integrity."""
         self._message_lists = MessageHistory._ensure_tool_call_integrity(message_list)
+        self._has_unmatched_tool_calls = False
+        self._forget_token_counts()
+
+    def _forget_token_counts(self, keep: int = 0) -> None:
+        """Drop the token counts of all but the first `keep` turns, after they changed."""
+        del self._turn_tokens[keep:]
+        self._counted_tokens = Counter()
+        for tokens in self._turn_tokens:
+            self._add_to_total(tokens)
+
+    def _add_to_total(self, tokens: Counter[str]) -> None:
+        self._counted_tokens.update(
+            {
+                content_type: count
+                for content_type, count in tokens.items()
+                if content_type != "thinking"
+            }
+        )
+
+    def count_tokens_by_type(self) -> Counter[str]:
+        """Estimate the tokens in the message list, by content type.
+
+        Only turns added since the last count are counted, the others are
+        part of a running total.
+        """
+        for turn in self._message_lists[len(self._turn_tokens) :]:
+            tokens = self._context_manager.count_turn_tokens(turn)
+            self._turn_tokens.append(tokens)
+            self._add_to_total(tokens)
+        total = Counter(self._counted_tokens)
+        # Thinking blocks only count in the last turn
+        if self._turn_tokens and self._turn_tokens[-1]["thinking"]:
+            total["thinking"] = self._turn_tokens[-1]["thinking"]
+        return total
 
     def count_tokens(self):
         """Counts the tokens in the message list."""
-        return self._context_manager.count_tokens(self.get_messages_for_llm())
+        return self._context_manager.token_counter.calibrate(
+            self.count_tokens_by_type()
+        )
+
+    def observe_usage(
+        self,
+        metadata: dict[str, Any],
+        system_prompt: str | None = None,
+        tools: list[ToolParam] = [],
+    ) -> None:
+        """Calibrate token counts with the usage reported for a request of the current messages.
+
+        Args:
+            metadata: The metadata the LLM client returned for the request
+            system_prompt: The system prompt of the request
+            tools: The tools of the request, whose definitions count as input
+        """
+        token_counter = self._context_manager.token_counter
+        estimated = self.count_tokens_by_type()
+        estimated["system"] = token_counter.count_tokens(system_prompt or "") + sum(
+            convert_cached(
+                tool,
+                token_counter.cache_key,
+                lambda tool: token_counter.count_tokens(json.dumps(tool.to_dict())),
+            )
+            for tool in tools
+        )
+        token_counter.observe_usage(estimated, metadata)
+
+    def _has_pending_tool_calls(self) -> bool:
+        return bool(self._message_lists) and any(
+            isinstance(block, ToolCall) for block in self._message_lists[-1]
+        )
 
     def truncate(self) -> None:
         """Remove oldest messages when context window limit is exceeded."""
+        messages = self.get_messages_for_llm()
         truncated_messages_for_llm = self._context_manager.apply_truncation_if_needed(
-            self.get_messages_for_llm()
+            messages, token_count=self.count_tokens()
         )
-
-        self.set_message_list(truncated_messages_for_llm)
+        # Results are added right after their tool calls, so the history can
+        # only lose integrity by truncation, or a run that stopped before the
+        # tool results of a turn were added, whether or not another turn
+        # followed it
+        if (
+            truncated_messages_for_llm is not messages
+            or self._has_unmatched_tool_calls
+            or self._has_pending_tool_calls()
+        ):
+            self.set_message_list(truncated_messages_for_llm)
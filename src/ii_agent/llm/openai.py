@@ -2,9 +2,7 @@
 
 import json
 import os
-import random
-import time
-from typing import Any, Tuple, cast
+from typing import Any, Callable, Tuple, cast
 import openai
 import logging
 
@@ -25,19 +23,37 @@ from openai._types import (
 
 from ii_agent.llm.base import (
     LLMClient,
+    observe_llm_request,
     AssistantContentBlock,
     LLMMessages,
+    StreamDelta,
     ToolParam,
     TextPrompt,
     ToolCall,
     TextResult,
     ToolFormattedResult,
+    convert_cached,
 )
+from ii_agent.llm.http_pool import HTTP_CLIENTS
+from ii_agent.llm.rate_limit import RATE_LIMITERS, estimate_request_tokens
+
+
+def _is_retryable(error: Exception) -> bool:
+    return isinstance(
+        error,
+        (
+            OpenAI_APIConnectionError,
+            OpenAI_InternalServerError,
+            OpenAI_RateLimitError,
+        ),
+    )
 
 
 class OpenAIDirectClient(LLMClient):
     """Use OpenAI models via first party API."""
 
+    provider = "openai"
+
     def __init__(self, model_name: str, max_retries=2, cot_model: bool = True, azure_model: bool = False):
         """Initialize the OpenAI first party client."""
         api_key = os.getenv("OPENAI_API_KEY", "EMPTY")
@@ -46,19 +62,53 @@ class OpenAIDirectClient(LLMClient):
             azure_endpoint = os.getenv("OPENAI_AZURE_ENDPOINT", "http://0.0.0.0:2323")
             api_key = os.getenv("OPENAI_API_KEY", "EMPTY")
             api_version = os.getenv("AZURE_API_VERSION", "2024-12-01-preview")
+            credential = (azure_endpoint, api_key)
+            http_client, async_http_client = HTTP_CLIENTS.get(
+                self.provider,
+                (azure_endpoint,),
+                openai.DefaultHttpxClient,
+                openai.DefaultAsyncHttpxClient,
+            )
             self.client = openai.AzureOpenAI(
                 api_key=api_key,
                 azure_endpoint=azure_endpoint,
                 api_version=api_version,
                 max_retries=max_retries,
+                http_client=http_client,
+            )
+            self.async_client = openai.AsyncAzureOpenAI(
+                api_key=api_key,
+                azure_endpoint=azure_endpoint,
+                api_version=api_version,
+                max_retries=max_retries,
+                http_client=async_http_client,
             )
         else:
-            self.client = openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries)
+            credential = (base_url, api_key)
+            http_client, async_http_client = HTTP_CLIENTS.get(
+                self.provider,
+                (base_url,),
+                openai.DefaultHttpxClient,
+                openai.DefaultAsyncHttpxClient,
+            )
+            self.client = openai.OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=max_retries,
+                http_client=http_client,
+            )
+            self.async_client = openai.AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=max_retries,
+                http_client=async_http_client,
+            )
         self.model_name = model_name
+        self.rate_limiter = RATE_LIMITERS.get(self.provider, model_name, credential)
         self.max_retries = max_retries
         self.cot_model = cot_model
 
-    def generate(
+    def _build_request(
         self,
         messages: LLMMessages,
         max_tokens: int,
@@ -67,21 +117,8 @@ class OpenAIDirectClient(LLMClient):
         tools: list[ToolParam] = [],
         tool_choice: dict[str, str] | None = None,
         thinking_tokens: int | None = None,
-    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
-        """Generate responses.
-
-        Args:
-            messages: A list of messages.
-            system_prompt: A system prompt.
-            max_tokens: The maximum number of tokens to generate.
-            temperature: The temperature.
-            tools: A list of tools.
-            tool_choice: A tool choice.
-
-        Returns:
-            A generated response.
-        """
-
+    ) -> dict[str, Any]:
+        """Turn internal messages and generation options into `chat.completions.create` kwargs."""
         openai_messages = []
         system_prompt_applied = False
 
@@ -93,6 +130,28 @@ class OpenAIDirectClient(LLMClient):
 
         for idx, message_list in enumerate(messages):
             if len(message_list) > 1:
+                if all(str(type(message)) == str(ToolCall) for message in message_list):
+                    # Parallel tool calls go into a single assistant message
+                    openai_messages.append(
+                        {
+                            "role": "assistant",
+                            "tool_calls": [
+                                self._cached_tool_call_payload(message)
+                                for message in message_list
+                            ],
+                        }
+                    )
+                    continue
+                if all(
+                    str(type(message)) == str(ToolFormattedResult)
+                    for message in message_list
+                ):
+                    # Each tool result is a message of its own
+                    openai_messages.extend(
+                        self._cached_tool_result_message(message)
+                        for message in message_list
+                    )
+                    continue
                 raise ValueError("Only one entry per message supported for openai")
             internal_message = message_list[0]
             
@@ -106,44 +165,26 @@ class OpenAIDirectClient(LLMClient):
                 role = "user"
             elif str(type(internal_message)) == str(TextResult):
                 internal_message = cast(TextResult, internal_message)
-                # For TextResult (assistant), content is handled differently by OpenAI API
-                message_content_obj = {"type": "text", "text": internal_message.text}
-                openai_message = {"role": "assistant", "content": [message_content_obj]}
-                openai_messages.append(openai_message)
+                openai_messages.append(
+                    convert_cached(
+                        internal_message, self.provider, self._text_result_message
+                    )
+                )
                 continue # Move to next message in outer loop
             elif str(type(internal_message)) == str(ToolCall):
                 internal_message = cast(ToolCall, internal_message)
-                # Ensure arguments are stringified JSON for the OpenAI API call
-                try:
-                    arguments_str = json.dumps(internal_message.tool_input)
-                except TypeError as e:
-                    logger.error(f"Failed to serialize tool_input to JSON string for tool '{internal_message.tool_name}': {internal_message.tool_input}. Error: {str(e)}")
-                    # Decide how to handle: skip this message, or raise, or send with potentially malformed args? For now, let's raise.
-                    raise ValueError(f"Cannot serialize tool arguments for {internal_message.tool_name}: {str(e)}") from e
-                
-                tool_call_payload = {
-                    "type": "function",
-                    "id": internal_message.tool_call_id,
-                    "function": {
-                        "name": internal_message.tool_name,
-                        "arguments": arguments_str, # Use the JSON string
-                    },
-                }
                 openai_message = {
                     "role": "assistant",
-                    "tool_calls": [tool_call_payload],
+                    "tool_calls": [self._cached_tool_call_payload(internal_message)],
                     # Content is implicitly None or omitted by not setting it
                 }
                 openai_messages.append(openai_message)
                 continue # Move to next message in outer loop
             elif str(type(internal_message)) == str(ToolFormattedResult):
                 internal_message = cast(ToolFormattedResult, internal_message)
-                openai_message = {
-                    "role": "tool",
-                    "tool_call_id": internal_message.tool_call_id,
-                    "content": internal_message.tool_output,
-                }
-                openai_messages.append(openai_message)
+                openai_messages.append(
+                    self._cached_tool_result_message(internal_message)
+                )
                 continue # Move to next message in outer loop
             else:
                 print(
@@ -201,41 +242,73 @@ class OpenAIDirectClient(LLMClient):
             }
             openai_tools.append(openai_tool_object)
 
-        response = None
-        for retry in range(self.max_retries):
-            try:
-                extra_body = {}
-                openai_max_tokens = max_tokens
-                openai_temperature = temperature
-                if self.cot_model:
-                    extra_body["max_completion_tokens"] = max_tokens
-                    openai_max_tokens = OpenAI_NOT_GIVEN
-                    openai_temperature = OpenAI_NOT_GIVEN
-                response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=openai_messages,
-                    tools=openai_tools if len(openai_tools) > 0 else OpenAI_NOT_GIVEN,
-                    tool_choice=tool_choice_param,
-                    max_tokens=openai_max_tokens,
-                    extra_body=extra_body,
-                )
-                break
-            except (
-                OpenAI_APIConnectionError,
-                OpenAI_InternalServerError,
-                OpenAI_RateLimitError,
-            ) as e:
-                if retry == self.max_retries - 1:
-                    print(f"Failed OpenAI request after {retry + 1} retries")
-                    raise e
-                else:
-                    print(f"Retrying OpenAI request: {retry + 1}/{self.max_retries}")
-                    # Sleep 8-12 seconds with jitter to avoid thundering herd.
-                    time.sleep(10 * random.uniform(0.8, 1.2))
+        extra_body = {}
+        openai_max_tokens = max_tokens
+        openai_temperature = temperature
+        if self.cot_model:
+            extra_body["max_completion_tokens"] = max_tokens
+            openai_max_tokens = OpenAI_NOT_GIVEN
+            openai_temperature = OpenAI_NOT_GIVEN
 
+        return dict(
+            model=self.model_name,
+            messages=openai_messages,
+            tools=openai_tools if len(openai_tools) > 0 else OpenAI_NOT_GIVEN,
+            tool_choice=tool_choice_param,
+            max_tokens=openai_max_tokens,
+            extra_body=extra_body,
+        )
+
+    def _text_result_message(self, text_result: TextResult) -> dict[str, Any]:
+        """Convert an assistant text response into an assistant message."""
+        # For TextResult (assistant), content is handled differently by OpenAI API
+        message_content_obj = {"type": "text", "text": text_result.text}
+        return {"role": "assistant", "content": [message_content_obj]}
+
+    def _cached_tool_call_payload(self, tool_call: ToolCall) -> dict[str, Any]:
+        return convert_cached(tool_call, self.provider, self._tool_call_payload)
+
+    def _cached_tool_result_message(
+        self, tool_result: ToolFormattedResult
+    ) -> dict[str, Any]:
+        return convert_cached(tool_result, self.provider, self._tool_result_message)
+
+    def _tool_call_payload(self, tool_call: ToolCall) -> dict[str, Any]:
+        """Convert a tool call into an entry of an assistant message's tool_calls."""
+        # Ensure arguments are stringified JSON for the OpenAI API call
+        try:
+            arguments_str = json.dumps(tool_call.tool_input)
+        except TypeError as e:
+            logger.error(
+                f"Failed to serialize tool_input to JSON string for tool '{tool_call.tool_name}': {tool_call.tool_input}. Error: {str(e)}"
+            )
+            raise ValueError(
+                f"Cannot serialize tool arguments for {tool_call.tool_name}: {str(e)}"
+            ) from e
+
+        return {
+            "type": "function",
+            "id": tool_call.tool_call_id,
+            "function": {
+                "name": tool_call.tool_name,
+                "arguments": arguments_str,
+            },
+        }
+
+    def _tool_result_message(self, tool_result: ToolFormattedResult) -> dict[str, Any]:
+        """Convert a tool result into a tool message."""
+        return {
+            "role": "tool",
+            "tool_call_id": tool_result.tool_call_id,
+            "content": tool_result.tool_output,
+        }
+
+    def _convert_response(
+        self, response: Any, tools: list[ToolParam]
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Convert an OpenAI response back into internal content blocks."""
         # Convert messages back to internal format
         internal_messages = []
-        assert response is not None
         openai_response_messages = response.choices
         if len(openai_response_messages) > 1:
             raise ValueError("Only one message supported for OpenAI")
@@ -285,8 +358,9 @@ class OpenAIDirectClient(LLMClient):
                         )
                     )
                     processed_tool_call = True
-                    logger.info(f"Successfully processed and selected tool call: {tool_name_from_model}")
-                    break # Processed the first valid and available tool call
+                    logger.info(
+                        f"Successfully processed tool call: {tool_name_from_model}"
+                    )
                 else:
                     logger.warning(f"Skipping tool call with unknown or placeholder name: '{tool_name_from_model}'. Not in available tools: {available_tool_names}")
             
@@ -306,3 +380,174 @@ class OpenAIDirectClient(LLMClient):
         }
 
         return internal_messages, message_metadata
+
+    @observe_llm_request
+    def generate(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Generate responses.
+
+        Args:
+            messages: A list of messages.
+            system_prompt: A system prompt.
+            max_tokens: The maximum number of tokens to generate.
+            temperature: The temperature.
+            tools: A list of tools.
+            tool_choice: A tool choice.
+
+        Returns:
+            A generated response.
+        """
+        request = self._build_request(
+            messages,
+            max_tokens,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            tools=tools,
+            tool_choice=tool_choice,
+            thinking_tokens=thinking_tokens,
+        )
+
+        tokens = estimate_request_tokens(messages)
+
+        def create():
+            raw_response = self.client.chat.completions.with_raw_response.create(
+                **request
+            )
+            self.rate_limiter.update_from_headers(raw_response.headers)
+            return raw_response.parse()
+
+        response = self.rate_limiter.call(
+            create,
+            tokens=tokens,
+            retryable=_is_retryable,
+            max_retries=self.max_retries,
+            retry_delay=10.0,
+        )
+        blocks, metadata = self._convert_response(response, tools)
+        self.rate_limiter.settle(tokens, metadata)
+        return blocks, metadata
+
+    @observe_llm_request
+    async def agenerate(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Generate responses using the async OpenAI client.
+
+        Same contract as `generate`, but waits on the network and on retry
+        backoff without holding a thread.
+        """
+        request = self._build_request(
+            messages,
+            max_tokens,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            tools=tools,
+            tool_choice=tool_choice,
+            thinking_tokens=thinking_tokens,
+        )
+
+        tokens = estimate_request_tokens(messages)
+
+        async def create():
+            raw_response = (
+                await self.async_client.chat.completions.with_raw_response.create(
+                    **request
+                )
+            )
+            self.rate_limiter.update_from_headers(raw_response.headers)
+            return raw_response.parse()
+
+        response = await self.rate_limiter.acall(
+            create,
+            tokens=tokens,
+            retryable=_is_retryable,
+            max_retries=self.max_retries,
+            retry_delay=10.0,
+        )
+        blocks, metadata = self._convert_response(response, tools)
+        self.rate_limiter.settle(tokens, metadata)
+        return blocks, metadata
+
+    @observe_llm_request
+    async def astream(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+        on_delta: Callable[[StreamDelta], None] | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Generate responses with a streamed chat completion.
+
+        Content and tool call arguments are passed to `on_delta` as they
+        arrive. A failed request is only retried if nothing has been
+        streamed yet.
+        """
+        request = self._build_request(
+            messages,
+            max_tokens,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            tools=tools,
+            tool_choice=tool_choice,
+            thinking_tokens=thinking_tokens,
+        )
+        # Usage is only reported on streams when asked for explicitly
+        request["stream_options"] = {"include_usage": True}
+
+        tokens = estimate_request_tokens(messages)
+        streamed = False
+
+        async def stream_response():
+            nonlocal streamed
+            async with self.async_client.chat.completions.stream(**request) as stream:
+                async for event in stream:
+                    if event.type == "content.delta":
+                        # Tool calls follow the content in the response
+                        delta = StreamDelta(index=0, kind="text", text=event.delta)
+                    elif event.type == "tool_calls.function.arguments.delta":
+                        snapshot = stream.current_completion_snapshot
+                        tool_call = snapshot.choices[0].message.tool_calls[event.index]
+                        delta = StreamDelta(
+                            index=event.index + 1,
+                            kind="tool_input",
+                            text=event.arguments_delta,
+                            tool_call_id=tool_call.id,
+                            tool_name=event.name,
+                        )
+                    else:
+                        continue
+                    streamed = True
+                    if on_delta is not None:
+                        on_delta(delta)
+                return await stream.get_final_completion()
+
+        response = await self.rate_limiter.acall(
+            stream_response,
+            tokens=tokens,
+            retryable=_is_retryable,
+            max_retries=self.max_retries,
+            retry_delay=10.0,
+            can_retry=lambda: not streamed,
+        )
+        blocks, metadata = self._convert_response(response, tools)
+        self.rate_limiter.settle(tokens, metadata)
+        return blocks, metadata
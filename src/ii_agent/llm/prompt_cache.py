@@ -0,0 +1,100 @@
+"""Placement of Anthropic prompt cache breakpoints, and cache hit accounting.
+
+Anthropic caches the request prefix up to each block marked with
+`cache_control`, in the order tools, system prompt, messages, and allows
+four such breakpoints per request. The plan only depends on the messages
+being sent, so the same conversation always gets the same breakpoints and
+nothing has to be remembered between requests.
+"""
+
+from dataclasses import dataclass
+from typing import Any
+
+from ii_agent.llm.base import LLMMessages, TextPrompt
+from ii_agent.llm.context_manager.llm_summarizing import SUMMARY_PREFIX
+
+MAX_CACHE_BREAKPOINTS = 4
+
+
+def _anchor_index(messages: LLMMessages) -> int:
+    """Return the last message of the prefix that context condensation keeps.
+
+    Condensation keeps the first messages and replaces what follows with a
+    summary, which then stays put until the next condensation.
+    """
+    for idx in range(len(messages) - 1, -1, -1):
+        first_block = messages[idx][0] if messages[idx] else None
+        if isinstance(first_block, TextPrompt) and first_block.text.startswith(
+            SUMMARY_PREFIX
+        ):
+            return idx
+    return 0
+
+
+def plan_message_breakpoints(
+    messages: LLMMessages, available: int = MAX_CACHE_BREAKPOINTS - 1
+) -> list[int]:
+    """Pick the messages whose last block gets a cache breakpoint.
+
+    In order of importance:
+    - the last message, which writes the prefix the next request reads
+    - the condensation anchor, the first message or the latest summary,
+      whose prefix is reused across condensations
+    - the last message of the previous turn, where the previous request
+      wrote its cache, so it is read even when the new turn added more
+      blocks than the cache lookback covers
+
+    Args:
+        messages: The messages of the request
+        available: Number of breakpoints left after tools and system prompt
+
+    Returns:
+        Message indices, in ascending order
+    """
+    last = len(messages) - 1
+    if last < 0 or available <= 0:
+        return []
+    # A turn adds an assistant message and a user message
+    candidates = [last, _anchor_index(messages), last - 2]
+    breakpoints = []
+    for idx in candidates:
+        if idx >= 0 and idx not in breakpoints and len(breakpoints) < available:
+            breakpoints.append(idx)
+    return sorted(breakpoints)
+
+
+@dataclass
+class PromptCacheStats:
+    """Input token totals of a session, split by how the prompt cache served them."""
+
+    requests: int = 0
+    input_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+
+    def record(self, metadata: dict[str, Any]) -> None:
+        """Add the token counts an LLM client returned for one request."""
+        self.requests += 1
+        for key in (
+            "input_tokens",
+            "cache_read_input_tokens",
+            "cache_creation_input_tokens",
+        ):
+            tokens = metadata.get(key)
+            # Clients report -1 or None for counts they do not have
+            if isinstance(tokens, int) and tokens > 0:
+                setattr(self, key, getattr(self, key) + tokens)
+
+    @property
+    def total_input_tokens(self) -> int:
+        return (
+            self.input_tokens
+            + self.cache_read_input_tokens
+            + self.cache_creation_input_tokens
+        )
+
+    @property
+    def read_ratio(self) -> float:
+        """Share of input tokens read from the cache."""
+        total = self.total_input_tokens
+        return self.cache_read_input_tokens / total if total else 0.0
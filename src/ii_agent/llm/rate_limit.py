@@ -0,0 +1,526 @@
+"""Client side rate limiting of LLM requests, shared by the sessions of a process.
+
+Every client used to retry on its own after a fixed sleep, ignoring what the
+provider said about when to come back, so under a rate limit all sessions
+slept and retried in lockstep. Requests to the same model and API key now go
+through one `RateLimiter`, which:
+
+- keeps token buckets of the request and token budgets, configured on the
+  command line or learned from the provider's rate limit headers
+- queues requests that would exceed the budgets, in arrival order
+- pauses all requests for as long as `retry-after` asks when one is rejected
+- waits with `asyncio.sleep` in the async methods, so no thread is held
+
+While a request waits, the listener set with `use_throttle_listener` is
+told, which the agent turns into a status event for the user.
+"""
+
+import asyncio
+import contextvars
+import email.utils
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Hashable,
+    Iterator,
+    Mapping,
+    Optional,
+    TypeVar,
+)
+
+from ii_agent.core.metrics import LLM_THROTTLE_SECONDS
+from ii_agent.llm.base import (
+    ImageBlock,
+    LLMMessages,
+    TextPrompt,
+    TextResult,
+    ToolCall,
+    ToolFormattedResult,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Waits shorter than this are not worth telling the user about
+THROTTLE_NOTIFY_SECONDS = 1.0
+
+# Rate limit headers by budget, as (limit, remaining, reset), in order of preference
+_BUDGET_HEADERS = {
+    "requests": [
+        (
+            "anthropic-ratelimit-requests-limit",
+            "anthropic-ratelimit-requests-remaining",
+            "anthropic-ratelimit-requests-reset",
+        ),
+        (
+            "x-ratelimit-limit-requests",
+            "x-ratelimit-remaining-requests",
+            "x-ratelimit-reset-requests",
+        ),
+    ],
+    "tokens": [
+        (
+            "anthropic-ratelimit-input-tokens-limit",
+            "anthropic-ratelimit-input-tokens-remaining",
+            "anthropic-ratelimit-input-tokens-reset",
+        ),
+        (
+            "anthropic-ratelimit-tokens-limit",
+            "anthropic-ratelimit-tokens-remaining",
+            "anthropic-ratelimit-tokens-reset",
+        ),
+        (
+            "x-ratelimit-limit-tokens",
+            "x-ratelimit-remaining-tokens",
+            "x-ratelimit-reset-tokens",
+        ),
+    ],
+}
+
+_DURATION_PATTERN = re.compile(
+    r"^(?:(?P<h>\d+(?:\.\d+)?)h)?(?:(?P<m>\d+(?:\.\d+)?)m(?!s))?"
+    r"(?:(?P<s>\d+(?:\.\d+)?)s)?(?:(?P<ms>\d+(?:\.\d+)?)ms)?$"
+)
+
+
+def parse_wait(value: str | None) -> float | None:
+    """Parse how long to wait from a header value.
+
+    Accepts seconds, durations like `6m0s` or `20ms`, RFC 3339 timestamps and
+    HTTP dates, the latter two relative to now.
+
+    Returns:
+        Seconds to wait, or None if the value is missing or not understood
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    match = _DURATION_PATTERN.match(value)
+    if match and any(match.groupdict().values()):
+        parts = {key: float(part or 0) for key, part in match.groupdict().items()}
+        return parts["h"] * 3600 + parts["m"] * 60 + parts["s"] + parts["ms"] / 1000
+    try:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        try:
+            moment = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+
+
+def retry_after_seconds(headers: Mapping[str, str] | None) -> float | None:
+    """Read `retry-after-ms` or `retry-after` from response headers."""
+    if not headers:
+        return None
+    milliseconds = parse_wait(headers.get("retry-after-ms"))
+    if milliseconds is not None:
+        return milliseconds / 1000
+    return parse_wait(headers.get("retry-after"))
+
+
+def _error_headers(error: Exception) -> Mapping[str, str] | None:
+    return getattr(getattr(error, "response", None), "headers", None)
+
+
+def _error_retry_delay(error: Exception) -> float | None:
+    """Read the retry delay Google APIs put in the error details."""
+    details = getattr(error, "details", None)
+    if not details:
+        return None
+    match = re.search(r'"retryDelay":\s*"([^"]+)"', json.dumps(details, default=str))
+    return parse_wait(match.group(1)) if match else None
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Whether the provider rejected a request for exceeding a rate limit."""
+    return 429 in (getattr(error, "status_code", None), getattr(error, "code", None))
+
+
+def estimate_request_tokens(messages: LLMMessages) -> int:
+    """Roughly count the input tokens of a request, for the token budget.
+
+    Uses the same three characters per token as `TokenCounter`, without
+    decoding images.
+    """
+    chars = 0
+    images = 0
+    for message in messages:
+        for block in message:
+            if isinstance(block, (TextPrompt, TextResult)):
+                chars += len(block.text)
+            elif isinstance(block, ToolCall):
+                chars += len(json.dumps(block.tool_input, default=str))
+            elif isinstance(block, ToolFormattedResult):
+                if isinstance(block.tool_output, str):
+                    chars += len(block.tool_output)
+                else:
+                    for item in block.tool_output:
+                        if item.get("type") == "image":
+                            images += 1
+                        else:
+                            chars += len(item.get("text", ""))
+            elif isinstance(block, ImageBlock):
+                images += 1
+            else:
+                chars += len(str(block))
+    return chars // 3 + images * 1500
+
+
+@dataclass(frozen=True)
+class RateLimits:
+    """Budgets of one model and API key, None for no limit."""
+
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+
+
+def parse_rate_limits(spec: str) -> tuple[str, RateLimits]:
+    """Parse a `PROVIDER=REQUESTS_PER_MINUTE[,TOKENS_PER_MINUTE]` command line value."""
+    provider, sep, values = spec.partition("=")
+    try:
+        numbers = [float(value) for value in values.split(",")]
+    except ValueError:
+        numbers = []
+    if not sep or not provider or len(numbers) not in (1, 2) or min(numbers) <= 0:
+        raise ValueError(
+            f"Invalid rate limits {spec!r}, expected "
+            "PROVIDER=REQUESTS_PER_MINUTE[,TOKENS_PER_MINUTE]"
+        )
+    return provider, RateLimits(*numbers)
+
+
+class TokenBucket:
+    """A budget that refills continuously up to its capacity, per minute.
+
+    Reservations are taken right away even when the budget does not cover
+    them, leaving it in debt, so later reservations wait for earlier ones.
+    """
+
+    def __init__(self, per_minute: float, now: float):
+        self.capacity = per_minute
+        self.available = per_minute
+        self.updated = now
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / 60
+
+    def _refill(self, now: float) -> None:
+        self.available = min(
+            self.capacity, self.available + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take an amount from the budget and return the seconds until it is covered."""
+        self._refill(now)
+        self.available -= min(amount, self.capacity)
+        return max(0.0, -self.available / self.rate)
+
+    def adjust(self, amount: float, now: float) -> None:
+        """Give back (positive) or take more (negative) than was reserved."""
+        self._refill(now)
+        self.available = min(self.capacity, self.available + amount)
+
+    def observe(self, limit: float, remaining: float, now: float) -> None:
+        """Follow the budget the provider reports."""
+        self._refill(now)
+        self.capacity = limit
+        self.available = min(self.available, remaining)
+
+
+class RateLimiter:
+    """Request and token budgets shared by the clients of one model and API key."""
+
+    def __init__(
+        self,
+        name: str,
+        limits: RateLimits = RateLimits(),
+        max_queue_seconds: float = 600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Initialize the limiter.
+
+        Args:
+            name: The provider, used in logs and metrics
+            limits: Budgets to start with, learned from headers when None
+            max_queue_seconds: Longest a request waits on rate limits before
+                a rejection counts as a failed attempt
+            clock: Monotonic time source
+        """
+        self.name = name
+        self.max_queue_seconds = max_queue_seconds
+        self._clock = clock
+        now = clock()
+        self.buckets: dict[str, TokenBucket] = {}
+        if limits.requests_per_minute:
+            self.buckets["requests"] = TokenBucket(limits.requests_per_minute, now)
+        if limits.tokens_per_minute:
+            self.buckets["tokens"] = TokenBucket(limits.tokens_per_minute, now)
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: int) -> float:
+        """Take one request and `tokens` from the budgets, returning the seconds to wait."""
+        with self._lock:
+            now = self._clock()
+            wait = max(0.0, self.blocked_until - now)
+            if "requests" in self.buckets:
+                wait = max(wait, self.buckets["requests"].reserve(1, now))
+            if "tokens" in self.buckets:
+                wait = max(wait, self.buckets["tokens"].reserve(tokens, now))
+            return wait
+
+    def refund(self, tokens: int) -> None:
+        """Give back the tokens reserved for an attempt that failed."""
+        if "tokens" in self.buckets:
+            with self._lock:
+                bucket = self.buckets["tokens"]
+                bucket.adjust(min(tokens, bucket.capacity), self._clock())
+
+    def settle(self, reserved: int, metadata: dict[str, Any]) -> None:
+        """Correct the token budget by what a request actually used."""
+        used = sum(
+            tokens
+            for tokens in (metadata.get("input_tokens"), metadata.get("output_tokens"))
+            if isinstance(tokens, int) and tokens > 0
+        )
+        if used and "tokens" in self.buckets:
+            with self._lock:
+                self.buckets["tokens"].adjust(reserved - used, self._clock())
+
+    def update_from_headers(self, headers: Mapping[str, str] | None) -> None:
+        """Follow the budgets the provider reports in its rate limit headers."""
+        if not headers:
+            return
+        with self._lock:
+            now = self._clock()
+            for budget, candidates in _BUDGET_HEADERS.items():
+                for limit_header, remaining_header, reset_header in candidates:
+                    try:
+                        limit = float(headers[limit_header])
+                        remaining = float(headers[remaining_header])
+                    except (KeyError, TypeError, ValueError):
+                        continue
+                    if limit <= 0:
+                        continue
+                    bucket = self.buckets.get(budget)
+                    if bucket is None:
+                        bucket = self.buckets[budget] = TokenBucket(limit, now)
+                    bucket.observe(limit, remaining, now)
+                    reset = parse_wait(headers.get(reset_header))
+                    if remaining <= 0 and reset:
+                        self.blocked_until = max(self.blocked_until, now + reset)
+                    break
+
+    def backoff(self, error: Exception, retry_delay: float) -> float:
+        """Decide how long to wait before retrying a failed request.
+
+        A rate limit rejection pauses every request of the limiter until the
+        provider's `retry-after`, other errors only delay the failed request.
+        """
+        headers = _error_headers(error)
+        self.update_from_headers(headers)
+        delay = retry_after_seconds(headers)
+        if delay is None:
+            delay = _error_retry_delay(error)
+        if delay is None:
+            # Jitter keeps sessions that failed together from retrying together
+            delay = retry_delay * random.uniform(0.8, 1.2)
+        if is_rate_limit_error(error):
+            with self._lock:
+                self.blocked_until = max(self.blocked_until, self._clock() + delay)
+        return delay
+
+    def _should_retry(
+        self,
+        error: Exception,
+        attempt: int,
+        max_retries: int,
+        throttled: float,
+        delay: float,
+    ) -> tuple[bool, int]:
+        """Return whether to retry, and the attempt count after this error."""
+        if is_rate_limit_error(error) and throttled + delay <= self.max_queue_seconds:
+            # Queue on the limiter rather than spending a retry
+            logger.info(f"{self.name} request rate limited, retrying in {delay:.1f}s")
+            return True, attempt
+        attempt += 1
+        if attempt >= max_retries:
+            logger.warning(
+                f"Failed {self.name} request after {attempt} attempts: {error}"
+            )
+            return False, attempt
+        logger.warning(
+            f"Retrying {self.name} request in {delay:.1f}s: {attempt}/{max_retries}: {error}"
+        )
+        return True, attempt
+
+    def _notify(self, seconds: float, reason: str) -> None:
+        LLM_THROTTLE_SECONDS.inc(seconds, provider=self.name, reason=reason)
+        listener = current_throttle_listener.get()
+        if listener is not None and seconds >= THROTTLE_NOTIFY_SECONDS:
+            listener(seconds, reason)
+
+    async def _asleep(self, seconds: float, reason: str) -> None:
+        if seconds > 0:
+            self._notify(seconds, reason)
+            await asyncio.sleep(seconds)
+
+    def _sleep(self, seconds: float, reason: str) -> None:
+        if seconds > 0:
+            self._notify(seconds, reason)
+            time.sleep(seconds)
+
+    async def acall(
+        self,
+        request: Callable[[], Awaitable[T]],
+        tokens: int,
+        retryable: Callable[[Exception], bool],
+        max_retries: int,
+        retry_delay: float = 15.0,
+        can_retry: Callable[[], bool] = lambda: True,
+    ) -> T:
+        """Make a request within the budgets, retrying failures.
+
+        Args:
+            request: Makes one attempt
+            tokens: Estimated input tokens of the request
+            retryable: Whether an error is worth retrying
+            max_retries: Attempts allowed, not counting rate limit rejections
+                that were queued
+            retry_delay: Seconds to wait after an error that does not say
+            can_retry: Whether the request can still be retried, false once
+                a streamed response was partly delivered
+
+        Returns:
+            What the successful attempt returned
+        """
+        attempt = 0
+        throttled = 0.0
+        while True:
+            wait = self.reserve(tokens)
+            throttled += wait
+            await self._asleep(wait, "rate_limit")
+            try:
+                return await request()
+            except Exception as e:
+                # The next attempt reserves again
+                self.refund(tokens)
+                if not retryable(e) or not can_retry():
+                    raise
+                delay = self.backoff(e, retry_delay)
+                retry, attempt = self._should_retry(
+                    e, attempt, max_retries, throttled, delay
+                )
+                if not retry:
+                    raise
+                # A rate limited request waits when it reserves again, so it
+                # stays queued behind the requests that reserved before it
+                if not is_rate_limit_error(e):
+                    await self._asleep(delay, "retry")
+
+    def call(
+        self,
+        request: Callable[[], T],
+        tokens: int,
+        retryable: Callable[[Exception], bool],
+        max_retries: int,
+        retry_delay: float = 15.0,
+    ) -> T:
+        """Blocking version of `acall`, for the synchronous client methods."""
+        attempt = 0
+        throttled = 0.0
+        while True:
+            wait = self.reserve(tokens)
+            throttled += wait
+            self._sleep(wait, "rate_limit")
+            try:
+                return request()
+            except Exception as e:
+                # The next attempt reserves again
+                self.refund(tokens)
+                if not retryable(e):
+                    raise
+                delay = self.backoff(e, retry_delay)
+                retry, attempt = self._should_retry(
+                    e, attempt, max_retries, throttled, delay
+                )
+                if not retry:
+                    raise
+                if not is_rate_limit_error(e):
+                    self._sleep(delay, "retry")
+
+
+class RateLimiterRegistry:
+    """Rate limiters of a process, one per provider, model and API key."""
+
+    def __init__(self):
+        self._limiters: dict[tuple[Hashable, ...], RateLimiter] = {}
+        self._limits: dict[str, RateLimits] = {}
+        self._lock = threading.Lock()
+
+    def set_limits(self, provider: str, limits: RateLimits) -> None:
+        """Set the budgets of the provider's limiters created from now on."""
+        with self._lock:
+            self._limits[provider] = limits
+
+    def get(
+        self, provider: str, model_name: str, credential: Hashable = None
+    ) -> RateLimiter:
+        """Return the limiter of a model, creating it on first use.
+
+        Args:
+            provider: The provider
+            model_name: The model, as providers budget each model separately
+            credential: What tells apart accounts, like the API key or the
+                Vertex project; only a hash of it is kept
+        """
+        account = hashlib.sha256(str(credential).encode()).hexdigest()[:16]
+        key = (provider, model_name, account)
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                limiter = RateLimiter(
+                    provider, self._limits.get(provider, RateLimits())
+                )
+                self._limiters[key] = limiter
+            return limiter
+
+
+RATE_LIMITERS = RateLimiterRegistry()
+
+ThrottleListener = Callable[[float, str], None]
+
+current_throttle_listener: contextvars.ContextVar[Optional[ThrottleListener]] = (
+    contextvars.ContextVar("current_throttle_listener", default=None)
+)
+
+
+@contextmanager
+def use_throttle_listener(listener: Optional[ThrottleListener]) -> Iterator[None]:
+    """Tell `listener` the seconds and reason of each wait on a rate limiter in the block."""
+    token = current_throttle_listener.set(listener)
+    try:
+        yield
+    finally:
+        current_throttle_listener.reset(token)
@@ -0,0 +1,241 @@
+"""LLM client that plays back scripted responses, for load and capacity tests.
+
+No model is called. Each response is taken from a script by the number of
+assistant turns in the conversation, so concurrent sessions each walk the
+script independently, and is delayed by a latency drawn from a configurable
+distribution.
+"""
+
+import asyncio
+import json
+import math
+import random
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Tuple
+
+from ii_agent.llm.base import (
+    LLMClient,
+    AssistantContentBlock,
+    LLMMessages,
+    StreamDelta,
+    TextResult,
+    ToolCall,
+    ToolParam,
+    block_to_deltas,
+    observe_llm_request,
+)
+
+# One query's worth of turns, touching the workspace, the shell and the web.
+# {web_url} is filled in from the client variables.
+DEFAULT_SCRIPT: list[list[dict[str, Any]]] = [
+    [
+        {"text": "Let me look at the workspace first."},
+        {"tool_name": "bash", "tool_input": {"command": "echo replay && ls -la"}},
+    ],
+    [
+        {
+            "tool_name": "str_replace_editor",
+            "tool_input": {
+                "command": "create",
+                "path": "replay_notes.md",
+                "file_text": "# Notes\n\nWritten by the replay client.\n",
+            },
+        },
+    ],
+    [
+        {
+            "tool_name": "str_replace_editor",
+            "tool_input": {
+                "command": "str_replace",
+                "path": "replay_notes.md",
+                "old_str": "Written by",
+                "new_str": "Edited by",
+            },
+        },
+    ],
+    [
+        {"text": "Checking the reference page."},
+        {"tool_name": "visit_webpage", "tool_input": {"url": "{web_url}"}},
+    ],
+    [{"text": "All done, the notes are in replay_notes.md."}],
+]
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """Parse a latency distribution into a sampler returning seconds.
+
+    Args:
+        spec: "fixed:SECONDS", "uniform:LOW,HIGH" or "lognormal:MEAN,SIGMA"
+
+    Returns:
+        A function drawing one latency from the given random generator
+    """
+    kind, _, params = spec.partition(":")
+    try:
+        values = [float(value) for value in params.split(",")] if params else []
+    except ValueError:
+        raise ValueError(f"Invalid latency parameters: {spec}")
+
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        low, high = values
+        return lambda rng: rng.uniform(low, high)
+    if kind == "lognormal" and len(values) == 2:
+        mean, sigma = values
+        # Pick mu so that the distribution has the requested mean
+        mu = math.log(mean) - sigma**2 / 2
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def load_script(path: Path | str) -> list[list[dict[str, Any]]]:
+    """Load a script: a JSON list of responses, each a list of blocks.
+
+    Blocks are `{"text": ...}` or `{"tool_name": ..., "tool_input": ...}`, the
+    shape `TextResult.to_dict()` and `ToolCall.to_dict()` produce, so recorded
+    responses can be replayed as they are.
+    """
+    with open(path) as f:
+        script = json.load(f)
+    if not isinstance(script, list) or not all(isinstance(r, list) for r in script):
+        raise ValueError(f"Replay script {path} must be a list of responses")
+    return script
+
+
+def _fill(value: Any, variables: dict[str, str]) -> Any:
+    if isinstance(value, str):
+        for name, replacement in variables.items():
+            value = value.replace("{" + name + "}", replacement)
+        return value
+    if isinstance(value, dict):
+        return {k: _fill(v, variables) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_fill(v, variables) for v in value]
+    return value
+
+
+class ReplayClient(LLMClient):
+    """Serve scripted or recorded responses with simulated latency."""
+
+    provider = "replay"
+
+    def __init__(
+        self,
+        model_name: str = "replay",
+        script_path: str | None = None,
+        latency: str = "lognormal:1.5,0.5",
+        variables: dict[str, str] | None = None,
+        seed: int | None = None,
+    ):
+        """Initialize the replay client.
+
+        Args:
+            model_name: Name reported in metrics
+            script_path: JSON script to play, the built-in script if None
+            latency: Distribution of the response latency, see `parse_latency`
+            variables: Values for `{name}` placeholders in the script
+            seed: Seed for the latency draws
+        """
+        self.model_name = model_name
+        self.script = load_script(script_path) if script_path else DEFAULT_SCRIPT
+        self.sample_latency = parse_latency(latency)
+        self.variables = variables or {}
+        self._rng = random.Random(seed)
+
+    def _respond(
+        self, messages: LLMMessages
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        # Messages alternate between user and assistant turns
+        step = (len(messages) // 2) % len(self.script)
+        blocks = []
+        for block in _fill(self.script[step], self.variables):
+            if "tool_name" in block:
+                blocks.append(
+                    ToolCall(
+                        tool_call_id=block.get("tool_call_id")
+                        or f"replay_{uuid.uuid4().hex[:12]}",
+                        tool_name=block["tool_name"],
+                        tool_input=block.get("tool_input", {}),
+                    )
+                )
+            else:
+                blocks.append(TextResult(text=block["text"]))
+
+        # Rough counts, enough to exercise token accounting
+        input_chars = sum(len(str(block)) for turn in messages for block in turn)
+        output_chars = sum(len(str(block)) for block in blocks)
+        metadata = {
+            "raw_response": None,
+            "input_tokens": input_chars // 4,
+            "output_tokens": output_chars // 4,
+        }
+        return blocks, metadata
+
+    @observe_llm_request
+    def generate(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Return the scripted response after the simulated latency."""
+        time.sleep(self.sample_latency(self._rng))
+        return self._respond(messages)
+
+    @observe_llm_request
+    async def agenerate(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Return the scripted response after the simulated latency."""
+        await asyncio.sleep(self.sample_latency(self._rng))
+        return self._respond(messages)
+
+    @observe_llm_request
+    async def astream(
+        self,
+        messages: LLMMessages,
+        max_tokens: int,
+        system_prompt: str | None = None,
+        temperature: float = 0.0,
+        tools: list[ToolParam] = [],
+        tool_choice: dict[str, str] | None = None,
+        thinking_tokens: int | None = None,
+        on_delta: Callable[[StreamDelta], None] | None = None,
+    ) -> Tuple[list[AssistantContentBlock], dict[str, Any]]:
+        """Stream the scripted response a word at a time over the simulated latency."""
+        latency = self.sample_latency(self._rng)
+        blocks, metadata = self._respond(messages)
+
+        deltas = []
+        for index, block in enumerate(blocks):
+            if isinstance(block, TextResult):
+                deltas.extend(
+                    StreamDelta(index=index, kind="text", text=word)
+                    for word in re.findall(r"\S+\s*|\s+", block.text)
+                )
+            else:
+                deltas.extend(block_to_deltas(index, block))
+
+        # A third of the latency passes before the first delta
+        await asyncio.sleep(latency / 3)
+        interval = latency * 2 / 3 / max(len(deltas), 1)
+        for delta in deltas:
+            if on_delta is not None:
+                on_delta(delta)
+            await asyncio.sleep(interval)
+        return blocks, metadata
@@ -0,0 +1,209 @@
+"""Calibration of token estimates against the usage providers report.
+
+Token counts of a history are estimates, and a context manager has to leave
+a safety margin below the model's limit for their error. Every response
+reports the exact number of input tokens, so the calibrator compares it with
+the estimate of the request and learns, per model, a correction factor for
+each type of content: text, tool calls, tool results, images, thinking and
+the system prompt with the tool definitions.
+
+One response only gives the total, so the factors are fitted with normalized
+least mean squares: each observation moves every factor in proportion to how
+much of the estimate its content type made up. Over requests with different
+mixes of content the factors converge to the per-type ratios. They are saved
+to a JSON file in the background, at most every `save_interval` seconds, so
+new sessions start calibrated.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+# Writes the factors off the event loop, one save at a time
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="token-calibration")
+
+CONTENT_TYPES = ("text", "tool_call", "tool_result", "image", "thinking", "system")
+
+
+def reported_input_tokens(metadata: dict[str, Any]) -> int:
+    """Total input tokens of a response, including those served by the prompt cache."""
+    total = 0
+    for key in (
+        "input_tokens",
+        "cache_read_input_tokens",
+        "cache_creation_input_tokens",
+    ):
+        tokens = metadata.get(key)
+        # Clients report -1 or None for counts they do not have
+        if isinstance(tokens, int) and tokens > 0:
+            total += tokens
+    return total
+
+
+class TokenCalibrator:
+    """Correction factors of token estimates, per model and content type."""
+
+    def __init__(
+        self,
+        path: Optional[Path | str] = None,
+        learning_rate: float = 0.2,
+        min_factor: float = 0.25,
+        max_factor: float = 4.0,
+        save_interval: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Initialize the calibrator.
+
+        Args:
+            path: JSON file the factors are loaded from and saved to, if any
+            learning_rate: Share of an observation's error corrected at once
+            min_factor: Lowest factor, guarding against outliers
+            max_factor: Highest factor
+            save_interval: Fewest seconds between two saves
+            clock: Monotonic time source
+        """
+        self.learning_rate = learning_rate
+        self.min_factor = min_factor
+        self.max_factor = max_factor
+        self.save_interval = save_interval
+        self._clock = clock
+        self._factors: dict[str, dict[str, float]] = {}
+        self._samples: dict[str, int] = {}
+        self._lock = threading.Lock()
+        # Whether there are observations since the last save
+        self._dirty = False
+        self._last_save: Optional[float] = None
+        self._pending_save: Optional[Future] = None
+        self.path: Optional[Path] = None
+        if path is not None:
+            self.load(path)
+
+    def load(self, path: Path | str) -> None:
+        """Load the factors saved at a path, and save there from now on."""
+        self.path = Path(path)
+        if not self.path.exists():
+            return
+        try:
+            saved = json.loads(self.path.read_text())
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable token calibration {self.path}: {e}")
+            return
+        with self._lock:
+            for model, entry in saved.items():
+                self._factors[model] = {
+                    content_type: float(factor)
+                    for content_type, factor in entry.get("factors", {}).items()
+                }
+                self._samples[model] = int(entry.get("samples", 0))
+
+    def save(self) -> None:
+        """Save the factors, if anything was learned since the last save."""
+        if self.path is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            saved = {
+                model: {
+                    "factors": dict(factors),
+                    "samples": self._samples.get(model, 0),
+                }
+                for model, factors in self._factors.items()
+            }
+            self._dirty = False
+        # Write a temporary file first, so readers never see a partial file
+        temporary = self.path.with_name(f"{self.path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            temporary.write_text(json.dumps(saved, indent=2, sort_keys=True))
+            os.replace(temporary, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save token calibration to {self.path}: {e}")
+            with self._lock:
+                self._dirty = True
+
+    def flush(self) -> None:
+        """Save what was learned, waiting for a save in progress first."""
+        pending = self._pending_save
+        if pending is not None:
+            pending.result()
+        self.save()
+
+    def _schedule_save(self) -> None:
+        """Save in the background, at most every `save_interval` seconds."""
+        now = self._clock()
+        with self._lock:
+            if self.path is None:
+                return
+            if self._pending_save is not None and not self._pending_save.done():
+                return
+            if (
+                self._last_save is not None
+                and now - self._last_save < self.save_interval
+            ):
+                return
+            self._last_save = now
+            self._pending_save = _executor.submit(self.save)
+
+    def factors(self, model: str) -> dict[str, float]:
+        """The correction factors of a model, 1.0 for content types without any."""
+        with self._lock:
+            factors = self._factors.get(model, {})
+            return {
+                content_type: factors.get(content_type, 1.0)
+                for content_type in CONTENT_TYPES
+            }
+
+    def samples(self, model: str) -> int:
+        """Number of responses the factors of a model were learned from."""
+        return self._samples.get(model, 0)
+
+    def calibrate(self, model: str, estimated: Mapping[str, int]) -> int:
+        """Correct an estimate, given as token counts per content type."""
+        with self._lock:
+            factors = self._factors.get(model, {})
+            return round(
+                sum(
+                    tokens * factors.get(content_type, 1.0)
+                    for content_type, tokens in estimated.items()
+                )
+            )
+
+    def observe(self, model: str, estimated: Mapping[str, int], reported: int) -> None:
+        """Learn from the input tokens reported for a request of the given estimate."""
+        estimated = {
+            content_type: tokens
+            for content_type, tokens in estimated.items()
+            if tokens > 0
+        }
+        if reported <= 0 or not estimated:
+            return
+        with self._lock:
+            factors = self._factors.setdefault(model, {})
+            predicted = sum(
+                tokens * factors.get(content_type, 1.0)
+                for content_type, tokens in estimated.items()
+            )
+            error = reported - predicted
+            norm = sum(tokens * tokens for tokens in estimated.values())
+            for content_type, tokens in estimated.items():
+                factor = (
+                    factors.get(content_type, 1.0)
+                    + self.learning_rate * error * tokens / norm
+                )
+                factors[content_type] = min(
+                    self.max_factor, max(self.min_factor, factor)
+                )
+            self._samples[model] = self._samples.get(model, 0) + 1
+            self._dirty = True
+        self._schedule_save()
+
+
+TOKEN_CALIBRATOR = TokenCalibrator()
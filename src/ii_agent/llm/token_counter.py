@@ -1,42 +1,98 @@
+import itertools
 import json
-import base64
-from typing import Any, Union
-from PIL import Image
-import io
+import logging
+from typing import TYPE_CHECKING, Any, Mapping, Optional, Union
+
+from ii_agent.llm.token_calibration import (
+    TOKEN_CALIBRATOR,
+    TokenCalibrator,
+    reported_input_tokens,
+)
+from ii_agent.llm.tokenizers import (
+    UNKNOWN_IMAGE_TOKENS,
+    HeuristicTokenizer,
+    Tokenizer,
+    get_tokenizer,
+    image_size_from_base64,
+)
+
+if TYPE_CHECKING:
+    from ii_agent.llm.base import LLMClient
+
+logger = logging.getLogger(__name__)
+
+_counter_ids = itertools.count()
 
 
 class TokenCounter:
+    def __init__(
+        self,
+        tokenizer: Optional[Tokenizer] = None,
+        model_name: Optional[str] = None,
+        calibrator: Optional[TokenCalibrator] = None,
+    ):
+        """Count tokens with a tokenizer, three characters per token by default.
+
+        With a calibrator and a model name, totals are corrected by what the
+        model's provider reported for earlier requests.
+        """
+        self.tokenizer = tokenizer or HeuristicTokenizer()
+        self.model_name = model_name
+        self.calibrator = calibrator
+        # Under which the counts of this counter are kept on history blocks
+        self.cache_key = f"tokens:{next(_counter_ids)}"
+
+    @classmethod
+    def for_model(
+        cls,
+        model_name: str,
+        backend: str = "bpe",
+        client: Optional["LLMClient"] = None,
+        calibrator: Optional[TokenCalibrator] = TOKEN_CALIBRATOR,
+    ) -> "TokenCounter":
+        """Create a token counter with the tokenizer backend of a model."""
+        return cls(get_tokenizer(model_name, backend, client), model_name, calibrator)
+
+    def calibrate(self, estimated: Mapping[str, int]) -> int:
+        """Total estimated token counts by content type, corrected if calibrated."""
+        if self.calibrator is None or self.model_name is None:
+            return sum(estimated.values())
+        return self.calibrator.calibrate(self.model_name, estimated)
+
+    def observe_usage(
+        self, estimated: Mapping[str, int], metadata: dict[str, Any]
+    ) -> None:
+        """Learn from the input tokens reported for a request with the given estimate."""
+        if self.calibrator is not None and self.model_name is not None:
+            self.calibrator.observe(
+                self.model_name, estimated, reported_input_tokens(metadata)
+            )
+
+    def count_image(self, source: dict[str, Any]) -> int:
+        """Count the tokens of an image from the dimensions in its header."""
+        size = None
+        if source.get("type", "base64") == "base64" and "data" in source:
+            size = image_size_from_base64(source["data"])
+        if size is None:
+            # Unknown formats and URLs get a conservative estimate
+            logger.warning("Could not read image dimensions for token counting")
+            return UNKNOWN_IMAGE_TOKENS
+        return self.tokenizer.count_image(*size)
+
     def count_tokens(self, prompt_chars: Union[str, list[dict[str, Any]]]) -> int:
         if isinstance(prompt_chars, str):
-            return len(prompt_chars) // 3
+            return self.tokenizer.count_text(prompt_chars)
         elif isinstance(prompt_chars, list):
             total_tokens = 0
             for item in prompt_chars:
                 if item.get("type") == "image" and "source" in item:
-                    # For images, calculate tokens based on image dimensions
-                    try:
-                        # Decode base64 image data
-                        image_data = base64.b64decode(item["source"]["data"])
-                        # Open image to get dimensions
-                        with Image.open(io.BytesIO(image_data)) as img:
-                            width, height = img.size
-                            # Calculate tokens using official formula: (width * height)/750
-                            image_tokens = int((width * height) / 750)
-                            total_tokens += image_tokens
-                    except Exception as e:
-                        # If we can't decode the image, use a conservative estimate
-                        print(
-                            f"Warning: Could not decode image for token counting: {e}"
-                        )
-                        total_tokens += (
-                            1500  # Conservative estimate for unknown image size
-                        )
+                    total_tokens += self.count_image(item["source"])
                 elif item.get("type") == "text":
-                    total_tokens += len(item["text"]) // 3
+                    total_tokens += self.tokenizer.count_text(item["text"])
                 else:
                     # For regular text/dict items, convert to JSON and count
                     json_str = json.dumps(item)
-                    total_tokens += len(json_str) // 3
+                    total_tokens += self.tokenizer.count_text(json_str)
             return total_tokens
         else:
             raise ValueError(
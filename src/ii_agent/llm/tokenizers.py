@@ -0,0 +1,380 @@
+"""Tokenizer backends for estimating the size of a history in model tokens.
+
+Token counts decide when a context manager truncates, so they should be close
+to what the provider bills. The backends, from cheapest to most exact:
+
+- `heuristic`: three characters per token, the original estimate
+- `bpe`: an offline approximation of the BPE tokenizer of the model's family,
+  splitting text the way BPE pre-tokenizers do and costing each piece
+- `tiktoken`: OpenAI's tokenizer, if the `tiktoken` package is installed and
+  can load its encoding
+- `api`: the provider's count tokens endpoint for long texts, the `bpe`
+  approximation for short texts and when the endpoint fails
+
+Images are costed from their dimensions with each provider's formula. The
+dimensions are read from the PNG, JPEG, GIF or WebP header, decoding only the
+first bytes of the base64 data rather than the whole image.
+"""
+
+import base64
+import binascii
+import hashlib
+import logging
+import math
+import re
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from ii_agent.llm.base import LLMClient
+
+logger = logging.getLogger(__name__)
+
+# Tokens of an image whose dimensions cannot be read
+UNKNOWN_IMAGE_TOKENS = 1500
+
+TOKENIZER_BACKENDS = ("heuristic", "bpe", "tiktoken", "api")
+
+
+def image_size(data: bytes) -> Optional[tuple[int, int]]:
+    """Read the width and height of a PNG, JPEG, GIF or WebP image from its header.
+
+    Returns None for other formats, and for JPEG data cut off before the
+    frame header.
+    """
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and data[12:16] == b"IHDR" and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+    if data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+        return struct.unpack("<HH", data[6:10])
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP" and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b"VP8X":
+            return (
+                1 + int.from_bytes(data[24:27], "little"),
+                1 + int.from_bytes(data[27:30], "little"),
+            )
+        if chunk == b"VP8L":
+            bits = int.from_bytes(data[21:25], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8 ":
+            width, height = struct.unpack("<HH", data[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        return None
+    if data[:2] == b"\xff\xd8":
+        return _jpeg_size(data)
+    return None
+
+
+def _jpeg_size(data: bytes) -> Optional[tuple[int, int]]:
+    """Walk the JPEG segments up to the start of frame, which holds the size."""
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without a length
+            i += 2
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[i + 5 : i + 9])
+            return width, height
+        (length,) = struct.unpack(">H", data[i + 2 : i + 4])
+        i += 2 + length
+    return None
+
+
+def image_size_from_base64(data: str) -> Optional[tuple[int, int]]:
+    """Read the dimensions of a base64 encoded image, decoding as little of it as needed.
+
+    The header of most formats is in the first bytes. JPEG metadata can come
+    before the frame header, so more is decoded, doubling each time, until
+    the header is found.
+    """
+    chars = 1024
+    while True:
+        prefix = data[:chars]
+        try:
+            decoded = base64.b64decode(prefix[: len(prefix) - len(prefix) % 4])
+        except (binascii.Error, ValueError):
+            return None
+        size = image_size(decoded)
+        if size is not None or chars >= len(data) or decoded[:2] != b"\xff\xd8":
+            return size
+        chars *= 2
+
+
+def model_family(model_name: str) -> Optional[str]:
+    """The provider family whose tokenizer a model uses, if known."""
+    name = model_name.lower()
+    if "claude" in name:
+        return "anthropic"
+    if "gemini" in name:
+        return "gemini"
+    if name.startswith(("gpt", "o1", "o3", "o4", "chatgpt")):
+        return "openai"
+    return None
+
+
+class Tokenizer(ABC):
+    """Estimates how many tokens a model spends on text and images."""
+
+    name: str = "unknown"
+
+    @abstractmethod
+    def count_text(self, text: str) -> int:
+        """Count the tokens of a text."""
+
+    def count_image(self, width: int, height: int) -> int:
+        """Count the tokens of an image of the given dimensions."""
+        return int((width * height) / 750)
+
+
+class HeuristicTokenizer(Tokenizer):
+    """Three characters per token, for models of unknown families."""
+
+    name = "heuristic"
+
+    def count_text(self, text: str) -> int:
+        return len(text) // 3
+
+
+@dataclass(frozen=True)
+class BPEProfile:
+    """How a family's BPE vocabulary splits the pieces of pre-tokenized text."""
+
+    family: str
+    # Words up to this many letters are usually a single token
+    short_word: int
+    # Letters per token of longer words
+    chars_per_token: float
+    # Digits merged into one token
+    digits_per_token: int
+    # Tokens per character of scripts without spaces, like Chinese or Japanese
+    cjk_tokens_per_char: float
+
+
+BPE_PROFILES = {
+    "openai": BPEProfile("openai", 10, 4.0, 3, 0.8),
+    "anthropic": BPEProfile("anthropic", 8, 3.5, 3, 1.0),
+    "gemini": BPEProfile("gemini", 10, 4.0, 1, 0.8),
+}
+
+# The pre-tokenizer split of GPT style tokenizers, simplified: contractions,
+# words with their leading space, numbers, punctuation runs and whitespace
+_PIECE = re.compile(r"'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d+| ?[^\s\w]+|\s+(?!\S)|\s+")
+_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+
+
+def _text_key(text: str) -> bytes:
+    """A short key for a text, so that caches of counts do not keep the text."""
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+class _CountCache:
+    """Token counts of the most recently counted texts, keyed by their hash."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._counts: OrderedDict[tuple[bytes, str], int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple[bytes, str]) -> int | None:
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+            return count
+
+    def put(self, key: tuple[bytes, str], count: int) -> None:
+        with self._lock:
+            self._counts[key] = count
+            if len(self._counts) > self.size:
+                self._counts.popitem(last=False)
+
+
+_bpe_counts = _CountCache(4096)
+
+
+def _bpe_count(text: str, profile: BPEProfile) -> int:
+    key = (_text_key(text), profile.family)
+    count = _bpe_counts.get(key)
+    if count is None:
+        count = _count_pieces(text, profile)
+        _bpe_counts.put(key, count)
+    return count
+
+
+def _count_pieces(text: str, profile: BPEProfile) -> int:
+    tokens = 0
+    for match in _PIECE.finditer(text):
+        piece = match.group()
+        if piece.isspace():
+            # Runs of indentation and newlines merge into few tokens
+            tokens += math.ceil(len(piece) / 8)
+            continue
+        word = piece.lstrip(" ")
+        first = word[0]
+        if first.isdigit():
+            tokens += math.ceil(len(word) / profile.digits_per_token)
+        elif first.isalpha():
+            if word.isascii():
+                tokens += (
+                    1
+                    if len(word) <= profile.short_word
+                    else math.ceil(len(word) / profile.chars_per_token)
+                )
+            else:
+                cjk = len(_CJK.findall(word))
+                tokens += math.ceil(
+                    cjk * profile.cjk_tokens_per_char + (len(word) - cjk) / 2
+                )
+        else:
+            tokens += math.ceil(len(word) / 2)
+    return tokens
+
+
+class BPEApproximationTokenizer(Tokenizer):
+    """Offline approximation of the BPE tokenizer of a provider family."""
+
+    name = "bpe"
+
+    def __init__(self, family: str):
+        self.profile = BPE_PROFILES[family]
+
+    def count_text(self, text: str) -> int:
+        return _bpe_count(text, self.profile)
+
+    def count_image(self, width: int, height: int) -> int:
+        family = self.profile.family
+        if family == "anthropic":
+            # Images are scaled down to 1568 pixels on the long edge and
+            # about 1.15 megapixels
+            scale = min(
+                1.0, 1568 / max(width, height), math.sqrt(1_150_000 / (width * height))
+            )
+            return math.ceil(width * scale * height * scale / 750)
+        if family == "openai":
+            # High detail: fit in 2048 x 2048, then 768 on the short edge,
+            # 170 tokens per 512 pixel tile plus 85
+            scale = min(1.0, 2048 / max(width, height))
+            scale = min(scale, 768 / min(width, height))
+            tiles = math.ceil(width * scale / 512) * math.ceil(height * scale / 512)
+            return 85 + 170 * tiles
+        if family == "gemini":
+            # Small images are one tile, larger ones are cut into 768 pixel tiles
+            if width <= 384 and height <= 384:
+                return 258
+            return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+        return super().count_image(width, height)
+
+
+class TiktokenTokenizer(BPEApproximationTokenizer):
+    """OpenAI's own tokenizer, for OpenAI models."""
+
+    name = "tiktoken"
+
+    def __init__(self, model_name: str):
+        # Raises ImportError without the optional package, and fails if the
+        # encoding is neither cached nor downloadable
+        import tiktoken
+
+        super().__init__("openai")
+        try:
+            self.encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("o200k_base")
+
+    def count_text(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+class ProviderTokenizer(Tokenizer):
+    """Count long texts with the provider's count tokens endpoint.
+
+    Counting blocks on a request to the provider, so texts shorter than
+    `min_chars` and images are estimated by the fallback, and callers on an
+    event loop count in a thread. Counts are kept per text, and after a failed
+    request the fallback is used for `retry_after` seconds.
+    """
+
+    name = "api"
+
+    def __init__(
+        self,
+        client: "LLMClient",
+        fallback: Tokenizer,
+        min_chars: int = 2000,
+        cache_size: int = 1024,
+        retry_after: float = 300.0,
+    ):
+        self.client = client
+        self.fallback = fallback
+        self.min_chars = min_chars
+        self.cache_size = cache_size
+        self.retry_after = retry_after
+        self._counts = _CountCache(cache_size)
+        self._disabled_until = 0.0
+
+    def count_text(self, text: str) -> int:
+        if len(text) < self.min_chars or time.monotonic() < self._disabled_until:
+            return self.fallback.count_text(text)
+        key = (_text_key(text), self.name)
+        count = self._counts.get(key)
+        if count is not None:
+            return count
+        try:
+            count = self.client.count_tokens(text)
+        except Exception as e:
+            logger.warning(
+                f"Counting tokens with the provider failed, estimating instead: {e}"
+            )
+            count = None
+        if count is None:
+            self._disabled_until = time.monotonic() + self.retry_after
+            return self.fallback.count_text(text)
+        self._counts.put(key, count)
+        return count
+
+    def count_image(self, width: int, height: int) -> int:
+        return self.fallback.count_image(width, height)
+
+
+def get_tokenizer(
+    model_name: str, backend: str = "bpe", client: Optional["LLMClient"] = None
+) -> Tokenizer:
+    """Create the tokenizer of a model.
+
+    Args:
+        model_name: The model whose tokens are counted
+        backend: One of `TOKENIZER_BACKENDS`
+        client: The model's client, needed by the `api` backend
+
+    Backends that do not apply to the model fall back to the `bpe`
+    approximation, and models of unknown families use the heuristic.
+    """
+    if backend not in TOKENIZER_BACKENDS:
+        raise ValueError(f"Unknown tokenizer backend: {backend}")
+    family = model_family(model_name)
+    if backend == "heuristic" or family is None:
+        return HeuristicTokenizer()
+    approximation = BPEApproximationTokenizer(family)
+    if backend == "tiktoken" and family == "openai":
+        try:
+            return TiktokenTokenizer(model_name)
+        except Exception as e:
+            logger.warning(
+                f"Using the approximate tokenizer, tiktoken is unavailable: {e}"
+            )
+    if backend == "api" and client is not None:
+        return ProviderTokenizer(client, approximation)
+    return approximation
@@ -23,6 +23,7 @@ class PdfTextExtractTool(LLMTool):
         },
         "required": ["file_path"],
     }
+    read_only = True
 
     def __init__(
         self, workspace_manager: WorkspaceManager, max_output_length: int = 15000
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+import asyncio
 from dataclasses import dataclass, field
 from typing import Any, Optional
 
@@ -39,6 +40,8 @@ class LLMTool(ABC):
     name: str
     description: str
     input_schema: ToolInputSchema
+    # Tools that change no state can run alongside other calls of the same turn
+    read_only: bool = False
 
     @property
     def should_stop(self) -> bool:
@@ -74,6 +77,28 @@ class LLMTool(ABC):
 
         return tool_output
 
+    @final
+    async def arun(
+        self,
+        tool_input: dict[str, Any],
+        message_history: Optional[MessageHistory] = None,
+    ) -> str | list[dict[str, Any]]:
+        """Run the tool from an event loop.
+
+        Same contract as run(), but dispatches to arun_impl() so that tools
+        never block the loop while they wait on I/O.
+        """
+        try:
+            self._validate_tool_input(tool_input)
+            result = await self.arun_impl(tool_input, message_history)
+            tool_output = result.tool_output
+        except jsonschema.ValidationError as exc:
+            tool_output = "Invalid tool input: " + exc.message
+        except BadRequestError as exc:
+            raise RuntimeError("Bad request: " + exc.message)
+
+        return tool_output
+
     def get_tool_start_message(self, tool_input: ToolInputSchema) -> str:
         """Return a user-friendly message to be shown to the model when the tool is called."""
         return f"Calling tool '{self.name}'"
@@ -91,6 +116,18 @@ class LLMTool(ABC):
         """
         raise NotImplementedError()
 
+    async def arun_impl(
+        self,
+        tool_input: dict[str, Any],
+        message_history: Optional[MessageHistory] = None,
+    ) -> ToolImplOutput:
+        """Async counterpart of run_impl().
+
+        Tools that are natively async should override this. The default runs
+        the synchronous run_impl() in a worker thread.
+        """
+        return await asyncio.to_thread(self.run_impl, tool_input, message_history)
+
     def get_tool_param(self) -> ToolParam:
         return ToolParam(
             name=self.name,
@@ -38,3 +38,10 @@ class BrowserTool(LLMTool):
     ) -> ToolImplOutput:
         loop = get_event_loop()
         return loop.run_until_complete(self._run(tool_input, message_history))
+
+    async def arun_impl(
+        self,
+        tool_input: dict[str, Any],
+        message_history: Optional[MessageHistory] = None,
+    ) -> ToolImplOutput:
+        return await self._run(tool_input, message_history)
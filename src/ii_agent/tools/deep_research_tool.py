@@ -55,14 +55,21 @@ class DeepResearchTool(LLMTool):
         self,
         tool_input: dict[str, Any],
         message_history: Optional[MessageHistory] = None,
+    ) -> ToolImplOutput:
+        return get_event_loop().run_until_complete(
+            self.arun_impl(tool_input, message_history)
+        )
+
+    async def arun_impl(
+        self,
+        tool_input: dict[str, Any],
+        message_history: Optional[MessageHistory] = None,
     ) -> ToolImplOutput:
         print(f"Performing deep research on {tool_input['query']}")
         agent = ReasoningAgent(
             question=tool_input["query"], report_type=ReportType.BASIC
         )
-        result = get_event_loop().run_until_complete(
-            agent.run(on_token=on_token, is_stream=True)
-        )
+        result = await agent.run(on_token=on_token, is_stream=True)
 
         assert result, "Model returned empty answer"
         self.answer = result
@@ -26,6 +26,7 @@ class ListHtmlLinksTool(LLMTool):
         },
         "required": ["path"],
     }
+    read_only = True
 
     def __init__(self, workspace_manager: WorkspaceManager):
         super().__init__()
@@ -283,50 +283,49 @@ action = init
                     auxiliary_data={"success": True},
                 )
 
-            if len(pending_tool_calls) > 1:
-                raise ValueError("Only one tool call per turn is supported")
-
-            assert len(pending_tool_calls) == 1
-            tool_call = pending_tool_calls[0]
-            self.message_queue.put_nowait(
-                RealtimeEvent(
-                    type=EventType.TOOL_CALL,
-                    content={
-                        "tool_call_id": tool_call.tool_call_id,
-                        "tool_name": tool_call.tool_name,
-                        "tool_input": tool_call.tool_input,
-                    },
+            # The presentation tools all change files, so calls run one at a time
+            tool_results = []
+            for tool_call in pending_tool_calls:
+                self.message_queue.put_nowait(
+                    RealtimeEvent(
+                        type=EventType.TOOL_CALL,
+                        content={
+                            "tool_call_id": tool_call.tool_call_id,
+                            "tool_name": tool_call.tool_name,
+                            "tool_input": tool_call.tool_input,
+                        },
+                    )
                 )
-            )
 
-            try:
-                tool = next(t for t in self.tools if t.name == tool_call.tool_name)
-            except StopIteration as exc:
-                raise ValueError(
-                    f"Tool with name {tool_call.tool_name} not found"
-                ) from exc
-
-            # Execute the tool
-            result = tool.run(tool_call.tool_input, deepcopy(self.history))
-
-            # Handle both string results and tuples
-            if isinstance(result, tuple):
-                tool_result, _ = result
-            else:
-                tool_result = result
-
-            self.history.add_tool_call_result(tool_call, tool_result)
-
-            self.message_queue.put_nowait(
-                RealtimeEvent(
-                    type=EventType.TOOL_RESULT,
-                    content={
-                        "tool_call_id": tool_call.tool_call_id,
-                        "tool_name": tool_call.tool_name,
-                        "result": tool_result,
-                    },
+                try:
+                    tool = next(t for t in self.tools if t.name == tool_call.tool_name)
+                except StopIteration as exc:
+                    raise ValueError(
+                        f"Tool with name {tool_call.tool_name} not found"
+                    ) from exc
+
+                # Execute the tool
+                result = tool.run(tool_call.tool_input, deepcopy(self.history))
+
+                # Handle both string results and tuples
+                if isinstance(result, tuple):
+                    tool_result, _ = result
+                else:
+                    tool_result = result
+                tool_results.append(tool_result)
+
+                self.message_queue.put_nowait(
+                    RealtimeEvent(
+                        type=EventType.TOOL_RESULT,
+                        content={
+                            "tool_call_id": tool_call.tool_call_id,
+                            "tool_name": tool_call.tool_name,
+                            "result": tool_result,
+                        },
+                    )
                 )
-            )
+
+            self.history.add_tool_call_results(pending_tool_calls, tool_results)
 
         # If we exit the loop without returning, we've hit max turns
         return ToolImplOutput(
@@ -0,0 +1,72 @@
+from typing import Any, Optional
+
+from ii_agent.llm.message_history import MessageHistory
+from ii_agent.tools.base import LLMTool, ToolImplOutput
+from ii_agent.tools.tool_output_store import ToolOutputStore
+
+
+class ReadToolOutputTool(LLMTool):
+    name = "read_tool_output"
+    description = (
+        "Reads part of a tool output that was too long to show in full. "
+        "Such outputs are shortened to their start and end, with a note giving "
+        "the handle of the full output. Pass that handle and the character "
+        "offset to start reading from."
+    )
+    input_schema = {
+        "type": "object",
+        "properties": {
+            "handle": {
+                "type": "string",
+                "description": "The handle of the saved tool output.",
+            },
+            "offset": {
+                "type": "integer",
+                "description": "The character offset to start reading from. Defaults to 0.",
+            },
+            "length": {
+                "type": "integer",
+                "description": "The number of characters to read. Defaults to 10000.",
+            },
+        },
+        "required": ["handle"],
+    }
+    read_only = True
+
+    def __init__(self, output_store: ToolOutputStore, default_length: int = 10_000):
+        super().__init__()
+        self.output_store = output_store
+        self.default_length = default_length
+
+    def run_impl(
+        self,
+        tool_input: dict[str, Any],
+        message_history: Optional[MessageHistory] = None,
+    ) -> ToolImplOutput:
+        handle = tool_input["handle"]
+        offset = max(0, tool_input.get("offset", 0))
+        # Never read more than the history keeps of an output
+        length = min(
+            max(1, tool_input.get("length", self.default_length)),
+            self.output_store.max_chars,
+        )
+        try:
+            text, total = self.output_store.read(handle, offset, length)
+        except (ValueError, FileNotFoundError):
+            return ToolImplOutput(
+                f"Error: No tool output is saved under the handle {handle}",
+                f"Tool output {handle} not found",
+                {"success": False},
+            )
+
+        end = offset + len(text)
+        output = (
+            f"Characters {offset}-{end} of {total} of tool output {handle}:\n{text}"
+        )
+        if end < total:
+            output += f"\n[... {total - end} more characters. Continue with offset {end}. ...]"
+        return ToolImplOutput(
+            output,
+            f"Read characters {offset}-{end} of tool output {handle}",
+            {"success": True},
+        )
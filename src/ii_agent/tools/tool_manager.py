@@ -1,8 +1,11 @@
 import os
 import asyncio
 import logging
+import time
 from copy import deepcopy
 from typing import Optional, List, Dict, Any
+from ii_agent.core.metrics import TOOL_RUN_SECONDS, TOOL_RUNS
+from ii_agent.core.tracing import span
 from ii_agent.llm.base import LLMClient
 from ii_agent.llm.context_manager.llm_summarizing import LLMSummarizingContextManager
 from ii_agent.llm.token_counter import TokenCounter
@@ -19,7 +22,9 @@ from ii_agent.tools.static_deploy_tool import StaticDeployTool
 from ii_agent.tools.sequential_thinking_tool import SequentialThinkingTool
 from ii_agent.tools.message_tool import MessageTool
 from ii_agent.tools.complete_tool import CompleteTool, ReturnControlToUserTool
-from ii_agent.tools.bash_tool import create_bash_tool, create_docker_bash_tool
+from ii_agent.tools.bash_tool import BashTool, create_bash_tool, create_docker_bash_tool
+from ii_agent.tools.read_tool_output_tool import ReadToolOutputTool
+from ii_agent.tools.tool_output_store import ToolOutputStore
 from ii_agent.browser.browser import Browser
 from ii_agent.utils import WorkspaceManager
 from ii_agent.llm.message_history import MessageHistory
@@ -49,6 +54,16 @@ from ii_agent.tools.advanced_tools.pdf_tool import PdfTextExtractTool
 from ii_agent.tools.deep_research_tool import DeepResearchTool
 from ii_agent.tools.list_html_links_tool import ListHtmlLinksTool
 
+# Tools that need input truncation (ToolCall)
+TOOLS_NEED_INPUT_TRUNCATION = {
+    SequentialThinkingTool.name: ["thought"],
+    StrReplaceEditorTool.name: ["file_text", "old_str", "new_str"],
+    BashTool.name: ["command"],
+}
+
+# Tools that need output truncation with file save (ToolFormattedResult)
+TOOLS_NEED_OUTPUT_FILE_SAVE = {VisitWebpageTool.name}
+
 
 def get_system_tools(
     client: LLMClient,
@@ -76,7 +91,7 @@ def get_system_tools(
     logger = logging.getLogger("presentation_context_manager")
     context_manager = LLMSummarizingContextManager(
         client=client,
-        token_counter=TokenCounter(),
+        token_counter=TokenCounter.for_model(getattr(client, "model_name", "unknown")),
         logger=logger,
         token_budget=120_000,
     )
@@ -174,10 +189,36 @@ class AgentToolManager:
     search capabilities, and task completion functionality.
     """
 
-    def __init__(self, tools: List[LLMTool], logger_for_agent_logs: logging.Logger, interactive_mode: bool = True):
+    def __init__(
+        self,
+        tools: List[LLMTool],
+        logger_for_agent_logs: logging.Logger,
+        interactive_mode: bool = True,
+        max_parallel_tool_calls: int = 8,
+        output_store: Optional[ToolOutputStore] = None,
+        file_save_output_chars: int = 8_000,
+    ):
+        """
+        Args:
+            tools: The tools the agent can call.
+            logger_for_agent_logs: Logger for agent logs.
+            interactive_mode: Whether the agent returns control to the user when done.
+            max_parallel_tool_calls: Most read-only tool calls run at once.
+            output_store: Where outputs too long for the history are saved.
+                Without it, outputs go into the history whatever their length.
+            file_save_output_chars: Length above which outputs of the tools in
+                TOOLS_NEED_OUTPUT_FILE_SAVE are saved, as they are read
+                selectively rather than in full.
+        """
         self.logger_for_agent_logs = logger_for_agent_logs
+        self.max_parallel_tool_calls = max_parallel_tool_calls
         self.complete_tool = ReturnControlToUserTool() if interactive_mode else CompleteTool()
         self.tools = tools
+        self.output_store = output_store
+        self.file_save_output_chars = file_save_output_chars
+        self.read_output_tool = (
+            ReadToolOutputTool(output_store) if output_store is not None else None
+        )
 
     def get_tool(self, tool_name: str) -> LLMTool:
         """
@@ -209,12 +250,112 @@ class AgentToolManager:
             ToolResult: The result of the tool execution.
         """
         llm_tool = self.get_tool(tool_params.tool_name)
+        self._log_tool_start(tool_params)
+        started = time.perf_counter()
+        try:
+            with span(f"tool.{tool_params.tool_name}", "tool"):
+                result = llm_tool.run(tool_params.tool_input, history)
+        except Exception:
+            self._observe_tool_run(tool_params, started, "error")
+            raise
+        self._observe_tool_run(tool_params, started, "ok")
+        tool_result = self._process_tool_result(tool_params, result)
+        return self._spill_tool_result(tool_params.tool_name, tool_result)
+
+    async def arun_tool(self, tool_params: ToolCallParameters, history: MessageHistory):
+        """
+        Executes a llm tool without blocking the event loop.
+
+        Args:
+            tool (LLMTool): The tool to execute.
+            history (MessageHistory): The history of the conversation.
+        Returns:
+            ToolResult: The result of the tool execution.
+        """
+        llm_tool = self.get_tool(tool_params.tool_name)
+        self._log_tool_start(tool_params)
+        started = time.perf_counter()
+        try:
+            with span(f"tool.{tool_params.tool_name}", "tool"):
+                result = await llm_tool.arun(tool_params.tool_input, history)
+        except asyncio.CancelledError:
+            self._observe_tool_run(tool_params, started, "cancelled")
+            raise
+        except Exception:
+            self._observe_tool_run(tool_params, started, "error")
+            raise
+        self._observe_tool_run(tool_params, started, "ok")
+        tool_result = self._process_tool_result(tool_params, result)
+        # Saving a long output writes a file, which is kept off the event loop
+        return await asyncio.to_thread(
+            self._spill_tool_result, tool_params.tool_name, tool_result
+        )
+
+    async def arun_tools(
+        self, tool_calls: list[ToolCallParameters], history: MessageHistory
+    ) -> list:
+        """
+        Executes the tool calls of one turn, running read-only tools concurrently.
+
+        Consecutive calls of read-only tools run together, while a call of any
+        other tool waits for the calls before it and runs on its own, so side
+        effects happen in the order the model asked for them.
+
+        Args:
+            tool_calls (list[ToolCallParameters]): The tool calls, in the order the model made them.
+            history (MessageHistory): The history of the conversation.
+        Returns:
+            list: The result of each tool call, in call order.
+        """
+        results = []
+        batch: list[ToolCallParameters] = []
+        for tool_call in tool_calls:
+            if self.get_tool(tool_call.tool_name).read_only:
+                batch.append(tool_call)
+                continue
+            results.extend(await self._arun_concurrently(batch, history))
+            batch = []
+            results.append(await self.arun_tool(tool_call, history))
+        results.extend(await self._arun_concurrently(batch, history))
+        return results
+
+    async def _arun_concurrently(
+        self, tool_calls: list[ToolCallParameters], history: MessageHistory
+    ) -> list:
+        if len(tool_calls) <= 1:
+            return [
+                await self.arun_tool(tool_call, history) for tool_call in tool_calls
+            ]
+
+        semaphore = asyncio.Semaphore(self.max_parallel_tool_calls)
+
+        async def run(tool_call: ToolCallParameters):
+            async with semaphore:
+                return await self.arun_tool(tool_call, history)
+
+        tasks = [asyncio.ensure_future(run(tool_call)) for tool_call in tool_calls]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            # A failed or cancelled call leaves no other call running
+            for task in tasks:
+                task.cancel()
+
+    def _log_tool_start(self, tool_params: ToolCallParameters):
+        self.logger_for_agent_logs.info(f"Running tool: {tool_params.tool_name}")
+        self.logger_for_agent_logs.info(f"Tool input: {tool_params.tool_input}")
+
+    def _observe_tool_run(
+        self, tool_params: ToolCallParameters, started: float, outcome: str
+    ):
         tool_name = tool_params.tool_name
-        tool_input = tool_params.tool_input
-        self.logger_for_agent_logs.info(f"Running tool: {tool_name}")
-        self.logger_for_agent_logs.info(f"Tool input: {tool_input}")
-        result = llm_tool.run(tool_input, history)
+        TOOL_RUN_SECONDS.observe(time.perf_counter() - started, tool=tool_name)
+        TOOL_RUNS.inc(tool=tool_name, outcome=outcome)
 
+    def _process_tool_result(self, tool_params: ToolCallParameters, result):
+        """Log a tool result and unwrap it into what goes back into the history."""
+        tool_name = tool_params.tool_name
+        tool_input = tool_params.tool_input
         tool_input_str = "\n".join([f" - {k}: {v}" for k, v in tool_input.items()])
 
         log_message = f"Calling tool {tool_name} with input:\n{tool_input_str}"
@@ -237,6 +378,27 @@ class AgentToolManager:
 
         return tool_result
 
+    def _spill_tool_result(self, tool_name: str, tool_result):
+        """Save an output too long for the history, which keeps a preview and a handle."""
+        if (
+            self.output_store is None
+            or not isinstance(tool_result, str)
+            or tool_name == ReadToolOutputTool.name
+        ):
+            return tool_result
+        max_chars = (
+            self.file_save_output_chars
+            if tool_name in TOOLS_NEED_OUTPUT_FILE_SAVE
+            else None
+        )
+        try:
+            return self.output_store.spill(tool_name, tool_result, max_chars)
+        except OSError as e:
+            self.logger_for_agent_logs.warning(
+                f"Could not save output of {tool_name}: {e}"
+            )
+            return tool_result
+
     def should_stop(self):
         """
         Checks if the agent should stop based on the completion tool.
@@ -268,4 +430,7 @@ class AgentToolManager:
         Returns:
             list[LLMTool]: A list of all available tools.
         """
-        return self.tools + [self.complete_tool]
+        tools = self.tools + [self.complete_tool]
+        if self.read_output_tool is not None:
+            tools.append(self.read_output_tool)
+        return tools
@@ -0,0 +1,106 @@
+"""Storage of tool outputs too large to keep in the history.
+
+An oversized output is saved to a file in the workspace, named after the hash
+of its content, and the history only gets its start and end with a handle.
+The model reads the rest on demand with `ReadToolOutputTool`, and since the
+file is in the workspace, other tools such as bash can search it too.
+"""
+
+import hashlib
+import os
+import re
+import uuid
+from pathlib import Path
+
+from ii_agent.utils import WorkspaceManager
+
+_HANDLE_PATTERN = re.compile(r"[0-9a-f]{16}")
+
+
+class ToolOutputStore:
+    """Tool outputs saved in the workspace, addressed by the hash of their content."""
+
+    def __init__(
+        self,
+        workspace_manager: WorkspaceManager,
+        directory: str = ".tool_outputs",
+        max_chars: int = 20_000,
+        head_chars: int = 1_500,
+        tail_chars: int = 500,
+    ):
+        """Initialize the store.
+
+        Args:
+            workspace_manager: Workspace the outputs are saved in
+            directory: Directory of the outputs, relative to the workspace root
+            max_chars: Length above which an output is saved instead of kept
+            head_chars: Characters of the start of a saved output kept in the history
+            tail_chars: Characters of the end of a saved output kept in the history
+        """
+        self.workspace_manager = workspace_manager
+        self.directory = workspace_manager.workspace_path(directory)
+        self.max_chars = max_chars
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+
+    def path(self, handle: str) -> Path:
+        """The file of a saved output.
+
+        Raises:
+            ValueError: If the handle is not one given out by `save`
+        """
+        if not _HANDLE_PATTERN.fullmatch(handle):
+            raise ValueError(f"Invalid tool output handle: {handle!r}")
+        return self.directory / f"{handle}.txt"
+
+    def save(self, output: str) -> str:
+        """Save an output and return its handle. Equal outputs are saved once."""
+        handle = hashlib.sha256(output.encode()).hexdigest()[:16]
+        path = self.path(handle)
+        if not path.exists():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Write a temporary file first, so readers never see a partial output
+            temporary = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+            temporary.write_text(output, encoding="utf-8")
+            os.replace(temporary, path)
+        return handle
+
+    def read(
+        self, handle: str, offset: int = 0, length: int | None = None
+    ) -> tuple[str, int]:
+        """Read part of a saved output.
+
+        Returns:
+            The characters from `offset` on, at most `length` of them, and the
+            length of the whole output
+
+        Raises:
+            ValueError: If the handle is invalid
+            FileNotFoundError: If no output is saved under the handle
+        """
+        output = self.path(handle).read_text(encoding="utf-8")
+        end = len(output) if length is None else offset + length
+        return output[offset:end], len(output)
+
+    def spill(self, tool_name: str, output: str, max_chars: int | None = None) -> str:
+        """Save an output if it is too long, and return what the history keeps of it.
+
+        Args:
+            tool_name: Name of the tool that returned the output
+            output: The output
+            max_chars: Length above which the output is saved, `max_chars` of
+                the store by default
+        """
+        max_chars = self.max_chars if max_chars is None else max_chars
+        if len(output) <= max(max_chars, self.head_chars + self.tail_chars):
+            return output
+        handle = self.save(output)
+        omitted = len(output) - self.head_chars - self.tail_chars
+        location = self.workspace_manager.relative_path(self.path(handle))
+        return (
+            f"{output[: self.head_chars]}\n\n"
+            f"[... {omitted} characters omitted. The full output of {tool_name} "
+            f"({len(output)} characters) is saved as tool output {handle} in {location}. "
+            f"Use the read_tool_output tool with this handle to read any part of it. ...]\n\n"
+            f"{output[-self.tail_chars :] if self.tail_chars else ''}"
+        )
@@ -25,6 +25,7 @@ class VisitWebpageTool(LLMTool):
         },
         "required": ["url"],
     }
+    read_only = True
     output_type = "string"
 
     def __init__(self, max_output_length: int = 40000):
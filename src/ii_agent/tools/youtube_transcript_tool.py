@@ -24,6 +24,7 @@ class YoutubeTranscriptTool(LLMTool):
         },
         "required": ["url"],
     }
+    read_only = True
     output_type = "string"
 
     def __init__(self):
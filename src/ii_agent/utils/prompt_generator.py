@@ -48,9 +48,9 @@ Format your response as a single, well-structured prompt without explanations or
         messages = [[
             TextPrompt(text=f"Enhance this request into a detailed prompt: {user_input}\n\nAdditional context - {file_context}")
         ]]
-        
-        # Use the Anthropic client's generate method
-        response_blocks, _ = client.generate(
+
+        # Use the client's async generate method
+        response_blocks, _ = await client.agenerate(
             messages=messages,
             max_tokens=max_tokens,
             system_prompt=system_prompt,
@@ -0,0 +1,339 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Optional
+from unittest.mock import Mock
+
+import pytest
+
+from ii_agent.agents.anthropic_fc import (
+    TRANSIENT_EVENT_TYPES,
+    AnthropicFC,
+    coalesce_stream_deltas,
+)
+from ii_agent.core.event import EventType, RealtimeEvent
+from ii_agent.llm.base import LLMClient, StreamDelta, TextResult, ToolCall
+from ii_agent.llm.context_manager.amortized_forgetting import (
+    AmortizedForgettingContextManager,
+)
+from ii_agent.llm.message_history import MessageHistory
+from ii_agent.llm.rate_limit import current_throttle_listener
+from ii_agent.llm.token_counter import TokenCounter
+from ii_agent.tools.base import LLMTool, ToolImplOutput
+from ii_agent.utils.workspace_manager import WorkspaceManager
+
+
+class ScriptedClient(LLMClient):
+    """Client that only implements generate and replays canned responses."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def generate(
+        self,
+        messages,
+        max_tokens,
+        system_prompt=None,
+        temperature=0.0,
+        tools=[],
+        tool_choice=None,
+        thinking_tokens=None,
+    ):
+        self.calls += 1
+        return self.responses.pop(0), {}
+
+
+class EchoTool(LLMTool):
+    name = "echo"
+    description = "Echo the input text."
+    input_schema = {
+        "type": "object",
+        "properties": {"text": {"type": "string"}},
+        "required": ["text"],
+    }
+
+    def run_impl(
+        self,
+        tool_input: dict[str, Any],
+        message_history: Optional[MessageHistory] = None,
+    ) -> ToolImplOutput:
+        return ToolImplOutput(tool_input["text"], "echoed")
+
+
+class StreamingClient(ScriptedClient):
+    """Client that streams each text block a word at a time."""
+
+    async def astream(
+        self,
+        messages,
+        max_tokens,
+        system_prompt=None,
+        temperature=0.0,
+        tools=[],
+        tool_choice=None,
+        thinking_tokens=None,
+        on_delta=None,
+    ):
+        blocks, metadata = self.generate(messages, max_tokens)
+        for index, block in enumerate(blocks):
+            for word in block.text.split(" "):
+                on_delta(StreamDelta(index=index, kind="text", text=word + " "))
+                await asyncio.sleep(0)
+        return blocks, metadata
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+
+def make_agent(client, tmp_path, token_counter=None, **kwargs):
+    logger = Mock(spec=logging.Logger)
+    return AnthropicFC(
+        system_prompt="You are a test agent.",
+        client=client,
+        tools=[EchoTool()],
+        workspace_manager=WorkspaceManager(root=tmp_path),
+        message_queue=asyncio.Queue(),
+        logger_for_agent_logs=logger,
+        context_manager=AmortizedForgettingContextManager(
+            token_counter=token_counter or TokenCounter(), logger=logger
+        ),
+        **kwargs,
+    )
+
+
+def test_arun_agent_runs_tools_and_stops(tmp_path):
+    client = ScriptedClient(
+        [
+            [ToolCall(tool_call_id="1", tool_name="echo", tool_input={"text": "hi"})],
+            [
+                ToolCall(
+                    tool_call_id="2", tool_name="return_control_to_user", tool_input={}
+                )
+            ],
+        ]
+    )
+    agent = make_agent(client, tmp_path)
+
+    result = asyncio.run(agent.arun_agent("say hi"))
+
+    assert result == "Task completed"
+    assert client.calls == 2
+    events = []
+    while not agent.message_queue.empty():
+        events.append(agent.message_queue.get_nowait())
+    tool_results = [e for e in events if e.type == EventType.TOOL_RESULT]
+    assert tool_results[0].content["result"] == "hi"
+
+
+def test_tool_calls_of_one_turn_run_in_one_round_trip(tmp_path):
+    client = ScriptedClient(
+        [
+            [
+                TextResult(text="Echoing twice."),
+                ToolCall(tool_call_id="1", tool_name="echo", tool_input={"text": "a"}),
+                ToolCall(tool_call_id="2", tool_name="echo", tool_input={"text": "b"}),
+            ],
+            [TextResult(text="Done.")],
+        ]
+    )
+    agent = make_agent(client, tmp_path)
+
+    asyncio.run(agent.arun_agent("echo a and b"))
+
+    assert client.calls == 2
+    messages = agent.history.get_messages_for_llm()
+    assert [block.tool_call_id for block in messages[2]] == ["1", "2"]
+    assert [block.tool_output for block in messages[2]] == ["a", "b"]
+
+
+def test_run_agent_sync_matches_async(tmp_path):
+    client = ScriptedClient([[TextResult(text="All done.")]])
+    agent = make_agent(client, tmp_path)
+
+    result = agent.run_agent("finish")
+
+    assert result == "All done."
+    assert client.calls == 1
+
+
+def test_run_agent_sync_inside_a_loop_points_to_arun_agent(tmp_path):
+    client = ScriptedClient([[TextResult(text="All done.")]])
+    agent = make_agent(client, tmp_path)
+
+    async def run():
+        with pytest.raises(RuntimeError, match="arun_agent"):
+            agent.run_agent("finish")
+
+    asyncio.run(run())
+    assert client.calls == 0
+
+
+class ThreadRecordingCounter(TokenCounter):
+    """Token counter noting the threads it counts on."""
+
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    def count_tokens(self, prompt_chars):
+        self.threads.add(threading.current_thread())
+        return super().count_tokens(prompt_chars)
+
+
+def test_tokens_are_counted_off_the_event_loop(tmp_path):
+    # Counting can be a request to the provider
+    client = ScriptedClient(
+        [
+            [ToolCall(tool_call_id="1", tool_name="echo", tool_input={"text": "hi"})],
+            [TextResult(text="Done.")],
+        ]
+    )
+    counter = ThreadRecordingCounter()
+    agent = make_agent(client, tmp_path, token_counter=counter)
+
+    asyncio.run(agent.arun_agent("say hi"))
+
+    assert counter.threads
+    assert threading.main_thread() not in counter.threads
+
+
+def test_coalesce_stream_deltas():
+    def delta(text, index=0, stream_id="a"):
+        return RealtimeEvent(
+            type=EventType.AGENT_THINKING,
+            content={
+                "text": text,
+                "delta": True,
+                "stream_id": stream_id,
+                "index": index,
+                "kind": "text",
+            },
+        )
+
+    merged = coalesce_stream_deltas(
+        [delta("Hel"), delta("lo"), delta("{", index=1), delta("x", stream_id="b")]
+    )
+
+    assert [event.content["text"] for event in merged] == ["Hello", "{", "x"]
+
+
+def test_streamed_output_is_coalesced_into_frames(tmp_path):
+    client = StreamingClient([[TextResult(text="one two three four")]])
+    websocket = FakeWebSocket()
+    agent = make_agent(
+        client,
+        tmp_path,
+        websocket=websocket,
+        stream_model_output=True,
+        stream_frame_interval=0.01,
+    )
+
+    async def run():
+        processor = agent.start_message_processing()
+        result = await agent.arun_agent("count")
+        await agent.message_queue.join()
+        processor.cancel()
+        return result
+
+    result = asyncio.run(run())
+
+    assert result == "one two three four"
+    thinking = [e for e in websocket.sent if e["type"] == EventType.AGENT_THINKING]
+    deltas = [e for e in thinking if e["content"].get("delta")]
+    assert len(deltas) < 4
+    assert "".join(e["content"]["text"] for e in deltas) == "one two three four "
+    assert thinking[-1]["content"]["text"] == "one two three four"
+    assert "delta" not in thinking[-1]["content"]
+
+
+def test_reattached_websocket_gets_missed_events(tmp_path):
+    client = ScriptedClient([])
+    first = FakeWebSocket()
+    agent = make_agent(client, tmp_path, websocket=first)
+
+    def put(i):
+        agent.message_queue.put_nowait(
+            RealtimeEvent(type=EventType.TOOL_RESULT, content={"i": i})
+        )
+
+    async def run():
+        processor = agent.start_message_processing()
+        put(0)
+        put(1)
+        await agent.message_queue.join()
+
+        # The client drops after the first event and misses the next ones
+        agent.websocket = None
+        put(2)
+        put(3)
+        await agent.message_queue.join()
+
+        second = FakeWebSocket()
+        complete = await agent.attach_websocket(second, last_seq=1)
+        put(4)
+        await agent.message_queue.join()
+        processor.cancel()
+        return complete, second
+
+    complete, second = asyncio.run(run())
+
+    assert complete
+    assert [e["seq"] for e in first.sent] == [1, 2]
+    assert [e["seq"] for e in second.sent] == [2, 3, 4, 5]
+    assert [e["content"]["i"] for e in second.sent] == [1, 2, 3, 4]
+
+
+def test_agent_run_is_traced(tmp_path):
+    client = ScriptedClient(
+        [
+            [ToolCall(tool_call_id="1", tool_name="echo", tool_input={"text": "hi"})],
+            [TextResult(text="Done.")],
+        ]
+    )
+    agent = make_agent(client, tmp_path)
+
+    asyncio.run(agent.arun_agent("say hi"))
+
+    names = [e["name"] for e in agent.tracer.export()["traceEvents"] if e["ph"] == "X"]
+    assert names.count("agent.turn") == 2
+    assert names.count("context.truncate") == 2
+    assert "tool.echo" in names
+
+
+class ThrottledClient(ScriptedClient):
+    """Client whose requests wait on a rate limiter before answering."""
+
+    async def agenerate(
+        self,
+        messages,
+        max_tokens,
+        system_prompt=None,
+        temperature=0.0,
+        tools=[],
+        tool_choice=None,
+        thinking_tokens=None,
+    ):
+        current_throttle_listener.get()(12.0, "rate_limit")
+        return self.generate(messages, max_tokens)
+
+
+def test_throttled_requests_are_reported_but_not_saved(tmp_path):
+    client = ThrottledClient([[TextResult(text="Done.")]])
+    agent = make_agent(client, tmp_path)
+
+    asyncio.run(agent.arun_agent("say hi"))
+
+    events = []
+    while not agent.message_queue.empty():
+        events.append(agent.message_queue.get_nowait())
+    throttled = [e for e in events if e.type == EventType.THROTTLED]
+    assert [e.content for e in throttled] == [
+        {"wait_seconds": 12.0, "reason": "rate_limit"}
+    ]
+    assert EventType.THROTTLED in TRANSIENT_EVENT_TYPES
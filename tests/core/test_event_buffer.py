@@ -0,0 +1,37 @@
+from ii_agent.core.event import EventType, RealtimeEvent
+from ii_agent.core.event_buffer import EventBuffer
+
+
+def make_event(i):
+    return RealtimeEvent(type=EventType.TOOL_RESULT, content={"i": i})
+
+
+def test_events_are_numbered_in_order():
+    buffer = EventBuffer()
+
+    events = [buffer.append(make_event(i)) for i in range(3)]
+
+    assert [event.seq for event in events] == [1, 2, 3]
+    assert buffer.last_seq == 3
+    assert events[0].model_dump()["seq"] == 1
+
+
+def test_since_returns_missed_events():
+    buffer = EventBuffer()
+    for i in range(5):
+        buffer.append(make_event(i))
+
+    assert [event.seq for event in buffer.since(2)] == [3, 4, 5]
+    assert buffer.since(5) == []
+    assert len(buffer.since(0)) == 5
+
+
+def test_since_reports_events_no_longer_buffered():
+    buffer = EventBuffer(max_events=3)
+    for i in range(5):
+        buffer.append(make_event(i))
+
+    assert buffer.since(1) is None
+    assert [event.seq for event in buffer.since(2)] == [3, 4, 5]
+    # A client ahead of the buffer saw another stream
+    assert buffer.since(9) is None
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from ii_agent.core.metrics import (
+    LLM_REQUEST_SECONDS,
+    LLM_REQUESTS,
+    LLM_TOKENS,
+    Counter,
+    Gauge,
+    Histogram,
+    MetricsRegistry,
+)
+from ii_agent.llm.base import LLMClient, TextResult, observe_llm_request
+
+
+def test_registry_renders_text_format():
+    registry = MetricsRegistry()
+    requests = registry.register(
+        Counter("requests_total", "Requests.", labels=("path",))
+    )
+    latency = registry.register(
+        Histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+    )
+    registry.register(Gauge("queue_depth", "Depth.", callback=lambda: 3))
+
+    requests.inc(path='/a"b')
+    requests.inc(2, path='/a"b')
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    lines = registry.render().splitlines()
+
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{path="/a\\"b"} 3' in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert "latency_seconds_sum 5.55" in lines
+    assert "latency_seconds_count 3" in lines
+    assert "queue_depth 3" in lines
+
+
+def test_labels_must_match():
+    counter = Counter("c_total", "C.", labels=("tool",))
+
+    with pytest.raises(ValueError):
+        counter.inc(model="x")
+    with pytest.raises(ValueError):
+        counter.inc(-1, tool="x")
+
+
+class MeteredClient(LLMClient):
+    provider = "test"
+    model_name = "metered"
+
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    @observe_llm_request
+    def generate(
+        self,
+        messages,
+        max_tokens,
+        system_prompt=None,
+        temperature=0.0,
+        tools=[],
+        tool_choice=None,
+        thinking_tokens=None,
+    ):
+        if self.fail:
+            raise ConnectionError("down")
+        return [TextResult(text="hi")], {
+            "input_tokens": 10,
+            "output_tokens": 2,
+            "cache_read_input_tokens": 5,
+            "cache_creation_input_tokens": -1,
+        }
+
+
+def test_llm_requests_are_observed():
+    labels = {"provider": "test", "model": "metered"}
+    before = LLM_REQUEST_SECONDS.count(method="generate", **labels)
+
+    MeteredClient().generate([], 10)
+    asyncio.run(MeteredClient().agenerate([], 10))
+    with pytest.raises(ConnectionError):
+        MeteredClient(fail=True).generate([], 10)
+
+    assert LLM_REQUEST_SECONDS.count(method="generate", **labels) == before + 3
+    assert LLM_REQUESTS.get(outcome="ok", **labels) >= 2
+    assert LLM_REQUESTS.get(outcome="error", **labels) >= 1
+    assert LLM_TOKENS.get(kind="input", **labels) >= 20
+    assert LLM_TOKENS.get(kind="cache_read", **labels) >= 10
+    assert LLM_TOKENS.get(kind="cache_creation", **labels) == 0
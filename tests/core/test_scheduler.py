@@ -0,0 +1,203 @@
+import asyncio
+
+import pytest
+
+from ii_agent.core.scheduler import (
+    AgentScheduler,
+    RunPriority,
+    checkpoint,
+    current_run_slot,
+)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_global_and_per_user_limits():
+    scheduler = AgentScheduler(max_concurrent_runs=3, max_runs_per_user=2)
+
+    async def run():
+        done = asyncio.Event()
+        started = []
+
+        async def job(user_id):
+            async with scheduler.slot(user_id):
+                started.append(user_id)
+                await done.wait()
+
+        tasks = [asyncio.create_task(job("a")) for _ in range(4)]
+        tasks += [asyncio.create_task(job("b")) for _ in range(2)]
+        await settle()
+
+        assert scheduler.running_count == 3
+        assert scheduler.waiting_count == 3
+        assert started.count("a") == 2
+
+        done.set()
+        await asyncio.gather(*tasks)
+        assert len(started) == 6
+        assert scheduler.running_count == 0
+
+    asyncio.run(run())
+
+
+def test_users_without_runs_are_forgotten():
+    scheduler = AgentScheduler(max_concurrent_runs=2, max_runs_per_user=1)
+
+    async def run():
+        async def job(user_id):
+            async with scheduler.slot(user_id):
+                await asyncio.sleep(0)
+
+        await asyncio.gather(*(job(f"user-{i}") for i in range(20)))
+        assert scheduler._user_tags == {}
+
+        # A returning user is still served after the others
+        async with scheduler.slot("user-0") as slot:
+            assert slot.tag > 0
+
+    asyncio.run(run())
+
+
+def test_users_are_served_fairly():
+    scheduler = AgentScheduler(max_concurrent_runs=1, max_runs_per_user=1)
+    order = []
+
+    async def run():
+        go = asyncio.Event()
+
+        async def job(user_id):
+            async with scheduler.slot(user_id):
+                order.append(user_id)
+                await go.wait()
+
+        # User a queues many runs before user b shows up
+        tasks = [asyncio.create_task(job("a")) for _ in range(4)]
+        await settle()
+        tasks += [asyncio.create_task(job("b")) for _ in range(2)]
+        await settle()
+        go.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+
+    # User b's runs are interleaved with a's backlog instead of waiting behind it
+    assert order == ["a", "a", "b", "a", "b", "a"]
+
+
+def test_waiting_runs_receive_queue_positions():
+    scheduler = AgentScheduler(max_concurrent_runs=1, max_runs_per_user=1)
+    positions = {"b": [], "c": []}
+
+    async def run():
+        done = asyncio.Event()
+
+        async def job(user_id):
+            async with scheduler.slot(
+                user_id, on_position=positions.setdefault(user_id, []).append
+            ):
+                await done.wait()
+
+        tasks = [asyncio.create_task(job(user_id)) for user_id in "abc"]
+        await settle()
+        done.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+
+    assert positions["a"] == []
+    assert positions["b"] == [1]
+    assert positions["c"] == [2, 1]
+
+
+def test_interactive_run_preempts_batch_run_at_checkpoint():
+    scheduler = AgentScheduler(max_concurrent_runs=1, max_runs_per_user=1)
+    events = []
+
+    async def run():
+        async def batch_job():
+            async with scheduler.slot("gaia", RunPriority.BATCH):
+                for turn in range(3):
+                    await checkpoint()
+                    events.append(f"batch {turn}")
+                    await asyncio.sleep(0.01)
+
+        async def interactive_job():
+            async with scheduler.slot("user", RunPriority.INTERACTIVE):
+                events.append("interactive")
+                assert current_run_slot.get().user_id == "user"
+
+        batch = asyncio.create_task(batch_job())
+        await settle()
+        await interactive_job()
+        await batch
+
+    asyncio.run(run())
+
+    assert events == ["batch 0", "interactive", "batch 1", "batch 2"]
+
+
+def test_cancelled_wait_gives_up_its_place():
+    scheduler = AgentScheduler(max_concurrent_runs=1, max_runs_per_user=1)
+
+    async def run():
+        done = asyncio.Event()
+
+        async def job(user_id):
+            async with scheduler.slot(user_id):
+                await done.wait()
+
+        first = asyncio.create_task(job("a"))
+        waiting = asyncio.create_task(job("b"))
+        await settle()
+        assert scheduler.waiting_count == 1
+
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert scheduler.waiting_count == 0
+
+        done.set()
+        await first
+        assert scheduler.running_count == 0
+        assert scheduler._user_running == {}
+
+    asyncio.run(run())
+
+
+def test_cancelled_preempted_run_releases_its_slot_once():
+    scheduler = AgentScheduler(max_concurrent_runs=1, max_runs_per_user=1)
+
+    async def run():
+        interactive_done = asyncio.Event()
+
+        async def batch_job():
+            async with scheduler.slot("b", RunPriority.BATCH):
+                await asyncio.sleep(0.01)
+                await checkpoint()
+
+        async def interactive_job():
+            async with scheduler.slot("user", RunPriority.INTERACTIVE):
+                await interactive_done.wait()
+
+        batch = asyncio.create_task(batch_job())
+        await settle()
+        interactive = asyncio.create_task(interactive_job())
+        await asyncio.sleep(0.05)
+        # The batch run gave up its slot and waits to get it back
+        assert scheduler.waiting_count == 1
+
+        batch.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await batch
+        assert scheduler.waiting_count == 0
+        assert scheduler._user_running == {"user": 1}
+
+        interactive_done.set()
+        await interactive
+        assert scheduler.running_count == 0
+        assert scheduler._user_running == {}
+
+    asyncio.run(run())
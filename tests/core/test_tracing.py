@@ -0,0 +1,57 @@
+import asyncio
+import json
+
+from ii_agent.core.tracing import Tracer, current_tracer, span, use_tracer
+
+
+def test_spans_without_tracer_are_skipped():
+    with span("work", "test") as args:
+        args["ok"] = True
+    assert current_tracer.get() is None
+
+
+def test_export_is_chrome_trace(tmp_path):
+    tracer = Tracer(name="session")
+
+    with use_tracer(tracer):
+        with span("outer", "test", turn=1):
+            with span("inner", "test") as args:
+                args["result"] = "done"
+
+    trace = tracer.export()
+    spans = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+    inner, outer = spans
+    assert (inner["name"], outer["name"]) == ("inner", "outer")
+    assert inner["args"] == {"result": "done"}
+    assert outer["args"] == {"turn": 1}
+    assert outer["ts"] <= inner["ts"]
+    assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+    assert inner["tid"] == outer["tid"]
+
+    path = tmp_path / "trace.json"
+    tracer.write(path)
+    assert json.loads(path.read_text())["traceEvents"][0]["name"] == "process_name"
+
+
+def test_tasks_and_threads_get_their_own_tracks():
+    tracer = Tracer()
+
+    def blocking():
+        with span("in thread", "test"):
+            pass
+
+    async def run():
+        with use_tracer(tracer):
+            with span("in task", "test"):
+                await asyncio.to_thread(blocking)
+
+    asyncio.run(run())
+
+    spans = {e["name"]: e for e in tracer.export()["traceEvents"] if e["ph"] == "X"}
+    assert spans["in task"]["tid"] != spans["in thread"]["tid"]
+    names = [
+        e["args"]["name"]
+        for e in tracer.export()["traceEvents"]
+        if e["name"] == "thread_name"
+    ]
+    assert len(names) == 2
@@ -0,0 +1,169 @@
+import asyncio
+import uuid
+from datetime import datetime
+from unittest.mock import patch
+
+from ii_agent.core.event import EventType, RealtimeEvent
+from ii_agent.db.event_writer import EventWriter, update_session_activity
+
+
+class FlakyStore:
+    """Collects inserted documents, failing while `down` is set."""
+
+    def __init__(self):
+        self.batches = []
+        self.down = False
+
+    def insert_many(self, documents):
+        if self.down:
+            raise ConnectionError("database unavailable")
+        self.batches.append(list(documents))
+
+    @property
+    def documents(self):
+        return [document for batch in self.batches for document in batch]
+
+
+def make_event(i):
+    return RealtimeEvent(type=EventType.TOOL_RESULT, content={"i": i})
+
+
+def make_writer(store, tmp_path, **kwargs):
+    return EventWriter(
+        insert_many=store.insert_many,
+        flush_interval=0.01,
+        retry_delay=0,
+        spill_path=tmp_path / "spill.jsonl",
+        **kwargs,
+    )
+
+
+def test_events_are_written_in_batches(tmp_path):
+    store = FlakyStore()
+    writer = make_writer(store, tmp_path, max_batch_size=10)
+    session_id = uuid.uuid4()
+
+    async def run():
+        for i in range(25):
+            writer.enqueue(session_id, make_event(i))
+        await writer.close()
+
+    asyncio.run(run())
+
+    assert len(store.batches) == 3
+    documents = store.documents
+    assert [d["event_payload"]["content"]["i"] for d in documents] == list(range(25))
+    timestamps = [d["timestamp"] for d in documents]
+    assert timestamps == sorted(timestamps)
+    assert len(set(timestamps)) == len(timestamps)
+
+
+def test_failed_batches_are_spilled_and_restored(tmp_path):
+    store = FlakyStore()
+    writer = make_writer(store, tmp_path, max_batch_size=5)
+    session_id = uuid.uuid4()
+
+    async def run():
+        store.down = True
+        for i in range(7):
+            writer.enqueue(session_id, make_event(i))
+        await writer.flush()
+        assert writer.spill_path.exists()
+        assert store.documents == []
+
+        store.down = False
+        writer.enqueue(session_id, make_event(7))
+        await writer.close()
+
+    asyncio.run(run())
+
+    assert not writer.spill_path.exists()
+    documents = sorted(store.documents, key=lambda d: d["timestamp"])
+    assert [d["event_payload"]["content"]["i"] for d in documents] == list(range(8))
+
+
+def test_full_buffer_spills_to_disk(tmp_path):
+    store = FlakyStore()
+    writer = make_writer(store, tmp_path, max_batch_size=100, max_pending=3)
+    session_id = uuid.uuid4()
+
+    async def run():
+        for i in range(5):
+            writer.enqueue(session_id, make_event(i))
+        assert len(writer._pending) == 3
+        await writer.close()
+
+    asyncio.run(run())
+
+    assert len(store.documents) == 5
+    # The buffered events, and the spilled ones restored from disk
+    assert sorted(len(batch) for batch in store.batches) == [2, 3]
+
+
+def test_unreadable_spilled_events_are_skipped(tmp_path):
+    store = FlakyStore()
+    writer = make_writer(store, tmp_path)
+    session_id = uuid.uuid4()
+
+    async def run():
+        store.down = True
+        for i in range(3):
+            writer.enqueue(session_id, make_event(i))
+        await writer.flush()
+        # A line cut short by a crash, and one with a bad timestamp
+        with open(writer.spill_path, "a") as f:
+            f.write('{"_id": "x", "timestamp": "yesterday"}\n{"_id": "y", "ti')
+
+        store.down = False
+        await writer.close()
+
+    asyncio.run(run())
+
+    assert not writer.spill_path.exists()
+    assert not writer.spill_path.with_suffix(".restoring").exists()
+    assert [d["event_payload"]["content"]["i"] for d in store.documents] == [0, 1, 2]
+
+
+def test_writer_keeps_running_if_restoring_fails(tmp_path):
+    store = FlakyStore()
+    writer = make_writer(store, tmp_path)
+    # A directory where the file to restore is expected cannot be read
+    writer.spill_path.with_suffix(".restoring").mkdir()
+
+    async def run():
+        writer.enqueue(uuid.uuid4(), make_event(0))
+        for _ in range(100):
+            if store.documents:
+                break
+            await asyncio.sleep(0.01)
+        assert not writer._task.done()
+
+    asyncio.run(run())
+
+    assert len(store.documents) == 1
+
+
+def test_session_activity_updates():
+    documents = [
+        {
+            "session_id": "s1",
+            "timestamp": datetime(2025, 1, 1, 0, 0, second),
+            "event_type": event_type,
+            "event_payload": {"type": event_type, "content": {"text": text}},
+        }
+        for second, event_type, text in [
+            (1, "user_message", "first"),
+            (2, "tool_call", ""),
+            (3, "user_message", "second"),
+        ]
+    ]
+
+    with patch("ii_agent.db.event_writer.Session._get_collection") as collection:
+        update_session_activity(documents)
+
+    updates = collection.return_value.bulk_write.call_args.args[0]
+    assert updates[0]._doc == {
+        "$max": {"last_activity_at": datetime(2025, 1, 1, 0, 0, 3)}
+    }
+    assert updates[1]._filter == {"_id": "s1", "first_message": {"$in": ["", None]}}
+    assert updates[1]._doc == {"$set": {"first_message": "first"}}
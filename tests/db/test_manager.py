@@ -0,0 +1,106 @@
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from ii_agent.db.manager import (
+    HEAVY_EVENT_FIELDS,
+    DatabaseManager,
+    decode_session_cursor,
+    encode_cursor,
+    encode_session_cursor,
+)
+
+
+def test_session_cursor_round_trip():
+    session = SimpleNamespace(
+        id="abc", created_at=datetime(2025, 5, 1, 12, 30, 0, 123000)
+    )
+
+    cursor = encode_session_cursor(session)
+
+    assert decode_session_cursor(cursor) == (session.created_at, "abc")
+
+
+def test_invalid_session_cursor():
+    with pytest.raises(ValueError):
+        decode_session_cursor("not-a-cursor")
+
+
+def test_find_session_events_pages_after_cursor_without_heavy_fields():
+    manager = DatabaseManager.__new__(DatabaseManager)
+    after = encode_cursor(datetime(2025, 5, 1, 12, 0, 0), "event-1")
+
+    with patch("ii_agent.db.manager.Event._get_collection") as collection:
+        manager.find_session_events("session-1", after=after, limit=10)
+
+    query, projection = collection.return_value.find.call_args.args
+    assert query == {
+        "session_id": "session-1",
+        "$or": [
+            {"timestamp": {"$gt": datetime(2025, 5, 1, 12, 0, 0)}},
+            {"timestamp": datetime(2025, 5, 1, 12, 0, 0), "_id": {"$gt": "event-1"}},
+        ],
+    }
+    assert projection == {field: 0 for field in HEAVY_EVENT_FIELDS}
+    collection.return_value.find.return_value.sort.return_value.limit.assert_called_once_with(
+        10
+    )
+
+
+def test_find_session_events_can_include_heavy_fields():
+    manager = DatabaseManager.__new__(DatabaseManager)
+
+    with patch("ii_agent.db.manager.Event._get_collection") as collection:
+        manager.find_session_events("session-1", include_heavy=True)
+
+    query, projection = collection.return_value.find.call_args.args
+    assert query == {"session_id": "session-1"}
+    assert projection is None
+
+
+def test_deleting_events_recomputes_session_activity():
+    manager = DatabaseManager.__new__(DatabaseManager)
+    last_user_event = SimpleNamespace(timestamp=datetime(2025, 5, 1, 12, 5, 0))
+    left = [
+        {"timestamp": datetime(2025, 5, 1, 12, 1, 0)},
+        {"event_payload": {"content": {"text": "first"}}},
+    ]
+
+    with (
+        patch("ii_agent.db.manager.Event.objects") as objects,
+        patch("ii_agent.db.manager.Event._get_collection") as events,
+        patch("ii_agent.db.manager.Session._get_collection") as sessions,
+    ):
+        objects.return_value.order_by.return_value.first.return_value = last_user_event
+        events.return_value.find_one.side_effect = left
+        manager.delete_events_from_last_to_user_message("session-1")
+
+    objects.return_value.delete.assert_called_once()
+    sessions.return_value.update_one.assert_called_once_with(
+        {"_id": "session-1"},
+        {
+            "$set": {
+                "first_message": "first",
+                "last_activity_at": datetime(2025, 5, 1, 12, 1, 0),
+            }
+        },
+    )
+
+
+def test_deleting_all_events_clears_session_activity():
+    manager = DatabaseManager.__new__(DatabaseManager)
+
+    with (
+        patch("ii_agent.db.manager.Event.objects"),
+        patch("ii_agent.db.manager.Event._get_collection") as events,
+        patch("ii_agent.db.manager.Session._get_collection") as sessions,
+    ):
+        events.return_value.find_one.return_value = None
+        manager.delete_session_events("session-1")
+
+    sessions.return_value.update_one.assert_called_once_with(
+        {"_id": "session-1"},
+        {"$set": {"first_message": "", "last_activity_at": None}},
+    )
@@ -1,6 +1,7 @@
 import logging
 from unittest.mock import Mock
 import re
+import threading
 
 from ii_agent.llm.base import (
     ImageBlock,
@@ -11,6 +12,10 @@ from ii_agent.llm.base import (
     ToolFormattedResult,
 )
 from ii_agent.llm.context_manager.llm_summarizing import LLMSummarizingContextManager
+from ii_agent.llm.context_manager.observation_masking import (
+    ObservationMaskingContextManager,
+)
+from ii_agent.llm.context_manager.pipeline import PipelineContextManager
 from ii_agent.llm.token_counter import TokenCounter
 
 
@@ -480,3 +485,133 @@ CHANGES: Processed images with blur filter"""
     print("--------------------------------")
     
     print("✅ Image summarization test passed!")
+
+
+def make_turns(count):
+    return [
+        [TextPrompt(text=f"Turn {j // 2}")]
+        if j % 2 == 0
+        else [TextResult(text=f"Turn {j // 2}")]
+        for j in range(count)
+    ]
+
+
+def summarizing_manager(generate, **kwargs):
+    client = Mock(spec=LLMClient)
+    client.generate.side_effect = generate
+    manager = LLMSummarizingContextManager(
+        client=client,
+        token_counter=TokenCounter(),
+        logger=Mock(spec=logging.Logger),
+        token_budget=1000,
+        max_size=10,
+        keep_first=2,
+        **kwargs,
+    )
+    return manager, client
+
+
+def test_summary_is_made_ahead_and_swapped_in_at_next_turn():
+    manager, client = summarizing_manager(
+        lambda messages, **kwargs: ([TextResult(text="Summary made ahead")], None)
+    )
+    history = make_turns(9)
+
+    # Past 80% of max_size the summary starts in the background
+    assert manager.apply_truncation_if_needed(history) is history
+    manager._speculation.future.result()
+
+    # The last summarized turn was 8, turns appended since are kept too
+    history = history + make_turns(2)
+    result = manager.apply_truncation_if_needed(history)
+    assert client.generate.call_count == 1
+    assert result[:2] == history[:2]
+    assert result[2][0].text == "Conversation Summary: Summary made ahead"
+    assert result[3:] == history[8:]
+
+
+def test_summary_made_ahead_is_dropped_when_history_changed():
+    manager, client = summarizing_manager(
+        lambda messages, **kwargs: ([TextResult(text="Summary")], None)
+    )
+    history = make_turns(9)
+    manager.apply_truncation_if_needed(history)
+    manager._speculation.future.result()
+
+    # A summarized turn was edited, so a new summary is made
+    changed = make_turns(11)
+    changed[2] = [TextPrompt(text="Edited")]
+    result = manager.apply_truncation_if_needed(changed)
+    assert client.generate.call_count == 2
+    assert len(result) == 5
+    assert manager._speculation is None
+
+
+def test_summary_made_ahead_is_kept_for_copied_turns():
+    manager, client = summarizing_manager(
+        lambda messages, **kwargs: ([TextResult(text="Summary")], None)
+    )
+    history = make_turns(9)
+    manager.apply_truncation_if_needed(history)
+    manager._speculation.future.result()
+
+    # Equal turns, as a context manager before this one may copy them
+    result = manager.apply_truncation_if_needed(make_turns(11))
+    assert client.generate.call_count == 1
+    assert result[2][0].text == "Conversation Summary: Summary"
+
+
+def test_truncation_waits_for_summary_in_progress():
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_generate(messages, **kwargs):
+        started.set()
+        release.wait(5)
+        return [TextResult(text="Slow summary")], None
+
+    manager, client = summarizing_manager(slow_generate)
+    history = make_turns(9)
+    manager.apply_truncation_if_needed(history)
+    started.wait(5)
+
+    # Over max_size while summarizing: wait for it rather than summarize twice
+    threading.Timer(0.1, release.set).start()
+    result = manager.apply_truncation_if_needed(history + make_turns(2))
+    assert client.generate.call_count == 1
+    assert result[2][0].text == "Conversation Summary: Slow summary"
+
+
+def test_summarizing_ahead_can_be_disabled():
+    manager, client = summarizing_manager(
+        lambda messages, **kwargs: ([TextResult(text="Summary")], None),
+        summarize_ahead_at=None,
+    )
+    manager.apply_truncation_if_needed(make_turns(9))
+    assert client.generate.call_count == 0
+
+
+def test_summary_is_made_ahead_in_a_pipeline():
+    manager, client = summarizing_manager(
+        lambda messages, **kwargs: ([TextResult(text="Summary made ahead")], None)
+    )
+    logger = Mock(spec=logging.Logger)
+    pipeline = PipelineContextManager(
+        manager.token_counter,
+        logger,
+        1000,
+        context_managers=[
+            ObservationMaskingContextManager(manager.token_counter, logger, 1000),
+            manager,
+        ],
+    )
+    history = make_turns(9)
+
+    # The summarizer sees the history before the pipeline is over budget
+    assert pipeline.apply_truncation_if_needed(history) is history
+    manager._speculation.future.result()
+
+    history = history + make_turns(2)
+    result = pipeline.apply_truncation_if_needed(history)
+    assert client.generate.call_count == 1
+    assert result[2][0].text == "Conversation Summary: Summary made ahead"
@@ -0,0 +1,227 @@
+import base64
+import io
+import logging
+from unittest.mock import Mock
+
+from PIL import Image
+
+from ii_agent.llm.base import (
+    ImageBlock,
+    LLMClient,
+    TextPrompt,
+    TextResult,
+    ToolCall,
+    ToolFormattedResult,
+)
+from ii_agent.llm.context_manager.llm_summarizing import LLMSummarizingContextManager
+from ii_agent.llm.context_manager.observation_masking import (
+    MASK_PREFIX,
+    ObservationMaskingContextManager,
+)
+from ii_agent.llm.context_manager.pipeline import PipelineContextManager
+from ii_agent.llm.message_history import MessageHistory
+from ii_agent.llm.token_counter import TokenCounter
+from utils import create_context_manager
+
+
+def screenshot_source():
+    buffer = io.BytesIO()
+    Image.new("RGB", (1000, 1000)).save(buffer, "PNG")
+    data = base64.b64encode(buffer.getvalue()).decode()
+    return {"type": "base64", "media_type": "image/png", "data": data}
+
+
+def tool_turns(n, output_chars=3000):
+    """A user prompt followed by n tool calls, each with a long output."""
+    history = [[TextPrompt(text="Find the answer")]]
+    for i in range(n):
+        history.append(
+            [
+                TextResult(text=f"Step {i}"),
+                ToolCall(
+                    tool_call_id=f"call_{i}",
+                    tool_name="bash",
+                    tool_input={"command": f"ls {i}"},
+                ),
+            ]
+        )
+        history.append(
+            [
+                ToolFormattedResult(
+                    tool_call_id=f"call_{i}",
+                    tool_name="bash",
+                    tool_output=f"result {i}\n" + "x" * output_chars,
+                )
+            ]
+        )
+    return history
+
+
+def test_old_outputs_are_masked_until_the_budget_fits():
+    context_manager = ObservationMaskingContextManager(
+        token_counter=TokenCounter(), logger=Mock(), token_budget=5000, keep_recent=2
+    )
+    history = tool_turns(10)
+    assert context_manager.count_tokens(history) > 10_000
+
+    result = context_manager.apply_truncation_if_needed(history)
+
+    assert len(result) == len(history)
+    assert context_manager.count_tokens(result) <= 5000
+    outputs = [turn[0] for turn in result if isinstance(turn[0], ToolFormattedResult)]
+    masked = [output.tool_output.startswith(MASK_PREFIX) for output in outputs]
+    # The oldest are masked first, and only as many as needed
+    assert masked == sorted(masked, reverse=True)
+    assert not all(masked)
+    assert "result 0" in outputs[0].tool_output
+    # Tool calls and assistant text are kept
+    for original, kept in zip(history, result):
+        if not isinstance(original[0], ToolFormattedResult):
+            assert kept is original
+    # The original history is not changed
+    assert history[2][0].tool_output.endswith("x" * 3000)
+
+
+def test_recent_turns_are_never_masked():
+    context_manager = ObservationMaskingContextManager(
+        token_counter=TokenCounter(), logger=Mock(), token_budget=100, keep_recent=3
+    )
+    history = tool_turns(3)
+    result = context_manager.apply_truncation_if_needed(history)
+    assert result[-3:] == history[-3:]
+    assert all(
+        turn[0].tool_output.startswith(MASK_PREFIX)
+        for turn in result[:-3]
+        if isinstance(turn[0], ToolFormattedResult)
+    )
+    # Masking again changes nothing
+    assert context_manager.apply_truncation(result) == result
+
+
+def test_outputs_are_masked_only_if_that_makes_them_shorter():
+    context_manager = ObservationMaskingContextManager(
+        token_counter=TokenCounter(), logger=Mock(), token_budget=10, keep_recent=0
+    )
+    history = tool_turns(2, output_chars=350)
+    history[-1][0] = ToolFormattedResult(
+        tool_call_id="call_1", tool_name="bash", tool_output="x" * 3000
+    )
+    result = context_manager.apply_truncation_if_needed(history)
+    # Slightly longer than the extract, the output is kept as it is
+    assert result[2] == history[2]
+    assert result[4][0].tool_output.startswith(MASK_PREFIX)
+    assert len(result[4][0].tool_output) < 3000
+
+
+def test_screenshots_are_masked():
+    context_manager = ObservationMaskingContextManager(
+        token_counter=TokenCounter.for_model("claude-sonnet-4", calibrator=None),
+        logger=Mock(),
+        token_budget=500,
+        keep_recent=1,
+    )
+    source = screenshot_source()
+    history = [
+        [
+            TextPrompt(text="What is on this page?"),
+            ImageBlock(type="image", source=source),
+        ],
+        [ToolCall(tool_call_id="call_0", tool_name="browser_view", tool_input={})],
+        [
+            ToolFormattedResult(
+                tool_call_id="call_0",
+                tool_name="browser_view",
+                tool_output=[
+                    {"type": "image", "source": source},
+                    {"type": "text", "text": "Viewed example.com"},
+                ],
+            )
+        ],
+        [TextResult(text="A page")],
+    ]
+    result = context_manager.apply_truncation_if_needed(history)
+
+    assert isinstance(result[0][1], TextPrompt)
+    assert result[0][1].text.startswith(MASK_PREFIX)
+    output = result[2][0].tool_output
+    assert [item["type"] for item in output] == ["text", "text"]
+    assert output[1]["text"] == "Viewed example.com"
+    assert result[2][0].tool_call_id == "call_0"
+    assert context_manager.count_tokens(result) < 500
+
+
+def test_summarizer_runs_only_when_masking_is_not_enough():
+    client = Mock(spec=LLMClient)
+    client.generate.return_value = ([TextResult(text="Summary")], None)
+    token_counter = TokenCounter()
+    logger = Mock(spec=logging.Logger)
+
+    def pipeline(token_budget):
+        return PipelineContextManager(
+            token_counter,
+            logger,
+            token_budget,
+            context_managers=[
+                ObservationMaskingContextManager(
+                    token_counter, logger, token_budget, keep_recent=2
+                ),
+                LLMSummarizingContextManager(
+                    client,
+                    token_counter,
+                    logger,
+                    token_budget,
+                    max_size=100,
+                    keep_first=1,
+                ),
+            ],
+        )
+
+    history = tool_turns(10)
+    context_manager = pipeline(5000)
+    result = context_manager.apply_truncation_if_needed(history)
+    assert len(result) == len(history)
+    # Masking keeps the history under the share of the budget past which
+    # the summarizer would summarize ahead, so it does not
+    assert context_manager.count_tokens(result) <= 4000
+    assert context_manager.context_managers[1]._speculation is None
+    result.append([TextPrompt(text="Please continue.")])
+    assert not context_manager.should_truncate(result)
+    assert context_manager.context_managers[1]._speculation is None
+    client.generate.assert_not_called()
+
+    # Long assistant text cannot be masked, so the summarizer has to step in
+    history = tool_turns(10)
+    history[1][0] = TextResult(text="y" * 30_000)
+    result = pipeline(5000).apply_truncation_if_needed(history)
+    assert len(result) < len(history)
+    client.generate.assert_called_once()
+
+
+def test_factory_pipeline_makes_no_model_call_while_masking_fits():
+    client = Mock(spec=LLMClient)
+    client.generate.return_value = ([TextResult(text="Summary")], None)
+    context_manager = create_context_manager(
+        "observation-masking+llm-summarizing",
+        client,
+        TokenCounter(),
+        Mock(spec=logging.Logger),
+        token_budget=20_000,
+    )
+    history = MessageHistory(context_manager)
+    history.add_user_prompt("Find the answer")
+    # An agent run, truncating before each model call
+    turns = tool_turns(30)[1:]
+    for assistant_turn, user_turn in zip(turns[::2], turns[1::2]):
+        history.truncate()
+        assert history.count_tokens() <= 20_000
+        history.add_assistant_turn(assistant_turn)
+        history.add_user_turn(user_turn)
+
+    assert len(history) == 61
+    assert any(
+        turn[0].tool_output.startswith(MASK_PREFIX)
+        for turn in history.get_messages_for_llm()
+        if isinstance(turn[0], ToolFormattedResult)
+    )
+    assert context_manager.context_managers[1]._speculation is None
+    client.generate.assert_not_called()
@@ -0,0 +1,120 @@
+import asyncio
+import gzip
+import json
+from unittest.mock import MagicMock
+
+import pytest
+from anthropic.types import ThinkingBlock
+
+from ii_agent.llm.base import TextPrompt, TextResult, ToolCall, ToolParam
+from ii_agent.llm.cassette import (
+    CacheMode,
+    CachingLLMClient,
+    CassetteMissError,
+    block_from_json,
+    block_to_json,
+    request_key,
+)
+from ii_agent.llm.replay import ReplayClient
+
+MESSAGES = [[TextPrompt(text="What is in the workspace?")]]
+TOOLS = [ToolParam(name="bash", description="Run a command", input_schema={})]
+
+
+def fake_client(blocks):
+    client = MagicMock()
+    client.provider = "anthropic"
+    client.model_name = "claude-test"
+    client.generate.return_value = (
+        blocks,
+        {"input_tokens": 10, "raw_response": object()},
+    )
+    return client
+
+
+def test_blocks_survive_serialization():
+    blocks = [
+        TextResult(text="hi"),
+        ToolCall(tool_call_id="1", tool_name="bash", tool_input={"command": "ls"}),
+        ThinkingBlock(type="thinking", thinking="hmm", signature="sig"),
+    ]
+    assert [
+        block_from_json(json.loads(json.dumps(block_to_json(b)))) for b in blocks
+    ] == blocks
+
+
+def test_request_key_covers_request_fields():
+    request = dict(
+        messages=MESSAGES,
+        max_tokens=100,
+        system_prompt="Be brief",
+        temperature=0.0,
+        tools=TOOLS,
+        tool_choice=None,
+        thinking_tokens=None,
+    )
+    key = request_key("claude-test", **request)
+    assert key == request_key("claude-test", **dict(request))
+    assert key != request_key("claude-other", **request)
+    assert key != request_key("claude-test", **dict(request, temperature=0.5))
+    assert key != request_key("claude-test", **dict(request, tools=[]))
+    assert key != request_key(
+        "claude-test", **dict(request, messages=[[TextPrompt(text="Something else")]])
+    )
+
+
+def test_read_through_records_then_serves(tmp_path):
+    path = tmp_path / "llm.jsonl.gz"
+    blocks = [
+        ToolCall(tool_call_id="1", tool_name="bash", tool_input={"command": "ls"})
+    ]
+    inner = fake_client(blocks)
+
+    client = CachingLLMClient(inner, path)
+    assert client.generate(MESSAGES, max_tokens=100, tools=TOOLS)[0] == blocks
+    assert client.generate(MESSAGES, max_tokens=100, tools=TOOLS)[0] == blocks
+    assert inner.generate.call_count == 1
+
+    # A new client replays from the file without calling the model
+    offline = fake_client([])
+    replay = CachingLLMClient(offline, path, CacheMode.REPLAY)
+    served, metadata = replay.generate(MESSAGES, max_tokens=100, tools=TOOLS)
+    assert served == blocks
+    assert metadata["input_tokens"] == 10
+    offline.generate.assert_not_called()
+
+    with pytest.raises(CassetteMissError):
+        replay.generate(MESSAGES, max_tokens=200, tools=TOOLS)
+
+    with gzip.open(path, "rt") as f:
+        assert len(f.readlines()) == 1
+
+
+def test_record_mode_replaces_responses(tmp_path):
+    path = tmp_path / "llm.jsonl.gz"
+    CachingLLMClient(fake_client([TextResult(text="old")]), path).generate(
+        MESSAGES, max_tokens=100
+    )
+    recorder = CachingLLMClient(fake_client([TextResult(text="new")]), path, "record")
+    recorder.generate(MESSAGES, max_tokens=100)
+
+    replay = CachingLLMClient(fake_client([]), path, "replay")
+    assert replay.generate(MESSAGES, max_tokens=100)[0] == [TextResult(text="new")]
+
+
+def test_async_methods_share_the_cassette(tmp_path):
+    path = tmp_path / "llm.jsonl.gz"
+    client = CachingLLMClient(ReplayClient(latency="fixed:0"), path)
+
+    deltas = []
+    streamed, _ = asyncio.run(
+        client.astream(MESSAGES, max_tokens=100, on_delta=deltas.append)
+    )
+    assert deltas
+
+    replay = CachingLLMClient(ReplayClient(latency="fixed:0"), path, "replay")
+    # Generated tool call ids are random, so equal blocks mean a cache hit
+    assert asyncio.run(replay.agenerate(MESSAGES, max_tokens=100))[0] == streamed
+    deltas.clear()
+    asyncio.run(replay.astream(MESSAGES, max_tokens=100, on_delta=deltas.append))
+    assert [d.kind for d in deltas] == ["text", "tool_input"]
@@ -0,0 +1,89 @@
+from unittest.mock import MagicMock
+
+from ii_agent.llm.anthropic import AnthropicDirectClient
+from ii_agent.llm.base import (
+    TextPrompt,
+    TextResult,
+    ToolCall,
+    ToolFormattedResult,
+    convert_cached,
+)
+from ii_agent.llm.openai import OpenAIDirectClient
+
+
+def conversation(turns: int) -> list:
+    messages = [[TextPrompt(text="Start")]]
+    for i in range(turns):
+        messages.append(
+            [
+                ToolCall(
+                    tool_call_id=str(i), tool_name="bash", tool_input={"command": "ls"}
+                )
+            ]
+        )
+        messages.append(
+            [
+                ToolFormattedResult(
+                    tool_call_id=str(i), tool_name="bash", tool_output="ok"
+                )
+            ]
+        )
+    return messages
+
+
+def has_cache_control(block) -> bool:
+    if isinstance(block, dict):
+        return "cache_control" in block
+    return getattr(block, "cache_control", None) is not None
+
+
+def test_blocks_convert_once_per_provider():
+    convert = MagicMock(side_effect=lambda block: {"text": block.text})
+    block = TextResult(text="hi")
+
+    first = convert_cached(block, "anthropic", convert)
+    assert convert_cached(block, "anthropic", convert) is first
+    convert_cached(block, "openai", convert)
+    assert convert.call_count == 2
+
+    # The memo is not part of the block's value
+    assert block == TextResult(text="hi")
+    assert block.to_dict() == {"text": "hi"}
+
+
+def test_anthropic_converts_only_the_new_tail():
+    client = AnthropicDirectClient(model_name="claude-test", use_caching=True)
+    client._convert_block = MagicMock(wraps=client._convert_block)
+    messages = conversation(3)
+
+    client._build_request(messages, max_tokens=100)
+    assert client._convert_block.call_count == 7
+
+    messages += conversation(4)[-2:]
+    request = client._build_request(messages, max_tokens=100)
+    assert client._convert_block.call_count == 9
+
+    # Breakpoints of the first request did not leak into the shared conversions
+    marked = [
+        idx
+        for idx, message in enumerate(request["messages"])
+        if any(has_cache_control(block) for block in message["content"])
+    ]
+    assert marked == [0, 6, 8]
+
+
+def test_openai_reuses_converted_messages():
+    client = OpenAIDirectClient(model_name="gpt-4.1", cot_model=False)
+    messages = conversation(2)
+
+    first = client._build_request(messages, max_tokens=100)["messages"]
+    messages += [[TextResult(text="done")]]
+    second = client._build_request(messages, max_tokens=100)["messages"]
+
+    assert second[:-1] == first
+    assert second[1]["tool_calls"][0] is first[1]["tool_calls"][0]
+    assert second[2] is first[2]
+    assert second[-1] == {
+        "role": "assistant",
+        "content": [{"type": "text", "text": "done"}],
+    }
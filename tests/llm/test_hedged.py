@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+import pytest
+
+from ii_agent.llm.base import LLMClient, StreamDelta, TextResult
+from ii_agent.llm.hedged import HedgedLLMClient, hedge_client_kwargs
+
+
+class Overloaded(Exception):
+    status_code = 529
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+class FakeClient(LLMClient):
+    def __init__(self, name, delay=0.0, error=None):
+        self.name = name
+        self.provider = "fake"
+        self.model_name = "fake-model"
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = False
+
+    def _respond(self):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return [TextResult(text=self.name)], {"input_tokens": 1, "output_tokens": 1}
+
+    def generate(self, messages, max_tokens, **kwargs):
+        time.sleep(self.delay)
+        return self._respond()
+
+    async def agenerate(self, messages, max_tokens, **kwargs):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return self._respond()
+
+    async def astream(self, messages, max_tokens, on_delta=None, **kwargs):
+        try:
+            await asyncio.sleep(self.delay)
+            on_delta(StreamDelta(index=0, kind="text", text=self.name))
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return self._respond()
+
+
+def hedged(primary, secondary, delay=0.05):
+    return HedgedLLMClient(
+        primary, secondary, initial_hedge_delay=delay, min_hedge_delay=delay
+    )
+
+
+def test_fast_primary_is_not_hedged():
+    primary, secondary = FakeClient("primary"), FakeClient("secondary")
+    client = hedged(primary, secondary)
+    blocks, _ = asyncio.run(client.agenerate([], 10))
+    assert blocks[0].text == "primary"
+    assert secondary.calls == 0
+    assert len(client.latencies) == 1
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    primary, secondary = FakeClient("primary", delay=5), FakeClient("secondary")
+    started = time.monotonic()
+    blocks, _ = asyncio.run(hedged(primary, secondary).agenerate([], 10))
+    assert blocks[0].text == "secondary"
+    assert time.monotonic() - started < 1
+    assert primary.cancelled
+
+
+def test_overloaded_primary_fails_over():
+    primary = FakeClient("primary", error=Overloaded())
+    secondary = FakeClient("secondary")
+    blocks, _ = asyncio.run(hedged(primary, secondary, delay=10).agenerate([], 10))
+    assert blocks[0].text == "secondary"
+
+    # Other errors are the request's fault, and not sent again
+    primary.error = BadRequest()
+    with pytest.raises(BadRequest):
+        asyncio.run(hedged(primary, FakeClient("secondary")).agenerate([], 10))
+
+
+def test_primary_error_is_raised_when_both_fail():
+    primary = FakeClient("primary", error=Overloaded())
+    secondary = FakeClient("secondary", error=BadRequest())
+    with pytest.raises(Overloaded):
+        asyncio.run(hedged(primary, secondary).agenerate([], 10))
+
+
+def test_hedge_delay_follows_latency_percentile():
+    client = HedgedLLMClient(
+        FakeClient("primary"),
+        FakeClient("secondary"),
+        hedge_percentile=90,
+        min_samples=10,
+    )
+    assert client.hedge_delay(client.latencies) == 30.0
+    client.latencies.extend(float(second) for second in range(1, 21))
+    assert client.hedge_delay(client.latencies) == 19.0
+
+
+def test_streams_are_hedged_on_first_delta():
+    primary, secondary = FakeClient("primary", delay=5), FakeClient("secondary")
+    deltas = []
+    blocks, _ = asyncio.run(
+        hedged(primary, secondary).astream(
+            [], 10, on_delta=lambda d: deltas.append(d.text)
+        )
+    )
+    assert blocks[0].text == "secondary"
+    assert deltas == ["secondary"]
+    assert primary.cancelled
+
+    # A primary streaming within the delay is left alone
+    primary, secondary = FakeClient("primary"), FakeClient("secondary")
+    blocks, _ = asyncio.run(
+        hedged(primary, secondary, delay=0.02).astream([], 10, on_delta=lambda d: None)
+    )
+    assert blocks[0].text == "primary"
+    assert secondary.calls == 0
+
+
+def test_sync_generate_is_hedged():
+    primary, secondary = FakeClient("primary", delay=0.5), FakeClient("secondary")
+    blocks, _ = hedged(primary, secondary).generate([], 10)
+    assert blocks[0].text == "secondary"
+
+
+def test_hedge_client_kwargs():
+    vertex = {"model_name": "m", "project_id": "p", "region": "us-east5"}
+    assert hedge_client_kwargs("anthropic-direct", vertex, "europe-west1") == dict(
+        vertex, region="europe-west1"
+    )
+    assert hedge_client_kwargs("gemini-direct", vertex, "direct") == dict(
+        vertex, project_id=None, region=None
+    )
+    assert hedge_client_kwargs(
+        "openai-direct", {"model_name": "o3", "azure_model": True}, "direct"
+    ) == {"model_name": "o3", "azure_model": False}
+    for name, kwargs, region in [
+        ("anthropic-direct", {"model_name": "m"}, "direct"),
+        ("anthropic-direct", {"model_name": "m"}, "us-east5"),
+        ("openai-direct", {"model_name": "o3", "azure_model": False}, "direct"),
+        ("replay", {}, "direct"),
+    ]:
+        with pytest.raises(ValueError):
+            hedge_client_kwargs(name, kwargs, region)
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from ii_agent.llm.anthropic import AnthropicDirectClient
+from ii_agent.llm.http_pool import HttpClientRegistry, PoolLimits, parse_pool_limits
+from ii_agent.llm.openai import OpenAIDirectClient
+
+
+class OkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_clients_share_pools_per_endpoint():
+    first = AnthropicDirectClient(model_name="claude-test")
+    second = AnthropicDirectClient(model_name="claude-other")
+    assert first.client._client is second.client._client
+    assert first.async_client._client is second.async_client._client
+
+    vertex = AnthropicDirectClient(model_name="claude-test", project_id="p", region="r")
+    assert vertex.client._client is not first.client._client
+
+    assert (
+        OpenAIDirectClient(model_name="gpt-4.1").client._client
+        is OpenAIDirectClient(model_name="gpt-4o", cot_model=False).client._client
+    )
+
+
+def test_parse_pool_limits():
+    assert parse_pool_limits("anthropic=50") == (
+        "anthropic",
+        PoolLimits(max_connections=50, max_keepalive_connections=20),
+    )
+    assert parse_pool_limits("openai=8,4") == (
+        "openai",
+        PoolLimits(max_connections=8, max_keepalive_connections=4),
+    )
+    for spec in ("anthropic", "=5", "openai=a", "openai=1,2,3"):
+        with pytest.raises(ValueError):
+            parse_pool_limits(spec)
+
+
+def test_pool_stats_count_kept_alive_connections():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    registry = HttpClientRegistry()
+    registry.set_limits(
+        "test", PoolLimits(max_connections=3, max_keepalive_connections=3)
+    )
+    sync_client, async_client = registry.get(
+        "test", ("local",), httpx.Client, httpx.AsyncClient
+    )
+    assert (
+        registry.get("test", ("local",), httpx.Client, httpx.AsyncClient)[0]
+        is sync_client
+    )
+    assert sync_client._transport._pool._max_connections == 3
+
+    for _ in range(3):
+        assert sync_client.get(url).text == "ok"
+
+    async def fetch():
+        await asyncio.gather(*(async_client.get(url) for _ in range(3)))
+        counts = registry.connection_counts()
+        stats = {pool["kind"]: pool for pool in registry.stats()}
+        await registry.aclose()
+        return counts, stats
+
+    counts, stats = asyncio.run(fetch())
+    assert counts[("test", "idle")] >= 2
+    assert counts[("test", "active")] == 0
+    # Sequential requests reuse one kept alive connection
+    assert stats["sync"]["connections"] == 1
+    assert sync_client.is_closed and async_client.is_closed
+    server.shutdown()
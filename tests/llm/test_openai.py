@@ -0,0 +1,56 @@
+import json
+from types import SimpleNamespace
+
+from ii_agent.llm.base import TextPrompt, ToolFormattedResult, ToolParam
+from ii_agent.llm.openai import OpenAIDirectClient
+
+TOOLS = [
+    ToolParam(name="web_search", description="Search", input_schema={"type": "object"})
+]
+
+
+def test_parallel_tool_calls_round_trip():
+    client = OpenAIDirectClient(model_name="gpt-4.1", cot_model=False)
+    response = SimpleNamespace(
+        choices=[
+            SimpleNamespace(
+                message=SimpleNamespace(
+                    content=None,
+                    tool_calls=[
+                        SimpleNamespace(
+                            id=f"call_{i}",
+                            function=SimpleNamespace(
+                                name="web_search", arguments=json.dumps({"query": q})
+                            ),
+                        )
+                        for i, q in enumerate(["a", "b"])
+                    ],
+                )
+            )
+        ],
+        usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5),
+    )
+
+    blocks, _ = client._convert_response(response, TOOLS)
+    assert [block.tool_input for block in blocks] == [{"query": "a"}, {"query": "b"}]
+
+    request = client._build_request(
+        [
+            [TextPrompt(text="search a and b")],
+            blocks,
+            [
+                ToolFormattedResult(
+                    tool_call_id=b.tool_call_id, tool_name=b.tool_name, tool_output="ok"
+                )
+                for b in blocks
+            ],
+        ],
+        max_tokens=100,
+        tools=TOOLS,
+    )
+    messages = request["messages"]
+    assert [call["id"] for call in messages[1]["tool_calls"]] == ["call_0", "call_1"]
+    assert [(m["role"], m["tool_call_id"]) for m in messages[2:]] == [
+        ("tool", "call_0"),
+        ("tool", "call_1"),
+    ]
@@ -0,0 +1,105 @@
+from ii_agent.llm.anthropic import AnthropicDirectClient
+from ii_agent.llm.base import TextPrompt, ToolCall, ToolFormattedResult, ToolParam
+from ii_agent.llm.prompt_cache import PromptCacheStats, plan_message_breakpoints
+
+TOOLS = [
+    ToolParam(name="bash", description="Run a command", input_schema={"type": "object"})
+]
+
+
+def conversation(turns: int) -> list:
+    messages = [[TextPrompt(text="Start")]]
+    for i in range(turns):
+        messages.append(
+            [
+                ToolCall(
+                    tool_call_id=str(i), tool_name="bash", tool_input={"command": "ls"}
+                )
+            ]
+        )
+        messages.append(
+            [
+                ToolFormattedResult(
+                    tool_call_id=str(i), tool_name="bash", tool_output="ok"
+                )
+            ]
+        )
+    return messages
+
+
+def test_breakpoints_follow_the_conversation():
+    assert plan_message_breakpoints([]) == []
+    assert plan_message_breakpoints(conversation(0)) == [0]
+    assert plan_message_breakpoints(conversation(1)) == [0, 2]
+    assert plan_message_breakpoints(conversation(5)) == [0, 8, 10]
+    # The previous request's last breakpoint is among the next request's
+    assert 10 in plan_message_breakpoints(conversation(6))
+    assert plan_message_breakpoints(conversation(5), available=1) == [10]
+
+
+def test_breakpoint_stays_on_the_summary_after_condensation():
+    messages = conversation(5)
+    condensed = [
+        messages[0],
+        [TextPrompt(text="Conversation Summary: ran ls")],
+    ] + messages[7:]
+    assert plan_message_breakpoints(condensed) == [1, 3, 5]
+
+
+def test_client_marks_tools_system_and_planned_messages():
+    client = AnthropicDirectClient(model_name="claude-test", use_caching=True)
+    messages = conversation(5)
+    request = client._build_request(
+        messages, max_tokens=100, system_prompt="Be brief", tools=TOOLS
+    )
+
+    assert request["system"][0]["cache_control"] == {"type": "ephemeral"}
+    marked = [
+        idx
+        for idx, message in enumerate(request["messages"])
+        if any(
+            (
+                block.get("cache_control")
+                if isinstance(block, dict)
+                else getattr(block, "cache_control", None)
+            )
+            for block in message["content"]
+        )
+    ]
+    assert marked == [0, 8, 10]
+
+    uncached = AnthropicDirectClient(model_name="claude-test", use_caching=False)
+    request = uncached._build_request(
+        messages, max_tokens=100, system_prompt="Be brief"
+    )
+    assert request["system"] == "Be brief"
+
+
+def test_tools_are_cached_without_a_system_prompt():
+    client = AnthropicDirectClient(model_name="claude-test", use_caching=True)
+    request = client._build_request(
+        [[TextPrompt(text="hi")]], max_tokens=100, tools=TOOLS
+    )
+    assert request["tools"][-1]["cache_control"] == {"type": "ephemeral"}
+
+
+def test_cache_stats_read_ratio():
+    stats = PromptCacheStats()
+    assert stats.read_ratio == 0.0
+    stats.record(
+        {
+            "input_tokens": 100,
+            "cache_creation_input_tokens": 900,
+            "cache_read_input_tokens": -1,
+        }
+    )
+    stats.record(
+        {
+            "input_tokens": 100,
+            "cache_creation_input_tokens": 0,
+            "cache_read_input_tokens": 900,
+        }
+    )
+    stats.record({})
+    assert stats.requests == 3
+    assert stats.read_ratio == 0.45
@@ -0,0 +1,222 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+
+import pytest
+
+from ii_agent.llm.base import TextPrompt, ToolFormattedResult
+from ii_agent.llm.rate_limit import (
+    RateLimiter,
+    RateLimits,
+    estimate_request_tokens,
+    parse_rate_limits,
+    parse_wait,
+    use_throttle_listener,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+    def __init__(self, headers):
+        super().__init__("rate limited")
+        self.response = SimpleNamespace(headers=headers)
+
+
+class ServerError(Exception):
+    status_code = 500
+
+
+def test_parse_wait():
+    assert parse_wait("2") == 2
+    assert parse_wait("1.5") == 1.5
+    assert parse_wait("6m0s") == 360
+    assert parse_wait("1h2m3s") == 3723
+    assert parse_wait("20ms") == 0.02
+    soon = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert parse_wait(soon.isoformat().replace("+00:00", "Z")) == pytest.approx(
+        30, abs=1
+    )
+    assert parse_wait(format_datetime(soon, usegmt=True)) == pytest.approx(30, abs=1)
+    assert parse_wait(None) is None
+    assert parse_wait("soon") is None
+
+
+def test_parse_rate_limits():
+    assert parse_rate_limits("anthropic=50,40000") == (
+        "anthropic",
+        RateLimits(50, 40000),
+    )
+    assert parse_rate_limits("openai=500") == ("openai", RateLimits(500))
+    for spec in ("anthropic", "openai=0", "openai=a"):
+        with pytest.raises(ValueError):
+            parse_rate_limits(spec)
+
+
+def test_budgets_queue_requests_in_order():
+    clock = FakeClock()
+    limiter = RateLimiter("test", RateLimits(requests_per_minute=60), clock=clock)
+    # A full bucket lets a minute's worth through, then one per second
+    assert [limiter.reserve(0) for _ in range(60)] == [0.0] * 60
+    assert [limiter.reserve(0) for _ in range(3)] == [1.0, 2.0, 3.0]
+    clock.now = 3.0
+    assert limiter.reserve(0) == 1.0
+
+    tokens = RateLimiter("test", RateLimits(tokens_per_minute=6000), clock=clock)
+    assert tokens.reserve(6000) == 0.0
+    assert tokens.reserve(1000) == 10.0
+    # The request used less than estimated, which is given back
+    tokens.settle(1000, {"input_tokens": 400, "output_tokens": 100})
+    assert tokens.reserve(0) == 5.0
+
+
+def test_budgets_follow_rate_limit_headers():
+    clock = FakeClock()
+    limiter = RateLimiter("test", clock=clock)
+    assert limiter.reserve(10_000) == 0.0
+
+    limiter.update_from_headers(
+        {
+            "x-ratelimit-limit-requests": "600",
+            "x-ratelimit-remaining-requests": "0",
+            "x-ratelimit-reset-requests": "6s",
+            "x-ratelimit-limit-tokens": "60000",
+            "x-ratelimit-remaining-tokens": "59000",
+        }
+    )
+    assert limiter.buckets["requests"].capacity == 600
+    assert limiter.buckets["tokens"].capacity == 60000
+    assert limiter.reserve(0) == 6.0
+
+
+def test_rate_limit_rejections_are_queued_not_failed():
+    limiter = RateLimiter("test")
+    calls = []
+    waits = []
+
+    async def request():
+        calls.append(time.monotonic())
+        if len(calls) < 3:
+            raise RateLimited({"retry-after-ms": "50"})
+        return "ok"
+
+    async def run():
+        with use_throttle_listener(lambda seconds, reason: waits.append(reason)):
+            return await limiter.acall(
+                request, tokens=10, retryable=lambda e: True, max_retries=1
+            )
+
+    assert asyncio.run(run()) == "ok"
+    assert len(calls) == 3
+    assert calls[2] - calls[0] >= 0.1
+    # Short waits are not reported to the user
+    assert waits == []
+
+
+def test_failed_attempts_give_back_their_tokens():
+    clock = FakeClock()
+    limiter = RateLimiter("test", RateLimits(tokens_per_minute=6000), clock=clock)
+    attempts = []
+
+    async def request():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RateLimited({"retry-after-ms": "1"})
+        return "ok"
+
+    result = asyncio.run(
+        limiter.acall(request, tokens=1000, retryable=lambda e: True, max_retries=1)
+    )
+    assert result == "ok"
+    assert len(attempts) == 2
+    # Only the attempt that went through is charged
+    assert limiter.buckets["tokens"].available == 5000
+
+    attempts.clear()
+    assert (
+        limiter.call(
+            lambda: asyncio.run(request()),
+            tokens=1000,
+            retryable=lambda e: True,
+            max_retries=1,
+        )
+        == "ok"
+    )
+    assert limiter.buckets["tokens"].available == 4000
+
+
+def test_other_errors_use_up_retries():
+    limiter = RateLimiter("test")
+    attempts = []
+
+    def request():
+        attempts.append(1)
+        raise ServerError()
+
+    with pytest.raises(ServerError):
+        limiter.call(
+            request,
+            tokens=10,
+            retryable=lambda e: isinstance(e, ServerError),
+            max_retries=2,
+            retry_delay=0.01,
+        )
+    assert len(attempts) == 2
+
+    # Errors that are not retryable are raised right away
+    attempts.clear()
+    with pytest.raises(ServerError):
+        limiter.call(request, tokens=10, retryable=lambda e: False, max_retries=2)
+    assert len(attempts) == 1
+
+
+def test_long_waits_are_reported(monkeypatch):
+    clock = FakeClock()
+    limiter = RateLimiter("test", RateLimits(requests_per_minute=1), clock=clock)
+    waits = []
+
+    async def no_sleep(seconds):
+        pass
+
+    async def request():
+        return "ok"
+
+    async def run():
+        with use_throttle_listener(
+            lambda seconds, reason: waits.append((seconds, reason))
+        ):
+            for _ in range(2):
+                await limiter.acall(
+                    request, tokens=0, retryable=lambda e: True, max_retries=1
+                )
+
+    monkeypatch.setattr(asyncio, "sleep", no_sleep)
+    asyncio.run(run())
+    assert waits == [(60.0, "rate_limit")]
+
+
+def test_estimate_request_tokens():
+    messages = [
+        [TextPrompt(text="x" * 300)],
+        [
+            ToolFormattedResult(
+                tool_call_id="1",
+                tool_name="screenshot",
+                tool_output=[
+                    {"type": "text", "text": "y" * 30},
+                    {"type": "image", "source": {"data": "..."}},
+                ],
+            )
+        ],
+    ]
+    assert estimate_request_tokens(messages) == 110 + 1500
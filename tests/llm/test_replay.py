@@ -0,0 +1,82 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+from ii_agent.llm import get_client
+from ii_agent.llm.base import TextResult, ToolCall, ToolFormattedResult
+from ii_agent.llm.replay import DEFAULT_SCRIPT, ReplayClient, parse_latency
+
+
+def test_parse_latency():
+    rng = random.Random(0)
+    assert parse_latency("fixed:0.5")(rng) == 0.5
+    assert all(1 <= parse_latency("uniform:1,2")(rng) <= 2 for _ in range(100))
+
+    sample = parse_latency("lognormal:2,0.5")
+    mean = sum(sample(rng) for _ in range(20_000)) / 20_000
+    assert mean == pytest.approx(2, rel=0.05)
+
+    with pytest.raises(ValueError):
+        parse_latency("normal:1,2")
+    with pytest.raises(ValueError):
+        parse_latency("uniform:1")
+
+
+def test_scripted_turns_follow_the_conversation(tmp_path):
+    script = [
+        [{"tool_name": "visit_webpage", "tool_input": {"url": "{web_url}/page"}}],
+        [{"text": "done"}],
+    ]
+    path = tmp_path / "script.json"
+    path.write_text(json.dumps(script))
+    client = get_client(
+        "replay",
+        script_path=str(path),
+        latency="fixed:0",
+        variables={"web_url": "http://127.0.0.1:9000"},
+    )
+
+    messages = [[TextResult(text="go")]]
+    blocks, metadata = client.generate(messages, max_tokens=100)
+    assert len(blocks) == 1
+    assert isinstance(blocks[0], ToolCall)
+    assert blocks[0].tool_input == {"url": "http://127.0.0.1:9000/page"}
+    assert metadata["output_tokens"] > 0
+
+    messages += [
+        blocks,
+        [ToolFormattedResult(blocks[0].tool_call_id, "visit_webpage", "page")],
+    ]
+    blocks, _ = asyncio.run(client.agenerate(messages, max_tokens=100))
+    assert blocks == [TextResult(text="done")]
+
+    # The script starts over with the next query
+    messages += [blocks, [TextResult(text="again")]]
+    blocks, _ = client.generate(messages, max_tokens=100)
+    assert blocks[0].tool_name == "visit_webpage"
+
+
+def test_default_script_ends_with_text():
+    assert all("text" in block for block in DEFAULT_SCRIPT[-1])
+    assert all(
+        any("tool_name" in block for block in response)
+        for response in DEFAULT_SCRIPT[:-1]
+    )
+
+
+def test_astream_delivers_the_response_in_pieces():
+    client = ReplayClient(latency="fixed:0.01")
+    deltas = []
+    blocks, _ = asyncio.run(
+        client.astream(
+            [[TextResult(text="go")]], max_tokens=100, on_delta=deltas.append
+        )
+    )
+
+    text_deltas = [d for d in deltas if d.kind == "text"]
+    assert len(text_deltas) > 1
+    assert "".join(d.text for d in text_deltas) == blocks[0].text
+    tool_deltas = [d for d in deltas if d.kind == "tool_input"]
+    assert json.loads(tool_deltas[0].text) == blocks[1].tool_input
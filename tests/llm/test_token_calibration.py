@@ -0,0 +1,118 @@
+import json
+import random
+from unittest.mock import Mock
+
+import pytest
+
+from ii_agent.llm.base import ToolParam
+from ii_agent.llm.context_manager.amortized_forgetting import (
+    AmortizedForgettingContextManager,
+)
+from ii_agent.llm.message_history import MessageHistory
+from ii_agent.llm.token_calibration import TokenCalibrator, reported_input_tokens
+from ii_agent.llm.token_counter import TokenCounter
+
+
+def test_single_ratio_is_learned():
+    calibrator = TokenCalibrator()
+    for _ in range(40):
+        calibrator.observe("m", {"text": 1000}, 1300)
+    assert calibrator.factors("m")["text"] == pytest.approx(1.3, abs=0.01)
+    assert calibrator.calibrate("m", {"text": 2000}) == pytest.approx(2600, abs=20)
+    # Other models are not affected
+    assert calibrator.calibrate("other", {"text": 2000}) == 2000
+
+
+def test_ratios_per_content_type_are_learned():
+    calibrator = TokenCalibrator()
+    true_factors = {"text": 1.2, "tool_result": 0.8, "image": 1.5, "system": 1.0}
+    rng = random.Random(0)
+    for _ in range(2000):
+        estimated = {
+            content_type: rng.randint(0, 5000) for content_type in true_factors
+        }
+        reported = sum(true_factors[t] * tokens for t, tokens in estimated.items())
+        calibrator.observe("m", estimated, round(reported))
+    factors = calibrator.factors("m")
+    for content_type, factor in true_factors.items():
+        assert factors[content_type] == pytest.approx(factor, abs=0.05)
+    assert calibrator.samples("m") == 2000
+
+
+def test_factors_are_bounded_and_ignore_missing_usage():
+    calibrator = TokenCalibrator(max_factor=2.0)
+    for _ in range(50):
+        calibrator.observe("m", {"text": 100}, 10_000)
+    assert calibrator.factors("m")["text"] == 2.0
+    calibrator.observe("m", {"text": 100}, 0)
+    calibrator.observe("m", {}, 100)
+    assert calibrator.samples("m") == 50
+
+
+def test_factors_are_kept_across_sessions(tmp_path):
+    path = tmp_path / "calibration.json"
+    calibrator = TokenCalibrator(path)
+    calibrator.observe("m", {"text": 1000}, 2000)
+    calibrator.flush()
+    saved = json.loads(path.read_text())
+    assert saved["m"]["samples"] == 1
+
+    restored = TokenCalibrator(path)
+    assert restored.factors("m") == calibrator.factors("m")
+    assert restored.samples("m") == 1
+
+    path.write_text("not json")
+    assert TokenCalibrator(path).factors("m")["text"] == 1.0
+
+
+def test_factors_are_saved_in_the_background_at_most_every_interval(tmp_path):
+    path = tmp_path / "calibration.json"
+    now = [0.0]
+    calibrator = TokenCalibrator(path, save_interval=30, clock=lambda: now[0])
+
+    def saved_samples():
+        calibrator._pending_save.result()
+        return json.loads(path.read_text())["m"]["samples"]
+
+    calibrator.observe("m", {"text": 1000}, 2000)
+    assert saved_samples() == 1
+    calibrator.observe("m", {"text": 1000}, 2000)
+    assert saved_samples() == 1
+
+    now[0] = 31
+    calibrator.observe("m", {"text": 1000}, 2000)
+    assert saved_samples() == 3
+    assert [p.name for p in tmp_path.iterdir()] == ["calibration.json"]
+
+
+def test_reported_input_tokens_include_cache():
+    assert (
+        reported_input_tokens(
+            {
+                "input_tokens": 10,
+                "cache_read_input_tokens": 1000,
+                "cache_creation_input_tokens": -1,
+            }
+        )
+        == 1010
+    )
+    assert reported_input_tokens({"input_tokens": None}) == 0
+
+
+def test_history_counts_are_calibrated_by_reported_usage():
+    calibrator = TokenCalibrator()
+    token_counter = TokenCounter(model_name="m", calibrator=calibrator)
+    history = MessageHistory(
+        AmortizedForgettingContextManager(token_counter=token_counter, logger=Mock())
+    )
+    history.add_user_prompt("x" * 3000)
+    tools = [ToolParam(name="bash", description="Run a command", input_schema={})]
+    assert history.count_tokens() == 1000
+
+    for _ in range(40):
+        history.observe_usage({"input_tokens": 1500}, "s" * 30, tools)
+    factors = calibrator.factors("m")
+    # Most of the error is put on the text, which makes up most of the estimate
+    assert factors["text"] > 1.4
+    assert factors["system"] < factors["text"]
+    assert history.count_tokens() > 1400
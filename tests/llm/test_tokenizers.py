@@ -0,0 +1,140 @@
+import base64
+import io
+from unittest.mock import Mock
+
+import pytest
+from PIL import Image
+
+from ii_agent.llm import tokenizers
+from ii_agent.llm.token_counter import TokenCounter
+from ii_agent.llm.tokenizers import (
+    UNKNOWN_IMAGE_TOKENS,
+    BPEApproximationTokenizer,
+    HeuristicTokenizer,
+    ProviderTokenizer,
+    get_tokenizer,
+    image_size,
+    image_size_from_base64,
+)
+
+
+def encode_image(format, size=(1234, 567), **kwargs):
+    buffer = io.BytesIO()
+    Image.new("RGB", size).save(buffer, format, **kwargs)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize(
+    "format,kwargs",
+    [
+        ("PNG", {}),
+        ("JPEG", {}),
+        ("GIF", {}),
+        ("WEBP", {}),
+        ("WEBP", {"lossless": True}),
+    ],
+)
+def test_image_size_from_header(format, kwargs):
+    data = encode_image(format, **kwargs)
+    assert image_size(data) == (1234, 567)
+    assert image_size_from_base64(base64.b64encode(data).decode()) == (1234, 567)
+
+
+def test_image_size_decodes_only_the_header(monkeypatch):
+    exif = Image.Exif()
+    exif[0x010E] = "x" * 30000
+    jpeg = encode_image("JPEG", size=(800, 600), exif=exif)
+    # The frame header comes after 30 kB of metadata
+    assert image_size_from_base64(base64.b64encode(jpeg).decode()) == (800, 600)
+
+    decoded = []
+    real_decode = base64.b64decode
+    monkeypatch.setattr(
+        base64, "b64decode", lambda data: decoded.append(len(data)) or real_decode(data)
+    )
+    png = base64.b64encode(encode_image("PNG", size=(2000, 2000))).decode()
+    assert image_size_from_base64(png) == (2000, 2000)
+    assert decoded == [1024]
+
+    assert image_size(b"not an image") is None
+    assert image_size_from_base64("bm90IGFuIGltYWdl") is None
+
+
+def test_image_tokens_follow_provider_formulas():
+    assert BPEApproximationTokenizer("openai").count_image(512, 512) == 85 + 170
+    # Scaled to 768 on the short edge: 1365 x 768, six tiles
+    assert BPEApproximationTokenizer("openai").count_image(2560, 1440) == 85 + 170 * 6
+    assert BPEApproximationTokenizer("gemini").count_image(300, 300) == 258
+    assert BPEApproximationTokenizer("gemini").count_image(1024, 768) == 258 * 2
+    # Large screenshots are scaled down before counting
+    assert BPEApproximationTokenizer("anthropic").count_image(1000, 1000) == 1334
+    assert BPEApproximationTokenizer("anthropic").count_image(4000, 4000) == 1534
+
+
+def test_bpe_approximation():
+    tokenizer = BPEApproximationTokenizer("openai")
+    assert tokenizer.count_text("") == 0
+    assert tokenizer.count_text("The quick brown fox jumps over the lazy dog.") == 10
+    assert tokenizer.count_text("123456789") == 3
+    # Gemini splits numbers into digits
+    assert BPEApproximationTokenizer("gemini").count_text("123456789") == 9
+    assert tokenizer.count_text("数据库") == 3
+
+
+def test_get_tokenizer():
+    assert isinstance(get_tokenizer("claude-sonnet-4"), BPEApproximationTokenizer)
+    assert get_tokenizer("gpt-4.1").profile.family == "openai"
+    assert isinstance(get_tokenizer("local-model"), HeuristicTokenizer)
+    assert isinstance(get_tokenizer("claude-sonnet-4", "heuristic"), HeuristicTokenizer)
+    assert isinstance(
+        get_tokenizer("claude-sonnet-4", "api", Mock()), ProviderTokenizer
+    )
+    with pytest.raises(ValueError):
+        get_tokenizer("claude-sonnet-4", "words")
+
+
+def test_provider_tokenizer_counts_long_texts_once():
+    client = Mock()
+    client.count_tokens.return_value = 42
+    tokenizer = ProviderTokenizer(client, HeuristicTokenizer(), min_chars=100)
+    assert tokenizer.count_text("x" * 30) == 10
+    assert tokenizer.count_text("x" * 300) == 42
+    assert tokenizer.count_text("x" * 300) == 42
+    assert client.count_tokens.call_count == 1
+
+    # After a failure the estimate is used without asking again
+    client.count_tokens.side_effect = RuntimeError("unavailable")
+    assert tokenizer.count_text("y" * 300) == 100
+    assert tokenizer.count_text("z" * 300) == 100
+    assert client.count_tokens.call_count == 2
+
+
+def test_bpe_counts_are_cached_without_the_text():
+    tokenizer = BPEApproximationTokenizer("anthropic")
+    text = "word " * 10_000
+    count = tokenizer.count_text(text)
+    assert tokenizer.count_text(text) == count
+    assert all(isinstance(key, bytes) for key, _ in tokenizers._bpe_counts._counts)
+
+
+def test_token_counter_counts_images_from_headers():
+    counter = TokenCounter.for_model("claude-sonnet-4")
+    png = base64.b64encode(encode_image("PNG", size=(750, 100))).decode()
+    assert (
+        counter.count_image({"type": "base64", "media_type": "image/png", "data": png})
+        == 100
+    )
+    assert counter.count_image({"type": "url", "url": "https://example.com/a.png"}) == (
+        UNKNOWN_IMAGE_TOKENS
+    )
+    assert (
+        counter.count_tokens(
+            [
+                {"type": "image", "source": {"type": "base64", "data": png}},
+                {"type": "text", "text": "hi"},
+            ]
+        )
+        == 101
+    )
+    # The default counter keeps three characters per token
+    assert TokenCounter().count_tokens("x" * 30) == 10
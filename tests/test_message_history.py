@@ -1,11 +1,19 @@
+from unittest.mock import Mock, patch
+
 import pytest
 from ii_agent.llm.base import (
+    AnthropicThinkingBlock,
     TextPrompt,
     TextResult,
     ToolCall,
+    ToolCallParameters,
     ToolFormattedResult,
 )
+from ii_agent.llm.context_manager.amortized_forgetting import (
+    AmortizedForgettingContextManager,
+)
 from ii_agent.llm.message_history import MessageHistory
+from ii_agent.llm.token_counter import TokenCounter
 
 
 @pytest.fixture
@@ -103,3 +111,124 @@ class TestToolCallIntegrity:
             [TextResult(text="Done")],
         ]
         assert result == expected
+
+
+class CountingTokenCounter(TokenCounter):
+    def __init__(self):
+        super().__init__()
+        self.counted = []
+
+    def count_tokens(self, prompt_chars):
+        self.counted.append(prompt_chars)
+        return super().count_tokens(prompt_chars)
+
+
+def counted_history(max_size=100, token_budget=120_000):
+    counter = CountingTokenCounter()
+    context_manager = AmortizedForgettingContextManager(
+        token_counter=counter,
+        logger=Mock(),
+        token_budget=token_budget,
+        max_size=max_size,
+    )
+    return MessageHistory(context_manager), counter
+
+
+class TestTokenAccounting:
+    def test_only_new_turns_are_counted(self):
+        history, counter = counted_history()
+        history.add_user_prompt("a" * 30)
+        history.add_assistant_turn([TextResult(text="b" * 60)])
+        assert history.count_tokens() == 30
+        assert len(counter.counted) == 2
+
+        history.truncate()
+        history.add_user_prompt("c" * 90)
+        assert history.count_tokens() == 60
+        # Truncation reused the running total, the new prompt was counted once
+        assert counter.counted[2:] == ["c" * 90]
+
+    def test_thinking_counts_only_in_the_last_turn(self):
+        history, _ = counted_history()
+        history.add_user_prompt("a" * 30)
+        history.add_assistant_turn(
+            [
+                AnthropicThinkingBlock(
+                    type="thinking", thinking="t" * 300, signature="s"
+                ),
+                TextResult(text="b" * 30),
+            ]
+        )
+        assert history.count_tokens() == 120
+        history.add_user_prompt("c" * 30)
+        assert history.count_tokens() == 30
+
+    def test_counts_follow_truncation_and_clearing(self):
+        history, counter = counted_history(max_size=4)
+        for i in range(3):
+            history.add_user_prompt(f"{i}" * 30)
+            history.add_assistant_turn([TextResult(text="r" * 30)])
+        history.truncate()
+        assert len(history) == 2
+        assert history.count_tokens() == 20
+        counted = len(counter.counted)
+        # Blocks kept by truncation are not counted again
+        assert history.count_tokens() == 20
+        assert len(counter.counted) == counted
+
+        history.add_user_prompt("x" * 300)
+        history.add_assistant_turn([TextResult(text="y" * 300)])
+        history.clear_from_last_to_user_message()
+        assert history.count_tokens() == 20
+        history.clear()
+        assert history.count_tokens() == 0
+
+    def test_integrity_is_checked_only_after_changes(self):
+        history, _ = counted_history()
+        history.add_user_prompt("run ls")
+        history.add_assistant_turn(
+            [ToolCall(tool_call_id="1", tool_name="ls", tool_input={})]
+        )
+        history.add_tool_call_results(
+            [ToolCallParameters(tool_call_id="1", tool_name="ls", tool_input={})],
+            ["file"],
+        )
+        with patch.object(
+            MessageHistory,
+            "_ensure_tool_call_integrity",
+            wraps=MessageHistory._ensure_tool_call_integrity,
+        ) as check:
+            history.truncate()
+            assert check.call_count == 0
+
+            # A run stopped before its tool results leaves calls to clean up
+            history.add_assistant_turn(
+                [ToolCall(tool_call_id="2", tool_name="ls", tool_input={})]
+            )
+            history.truncate()
+            assert check.call_count == 1
+        assert len(history) == 3
+
+    def test_calls_left_by_a_tool_error_are_removed_after_a_new_prompt(self):
+        history, _ = counted_history()
+        history.add_user_prompt("run ls")
+        history.add_assistant_turn(
+            [
+                TextResult(text="Listing"),
+                ToolCall(tool_call_id="1", tool_name="ls", tool_input={}),
+            ]
+        )
+        # The run stopped on a tool error, and the user sent another prompt
+        history.add_user_prompt("try again")
+        history.truncate()
+        assert [type(block) for block in history.get_messages_for_llm()[1]] == [
+            TextResult
+        ]
+
+        with patch.object(
+            MessageHistory,
+            "_ensure_tool_call_integrity",
+            wraps=MessageHistory._ensure_tool_call_integrity,
+        ) as check:
+            history.truncate()
+            assert check.call_count == 0
@@ -0,0 +1,30 @@
+import asyncio
+from unittest.mock import Mock
+
+from fastapi.testclient import TestClient
+
+import ws_server
+from ii_agent.llm.prompt_cache import PromptCacheStats
+
+
+def test_metrics_do_not_expose_sessions(monkeypatch):
+    agents = {}
+    for session_id, queued in (("session-a", 2), ("session-b", 3)):
+        agent = Mock()
+        agent.message_queue = asyncio.Queue()
+        agent.cache_stats = PromptCacheStats(
+            input_tokens=100, cache_read_input_tokens=100 * queued
+        )
+        for i in range(queued):
+            agent.message_queue.put_nowait(i)
+        agents[session_id] = agent
+    monkeypatch.setattr(ws_server, "session_agents", agents)
+
+    response = TestClient(ws_server.app).get("/metrics")
+
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert "ii_agent_message_queue_depth 5" in lines
+    assert "ii_agent_cache_read_ratio 0.7142857142857143" in lines
+    assert "session_id" not in response.text
+    assert "session-a" not in response.text
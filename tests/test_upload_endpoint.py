@@ -0,0 +1,114 @@
+from argparse import Namespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import ws_server
+from ii_agent.utils.constants import UPLOAD_FOLDER_NAME
+
+SESSION_ID = "session"
+OTHER_SESSION_ID = "other-session"
+
+
+class FakeDatabaseManager:
+    """Sessions owned by the user the requests authenticate as."""
+
+    def get_session_for_device(self, session_id, email):
+        if email == "user@example.com" and session_id in (SESSION_ID, OTHER_SESSION_ID):
+            return Namespace(id=session_id)
+        return None
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    (tmp_path / SESSION_ID).mkdir()
+    (tmp_path / OTHER_SESSION_ID).mkdir()
+    monkeypatch.setattr(ws_server, "global_args", Namespace(workspace=str(tmp_path)))
+    monkeypatch.setattr(
+        ws_server,
+        "authenticate_request",
+        lambda request: {"email": request.headers.get("X-Email", "user@example.com")},
+    )
+    monkeypatch.setattr(ws_server, "DatabaseManager", FakeDatabaseManager)
+    return TestClient(ws_server.app)
+
+
+def put_chunk(
+    client,
+    body,
+    offset,
+    total=10,
+    upload_id="u1",
+    path="data.bin",
+    session_id=SESSION_ID,
+    headers=None,
+):
+    return client.put(
+        f"/api/upload/{session_id}",
+        params={
+            "path": path,
+            "upload_id": upload_id,
+            "total": total,
+            "offset": offset,
+        },
+        content=body,
+        headers=headers,
+    )
+
+
+def test_upload_resumes_at_offset(client, tmp_path):
+    response = put_chunk(client, b"01234", 0)
+    assert response.json() == {"upload_id": "u1", "offset": 5, "complete": False}
+    assert client.get(f"/api/upload/{SESSION_ID}/u1").json()["offset"] == 5
+
+    response = put_chunk(client, b"56789", 5)
+    assert response.json()["complete"] is True
+    saved = tmp_path / SESSION_ID / UPLOAD_FOLDER_NAME / "data.bin"
+    assert saved.read_bytes() == b"0123456789"
+
+
+def test_offset_mismatch_is_rejected(client):
+    put_chunk(client, b"01234", 0)
+    response = put_chunk(client, b"789", 7)
+    assert response.status_code == 409
+    assert response.json()["offset"] == 5
+    # The upload can still resume from what was received
+    assert put_chunk(client, b"56789", 5).json()["complete"] is True
+
+
+def test_oversized_body_keeps_only_accepted_bytes(client, tmp_path):
+    put_chunk(client, b"01234", 0)
+    response = put_chunk(client, b"56789abc", 5)
+    assert response.status_code == 400
+    assert client.get(f"/api/upload/{SESSION_ID}/u1").json()["offset"] == 5
+
+    assert put_chunk(client, b"56789", 5).json()["complete"] is True
+    saved = tmp_path / SESSION_ID / UPLOAD_FOLDER_NAME / "data.bin"
+    assert saved.read_bytes() == b"0123456789"
+
+
+def test_uploads_are_only_accepted_for_the_callers_sessions(client, tmp_path):
+    response = put_chunk(
+        client, b"0123456789", 0, headers={"X-Email": "eve@example.com"}
+    )
+    assert response.status_code == 404
+    response = client.get(
+        f"/api/upload/{SESSION_ID}/u1", headers={"X-Email": "eve@example.com"}
+    )
+    assert response.status_code == 404
+    assert not (tmp_path / SESSION_ID / UPLOAD_FOLDER_NAME).exists()
+
+
+def test_paths_out_of_the_upload_folder_are_rejected(client, tmp_path):
+    response = put_chunk(client, b"0123456789", 0, path="../../escaped.bin")
+    assert response.status_code == 400
+    assert not (tmp_path / "escaped.bin").exists()
+    assert not (tmp_path / SESSION_ID / UPLOAD_FOLDER_NAME).exists()
+
+
+def test_upload_ids_are_per_session(client):
+    ws_server.active_uploads.add((OTHER_SESSION_ID, "u1"))
+    try:
+        assert put_chunk(client, b"0123456789", 0).json()["complete"] is True
+    finally:
+        ws_server.active_uploads.discard((OTHER_SESSION_ID, "u1"))
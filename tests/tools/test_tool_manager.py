@@ -0,0 +1,92 @@
+import asyncio
+import logging
+from typing import Any, Optional
+from unittest.mock import Mock
+
+from ii_agent.llm.message_history import MessageHistory, ToolCallParameters
+from ii_agent.tools.base import LLMTool, ToolImplOutput
+from ii_agent.tools.tool_manager import AgentToolManager
+
+
+class SlowTool(LLMTool):
+    description = "Wait, then return the input text."
+    input_schema = {
+        "type": "object",
+        "properties": {"text": {"type": "string"}},
+        "required": ["text"],
+    }
+
+    def __init__(self, name: str, read_only: bool, log: list):
+        self.name = name
+        self.read_only = read_only
+        self.log = log
+
+    def run_impl(
+        self,
+        tool_input: dict[str, Any],
+        message_history: Optional[MessageHistory] = None,
+    ) -> ToolImplOutput:
+        raise NotImplementedError
+
+    async def arun_impl(
+        self,
+        tool_input: dict[str, Any],
+        message_history: Optional[MessageHistory] = None,
+    ) -> ToolImplOutput:
+        self.log.append(("start", tool_input["text"]))
+        await asyncio.sleep(0.05)
+        self.log.append(("end", tool_input["text"]))
+        return ToolImplOutput(tool_input["text"], "done")
+
+
+def make_manager(log: list, **kwargs) -> AgentToolManager:
+    return AgentToolManager(
+        tools=[SlowTool("search", True, log), SlowTool("write", False, log)],
+        logger_for_agent_logs=Mock(spec=logging.Logger),
+        **kwargs,
+    )
+
+
+def calls(*names: str) -> list[ToolCallParameters]:
+    return [
+        ToolCallParameters(
+            tool_call_id=str(i), tool_name=name, tool_input={"text": f"{name}{i}"}
+        )
+        for i, name in enumerate(names)
+    ]
+
+
+def test_read_only_calls_run_concurrently():
+    log = []
+    manager = make_manager(log)
+
+    results = asyncio.run(manager.arun_tools(calls("search", "search", "search"), None))
+
+    assert results == ["search0", "search1", "search2"]
+    # All calls started before the first one finished
+    assert [event for event, _ in log[:3]] == ["start"] * 3
+
+
+def test_side_effecting_calls_run_alone_and_in_order():
+    log = []
+    manager = make_manager(log)
+
+    results = asyncio.run(
+        manager.arun_tools(calls("search", "search", "write", "search"), None)
+    )
+
+    assert results == ["search0", "search1", "write2", "search3"]
+    write_start = log.index(("start", "write2"))
+    write_end = log.index(("end", "write2"))
+    assert write_end == write_start + 1
+    assert ("end", "search1") in log[:write_start]
+    assert log[write_end + 1] == ("start", "search3")
+
+
+def test_parallel_calls_are_limited():
+    log = []
+    manager = make_manager(log, max_parallel_tool_calls=2)
+
+    asyncio.run(manager.arun_tools(calls("search", "search", "search"), None))
+
+    assert [event for event, _ in log[:3]] == ["start", "start", "end"]
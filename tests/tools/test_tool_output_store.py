@@ -0,0 +1,117 @@
+import asyncio
+import logging
+from unittest.mock import Mock
+
+import pytest
+
+from ii_agent.llm.message_history import ToolCallParameters
+from ii_agent.tools.read_tool_output_tool import ReadToolOutputTool
+from ii_agent.tools.tool_manager import AgentToolManager
+from ii_agent.tools.tool_output_store import ToolOutputStore
+from ii_agent.tools.visit_webpage_tool import VisitWebpageTool
+from ii_agent.utils import WorkspaceManager
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ToolOutputStore(
+        WorkspaceManager(root=tmp_path), max_chars=1000, head_chars=100, tail_chars=50
+    )
+
+
+def test_short_outputs_are_kept(store):
+    assert store.spill("bash", "x" * 1000) == "x" * 1000
+    assert not store.directory.exists()
+
+
+def test_long_outputs_are_saved_by_content(store):
+    output = "".join(f"line {i}\n" for i in range(1000))
+    preview = store.spill("bash", output)
+
+    assert preview.startswith(output[:100])
+    assert preview.endswith(output[-50:])
+    assert f"{len(output)} characters" in preview
+    handle = preview.split("saved as tool output ")[1].split()[0]
+    assert store.read(handle) == (output, len(output))
+    assert store.read(handle, 10, 5) == (output[10:15], len(output))
+    assert ".tool_outputs" in preview
+
+    # The same output is saved once, under the same handle
+    assert store.spill("bash", output) == preview
+    assert len(list(store.directory.iterdir())) == 1
+
+    with pytest.raises(ValueError):
+        store.path("../secrets")
+
+
+def test_read_tool_pages_through_an_output(store):
+    output = "abcdefghij" * 200
+    handle = store.save(output)
+    tool = ReadToolOutputTool(store)
+
+    page = tool.run({"handle": handle, "offset": 5, "length": 10})
+    assert page.endswith(
+        f"{handle}:\n{output[5:15]}\n[... 1985 more characters. Continue with offset 15. ...]"
+    )
+    # Pages are never longer than what the history keeps of an output
+    assert "0-1000 of 2000" in tool.run({"handle": handle})
+    assert tool.run({"handle": handle, "offset": 1990}).endswith(output[1990:])
+    assert tool.run({"handle": "0" * 16}).startswith("Error")
+    assert tool.run({"handle": "../../etc/passwd"}).startswith("Error")
+
+
+def test_tool_manager_spills_long_outputs(store):
+    bash = Mock(read_only=False)
+    bash.name = "bash"
+    visit = Mock(read_only=True)
+    visit.name = VisitWebpageTool.name
+    manager = AgentToolManager(
+        tools=[bash, visit],
+        logger_for_agent_logs=Mock(spec=logging.Logger),
+        output_store=store,
+        file_save_output_chars=500,
+    )
+
+    def call(tool_name):
+        return ToolCallParameters(tool_call_id="1", tool_name=tool_name, tool_input={})
+
+    bash.run.return_value = "b" * 800
+    assert manager.run_tool(call("bash"), None) == "b" * 800
+    bash.run.return_value = "b" * 5000
+    preview = manager.run_tool(call("bash"), None)
+    assert len(preview) < 500
+
+    # Web pages are saved at a lower length
+    visit.arun.side_effect = lambda *args: asyncio.sleep(0, result="v" * 800)
+    assert "saved as tool output" in asyncio.run(
+        manager.arun_tool(call(visit.name), None)
+    )
+
+    # Outputs can be read back through the manager
+    handle = preview.split("saved as tool output ")[1].split()[0]
+    read_call = ToolCallParameters(
+        tool_call_id="2", tool_name="read_tool_output", tool_input={"handle": handle}
+    )
+    # Pages are not saved again, even when long
+    assert f"{handle}:\n{'b' * 1000}\n" in manager.run_tool(read_call, None)
+
+
+def test_parallel_calls_spill_the_same_output(store):
+    search = Mock(read_only=True)
+    search.name = "search"
+    search.arun.side_effect = lambda *args: asyncio.sleep(0, result="s" * 5000)
+    manager = AgentToolManager(
+        tools=[search],
+        logger_for_agent_logs=Mock(spec=logging.Logger),
+        output_store=store,
+    )
+    calls = [
+        ToolCallParameters(tool_call_id=str(i), tool_name="search", tool_input={})
+        for i in range(8)
+    ]
+
+    results = asyncio.run(manager.arun_tools(calls, None))
+
+    assert len(set(results)) == 1
+    assert "saved as tool output" in results[0]
+    assert len(list(store.directory.iterdir())) == 1
@@ -1,9 +1,40 @@
 from argparse import ArgumentParser
+import atexit
+import logging
 import uuid
 from pathlib import Path
+from ii_agent.llm import (
+    CacheMode,
+    CachingLLMClient,
+    HedgedLLMClient,
+    LLMClient,
+    get_client,
+)
+from ii_agent.llm.context_manager import (
+    AmortizedForgettingContextManager,
+    LLMSummarizingContextManager,
+    ObservationMaskingContextManager,
+    PipelineContextManager,
+)
+from ii_agent.llm.context_manager.base import ContextManager
+from ii_agent.llm.hedged import hedge_client_kwargs
+from ii_agent.llm.http_pool import HTTP_CLIENTS, parse_pool_limits
+from ii_agent.llm.rate_limit import RATE_LIMITERS, parse_rate_limits
+from ii_agent.llm.token_calibration import TOKEN_CALIBRATOR
+from ii_agent.llm.token_counter import TokenCounter
+from ii_agent.llm.tokenizers import TOKENIZER_BACKENDS
 from ii_agent.utils import WorkspaceManager
 from ii_agent.utils.constants import DEFAULT_MODEL
 
+logger = logging.getLogger(__name__)
+
+CONTEXT_MANAGERS = (
+    "llm-summarizing",
+    "amortized-forgetting",
+    "observation-masking",
+    "observation-masking+llm-summarizing",
+)
+
 
 def parse_common_args(parser: ArgumentParser):
     parser.add_argument(
@@ -59,8 +90,9 @@ def parse_common_args(parser: ArgumentParser):
         "--context-manager",
         type=str,
         default="llm-summarizing",
-        choices=["llm-summarizing", "amortized-forgetting"],
-        help="Type of context manager to use (llm-summarizing, or amortized-forgetting)",
+        choices=CONTEXT_MANAGERS,
+        help="Type of context manager to use (llm-summarizing, amortized-forgetting, "
+        "observation-masking, or observation-masking+llm-summarizing)",
     )
     parser.add_argument(
         "--memory-tool",
@@ -101,9 +133,158 @@ def parse_common_args(parser: ArgumentParser):
         default=None,
         help="Prompt to use for the LLM",
     )
+    parser.add_argument(
+        "--llm-cache",
+        type=str,
+        default=None,
+        help="(Optional) Cassette file to record LLM responses to and replay them from",
+    )
+    parser.add_argument(
+        "--llm-cache-mode",
+        type=str,
+        default=CacheMode.READ_THROUGH.value,
+        choices=[mode.value for mode in CacheMode],
+        help="Whether to record, only replay, or replay and record missing responses",
+    )
+    parser.add_argument(
+        "--llm-pool-limits",
+        type=parse_pool_limits,
+        action="append",
+        default=[],
+        metavar="PROVIDER=MAX_CONNECTIONS[,MAX_KEEPALIVE]",
+        help="(Optional) Connection limits of a provider's shared HTTP pool, repeatable",
+    )
+    parser.add_argument(
+        "--llm-rate-limits",
+        type=parse_rate_limits,
+        action="append",
+        default=[],
+        metavar="PROVIDER=REQUESTS_PER_MINUTE[,TOKENS_PER_MINUTE]",
+        help="(Optional) Request budgets per model of a provider, repeatable. "
+        "Budgets are otherwise learned from the provider's rate limit headers",
+    )
+    parser.add_argument(
+        "--tokenizer",
+        type=str,
+        default="bpe",
+        choices=TOKENIZER_BACKENDS,
+        help="How history tokens are counted: heuristic (3 characters per token), bpe "
+        "(offline approximation of the model's tokenizer), tiktoken (OpenAI models) or "
+        "api (the provider's count tokens endpoint for long texts)",
+    )
+    parser.add_argument(
+        "--token-calibration-file",
+        type=str,
+        default="token_calibration.json",
+        help="File where the correction factors of token estimates, learned from the "
+        "usage providers report, are kept across sessions. Empty to not keep them",
+    )
+    parser.add_argument(
+        "--hedge-region",
+        type=str,
+        default=None,
+        help="(Optional) Vertex region, or 'direct' for the provider's own API, to send "
+        "a duplicate of slow LLM requests to, and overloaded ones instead",
+    )
+    parser.add_argument(
+        "--hedge-percentile",
+        type=float,
+        default=95.0,
+        help="Percentile of recent LLM latencies after which a request is hedged",
+    )
     return parser
 
 
+def configure_llm_limits(args) -> None:
+    """Apply the connection and rate limits and the token calibration given on the command line."""
+    for provider, limits in args.llm_pool_limits:
+        HTTP_CLIENTS.set_limits(provider, limits)
+    for provider, limits in args.llm_rate_limits:
+        RATE_LIMITERS.set_limits(provider, limits)
+    if args.token_calibration_file:
+        TOKEN_CALIBRATOR.load(args.token_calibration_file)
+        # Keep what was learned since the last background save
+        atexit.register(TOKEN_CALIBRATOR.flush)
+
+
+def create_llm_client(client_name: str, args, **client_kwargs) -> LLMClient:
+    """Create an LLM client, hedged to the region given on the command line, if any."""
+    client = get_client(client_name, **client_kwargs)
+    if not getattr(args, "hedge_region", None) or client_name == "replay":
+        return client
+    try:
+        hedge_kwargs = hedge_client_kwargs(
+            client_name, client_kwargs, args.hedge_region
+        )
+    except ValueError as e:
+        logger.warning(f"Not hedging {client_name} requests: {e}")
+        return client
+    secondary = get_client(client_name, **hedge_kwargs)
+    return HedgedLLMClient(client, secondary, hedge_percentile=args.hedge_percentile)
+
+
+def create_context_manager(
+    name: str,
+    client: LLMClient,
+    token_counter: TokenCounter,
+    logger_for_agent_logs: logging.Logger,
+    token_budget: int = 120_000,
+) -> ContextManager:
+    """Create one of the context managers in CONTEXT_MANAGERS by name."""
+    if name == "llm-summarizing":
+        return LLMSummarizingContextManager(
+            client=client,
+            token_counter=token_counter,
+            logger=logger_for_agent_logs,
+            token_budget=token_budget,
+        )
+    elif name == "amortized-forgetting":
+        return AmortizedForgettingContextManager(
+            token_counter=token_counter,
+            logger=logger_for_agent_logs,
+            token_budget=token_budget,
+        )
+    elif name == "observation-masking":
+        return ObservationMaskingContextManager(
+            token_counter=token_counter,
+            logger=logger_for_agent_logs,
+            token_budget=token_budget,
+        )
+    elif name == "observation-masking+llm-summarizing":
+        # Summarize only when masking old observations is not enough. The
+        # pipeline masks down to where the summarizer would summarize ahead,
+        # so it only does once masking cannot keep up
+        return PipelineContextManager(
+            token_counter=token_counter,
+            logger=logger_for_agent_logs,
+            token_budget=token_budget,
+            context_managers=[
+                create_context_manager(
+                    "observation-masking",
+                    client,
+                    token_counter,
+                    logger_for_agent_logs,
+                    token_budget,
+                ),
+                create_context_manager(
+                    "llm-summarizing",
+                    client,
+                    token_counter,
+                    logger_for_agent_logs,
+                    token_budget,
+                ),
+            ],
+        )
+    raise ValueError(f"Unknown context manager type: {name}")
+
+
+def wrap_llm_cache(client: LLMClient, args) -> LLMClient:
+    """Serve the client's responses from the cassette given on the command line, if any."""
+    if not args.llm_cache:
+        return client
+    return CachingLLMClient(client, args.llm_cache, args.llm_cache_mode)
+
+
 def create_workspace_manager_for_connection(
     workspace_root: str, use_container_workspace: bool = False
 ):
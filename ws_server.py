@@ -9,15 +9,18 @@ allowing real-time communication with a frontend application.
 import os
 import argparse
 import asyncio
+import itertools
 import json
 import logging
+import re
 import uuid
 from pathlib import Path
-from typing import Dict, List, Set, Any, Optional
+from typing import Dict, List, Set, Any, Optional, Tuple
 from dotenv import load_dotenv
 
 load_dotenv()
 
+import anyio
 import uvicorn
 from fastapi import (
     FastAPI,
@@ -27,38 +30,46 @@ from fastapi import (
     HTTPException,
 )
 
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import anyio
 import base64
 import jwt
 from datetime import datetime
 
 from ii_agent.core.event import RealtimeEvent, EventType
-from ii_agent.db.models import Session, Event
+from ii_agent.core.metrics import REGISTRY, Gauge
+from ii_agent.core.scheduler import AgentScheduler, RunPriority
 from ii_agent.utils.constants import DEFAULT_MODEL, UPLOAD_FOLDER_NAME
-from utils import parse_common_args, create_workspace_manager_for_connection
+from utils import (
+    parse_common_args,
+    create_workspace_manager_for_connection,
+    configure_llm_limits,
+    create_context_manager,
+    create_llm_client,
+    wrap_llm_cache,
+)
 from ii_agent.agents.anthropic_fc import AnthropicFC
 from ii_agent.agents.base import BaseAgent
 from ii_agent.llm.base import LLMClient
 from ii_agent.utils import WorkspaceManager
-from ii_agent.llm import get_client
+from ii_agent.llm.http_pool import HTTP_CLIENTS
 from ii_agent.utils.prompt_generator import enhance_user_prompt
 
 from fastapi.staticfiles import StaticFiles
 
-from ii_agent.llm.context_manager.llm_summarizing import LLMSummarizingContextManager
-from ii_agent.llm.context_manager.amortized_forgetting import (
-    AmortizedForgettingContextManager,
-)
 from ii_agent.llm.token_counter import TokenCounter
-from ii_agent.db.manager import DatabaseManager
+from ii_agent.db.manager import DatabaseManager, encode_cursor
+from ii_agent.db.event_writer import get_event_writer
 from ii_agent.tools import get_system_tools
 from ii_agent.prompts.system_prompt import SYSTEM_PROMPT, SYSTEM_PROMPT_WITH_SEQ_THINKING
 
 MAX_OUTPUT_TOKENS_PER_TURN = 32000
 MAX_TURNS = 200
 
+# Resumable uploads are kept here, inside the upload folder, until complete
+UPLOAD_PARTS_FOLDER_NAME = ".partial"
+UPLOAD_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
 
 app = FastAPI(title="Agent WebSocket API")
 app.add_middleware(
@@ -91,12 +102,94 @@ active_agents: Dict[WebSocket, BaseAgent] = {}
 # Active agent tasks
 active_tasks: Dict[WebSocket, asyncio.Task] = {}
 
+# Agents by session ID, kept after a disconnect so a client can resume
+session_agents: Dict[str, BaseAgent] = {}
+
+# Seconds an agent stays resumable after its run ended without a client
+RESUME_GRACE_PERIOD = 300
+
+# Agent runs that outlived their websocket connection
+detached_tasks: Dict[BaseAgent, asyncio.Task] = {}
+
+# Resumable uploads currently receiving a chunk, by session and upload id
+active_uploads: Set[Tuple[str, str]] = set()
+
 # Store message processors for each connection
 message_processors: Dict[WebSocket, asyncio.Task] = {}
 
 # Store global args for use in endpoint
 global_args = None
 
+# Admission control for agent runs across all connections, sized in main()
+scheduler = AgentScheduler()
+
+# Gauges read from the state above when metrics are scraped
+REGISTRY.register(
+    Gauge(
+        "ii_agent_active_connections",
+        "Open websocket connections.",
+        callback=lambda: len(active_connections),
+    )
+)
+REGISTRY.register(
+    Gauge(
+        "ii_agent_active_agents",
+        "Agents of sessions that can still be resumed.",
+        callback=lambda: len(session_agents),
+    )
+)
+REGISTRY.register(
+    Gauge(
+        "ii_agent_active_tasks",
+        "Agent runs in progress, by whether a client is connected.",
+        labels=("attached",),
+        callback=lambda: {
+            ("true",): sum(1 for task in active_tasks.values() if not task.done()),
+            ("false",): len(detached_tasks),
+        },
+    )
+)
+REGISTRY.register(
+    Gauge(
+        "ii_agent_scheduled_runs",
+        "Agent runs holding or waiting for a scheduler slot.",
+        labels=("state",),
+        callback=lambda: {
+            ("running",): scheduler.running_count,
+            ("waiting",): scheduler.waiting_count,
+        },
+    )
+)
+# No session labels: /metrics is unauthenticated, and sessions come and go
+REGISTRY.register(
+    Gauge(
+        "ii_agent_message_queue_depth",
+        "Events waiting in the message queues of all sessions.",
+        callback=lambda: sum(
+            agent.message_queue.qsize() for agent in session_agents.values()
+        ),
+    )
+)
+
+
+def cache_read_ratio() -> float:
+    """Share of the LLM input tokens of all sessions read from the prompt cache."""
+    read = total = 0
+    for agent in session_agents.values():
+        read += agent.cache_stats.cache_read_input_tokens
+        total += agent.cache_stats.total_input_tokens
+    return read / total if total else 0.0
+
+
+REGISTRY.register(
+    Gauge(
+        "ii_agent_cache_read_ratio",
+        "Share of the LLM input tokens of resumable sessions read from the "
+        "prompt cache.",
+        callback=cache_read_ratio,
+    )
+)
+
 
 def authenticate_request(request: Request) -> Dict[str, Any]:
     """Extract and validate NextAuth JWT token from request headers.
@@ -222,32 +315,66 @@ def map_model_name_to_client(model_name: str, ws_content: Dict[str, Any]) -> LLM
         ValueError: If the model name is not supported
     """
     if "claude" in model_name:
-        return get_client(
+        return create_llm_client(
             "anthropic-direct",
+            global_args,
             model_name=model_name,
-            use_caching=False,
+            use_caching=True,
             project_id=global_args.project_id,
             region=global_args.region,
             thinking_tokens=ws_content.get("thinking_tokens", 0),
         )
     elif "gemini" in model_name:
-        return get_client(
+        return create_llm_client(
             "gemini-direct",
+            global_args,
             model_name=model_name,
             project_id=global_args.project_id,
             region=global_args.region,
         )
     elif model_name in ["o3", "o4-mini", "gpt-4.1", "gpt-4o"]:
-        return get_client(
+        return create_llm_client(
             "openai-direct",
+            global_args,
             model_name=model_name,
             azure_model=ws_content.get("azure_model", True),
             cot_model=ws_content.get("cot_model", False),
         )
+    elif model_name == "replay" and global_args.replay:
+        return create_llm_client(
+            "replay",
+            global_args,
+            script_path=global_args.replay_script,
+            latency=global_args.replay_latency,
+            variables=ws_content.get("replay_variables", {}),
+        )
     else:
         raise ValueError(f"Unknown model name: {model_name}")
 
 
+@app.on_event("shutdown")
+async def flush_pending_events():
+    """Write events still buffered by the event writer before exiting."""
+    await get_event_writer().close()
+
+
+@app.on_event("shutdown")
+async def close_llm_connections():
+    """Close the connection pools shared by the LLM clients."""
+    await HTTP_CLIENTS.aclose()
+
+
+@app.get("/metrics")
+async def metrics():
+    """Expose runtime metrics in the Prometheus text format.
+
+    Left unauthenticated for scrapers, so no metric identifies a session or user.
+    """
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
@@ -282,7 +409,9 @@ async def websocket_endpoint(websocket: WebSocket):
                 if msg_type == "init_agent":
                     model_name = content.get("model_name", DEFAULT_MODEL)
                     # Initialize LLM client
-                    client = map_model_name_to_client(model_name, content)
+                    client = wrap_llm_cache(
+                        map_model_name_to_client(model_name, content), global_args
+                    )
 
                     # Create a new agent for this connection
                     tool_args = content.get("tool_args", {})
@@ -290,6 +419,7 @@ async def websocket_endpoint(websocket: WebSocket):
                         client, session_uuid, workspace_manager, websocket, tool_args
                     )
                     active_agents[websocket] = agent
+                    session_agents[str(session_uuid)] = agent
 
                     # Start message processor for this connection
                     message_processor = agent.start_message_processing()
@@ -318,6 +448,20 @@ async def websocket_endpoint(websocket: WebSocket):
                     user_input = content.get("text", "")
                     resume = content.get("resume", False)
                     files = content.get("files", [])
+                    try:
+                        priority = RunPriority(
+                            content.get("priority", RunPriority.INTERACTIVE.value)
+                        )
+                    except ValueError:
+                        await websocket.send_json(
+                            RealtimeEvent(
+                                type=EventType.ERROR,
+                                content={
+                                    "message": f"Unknown priority: {content.get('priority')}"
+                                },
+                            ).model_dump()
+                        )
+                        continue
 
                     # Send acknowledgment
                     await websocket.send_json(
@@ -329,10 +473,21 @@ async def websocket_endpoint(websocket: WebSocket):
 
                     # Run the agent with the query in a separate task
                     task = asyncio.create_task(
-                        run_agent_async(websocket, user_input, resume, files)
+                        run_agent_async(websocket, user_input, resume, files, priority)
                     )
                     active_tasks[websocket] = task
 
+                elif msg_type == "resume":
+                    # Reattach to the agent of a session this client was connected to
+                    resumed = await resume_session(
+                        websocket,
+                        content.get("session_id", ""),
+                        int(content.get("last_seq") or 0),
+                    )
+                    if resumed:
+                        workspace_manager = resumed.workspace_manager
+                        session_uuid = str(resumed.session_id)
+
                 elif msg_type == "workspace_info":
                     # Send information about the current workspace
                     if workspace_manager:
@@ -405,6 +560,8 @@ async def websocket_endpoint(websocket: WebSocket):
                     # Delete events from database up to last user message if we have a session ID
                     if agent.session_id:
                         try:
+                            # Buffered events of the cancelled turn must be written before deleting
+                            await agent.db_manager.flush_events()
                             agent.db_manager.delete_events_from_last_to_user_message(
                                 agent.session_id
                             )
@@ -479,8 +636,10 @@ async def websocket_endpoint(websocket: WebSocket):
                     user_input = content.get("text", "")
                     files = content.get("files", [])
                     # Initialize LLM client
-                    client = map_model_name_to_client(model_name, content)
-                    
+                    client = wrap_llm_cache(
+                        map_model_name_to_client(model_name, content), global_args
+                    )
+
                     # Call the enhance_prompt function from the module
                     success, message, enhanced_prompt = await enhance_user_prompt(
                         client=client,
@@ -542,10 +701,27 @@ async def websocket_endpoint(websocket: WebSocket):
         cleanup_connection(websocket)
 
 
+def get_connection_user_id(websocket: WebSocket) -> str:
+    """Identify the user of a websocket connection for scheduling."""
+    token = websocket.query_params.get("token")
+    user_info = decode_nextauth_token(token) if token else None
+    if not user_info or not user_info.get("email"):
+        return "anonymous"
+    return user_info["email"]
+
+
 async def run_agent_async(
-    websocket: WebSocket, user_input: str, resume: bool = False, files: List[str] = []
+    websocket: WebSocket,
+    user_input: str,
+    resume: bool = False,
+    files: List[str] = [],
+    priority: RunPriority = RunPriority.INTERACTIVE,
 ):
-    """Run the agent asynchronously and send results back to the websocket."""
+    """Run the agent asynchronously and send results back to the websocket.
+
+    The run waits for a slot from the scheduler first, and the client is told
+    its queue position while it waits.
+    """
     agent = active_agents.get(websocket)
 
     if not agent:
@@ -562,10 +738,23 @@ async def run_agent_async(
         agent.message_queue.put_nowait(
             RealtimeEvent(type=EventType.USER_MESSAGE, content={"text": user_input})
         )
-        # Run the agent with the query
-        await anyio.to_thread.run_sync(
-            agent.run_agent, user_input, files, resume, abandon_on_cancel=True
-        )
+
+        def report_position(position: int):
+            agent.message_queue.put_nowait(
+                RealtimeEvent(
+                    type=EventType.QUEUE_POSITION, content={"position": position}
+                )
+            )
+
+        # A cancel while queued is remembered until the slot is granted
+        agent.interrupted = False
+        async with scheduler.slot(
+            get_connection_user_id(websocket), priority, on_position=report_position
+        ):
+            if agent.interrupted:
+                return
+            # Run the agent with the query
+            await agent.arun_agent(user_input, files, resume)
 
     except Exception as e:
         logger.error(f"Error running agent: {str(e)}")
@@ -584,6 +773,63 @@ async def run_agent_async(
             del active_tasks[websocket]
 
 
+async def resume_session(
+    websocket: WebSocket, session_id: str, last_seq: int
+) -> Optional[BaseAgent]:
+    """Attach a reconnected websocket to the agent of a session.
+
+    Events the client missed are replayed from the agent's event buffer. When
+    they are no longer buffered, the client is told to fetch the saved events.
+
+    Returns:
+        The agent, or None if the session cannot be resumed
+    """
+    agent = session_agents.get(session_id)
+    user_id = get_connection_user_id(websocket)
+    if not agent or not agent.db_manager.get_session_for_device(session_id, user_id):
+        await websocket.send_json(
+            RealtimeEvent(
+                type=EventType.ERROR,
+                content={"message": f"Session {session_id} cannot be resumed"},
+            ).model_dump()
+        )
+        return None
+
+    # Detach the agent from the connection it is currently attached to
+    for other, other_agent in list(active_agents.items()):
+        if other_agent is agent and other is not websocket:
+            cleanup_connection(other)
+    active_agents[websocket] = agent
+    task = detached_tasks.pop(agent, None)
+    if task is not None and not task.done():
+        active_tasks[websocket] = task
+
+    complete = await agent.attach_websocket(websocket, last_seq)
+    if not complete:
+        # Everything the client fetches next must already be saved
+        await agent.db_manager.flush_events()
+    await websocket.send_json(
+        RealtimeEvent(
+            type=EventType.SESSION_RESUMED,
+            content={
+                "session_id": session_id,
+                "last_seq": agent.event_buffer.last_seq,
+                "missed_events": not complete,
+                "running": websocket in active_tasks,
+            },
+        ).model_dump()
+    )
+    return agent
+
+
+def release_session_agent(agent: BaseAgent):
+    """Forget the agent of a session unless a client has resumed it."""
+    if agent.websocket is not None or agent in detached_tasks:
+        return
+    if session_agents.get(str(agent.session_id)) is agent:
+        del session_agents[str(agent.session_id)]
+
+
 def cleanup_connection(websocket: WebSocket):
     """Clean up resources associated with a websocket connection."""
     # Remove from active connections
@@ -591,8 +837,8 @@ def cleanup_connection(websocket: WebSocket):
         active_connections.remove(websocket)
 
     # Set websocket to None in the agent but keep the message processor running
-    if websocket in active_agents:
-        agent = active_agents[websocket]
+    agent = active_agents.pop(websocket, None)
+    if agent is not None:
         agent.websocket = (
             None  # This will prevent sending to websocket but keep processing
         )
@@ -600,14 +846,27 @@ def cleanup_connection(websocket: WebSocket):
         if websocket in message_processors:
             del message_processors[websocket]  # Just remove the reference
 
-    # Cancel any running tasks
-    if websocket in active_tasks and not active_tasks[websocket].done():
-        active_tasks[websocket].cancel()
-        del active_tasks[websocket]
+    # Let a running agent finish in the background, its events are still
+    # saved to the database by the message processor
+    task = active_tasks.pop(websocket, None)
+    if agent is not None and task is not None and not task.done():
+        detached_tasks[agent] = task
+
+        def on_detached_task_done(_):
+            if detached_tasks.get(agent) is task:
+                del detached_tasks[agent]
+            schedule_session_release(agent)
 
-    # Remove agent for this connection
-    if websocket in active_agents:
-        del active_agents[websocket]
+        task.add_done_callback(on_detached_task_done)
+    elif agent is not None:
+        schedule_session_release(agent)
+
+
+def schedule_session_release(agent: BaseAgent):
+    # The session stays resumable for a while after its run ended
+    asyncio.get_running_loop().call_later(
+        RESUME_GRACE_PERIOD, release_session_agent, agent
+    )
 
 
 def create_agent_for_connection(
@@ -654,23 +913,13 @@ def create_agent_for_connection(
     )
 
     # Initialize token counter
-    token_counter = TokenCounter()
-
-    if global_args.context_manager == "llm-summarizing":
-        context_manager = LLMSummarizingContextManager(
-            client=client,
-            token_counter=token_counter,
-            logger=logger_for_agent_logs,
-            token_budget=120_000,
-        )
-    elif global_args.context_manager == "amortized-forgetting":
-        context_manager = AmortizedForgettingContextManager(
-            token_counter=token_counter,
-            logger=logger_for_agent_logs,
-            token_budget=120_000,
-        )
-    else:
-        raise ValueError(f"Unknown context manager type: {global_args.context_manager}")
+    token_counter = TokenCounter.for_model(
+        client.model_name, global_args.tokenizer, client
+    )
+
+    context_manager = create_context_manager(
+        global_args.context_manager, client, token_counter, logger_for_agent_logs
+    )
 
     # Initialize agent with websocket
     queue = asyncio.Queue()
@@ -683,7 +932,9 @@ def create_agent_for_connection(
         tool_args=tool_args,
     )
     agent = AnthropicFC(
-        system_prompt=SYSTEM_PROMPT_WITH_SEQ_THINKING if tool_args.get("sequential_thinking", False) else SYSTEM_PROMPT,
+        system_prompt=SYSTEM_PROMPT_WITH_SEQ_THINKING
+        if tool_args.get("sequential_thinking", False)
+        else SYSTEM_PROMPT,
         client=client,
         tools=tools,
         workspace_manager=workspace_manager,
@@ -693,6 +944,7 @@ def create_agent_for_connection(
         max_output_tokens_per_turn=MAX_OUTPUT_TOKENS_PER_TURN,
         max_turns=MAX_TURNS,
         websocket=websocket,
+        stream_model_output=True,
         session_id=session_id,  # Pass the session_id from database manager
     )
 
@@ -740,8 +992,41 @@ def main():
         default=8000,
         help="Port to run the server on",
     )
+    parser.add_argument(
+        "--max-concurrent-runs",
+        type=int,
+        default=16,
+        help="Maximum number of agent runs across all users",
+    )
+    parser.add_argument(
+        "--max-runs-per-user",
+        type=int,
+        default=2,
+        help="Maximum number of agent runs per user, further queries wait in line",
+    )
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="Offer the scripted `replay` model, for load testing without model calls",
+    )
+    parser.add_argument(
+        "--replay-script",
+        type=str,
+        default=None,
+        help="JSON script of responses for the replay model, built-in script if not set",
+    )
+    parser.add_argument(
+        "--replay-latency",
+        type=str,
+        default="lognormal:1.5,0.5",
+        help="Response latency of the replay model: fixed:S, uniform:LOW,HIGH or lognormal:MEAN,SIGMA",
+    )
     args = parser.parse_args()
     global_args = args
+    configure_llm_limits(args)
+
+    scheduler.max_concurrent_runs = args.max_concurrent_runs
+    scheduler.max_runs_per_user = args.max_runs_per_user
 
     setup_workspace(app, args.workspace)
 
@@ -750,6 +1035,192 @@ def main():
     uvicorn.run(app, host=args.host, port=args.port)
 
 
+def checked_upload_path(upload_dir: Path, file_path: str) -> str:
+    """Make a client's file path relative to the upload directory.
+
+    Raises:
+        HTTPException: If the path leads out of the upload directory
+    """
+    # Ensure the file path is relative to the workspace
+    if Path(file_path).is_absolute():
+        file_path = Path(file_path).name
+    upload_root = upload_dir.resolve()
+    if not (upload_root / file_path).resolve().is_relative_to(upload_root):
+        raise HTTPException(
+            status_code=400, detail="File path must stay in the upload folder"
+        )
+    return file_path
+
+
+def authorize_session(request: Request, session_id: str) -> Dict[str, Any]:
+    """Authenticate a request for a session, which must belong to the caller.
+
+    Raises:
+        HTTPException: If authentication fails or the session is not the caller's
+    """
+    user_info = authenticate_request(request)
+    if not DatabaseManager().get_session_for_device(session_id, user_info.get("email")):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return user_info
+
+
+def unique_upload_path(upload_dir: Path, file_path: str) -> tuple[Path, str]:
+    """Pick where an uploaded file is saved, without overwriting existing files.
+
+    Args:
+        upload_dir: The session's upload directory
+        file_path: The path requested by the client
+
+    Returns:
+        A tuple of (full path, path relative to the upload directory)
+    """
+    file_path = checked_upload_path(upload_dir, file_path)
+
+    # Create the full path within the upload directory
+    original_path = upload_dir / file_path
+    full_path = original_path
+
+    # Handle filename collision by adding a suffix
+    if full_path.exists():
+        base_name = full_path.stem
+        extension = full_path.suffix
+        counter = 1
+
+        # Keep incrementing counter until we find a unique filename
+        while full_path.exists():
+            new_filename = f"{base_name}_{counter}{extension}"
+            full_path = upload_dir / new_filename
+            counter += 1
+
+        # Update the file_path to reflect the new name
+        file_path = f"{full_path.relative_to(upload_dir)}"
+
+    return full_path, file_path
+
+
+def get_upload_part_path(session_id: str, upload_id: str) -> Path:
+    """Get the file a resumable upload is written to until it completes.
+
+    Raises:
+        HTTPException: If the upload id is malformed or the workspace does not exist
+    """
+    if not UPLOAD_ID_PATTERN.match(upload_id):
+        raise HTTPException(status_code=400, detail="Invalid upload_id")
+    workspace_path = Path(global_args.workspace).resolve() / session_id
+    if not workspace_path.exists():
+        raise HTTPException(
+            status_code=404, detail=f"Workspace not found for session: {session_id}"
+        )
+    return (
+        workspace_path
+        / UPLOAD_FOLDER_NAME
+        / UPLOAD_PARTS_FOLDER_NAME
+        / f"{upload_id}.part"
+    )
+
+
+@app.get("/api/upload/{session_id}/{upload_id}")
+async def get_upload_offset_endpoint(session_id: str, upload_id: str, request: Request):
+    """Get how many bytes of a resumable upload the server has received.
+
+    Returns:
+        The offset to resume the upload from
+    """
+    authorize_session(request, session_id)
+    part_path = get_upload_part_path(session_id, upload_id)
+    offset = 0
+    if await anyio.Path(part_path).exists():
+        offset = (await anyio.Path(part_path).stat()).st_size
+    return {"upload_id": upload_id, "offset": offset}
+
+
+@app.put("/api/upload/{session_id}")
+async def upload_file_chunk_endpoint(
+    session_id: str,
+    request: Request,
+    path: str,
+    upload_id: str,
+    total: int,
+    offset: int = 0,
+):
+    """API endpoint for uploading a file to the workspace in resumable chunks.
+
+    The request body is the raw bytes of the file from `offset` on, and is
+    written to disk as it arrives. A chunk may end anywhere. Once `total`
+    bytes have been received the file is moved into the upload folder.
+
+    Args:
+        session_id: UUID of the session/workspace
+        path: The file path to save the file under
+        upload_id: Client chosen id of the upload, reused when resuming
+        total: The size of the whole file in bytes
+        offset: Where in the file the body starts, must match what the server has
+
+    Returns:
+        The new offset, and the saved file once the upload is complete
+    """
+    authorize_session(request, session_id)
+    if not path:
+        raise HTTPException(status_code=400, detail="File path is required")
+    if total < 0:
+        raise HTTPException(status_code=400, detail="total must not be negative")
+    part_path = get_upload_part_path(session_id, upload_id)
+    upload_dir = part_path.parent.parent
+    checked_upload_path(upload_dir, path)
+
+    upload_key = (session_id, upload_id)
+    if upload_key in active_uploads:
+        raise HTTPException(
+            status_code=409, detail="A chunk of this upload is already being received"
+        )
+    active_uploads.add(upload_key)
+    try:
+        await anyio.Path(part_path.parent).mkdir(parents=True, exist_ok=True)
+        received = 0
+        if await anyio.Path(part_path).exists():
+            received = (await anyio.Path(part_path).stat()).st_size
+        if offset != 0 and offset != received:
+            return JSONResponse(
+                status_code=409,
+                content={
+                    "error": "Offset does not match the received size",
+                    "offset": received,
+                },
+            )
+
+        received = offset
+        async with await anyio.open_file(part_path, "ab" if offset else "wb") as f:
+            async for chunk in request.stream():
+                if received + len(chunk) > total:
+                    # Keep only the bytes accepted, so the upload can resume from them
+                    await f.truncate(received)
+                    raise HTTPException(
+                        status_code=400, detail="Upload is larger than total"
+                    )
+                await f.write(chunk)
+                received += len(chunk)
+
+        if received < total:
+            return {"upload_id": upload_id, "offset": received, "complete": False}
+
+        full_path, file_path = unique_upload_path(upload_dir, path)
+        await anyio.Path(full_path.parent).mkdir(parents=True, exist_ok=True)
+        await anyio.Path(part_path).rename(full_path)
+        logger.info(f"File uploaded to {full_path}")
+
+        # Return the path relative to the workspace for client use
+        relative_path = f"/{UPLOAD_FOLDER_NAME}/{file_path}"
+        return {
+            "message": "File uploaded successfully",
+            "upload_id": upload_id,
+            "offset": received,
+            "complete": True,
+            "file": {"path": relative_path, "saved_path": str(full_path)},
+        }
+    finally:
+        active_uploads.discard(upload_key)
+
+
 @app.post("/api/upload")
 async def upload_file_endpoint(request: Request):
     """API endpoint for uploading a single file to the workspace.
@@ -795,28 +1266,7 @@ async def upload_file_endpoint(request: Request):
                 status_code=400, content={"error": "File path is required"}
             )
 
-        # Ensure the file path is relative to the workspace
-        if Path(file_path).is_absolute():
-            file_path = Path(file_path).name
-
-        # Create the full path within the upload directory
-        original_path = upload_dir / file_path
-        full_path = original_path
-
-        # Handle filename collision by adding a suffix
-        if full_path.exists():
-            base_name = full_path.stem
-            extension = full_path.suffix
-            counter = 1
-
-            # Keep incrementing counter until we find a unique filename
-            while full_path.exists():
-                new_filename = f"{base_name}_{counter}{extension}"
-                full_path = upload_dir / new_filename
-                counter += 1
-
-            # Update the file_path to reflect the new name
-            file_path = f"{full_path.relative_to(upload_dir)}"
+        full_path, file_path = unique_upload_path(upload_dir, file_path)
 
         # Ensure any subdirectories exist
         full_path.parent.mkdir(parents=True, exist_ok=True)
@@ -857,15 +1307,20 @@ async def upload_file_endpoint(request: Request):
 
 
 @app.get("/api/sessions")
-async def get_sessions_by_device_id(request: Request):
-    """Get all sessions for a specific device ID, sorted by creation time descending.
-    For each session, also includes the first user message if available.
+async def get_sessions_by_device_id(
+    request: Request, limit: int = 50, cursor: Optional[str] = None
+):
+    """Get a page of sessions for the authenticated user, sorted by creation time descending.
+    Each session includes its first user message if available.
 
     Args:
-        device_id: The device identifier to look up sessions for
+        request: FastAPI Request object for authentication
+        limit: The maximum number of sessions to return, at most 200
+        cursor: The next_cursor returned with the previous page
 
     Returns:
-        A list of sessions with their details and first user message, sorted by creation time descending
+        A page of sessions with their details and first user message, sorted by
+        creation time descending, and the cursor of the next page or None
     """
     try:
         # Authenticate the request and get user info
@@ -885,33 +1340,34 @@ async def get_sessions_by_device_id(request: Request):
             raise HTTPException(
                 status_code=400, detail="device_id parameter is required"
             )
+        if not 1 <= limit <= 200:
+            raise HTTPException(
+                status_code=400, detail="limit must be between 1 and 200"
+            )
 
-        # Get all sessions for this device, sorted by created_at descending
-        sessions_data = []
-        sessions = Session.objects(device_id=device_id).order_by('-created_at')
-        
-        for session in sessions:
-            # Find the first user message for this session
-            first_user_event = Event.objects(
-                session_id=session.id,
-                event_type="user_message"
-            ).order_by('timestamp').first()
-            
-            first_message = ""
-            if first_user_event and first_user_event.event_payload:
-                first_message = first_user_event.event_payload.get("content", {}).get("text", "")
-            
-            session_data = {
+        try:
+            sessions, next_cursor = db_manager.list_sessions(
+                device_id, limit=limit, cursor=cursor
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        sessions_data = [
+            {
                 "id": session.id,
                 "workspace_dir": session.workspace_dir,
                 "created_at": session.created_at,
                 "device_id": session.device_id,
-                "first_message": first_message,
+                "first_message": session.first_message or "",
+                "last_activity_at": session.last_activity_at,
             }
-            sessions_data.append(session_data)
+            for session in sessions
+        ]
 
-        return {"sessions": sessions_data}
+        return {"sessions": sessions_data, "next_cursor": next_cursor}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error retrieving sessions: {str(e)}")
         raise HTTPException(
@@ -919,16 +1375,70 @@ async def get_sessions_by_device_id(request: Request):
         )
 
 
+def format_event_document(
+    document: Dict[str, Any], workspace_dir: str, include_heavy: bool
+) -> Dict[str, Any]:
+    """Turn a raw event document into its API representation."""
+    event = {
+        "id": document["_id"],
+        "session_id": document["session_id"],
+        "timestamp": document["timestamp"].isoformat(),
+        "event_type": document["event_type"],
+        "event_payload": document["event_payload"],
+        "workspace_dir": workspace_dir,
+        "cursor": encode_cursor(document["timestamp"], document["_id"]),
+    }
+    if not include_heavy:
+        event["heavy_fields_omitted"] = True
+    return event
+
+
+async def stream_event_lines(
+    cursor, workspace_dir: str, include_heavy: bool, batch_size: int = 100
+):
+    """Yield NDJSON lines from a pymongo cursor, fetching batches off the event loop."""
+    try:
+        while True:
+            documents = await asyncio.to_thread(
+                lambda: list(itertools.islice(cursor, batch_size))
+            )
+            if not documents:
+                break
+            yield "".join(
+                json.dumps(
+                    format_event_document(document, workspace_dir, include_heavy)
+                )
+                + "\n"
+                for document in documents
+            )
+    finally:
+        cursor.close()
+
+
 @app.get("/api/sessions/{session_id}/events")
-async def get_session_events(session_id: str, request: Request):
-    """Get all events for a specific session ID, sorted by timestamp ascending.
+async def get_session_events(
+    session_id: str,
+    request: Request,
+    after: Optional[str] = None,
+    limit: int = 200,
+    include_heavy: bool = False,
+    format: str = "json",
+):
+    """Get events for a specific session ID, sorted by timestamp ascending.
 
     Args:
         session_id: The session identifier to look up events for
         request: FastAPI Request object for authentication
+        after: The next_cursor of the previous page, or the cursor of the last
+            event received
+        limit: The maximum number of events in a json page, at most 1000. With
+            ndjson a limit of 0 streams every remaining event
+        include_heavy: Whether to include screenshot data and full file contents
+        format: "json" for one page of events, "ndjson" to stream one event per line
 
     Returns:
-        A list of events with their details, sorted by timestamp ascending
+        A page of events with their details and the cursor of the next page, or
+        a stream of newline delimited events
     """
     try:
         # Authenticate the request and get user info
@@ -939,29 +1449,50 @@ async def get_session_events(session_id: str, request: Request):
         user_name = user_info.get("name")
         logger.info(f"User {user_name} ({user_email}) accessing events for session {session_id}")
 
-        # Get all events for this session, sorted by timestamp ascending
-        events = Event.objects(session_id=session_id, device_id=user_email).order_by('timestamp')
-        
-        # Get the session to get workspace_dir
-        session = Session.objects(id=session_id).first()
-        workspace_dir = session.workspace_dir if session else ""
-
-        # Convert events to a list of dictionaries
-        event_list = []
-        for e in events:
-            event_list.append(
-                {
-                    "id": e.id,
-                    "session_id": e.session_id,
-                    "timestamp": e.timestamp.isoformat(),
-                    "event_type": e.event_type,
-                    "event_payload": e.event_payload,
-                    "workspace_dir": workspace_dir,
-                }
-            )
+        if format not in ("json", "ndjson"):
+            raise HTTPException(status_code=400, detail="format must be json or ndjson")
+        max_limit = 1000 if format == "json" else None
+        if limit < 0 or (max_limit and not 1 <= limit <= max_limit):
+            raise HTTPException(status_code=400, detail="limit is out of range")
+
+        # Only the owner of a session may read its events
+        db_manager = DatabaseManager()
+        session = db_manager.get_session_for_device(session_id, user_email)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        workspace_dir = session.workspace_dir
+
+        try:
+            if format == "ndjson":
+                cursor = db_manager.find_session_events(
+                    session_id, after=after, limit=limit, include_heavy=include_heavy
+                )
+                return StreamingResponse(
+                    stream_event_lines(cursor, workspace_dir, include_heavy),
+                    media_type="application/x-ndjson",
+                )
 
-        return {"events": event_list}
+            # Fetch one extra event to know whether there is a next page
+            cursor = db_manager.find_session_events(
+                session_id, after=after, limit=limit + 1, include_heavy=include_heavy
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        documents = await asyncio.to_thread(list, cursor)
+        event_list = [
+            format_event_document(document, workspace_dir, include_heavy)
+            for document in documents[:limit]
+        ]
+        next_cursor = event_list[-1]["cursor"] if len(documents) > limit else None
+        return {
+            "events": event_list,
+            "workspace_dir": workspace_dir,
+            "next_cursor": next_cursor,
+        }
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error retrieving events: {str(e)}")
         raise HTTPException(
@@ -969,6 +1500,34 @@ async def get_session_events(session_id: str, request: Request):
         )
 
 
+@app.get("/api/sessions/{session_id}/trace")
+async def get_session_trace(session_id: str, request: Request):
+    """Get the timeline of a session in Chrome trace format.
+
+    Only sessions whose agent is still in memory have a trace. The result
+    can be opened in chrome://tracing or ui.perfetto.dev.
+
+    Args:
+        session_id: The session identifier
+        request: FastAPI Request object for authentication
+
+    Returns:
+        The Chrome trace JSON object
+    """
+    user_info = authenticate_request(request)
+    agent = session_agents.get(session_id)
+    if agent is None or not DatabaseManager().get_session_for_device(
+        session_id, user_info.get("email")
+    ):
+        raise HTTPException(status_code=404, detail="No trace for this session")
+    return JSONResponse(
+        agent.tracer.export(),
+        headers={
+            "Content-Disposition": f'attachment; filename="trace-{session_id}.json"'
+        },
+    )
+
+
 @app.get("/api/debug-auth")
 async def debug_auth(request: Request):
     """Debug endpoint to test authentication token parsing."""